@@ -5,8 +5,8 @@ import signal
 import sys
 import time
 
-from channel import channel_factory
-from common import const
+from channel import channel_factory, worker_pool
+from common import const, http_server, metrics
 from config import load_config
 from plugins import *
 import threading
@@ -16,7 +16,7 @@ def sigterm_handler_wrap(_signo):
     old_handler = signal.getsignal(_signo)
 
     def func(_signo, _stack_frame):
-        logger.info("signal {} received, exiting...".format(_signo))
+        logger.info("signal %s received, exiting...", _signo)
         conf().save_user_datas()
         if callable(old_handler):  #  check old_handler
             return old_handler(_signo, _stack_frame)
@@ -26,10 +26,15 @@ def sigterm_handler_wrap(_signo):
 
 
 def start_channel(channel_name: str):
+    # 多进程监听时先fork，每个进程创建自己的channel
+    worker_index = http_server.fork_workers(channel_name)
     channel = channel_factory.create_channel(channel_name)
-    if channel_name in ["wx", "wxy", "terminal", "wechatmp", "web", "wechatmp_service", "wechatcom_app", "wework",
+    metrics.register_channel(channel)
+    metrics.start_server(worker_index)
+    if channel_name in ["wx", "wxy", "terminal", "wechatmp", "web", "api", "wechatmp_service", "wechatcom_app", "wework",
                         const.FEISHU, const.DINGTALK]:
         PluginManager().load_plugins()
+    worker_pool.start(channel)
 
     if conf().get("use_linkai"):
         try:
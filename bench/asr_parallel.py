@@ -0,0 +1,120 @@
+# encoding:utf-8
+"""
+长语音识别基准：使用本地桩ASR(耗时与音频时长成正比)，对比整段识别与静音切分后并发识别的延迟
+
+用法:
+    python bench/asr_parallel.py --duration 60 --rtf 0.1 --latency 0.3
+    python bench/asr_parallel.py --max-duration 15000 --output result.json
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pydub import AudioSegment
+from pydub.generators import Sine, WhiteNoise
+
+import config
+from bridge.bridge import Bridge
+from bridge.reply import Reply, ReplyType
+from voice.audio_convert import ASR_SAMPLE_RATE
+from voice.parallel_asr import parallel_asr
+from voice.voice import Voice
+
+
+class StubASR(Voice):
+    """
+    桩ASR：固定延迟 + 实时率 * 音频时长，返回音频时长，便于检查拼接顺序
+    """
+
+    def __init__(self, latency, rtf, max_duration):
+        self.latency = latency
+        self.rtf = rtf
+        self.ASR_MAX_DURATION = max_duration
+        self.calls = 0
+
+    def voiceToText(self, voice_file):
+        self.calls += 1
+        duration = len(AudioSegment.from_file(voice_file))
+        if self.ASR_MAX_DURATION and duration > self.ASR_MAX_DURATION:
+            return Reply(ReplyType.ERROR, "audio too long: {}ms".format(duration))
+        time.sleep(self.latency + self.rtf * duration / 1000.0)
+        return Reply(ReplyType.TEXT, "<{}ms>".format(duration))
+
+
+def make_voice(path, duration_s, seed):
+    # 固定种子生成“说话-停顿”交替的语音，说话段1~6秒，停顿0.3~1秒
+    rnd = random.Random(seed)
+    audio = AudioSegment.silent(duration=0, frame_rate=ASR_SAMPLE_RATE)
+    while len(audio) < duration_s * 1000:
+        speech_ms = rnd.randint(1000, 6000)
+        tone = Sine(rnd.randint(200, 400), sample_rate=ASR_SAMPLE_RATE).to_audio_segment(speech_ms, volume=-10)
+        noise = WhiteNoise(sample_rate=ASR_SAMPLE_RATE).to_audio_segment(speech_ms, volume=-30)
+        audio += tone.overlay(noise)
+        audio += AudioSegment.silent(duration=rnd.randint(300, 1000), frame_rate=ASR_SAMPLE_RATE)
+    audio = audio[: duration_s * 1000].set_channels(1).set_sample_width(2)
+    audio.export(path, format="wav")
+
+
+def main():
+    # 压测不写日志文件，只输出到控制台
+    from common import log
+
+    log.setup({"log_file": ""})
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--duration", type=int, default=60, help="语音时长(秒)")
+    parser.add_argument("--latency", type=float, default=0.3, help="桩ASR每次请求的固定延迟(秒)")
+    parser.add_argument("--rtf", type=float, default=0.1, help="桩ASR的实时率，识别耗时=时长*rtf")
+    parser.add_argument("--max-duration", type=int, default=60 * 1000, help="桩ASR单次识别上限(毫秒)")
+    parser.add_argument("--chunk-length", type=int, default=15 * 1000, help="asr_chunk_length(毫秒)")
+    parser.add_argument("--concurrency", type=int, default=4, help="asr_max_concurrency")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="结果保存为json文件")
+    args = parser.parse_args()
+
+    config.config = config.Config(
+        {
+            "asr_chunk_length": args.chunk_length,
+            "asr_max_concurrency": args.concurrency,
+            "audio_convert_workers": 0,
+        }
+    )
+    stub = StubASR(args.latency, args.rtf, args.max_duration)
+    bridge = Bridge()
+    bridge.btype["voice_to_text"] = "stub"
+    bridge.bots["voice_to_text"] = stub
+
+    with tempfile.TemporaryDirectory() as tmp:
+        wav_path = os.path.join(tmp, "voice.wav")
+        make_voice(wav_path, args.duration, args.seed)
+
+        stub.calls = 0
+        start = time.perf_counter()
+        whole = stub.voiceToText(wav_path)
+        whole_time = time.perf_counter() - start
+
+        stub.calls = 0
+        start = time.perf_counter()
+        chunked = parallel_asr.voice_to_text(wav_path)
+        chunked_time = time.perf_counter() - start
+
+    result = {
+        "duration_s": args.duration,
+        "whole": {"seconds": round(whole_time, 3), "type": str(whole.type), "text": whole.content},
+        "parallel": {"seconds": round(chunked_time, 3), "segments": stub.calls, "type": str(chunked.type), "text": chunked.content},
+        "speedup": round(whole_time / chunked_time, 2) if chunked_time else None,
+    }
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
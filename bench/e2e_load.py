@@ -0,0 +1,488 @@
+# encoding:utf-8
+"""
+端到端压测：本地运行兼容OpenAI接口的桩LLM服务，在进程内启动完整的消息处理流程
+(ChatChannel -> 插件 -> Bridge/ChatRouter -> bot -> HTTP请求桩服务 -> 装饰 -> 发送)，
+由N个私聊用户和M个群按比例发送文字、语音和图片消息，统计吞吐、端到端延迟分位数、内存和CPU
+
+桩服务在子进程中运行，可配置首字延迟、每秒输出token数、回复长度和错误注入(500/429)，
+支持非流式和stream=true的SSE输出；chatGPT bot通过open_ai_api_base、linkai bot通过linkai_api_base请求桩服务。
+语音识别使用进程内的桩ASR(固定延迟)，语音文件为生成的wav；图片消息只走图片缓存流程，没有回复。
+端到端延迟从消息入队开始，到处理线程结束(含发送)为止，吞吐和延迟分位数只统计成功的消息，
+处理异常或回复ERROR的消息计入failed并单独统计延迟；RSS和CPU只统计压测进程，不含桩服务。
+
+用法:
+    python bench/e2e_load.py --users 200 --groups 20 --rate 50 --duration 30
+    python bench/e2e_load.py --bot linkai --mix text=0.7,voice=0.2,image=0.1 --error-rate 0.05 --output result.json
+"""
+
+import argparse
+import http.client
+import json
+import logging
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import wave
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BOT_NAME = "bench"
+
+
+# ---------------- 桩LLM服务 ----------------
+
+class StubLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    args = None
+    stats = {"requests": 0, "stream": 0, "errors": 0, "rate_limited": 0, "completion_tokens": 0}
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _json(self, status, data, headers=None):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _incr(self, name, value=1):
+        with self.lock:
+            self.stats[name] += value
+
+    def do_GET(self):
+        if self.path.startswith("/stats"):
+            with self.lock:
+                return self._json(200, dict(self.stats))
+        if self.path.startswith("/v1/app/info"):
+            # linkai查询应用信息，没有插件时不处理图片
+            return self._json(200, {"success": True, "data": {"plugins": []}})
+        if self.path.startswith("/v1/models"):
+            return self._json(200, {"object": "list", "data": [{"id": "gpt-3.5-turbo", "object": "model"}]})
+        self._json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.endswith("/chat/completions"):
+            return self._json(404, {"error": {"message": "not found"}})
+        args = self.args
+        self._incr("requests")
+        roll = random.random()
+        if roll < args.error_rate:
+            self._incr("errors")
+            time.sleep(args.llm_latency)
+            return self._json(500, {"error": {"message": "injected error", "type": "server_error"}})
+        if roll < args.error_rate + args.rate_limit_rate:
+            self._incr("rate_limited")
+            return self._json(429, {"error": {"message": "injected rate limit", "type": "rate_limit"}}, {"retry-after": "1"})
+        messages = body.get("messages") or []
+        prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in messages)
+        tokens = ["tok{}".format(i) for i in range(args.reply_tokens)]
+        self._incr("completion_tokens", len(tokens))
+        time.sleep(args.llm_latency)
+        interval = 1.0 / args.token_rate if args.token_rate > 0 else 0
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens), "total_tokens": prompt_tokens + len(tokens)}
+        if body.get("stream"):
+            self._incr("stream")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            for token in tokens:
+                time.sleep(interval)
+                chunk = {"object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {"content": token + " "}}]}
+                self.wfile.write("data: {}\n\n".format(json.dumps(chunk)).encode("utf-8"))
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.close_connection = True
+            return
+        time.sleep(interval * len(tokens))
+        self._json(200, {
+            "id": "chatcmpl-bench",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model") or "gpt-3.5-turbo",
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": " ".join(tokens)}, "finish_reason": "stop"}],
+            "usage": usage,
+        })
+
+
+def run_stub(args):
+    random.seed(args.seed)
+    StubLLMHandler.args = args
+    server = ThreadingHTTPServer(("127.0.0.1", args.stub_port), StubLLMHandler)
+    server.daemon_threads = True
+    server.serve_forever()
+
+
+def stub_request(port, method, path):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+    try:
+        conn.request(method, path)
+        return json.loads(conn.getresponse().read())
+    finally:
+        conn.close()
+
+
+def wait_stub(port, timeout=15):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            return stub_request(port, "GET", "/stats")
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("stub llm server not started")
+
+
+# ---------------- 进程内channel ----------------
+
+def make_voice(path, seconds=2, sample_rate=8000):
+    rng = random.Random(0)
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(bytes(rng.getrandbits(8) for _ in range(seconds * sample_rate * 2)))
+
+
+def make_image(path):
+    # 1x1的png
+    data = bytes.fromhex(
+        "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+        "1f15c4890000000d49444154789c6360000002000154a24f5d0000000049454e44ae426082"
+    )
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def build_pipeline(args, stats):
+    import config
+    from bridge.bridge import Bridge
+    from bridge.context import ContextType
+    from bridge.reply import Reply, ReplyType
+    from channel.chat_channel import ChatChannel
+    from channel.chat_message import ChatMessage
+    from common.log import logger
+    from voice.voice import Voice
+
+    # 压测时只输出警告以上的日志
+    logger.setLevel(logging.WARNING)
+    base = "http://127.0.0.1:{}".format(args.stub_port)
+    config.config = config.Config({
+        "bot_type": args.bot,
+        "model": "gpt-3.5-turbo",
+        "open_ai_api_key": "bench",
+        "open_ai_api_base": base + "/v1",
+        "linkai_api_key": "bench",
+        "linkai_api_base": base,
+        "single_chat_prefix": [""],
+        "group_chat_prefix": [],
+        "group_name_white_list": ["ALL_GROUP"],
+        "concurrency_in_session": args.session_concurrency,
+        "request_timeout": 60,
+        "debug": False,
+    })
+
+    class StubASR(Voice):
+        def voiceToText(self, voice_file):
+            time.sleep(args.asr_latency)
+            return Reply(ReplyType.TEXT, "voice message from " + os.path.basename(voice_file))
+
+    bridge = Bridge()
+    bridge.btype["voice_to_text"] = "stub"
+    bridge.bots["voice_to_text"] = StubASR()
+
+    if args.plugins:
+        from plugins import PluginManager
+
+        PluginManager().load_plugins()
+
+    class BenchMessage(ChatMessage):
+        def __init__(self, msg_id, ctype, content, user, group=None):
+            super().__init__(None)
+            self.msg_id = msg_id
+            self.create_time = int(time.time())
+            self.ctype = ctype
+            self.content = content
+            self.from_user_id = group or user
+            self.from_user_nickname = group or user
+            self.to_user_id = BOT_NAME
+            self.to_user_nickname = BOT_NAME
+            self.other_user_id = group or user
+            self.other_user_nickname = group or user
+            self.is_group = group is not None
+            self.is_at = group is not None
+            self.actual_user_id = user
+            self.actual_user_nickname = user
+            self.at_list = []
+            self.self_display_name = BOT_NAME
+
+    class BenchChannel(ChatChannel):
+        NOT_SUPPORT_REPLYTYPE = []
+        channel_type = "bench"
+
+        def __init__(self):
+            super().__init__()
+            self.name = BOT_NAME
+            self.user_id = BOT_NAME
+
+        def send(self, reply, context):
+            stats.record_reply(context, reply)
+
+        def _success_callback(self, session_id, context=None, **kwargs):
+            stats.record_done(context, ok=True)
+
+        def _fail_callback(self, session_id, exception, context=None, **kwargs):
+            stats.record_done(context, ok=False)
+
+    return BenchChannel(), BenchMessage, ContextType
+
+
+class Stats(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}  # msg_id -> (类型, 入队时间)
+        self.latencies = {}  # 类型 -> [秒]，只统计成功回复的消息
+        self.failed_latencies = {}  # 类型 -> [秒]，处理异常或回复ERROR的消息
+        self.error_replies = set()  # 回复了ERROR的msg_id
+        self.sent = {}
+        self.filtered = 0
+        self.replies = {}
+        self.done = threading.Condition(self.lock)
+
+    def record_sent(self, msg_id, kind):
+        with self.lock:
+            self.pending[msg_id] = (kind, time.time())
+            self.sent[kind] = self.sent.get(kind, 0) + 1
+
+    def record_reply(self, context, reply):
+        msg = context.get("msg") if context else None
+        with self.lock:
+            self.replies[reply.type.name] = self.replies.get(reply.type.name, 0) + 1
+            if msg and reply.type.name == "ERROR":
+                self.error_replies.add(msg.msg_id)
+
+    def record_done(self, context, ok):
+        msg = context.get("msg") if context else None
+        with self.lock:
+            item = self.pending.pop(msg.msg_id, None) if msg else None
+            if item is not None:
+                kind, start = item
+                if msg.msg_id in self.error_replies:
+                    self.error_replies.discard(msg.msg_id)
+                    ok = False
+                latencies = self.latencies if ok else self.failed_latencies
+                latencies.setdefault(kind, []).append(time.time() - start)
+            self.done.notify_all()
+
+    def wait_all(self, timeout):
+        deadline = time.time() + timeout
+        with self.lock:
+            while self.pending and time.time() < deadline:
+                self.done.wait(max(0.01, deadline - time.time()))
+            return len(self.pending)
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    return round(values[min(len(values) - 1, int(len(values) * p))] * 1000, 1)
+
+
+def latency_summary(values):
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "p50_ms": percentile(values, 0.5),
+        "p95_ms": percentile(values, 0.95),
+        "p99_ms": percentile(values, 0.99),
+        "max_ms": round(values[-1] * 1000, 1) if values else None,
+    }
+
+
+def current_rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return round(int(f.read().split()[1]) * resource.getpagesize() / 1024 / 1024, 1)
+    except OSError:
+        return None
+
+
+def parse_mix(text):
+    mix = {}
+    for item in text.split(","):
+        kind, weight = item.split("=")
+        mix[kind.strip().upper()] = float(weight)
+    unknown = set(mix) - {"TEXT", "VOICE", "IMAGE"}
+    if unknown:
+        raise ValueError("unknown message types: {}".format(", ".join(sorted(unknown))))
+    return mix
+
+
+def run(args):
+    stats = Stats()
+    channel, BenchMessage, ContextType = build_pipeline(args, stats)
+    rng = random.Random(args.seed)
+    mix = parse_mix(args.mix)
+    kinds, weights = list(mix.keys()), list(mix.values())
+    users = ["user_{}".format(i) for i in range(args.users)]
+    groups = ["group_{}".format(i) for i in range(args.groups)]
+    tmp_dir = tempfile.mkdtemp(prefix="e2e_load_")
+    voice_template = os.path.join(tmp_dir, "voice_template.wav")
+    image_template = os.path.join(tmp_dir, "image_template.png")
+    make_voice(voice_template, args.voice_seconds)
+    make_image(image_template)
+
+    def produce(index):
+        kind = rng.choices(kinds, weights)[0]
+        user = rng.choice(users)
+        group = rng.choice(groups) if groups and rng.random() < args.group_ratio else None
+        msg_id = "bench_{}".format(index)
+        kwargs = {"isgroup": group is not None}
+        if kind == "TEXT":
+            text = "hello {} from {}".format(index, user)
+            content = "@{} {}".format(BOT_NAME, text) if group else text
+            ctype = ContextType.TEXT
+        elif kind == "VOICE":
+            # 语音文件在context处理结束后会被删除，每条消息使用单独的副本
+            content = os.path.join(tmp_dir, msg_id + ".wav")
+            shutil.copyfile(voice_template, content)
+            ctype = ContextType.VOICE
+        else:
+            content = os.path.join(tmp_dir, msg_id + ".png")
+            shutil.copyfile(image_template, content)
+            ctype = ContextType.IMAGE
+        msg = BenchMessage(msg_id, ctype, content, user, group)
+        context = channel._compose_context(ctype, content, msg=msg, **kwargs)
+        if context is None:
+            with stats.lock:
+                stats.filtered += 1
+            return
+        stats.record_sent(msg_id, kind)
+        channel.produce(context)
+
+    usage_before = resource.getrusage(resource.RUSAGE_SELF)
+    rss_before = current_rss_mb()
+    start = time.time()
+    deadline = start + args.duration
+    next_at = start
+    index = 0
+    # 开环：按泊松过程到达，不等待上一条消息处理完
+    while True:
+        next_at += rng.expovariate(args.rate)
+        if next_at >= deadline:
+            break
+        delay = next_at - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        produce(index)
+        index += 1
+    produce_end = time.time()
+    unfinished = stats.wait_all(args.drain_timeout)
+    elapsed = time.time() - start
+    usage_after = resource.getrusage(resource.RUSAGE_SELF)
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    # 吞吐和耗时分位数只按成功回复的消息计算，失败的消息单独统计
+    all_latencies = [v for values in stats.latencies.values() for v in values]
+    completed = len(all_latencies)
+    failed_latencies = [v for values in stats.failed_latencies.values() for v in values]
+    return {
+        "config": {
+            "bot": args.bot,
+            "users": args.users,
+            "groups": args.groups,
+            "group_ratio": args.group_ratio,
+            "rate": args.rate,
+            "duration": args.duration,
+            "mix": mix,
+            "llm_latency": args.llm_latency,
+            "token_rate": args.token_rate,
+            "reply_tokens": args.reply_tokens,
+            "error_rate": args.error_rate,
+            "rate_limit_rate": args.rate_limit_rate,
+            "asr_latency": args.asr_latency,
+            "plugins": args.plugins,
+            "seed": args.seed,
+        },
+        "sent": stats.sent,
+        "filtered": stats.filtered,
+        "completed": completed,
+        "failed": len(failed_latencies),
+        "failed_by_type": {kind: len(values) for kind, values in stats.failed_latencies.items()},
+        "unfinished": unfinished,
+        "replies": stats.replies,
+        "produce_seconds": round(produce_end - start, 2),
+        "elapsed_seconds": round(elapsed, 2),
+        "throughput_per_sec": round(completed / elapsed, 2) if elapsed else None,
+        "latency": latency_summary(all_latencies),
+        "latency_by_type": {kind: latency_summary(values) for kind, values in stats.latencies.items()},
+        "failed_latency": latency_summary(failed_latencies),
+        "cpu_seconds": round((usage_after.ru_utime - usage_before.ru_utime) + (usage_after.ru_stime - usage_before.ru_stime), 2),
+        "rss_mb_before": rss_before,
+        "rss_mb_after": current_rss_mb(),
+        "max_rss_mb": round(usage_after.ru_maxrss / 1024, 1),
+    }
+
+
+def main():
+    # 压测不写日志文件，只输出到控制台
+    from common import log
+
+    log.setup({"log_file": ""})
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bot", default="chatGPT", choices=["chatGPT", "linkai"], help="请求桩服务的bot")
+    parser.add_argument("--users", type=int, default=100, help="私聊用户数")
+    parser.add_argument("--groups", type=int, default=10, help="群数")
+    parser.add_argument("--group-ratio", type=float, default=0.3, help="群消息占比")
+    parser.add_argument("--mix", default="text=0.8,voice=0.1,image=0.1", help="消息类型比例")
+    parser.add_argument("--rate", type=float, default=20, help="每秒平均消息数(泊松到达)")
+    parser.add_argument("--duration", type=float, default=20, help="发送消息的时长(秒)")
+    parser.add_argument("--drain-timeout", type=float, default=120, help="停止发送后等待处理完成的最长时间(秒)")
+    parser.add_argument("--session-concurrency", type=int, default=4, help="concurrency_in_session")
+    parser.add_argument("--plugins", action="store_true", help="加载插件(与正常启动一样会生成插件配置文件)")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="桩服务首字延迟(秒)")
+    parser.add_argument("--token-rate", type=float, default=200, help="桩服务每秒输出token数，0表示不限")
+    parser.add_argument("--reply-tokens", type=int, default=50, help="每个回复的token数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="桩服务返回500的比例")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="桩服务返回429的比例")
+    parser.add_argument("--asr-latency", type=float, default=0.2, help="桩ASR每条语音的耗时(秒)")
+    parser.add_argument("--voice-seconds", type=int, default=2, help="生成的语音时长(秒)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--stub-port", type=int, default=19892)
+    parser.add_argument("--output", help="结果写入的json文件")
+    parser.add_argument("--stub", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stub:
+        run_stub(args)
+        return
+
+    stub = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--stub"] + sys.argv[1:])
+    try:
+        wait_stub(args.stub_port)
+        result = run(args)
+        result["stub"] = stub_request(args.stub_port, "GET", "/stats")
+    finally:
+        stub.terminate()
+        stub.wait()
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
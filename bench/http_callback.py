@@ -0,0 +1,213 @@
+# encoding:utf-8
+"""
+HTTP回调处理吞吐测试：以飞书消息事件回调为例，对比web.py自带的开发服务器(runsimple)
+和common/http_server服务层的每秒处理请求数、延迟和失败数
+
+服务端在子进程中运行FeiShuChanel，bot、发送和access_token请求都替换为桩函数，
+只测量回调接收、解析、幂等判断、构造context和入队的开销。
+客户端在多个进程中并发发送不重复的消息事件，--no-keepalive时每个请求新建连接，模拟突发流量。
+
+用法:
+    python bench/http_callback.py --mode both --concurrency 64 --duration 10
+    python bench/http_callback.py --mode serve --threads 64 --no-keepalive --output result.json
+
+飞书回调的幂等判断等状态在进程内，不支持http_workers多进程，这里只测试单进程
+"""
+
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import time
+import uuid
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TOKEN = "bench_token"
+
+
+def serve(args):
+    import config
+
+    config.config = config.Config({
+        "channel_type": "feishu",
+        "feishu_port": args.port,
+        "feishu_token": TOKEN,
+        "feishu_bot_name": "bench",
+        "http_server_threads": args.threads,
+    })
+    import web
+    from bridge.bridge import Bridge
+    from bridge.reply import Reply, ReplyType
+    from channel.feishu.feishu_channel import FeiShuChanel
+
+    Bridge().fetch_reply_content = lambda query, context: Reply(ReplyType.TEXT, query)
+    channel = FeiShuChanel()
+    channel.fetch_access_token = lambda: "bench"
+    channel.send = lambda reply, context: None
+    if args.mode == "serve":
+        channel.startup()
+    else:
+        # 改造前的启动方式
+        app = web.application(("/", "channel.feishu.feishu_channel.FeishuController"), globals(), autoreload=False)
+        web.httpserver.runsimple(app.wsgifunc(), ("0.0.0.0", args.port))
+
+
+def make_event(user):
+    return json.dumps({
+        "schema": "2.0",
+        "header": {"event_id": uuid.uuid4().hex, "event_type": "im.message.receive_v1", "token": TOKEN},
+        "event": {
+            "sender": {"sender_id": {"open_id": user}},
+            "message": {
+                "message_id": uuid.uuid4().hex,
+                "chat_type": "p2p",
+                "message_type": "text",
+                "content": json.dumps({"text": "hello from " + user}),
+            },
+        },
+    })
+
+
+def client_worker(index, args, deadline, queue):
+    import threading
+
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def run(n):
+        conn = None
+        user = "user_{}_{}".format(index, n)
+        while time.time() < deadline:
+            body = make_event(user)
+            start = time.time()
+            try:
+                if conn is None:
+                    conn = http.client.HTTPConnection("127.0.0.1", args.port, timeout=30)
+                conn.request("POST", "/", body, {"Content-Type": "application/json"})
+                response = conn.getresponse()
+                data = response.read()
+                ok = response.status == 200 and b"true" in data
+            except (OSError, http.client.HTTPException):
+                ok = False
+                conn.close()
+                conn = None
+            elapsed = time.time() - start
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                else:
+                    errors[0] += 1
+            if args.no_keepalive and conn is not None:
+                conn.close()
+                conn = None
+
+    threads = [threading.Thread(target=run, args=(n,)) for n in range(args.concurrency // args.client_procs)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    queue.put((latencies, errors[0]))
+
+
+def wait_server(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/")
+            conn.getresponse().read()
+            conn.close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("feishu channel not started")
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    return round(values[min(len(values) - 1, int(len(values) * p))] * 1000, 2)
+
+
+def run_mode(args):
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    server = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--serve", "--mode", args.mode, "--port", str(args.port),
+         "--threads", str(args.threads)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_server(args.port)
+        queue = multiprocessing.Queue()
+        start = time.time()
+        deadline = start + args.duration
+        procs = [multiprocessing.Process(target=client_worker, args=(i, args, deadline, queue)) for i in range(args.client_procs)]
+        for p in procs:
+            p.start()
+        latencies, errors = [], 0
+        for _ in procs:
+            result = queue.get()
+            latencies.extend(result[0])
+            errors += result[1]
+        for p in procs:
+            p.join()
+        elapsed = time.time() - start
+    finally:
+        server.terminate()
+        server.wait()
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    latencies.sort()
+    return {
+        "mode": args.mode,
+        "concurrency": args.concurrency,
+        "keepalive": not args.no_keepalive,
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1),
+        "latency_p50_ms": percentile(latencies, 0.5),
+        "latency_p99_ms": percentile(latencies, 0.99),
+        # 包含客户端进程的CPU耗时
+        "cpu_seconds": round((after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime), 3),
+    }
+
+
+def main():
+    # 压测不写日志文件，只输出到控制台
+    from common import log
+
+    log.setup({"log_file": ""})
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=["dev", "serve", "both"], default="both")
+    parser.add_argument("--concurrency", type=int, default=64, help="并发连接数")
+    parser.add_argument("--duration", type=float, default=10, help="每种模式的测试时长(秒)")
+    parser.add_argument("--client-procs", type=int, default=2, help="客户端进程数")
+    parser.add_argument("--threads", type=int, default=32, help="serve模式每个进程的服务线程数")
+    parser.add_argument("--no-keepalive", action="store_true", help="每个请求新建连接")
+    parser.add_argument("--port", type=int, default=19891)
+    parser.add_argument("--output", help="结果写入的json文件")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    modes = ["dev", "serve"] if args.mode == "both" else [args.mode]
+    results = []
+    for mode in modes:
+        args.mode = mode
+        results.append(run_mode(args))
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
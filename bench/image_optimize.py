@@ -0,0 +1,129 @@
+# encoding:utf-8
+"""
+图片压缩基准：对比逐步降低质量的旧压缩方式与二分查找质量+缩放的新方式
+
+用法:
+    python bench/image_optimize.py --count 3 --width 6000 --height 4500 --max-mb 10
+    python bench/image_optimize.py --corpus /path/to/images --max-mb 10
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+
+from common import image_optimizer
+
+
+def legacy_compress(data, max_size):
+    # 旧实现: 质量从95开始每次降低5，每次都完整编码
+    rgb_image = Image.open(io.BytesIO(data)).convert("RGB")
+    quality = 95
+    encodes = 0
+    while quality > 0:
+        out_buf = io.BytesIO()
+        rgb_image.save(out_buf, "JPEG", quality=quality)
+        encodes += 1
+        if out_buf.tell() <= max_size:
+            return out_buf.getvalue(), encodes
+        quality -= 5
+    return None, encodes
+
+
+def make_corpus(count, width, height, seed):
+    # 固定种子生成噪声与渐变混合的大图，压缩难度接近真实照片
+    rnd = random.Random(seed)
+    corpus = []
+    for i in range(count):
+        size = width * height * 3
+        # random.randbytes需要python3.9
+        noise = Image.frombytes("RGB", (width, height), rnd.getrandbits(size * 8).to_bytes(size, "little"))
+        gradient = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+        img = Image.blend(noise, gradient, 0.3 + 0.4 * rnd.random())
+        buf = io.BytesIO()
+        img.save(buf, "PNG")
+        corpus.append(("synthetic-{}.png".format(i), buf.getvalue()))
+    return corpus
+
+
+def load_corpus(directory):
+    corpus = []
+    for name in sorted(os.listdir(directory)):
+        with open(os.path.join(directory, name), "rb") as f:
+            corpus.append((name, f.read()))
+    return corpus
+
+
+def count_encodes(func, *args):
+    counter = {"n": 0}
+    origin = image_optimizer._encode
+
+    def wrapped(*a, **kw):
+        counter["n"] += 1
+        return origin(*a, **kw)
+
+    image_optimizer._encode = wrapped
+    try:
+        return func(*args), counter["n"]
+    finally:
+        image_optimizer._encode = origin
+
+
+def main():
+    # 压测不写日志文件，只输出到控制台
+    from common import log
+
+    log.setup({"log_file": ""})
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", help="图片目录，不指定时生成合成图片")
+    parser.add_argument("--count", type=int, default=3)
+    parser.add_argument("--width", type=int, default=6000)
+    parser.add_argument("--height", type=int, default=4500)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--max-mb", type=float, default=10)
+    parser.add_argument("--output", help="结果保存为json文件")
+    args = parser.parse_args()
+
+    max_size = int(args.max_mb * 1024 * 1024)
+    corpus = load_corpus(args.corpus) if args.corpus else make_corpus(args.count, args.width, args.height, args.seed)
+    results = []
+    for name, data in corpus:
+        start = time.perf_counter()
+        legacy_out, legacy_encodes = legacy_compress(data, max_size)
+        legacy_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        (out, fmt), encodes = count_encodes(image_optimizer.optimize_image_bytes, data, max_size, True)
+        optimize_time = time.perf_counter() - start
+        out = out or data
+        results.append(
+            {
+                "name": name,
+                "input_bytes": len(data),
+                "legacy": {"seconds": round(legacy_time, 3), "encodes": legacy_encodes, "output_bytes": len(legacy_out) if legacy_out else None},
+                "optimized": {"seconds": round(optimize_time, 3), "encodes": encodes, "output_bytes": len(out), "format": fmt},
+            }
+        )
+        print(json.dumps(results[-1]))
+
+    summary = {
+        "max_size": max_size,
+        "legacy_seconds": round(sum(r["legacy"]["seconds"] for r in results), 3),
+        "optimized_seconds": round(sum(r["optimized"]["seconds"] for r in results), 3),
+        "results": results,
+    }
+    print(json.dumps({k: v for k, v in summary.items() if k != "results"}))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+# encoding:utf-8
+"""
+媒体发送内存占用基准：模拟多路视频回复并发下载、计算md5、分片上传，对比整体缓冲与流式管道的峰值RSS
+
+用法: python bench/media_memory.py --size-mb 100 --concurrency 4
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CHUNK_SIZE = 524288  # 与itchat分片上传大小一致
+
+
+def peak_rss_kb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    import resource
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def send_buffered(url):
+    # 旧实现：BytesIO整体下载，再整体读出计算md5并复制一份用于上传
+    import requests
+
+    res = requests.get(url, stream=True)
+    storage = io.BytesIO()
+    for block in res.iter_content(1024):
+        storage.write(block)
+    storage.seek(0)
+    data = storage.read()
+    hashlib.md5(data).hexdigest()
+    file_ = io.BytesIO(data)
+    while file_.read(CHUNK_SIZE):
+        pass
+
+
+def send_streaming(url):
+    from common.media_cache import file_md5
+    from common.utils import download_file
+
+    storage = download_file(url)
+    file_md5(storage)
+    while storage.read(CHUNK_SIZE):
+        pass
+    storage.close()
+
+
+def run_worker(mode, url, concurrency):
+    func = send_streaming if mode == "stream" else send_buffered
+    base_rss = peak_rss_kb()
+    threads = [threading.Thread(target=func, args=(url,)) for _ in range(concurrency)]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    result = {
+        "mode": mode,
+        "concurrency": concurrency,
+        "elapsed_s": round(time.time() - start, 3),
+        "base_rss_mb": round(base_rss / 1024, 1),
+        "peak_rss_mb": round(peak_rss_kb() / 1024, 1),
+    }
+    print(json.dumps(result))
+
+
+def serve(directory):
+    handler = lambda *args, **kwargs: SimpleHTTPRequestHandler(*args, directory=directory, **kwargs)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    # 压测不写日志文件，只输出到控制台
+    from common import log
+
+    log.setup({"log_file": ""})
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--worker", choices=["buffer", "stream"])
+    parser.add_argument("--url")
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args.url, args.concurrency)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, "video.mp4"), "wb") as f:
+            for _ in range(args.size_mb):
+                f.write(os.urandom(1024 * 1024))
+        server = serve(directory)
+        url = "http://127.0.0.1:{}/video.mp4".format(server.server_address[1])
+        results = []
+        # 每种模式在独立进程中运行，保证峰值RSS互不影响
+        for mode in ["buffer", "stream"]:
+            out = subprocess.check_output([sys.executable, __file__, "--worker", mode, "--url", url, "--concurrency", str(args.concurrency)])
+            results.append(json.loads(out.decode("utf-8").strip().splitlines()[-1]))
+        server.shutdown()
+    print(json.dumps({"size_mb": args.size_mb, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,565 @@
+# encoding:utf-8
+"""
+热点函数微基准：每条消息都会经过的构造context、插件事件分发、过期字典、token计算与截断、
+敏感词匹配、按utf-8长度切分和SortedDict更新
+
+每个用例先校准循环次数，使单轮耗时不少于--min-time秒，再重复--repeat轮，取每次调用耗时的中位数；
+输入语料由固定种子生成，结果附带python版本、git提交等信息，可以用--compare与之前保存的结果对比。
+依赖缺失的用例(如没有安装tiktoken)会被跳过并在结果中注明。
+加载插件与正常启动一样会生成插件配置文件，运行结束后删除本次运行新生成的文件。
+
+用法:
+    python bench/micro.py
+    python bench/micro.py --filter compose --repeat 10 --output before.json
+    python bench/micro.py --output after.json --compare before.json
+"""
+
+import argparse
+import glob
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+
+BOT_NAME = "bench"
+BENCHMARKS = []  # (名称, setup函数)
+
+
+class Skip(Exception):
+    pass
+
+
+def benchmark(name):
+    """
+    注册用例：setup(corpus)返回被测的无参函数，不可用时抛出Skip
+    """
+
+    def decorator(setup):
+        BENCHMARKS.append((name, setup))
+        return setup
+
+    return decorator
+
+
+# ---------------- 语料 ----------------
+
+CHINESE = "的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面而方后多定行学法所民得经十三之进着等部度家电力里如水化高自二理起小物现实加量都两体制机当使点从业本去把性好应开它合还因由其些然前外天政四日那社义事平形相全表间样与关各重新线内数正心反你明看原又么利比或但质气第向道命此变条只没结解问意建月公无系军很情者最立代想已通并提直题党程展五果料象员革位入常文总次品式活设及管特件长求老头基资边流路级少图山统接知较将组见计别她手角期根论运农指几九区强放决西被干做必战先回则任取据处理"
+ENGLISH = "the quick brown fox jumps over lazy dog message reply bot channel session plugin voice image group user".split()
+
+
+class Corpus(object):
+    """
+    由固定种子生成的输入数据
+    """
+
+    def __init__(self, seed):
+        self.rng = random.Random(seed)
+        self.sentences = [self.sentence() for _ in range(200)]
+
+    def sentence(self, min_len=8, max_len=60):
+        rng = self.rng
+        parts = []
+        for _ in range(rng.randint(min_len, max_len) // 4):
+            if rng.random() < 0.7:
+                parts.append("".join(rng.choice(CHINESE) for _ in range(rng.randint(2, 6))))
+            else:
+                parts.append(rng.choice(ENGLISH))
+        return " ".join(parts)
+
+    def text(self, length):
+        text = ""
+        while len(text) < length:
+            text += self.rng.choice(self.sentences) + "。"
+        return text[:length]
+
+    def messages(self, count):
+        messages = [{"role": "system", "content": "你是一个乐于助人的助手。"}]
+        for i in range(count):
+            messages.append({"role": "user" if i % 2 == 0 else "assistant", "content": self.text(self.rng.randint(20, 300))})
+        return messages
+
+    def keywords(self, count):
+        words = set()
+        while len(words) < count:
+            words.add("".join(self.rng.choice(CHINESE) for _ in range(self.rng.randint(2, 4))))
+        return sorted(words)
+
+
+# ---------------- 运行环境 ----------------
+
+_channel = None
+_created_files = []
+
+
+def plugin_config_files():
+    return set(glob.glob(os.path.join(ROOT_DIR, "plugins", "plugins.json")) + glob.glob(os.path.join(ROOT_DIR, "plugins", "*", "config.json")))
+
+
+def setup_env():
+    import config
+    from common.log import logger
+
+    logger.setLevel(logging.WARNING)
+    config.config = config.Config({
+        # linkai bot的创建不依赖额外的SDK，角色插件会通过Bridge获取bot
+        "bot_type": "linkai",
+        "model": "gpt-3.5-turbo",
+        "single_chat_prefix": ["bot", "@bot"],
+        "group_chat_prefix": ["@bot"],
+        "group_name_white_list": ["ALL_GROUP"],
+        "group_chat_in_one_session": ["group_0"],
+        "nick_name_black_list": ["blocked_{}".format(i) for i in range(20)],
+        "debug": False,
+    })
+    # 插件管理器按相对路径读取插件目录
+    os.chdir(ROOT_DIR)
+    existing = plugin_config_files()
+    from plugins import PluginManager
+
+    PluginManager().load_plugins()
+    _created_files.extend(plugin_config_files() - existing)
+
+
+def cleanup_env():
+    for path in _created_files:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def get_channel():
+    global _channel
+    if _channel is None:
+        from bridge.reply import ReplyType
+        from channel.chat_channel import ChatChannel
+
+        class BenchChannel(ChatChannel):
+            NOT_SUPPORT_REPLYTYPE = [ReplyType.VOICE]
+            channel_type = "bench"
+
+            def send(self, reply, context):
+                pass
+
+        _channel = BenchChannel()
+        _channel.name = BOT_NAME
+        _channel.user_id = BOT_NAME
+    return _channel
+
+
+def make_message(content, user="user_0", group=None, is_at=False):
+    from bridge.context import ContextType
+    from channel.chat_message import ChatMessage
+
+    msg = ChatMessage(None)
+    msg.msg_id = "bench"
+    msg.ctype = ContextType.TEXT
+    msg.content = content
+    msg.from_user_id = msg.from_user_nickname = group or user
+    msg.to_user_id = msg.to_user_nickname = BOT_NAME
+    msg.other_user_id = msg.other_user_nickname = group or user
+    msg.actual_user_id = msg.actual_user_nickname = user
+    msg.is_group = group is not None
+    msg.is_at = is_at
+    msg.at_list = []
+    msg.self_display_name = BOT_NAME
+    return msg
+
+
+# ---------------- 用例 ----------------
+
+@benchmark("compose_context.private")
+def bench_compose_private(corpus):
+    from bridge.context import ContextType
+
+    channel = get_channel()
+    content = "bot " + corpus.text(40)
+    msg = make_message(content)
+    return lambda: channel._compose_context(ContextType.TEXT, content, msg=msg, isgroup=False)
+
+
+@benchmark("compose_context.group_prefix")
+def bench_compose_group(corpus):
+    from bridge.context import ContextType
+
+    channel = get_channel()
+    content = "@bot " + corpus.text(40)
+    msg = make_message(content, group="group_1")
+    return lambda: channel._compose_context(ContextType.TEXT, content, msg=msg, isgroup=True)
+
+
+@benchmark("compose_context.group_at")
+def bench_compose_at(corpus):
+    from bridge.context import ContextType
+
+    channel = get_channel()
+    content = "@{} {}".format(BOT_NAME, corpus.text(40))
+    msg = make_message(content, group="group_0", is_at=True)
+    msg.at_list = ["someone"]
+    return lambda: channel._compose_context(ContextType.TEXT, content, msg=msg, isgroup=True)
+
+
+def _emit_setup(corpus, event_name):
+    from bridge.context import Context, ContextType
+    from bridge.reply import Reply, ReplyType
+    from plugins import EventContext, Event, PluginManager
+
+    channel = get_channel()
+    manager = PluginManager()
+    event = getattr(Event, event_name)
+    if not manager.listening_plugins.get(event):
+        raise Skip("no plugin listening {}".format(event_name))
+    content = corpus.text(60)
+    msg = make_message(content)
+    context = Context(ContextType.TEXT, content, {"session_id": "user_0", "receiver": "user_0", "isgroup": False, "msg": msg})
+    reply_text = corpus.text(200)
+
+    def run():
+        reply = Reply(ReplyType.TEXT, reply_text)
+        return manager.emit_event(EventContext(event, {"channel": channel, "context": context, "reply": reply}))
+
+    return run
+
+
+@benchmark("emit_event.on_handle_context")
+def bench_emit_handle(corpus):
+    return _emit_setup(corpus, "ON_HANDLE_CONTEXT")
+
+
+@benchmark("emit_event.on_decorate_reply")
+def bench_emit_decorate(corpus):
+    return _emit_setup(corpus, "ON_DECORATE_REPLY")
+
+
+@benchmark("emit_event.on_send_reply")
+def bench_emit_send(corpus):
+    return _emit_setup(corpus, "ON_SEND_REPLY")
+
+
+def _expired_dict(size):
+    from common.expired_dict import ExpiredDict
+
+    d = ExpiredDict(3600)
+    for i in range(size):
+        d["msg_{}".format(i)] = True
+    return d
+
+
+@benchmark("expired_dict.set")
+def bench_expired_set(corpus):
+    d = _expired_dict(1000)
+    keys = ["msg_{}".format(i) for i in range(1000)]
+    state = {"i": 0}
+
+    def run():
+        i = state["i"] = (state["i"] + 1) % 1000
+        d[keys[i]] = True
+
+    return run
+
+
+@benchmark("expired_dict.contains")
+def bench_expired_contains(corpus):
+    d = _expired_dict(1000)
+    return lambda: "msg_500" in d
+
+
+@benchmark("expired_dict.get_miss")
+def bench_expired_miss(corpus):
+    d = _expired_dict(1000)
+    return lambda: d.get("missing")
+
+
+@benchmark("expired_dict.keys_1000")
+def bench_expired_keys(corpus):
+    d = _expired_dict(1000)
+    return d.keys
+
+
+@benchmark("bounded_expired_dict.set_get")
+def bench_bounded_expired(corpus):
+    from common.expired_dict import BoundedExpiredDict
+
+    d = BoundedExpiredDict(3600, max_size=1000)
+    keys = ["msg_{}".format(i) for i in range(2000)]
+    state = {"i": 0}
+
+    def run():
+        i = state["i"] = (state["i"] + 1) % 2000
+        d[keys[i]] = True
+        return d.get(keys[i - 1])
+
+    return run
+
+
+def _num_tokens(corpus, model):
+    from bot.chatgpt.chat_gpt_session import num_tokens_from_messages
+
+    if model not in ["wenxin", "xunfei"]:
+        try:
+            import tiktoken  # noqa: F401
+        except ImportError:
+            raise Skip("tiktoken not installed")
+    messages = corpus.messages(20)
+    num_tokens_from_messages(messages, model)  # 预热编码器
+    return lambda: num_tokens_from_messages(messages, model)
+
+
+@benchmark("num_tokens_from_messages.gpt-3.5-turbo")
+def bench_tokens_gpt(corpus):
+    return _num_tokens(corpus, "gpt-3.5-turbo")
+
+
+@benchmark("num_tokens_from_messages.by_character")
+def bench_tokens_char(corpus):
+    return _num_tokens(corpus, "wenxin")
+
+
+def _discard(corpus, model):
+    from bot.chatgpt.chat_gpt_session import ChatGPTSession
+
+    if model != "wenxin":
+        try:
+            import tiktoken  # noqa: F401
+        except ImportError:
+            raise Skip("tiktoken not installed")
+    messages = corpus.messages(30)
+    session = ChatGPTSession("bench", system_prompt=messages[0]["content"], model=model)
+    session.messages = list(messages)
+    # 截断到约一半的消息
+    max_tokens = session.calc_tokens() // 2
+
+    def run():
+        session.messages = list(messages)
+        return session.discard_exceeding(max_tokens)
+
+    return run
+
+
+@benchmark("discard_exceeding.gpt-3.5-turbo")
+def bench_discard_gpt(corpus):
+    return _discard(corpus, "gpt-3.5-turbo")
+
+
+@benchmark("discard_exceeding.by_character")
+def bench_discard_char(corpus):
+    return _discard(corpus, "wenxin")
+
+
+def _words_search(corpus):
+    from plugins.banwords.lib.WordsSearch import WordsSearch
+
+    search = WordsSearch()
+    search.SetKeywords(corpus.keywords(2000))
+    return search
+
+
+@benchmark("words_search.find_first")
+def bench_words_first(corpus):
+    search = _words_search(corpus)
+    text = corpus.text(500)
+    return lambda: search.FindFirst(text)
+
+
+@benchmark("words_search.find_all")
+def bench_words_all(corpus):
+    search = _words_search(corpus)
+    text = corpus.text(500)
+    return lambda: search.FindAll(text)
+
+
+@benchmark("words_search.replace")
+def bench_words_replace(corpus):
+    search = _words_search(corpus)
+    text = corpus.text(500)
+    return lambda: search.Replace(text)
+
+
+@benchmark("split_string_by_utf8_length.10k")
+def bench_split_utf8(corpus):
+    from common.utils import split_string_by_utf8_length
+
+    text = corpus.text(10000)
+    return lambda: split_string_by_utf8_length(text, 2048)
+
+
+def _sorted_dict(size):
+    from common.sorted_dict import SortedDict
+
+    return SortedDict(lambda k, v: v, init_dict={"key_{}".format(i): i for i in range(size)}, reverse=True)
+
+
+@benchmark("sorted_dict.update_20")
+def bench_sorted_update_small(corpus):
+    d = _sorted_dict(20)
+    rng = random.Random(0)
+    values = [rng.randint(0, 1000) for _ in range(1000)]
+    state = {"i": 0}
+
+    def run():
+        i = state["i"] = (state["i"] + 1) % 1000
+        d["key_{}".format(i % 20)] = values[i]
+        return d.keys()
+
+    return run
+
+
+@benchmark("sorted_dict.update_1000")
+def bench_sorted_update_large(corpus):
+    d = _sorted_dict(1000)
+    rng = random.Random(0)
+    values = [rng.randint(0, 100000) for _ in range(1000)]
+    state = {"i": 0}
+
+    def run():
+        i = state["i"] = (state["i"] + 1) % 1000
+        d["key_{}".format(i)] = values[i]
+
+    return run
+
+
+@benchmark("sorted_dict.items_after_update_20")
+def bench_sorted_items(corpus):
+    d = _sorted_dict(20)
+    state = {"i": 0}
+
+    def run():
+        state["i"] += 1
+        d["key_{}".format(state["i"] % 20)] = state["i"] % 50
+        return d.items()
+
+    return run
+
+
+# ---------------- 计时与报告 ----------------
+
+def measure(func, min_time, repeat):
+    """
+    :return: 每次调用耗时(秒)的列表，每个元素对应一轮
+    """
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        loops *= 2 if elapsed <= 0 else max(2, min(10, int(min_time / elapsed * 1.2)))
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        timings.append((time.perf_counter() - start) / loops)
+    return timings, loops
+
+
+def metadata(args):
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    from plugins import PluginManager
+
+    manager = PluginManager()
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "seed": args.seed,
+        "repeat": args.repeat,
+        "min_time": args.min_time,
+        "plugins": [name for name in manager.plugins if manager.plugins[name].enabled and name in manager.instances],
+    }
+
+
+def format_time(seconds):
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return "{:.2f} {}".format(seconds / scale, unit)
+    return "{:.1f} ns".format(seconds / 1e-9)
+
+
+def compare(results, baseline_path, threshold):
+    with open(baseline_path, encoding="utf-8") as f:
+        data = json.load(f)
+    baseline = {item["name"]: item for item in data["benchmarks"]}
+    print("\n对比 {} (commit {}):".format(baseline_path, data["metadata"].get("commit")))
+    rows = []
+    for item in results:
+        old = baseline.get(item["name"])
+        if not old or old.get("skipped") or item.get("skipped"):
+            continue
+        change = item["median"] / old["median"] - 1
+        flag = "慢" if change > threshold else ("快" if change < -threshold else "")
+        rows.append((item["name"], format_time(old["median"]), format_time(item["median"]), "{:+.1f}%".format(change * 100), flag))
+    for row in rows:
+        print("  {:<45} {:>12} -> {:>12} {:>8} {}".format(*row))
+    return rows
+
+
+def main():
+    # 压测不写日志文件，只输出到控制台
+    from common import log
+
+    log.setup({"log_file": ""})
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--filter", help="只运行名称包含该字符串的用例")
+    parser.add_argument("--repeat", type=int, default=5, help="每个用例重复的轮数")
+    parser.add_argument("--min-time", type=float, default=0.2, help="每轮的最短耗时(秒)")
+    parser.add_argument("--seed", type=int, default=20240601, help="生成语料的随机种子")
+    parser.add_argument("--output", help="结果写入的json文件")
+    parser.add_argument("--compare", help="与之前保存的json结果对比")
+    parser.add_argument("--threshold", type=float, default=0.1, help="对比时标记变化超过该比例的用例")
+    args = parser.parse_args()
+
+    setup_env()
+    try:
+        results = []
+        for name, setup in BENCHMARKS:
+            if args.filter and args.filter not in name:
+                continue
+            # 每个用例使用独立的语料实例，增删用例不影响其它用例的输入
+            corpus = Corpus(args.seed)
+            try:
+                func = setup(corpus)
+            except Skip as e:
+                results.append({"name": name, "skipped": str(e)})
+                print("{:<45} skipped: {}".format(name, e))
+                continue
+            timings, loops = measure(func, args.min_time, args.repeat)
+            item = {
+                "name": name,
+                "median": statistics.median(timings),
+                "mean": statistics.mean(timings),
+                "stdev": statistics.stdev(timings) if len(timings) > 1 else 0.0,
+                "min": min(timings),
+                "loops": loops,
+                "repeat": args.repeat,
+            }
+            results.append(item)
+            print("{:<45} {:>12} +- {:<10} ({} loops x {})".format(name, format_time(item["median"]), format_time(item["stdev"]), loops, args.repeat))
+        report = {"metadata": metadata(args), "benchmarks": results}
+    finally:
+        cleanup_env()
+    if args.compare:
+        compare(results, args.compare, args.threshold)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
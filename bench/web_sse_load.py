@@ -0,0 +1,271 @@
+# encoding:utf-8
+"""
+web channel负载测试：同样数量的浏览器客户端分别使用轮询(/poll)和SSE(/stream)接收回复，
+对比回复延迟、服务端请求数和服务端进程CPU耗时
+
+服务端在子进程中运行WebChannel，bot替换为固定延迟的回显，流式模式下会分段推送增量内容。
+每种模式先空闲等待--idle秒(只有轮询或心跳)，再由每个客户端依次发送--messages条消息。
+
+用法:
+    python bench/web_sse_load.py --clients 200 --messages 2 --idle 10
+    python bench/web_sse_load.py --mode sse --clients 500 --output result.json
+"""
+
+import argparse
+import http.client
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def serve(args):
+    import config
+    from bridge.bridge import Bridge
+    from bridge.reply import Reply, ReplyType
+    from channel.web.web_channel import WebChannel
+
+    config.config = config.Config({
+        "channel_type": "web",
+        "web_port": args.port,
+        "web_server_threads": args.clients * 2 + 16,
+        "web_sse_heartbeat": 15,
+    })
+
+    def stub_reply(query, context):
+        callback = context.get("stream_callback")
+        parts = ["echo: ", query[:8], query[8:]]
+        for part in parts:
+            time.sleep(args.reply_latency / len(parts))
+            if callback:
+                callback(part)
+        return Reply(ReplyType.TEXT, "".join(parts))
+
+    Bridge().fetch_reply_content = stub_reply
+    WebChannel().startup()
+
+
+def post_json(port, path, data):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    try:
+        conn.request("POST", path, json.dumps(data), {"Content-Type": "application/json"})
+        return json.loads(conn.getresponse().read())
+    finally:
+        conn.close()
+
+
+class Client(object):
+    def __init__(self, index, args, stats):
+        self.session_id = "bench_{}".format(index)
+        self.args = args
+        self.stats = stats
+        self.pending = {}  # request_id -> 发送时间
+        self.early = {}  # 在/message返回前就收到的回复，request_id -> 收到时间
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        self.conn = None
+
+    def on_reply(self, data):
+        if data.get("type") == "DELTA":
+            self.stats.incr("deltas")
+            return
+        with self.lock:
+            sent = self.pending.pop(data["request_id"], None)
+            if sent is None:
+                self.early[data["request_id"]] = time.time()
+        if sent is not None:
+            self.stats.latency(time.time() - sent)
+
+    def send_messages(self, start_at):
+        time.sleep(max(0, start_at - time.time()))
+        for i in range(self.args.messages):
+            sent = time.time()
+            res = post_json(self.args.port, "/message", {
+                "session_id": self.session_id,
+                "message": "hello {} from {}".format(i, self.session_id),
+                "stream": self.args.mode == "sse",
+            })
+            self.stats.incr("requests")
+            with self.lock:
+                received = self.early.pop(res["request_id"], None)
+                if received is None:
+                    self.pending[res["request_id"]] = sent
+            if received is not None:
+                self.stats.latency(received - sent)
+            time.sleep(self.args.interval)
+
+    def run_sse(self):
+        self.conn = http.client.HTTPConnection("127.0.0.1", self.args.port, timeout=None)
+        self.conn.request("GET", "/stream?session_id=" + self.session_id)
+        response = self.conn.getresponse()
+        self.stats.incr("requests")
+        self.stats.incr("connected")
+        try:
+            while not self.done.is_set():
+                line = response.readline()
+                if not line:
+                    break
+                line = line.decode("utf-8").strip()
+                if line.startswith("data: "):
+                    self.on_reply(json.loads(line[6:]))
+        except (OSError, ValueError):
+            pass
+
+    def run_poll(self):
+        self.stats.incr("connected")
+        while not self.done.is_set():
+            try:
+                data = post_json(self.args.port, "/poll", {"session_id": self.session_id})
+            except (OSError, ValueError):
+                break
+            self.stats.incr("requests")
+            if data.get("has_content"):
+                self.on_reply(data)
+            else:
+                # 与chat.html一致，每次轮询间隔poll_interval秒
+                self.done.wait(self.args.poll_interval)
+
+    def close(self):
+        self.done.set()
+        if self.conn is not None and self.conn.sock is not None:
+            self.conn.sock.close()
+
+
+class Stats(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {"connected": 0, "requests": 0, "deltas": 0}
+        self.latencies = []
+
+    def incr(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def latency(self, seconds):
+        with self.lock:
+            self.latencies.append(seconds)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return None
+    return round(values[min(len(values) - 1, int(len(values) * p))], 3)
+
+
+def wait_server(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/chat")
+            conn.getresponse().read()
+            conn.close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("web channel not started")
+
+
+def run_mode(args):
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    server = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--serve", "--port", str(args.port), "--clients", str(args.clients),
+         "--reply-latency", str(args.reply_latency)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_server(args.port)
+        stats = Stats()
+        clients = [Client(i, args, stats) for i in range(args.clients)]
+        receivers = []
+        for client in clients:
+            # 轮询客户端在第一条消息后才开始轮询，这里与SSE一样从页面打开时开始计算
+            if args.mode == "sse":
+                t = threading.Thread(target=client.run_sse, daemon=True)
+                t.start()
+                # 建立SSE连接并在服务端创建会话队列
+                while stats.counters["connected"] <= len(receivers):
+                    time.sleep(0.001)
+            else:
+                post_json(args.port, "/message", {"session_id": client.session_id, "message": "#warmup"})
+                t = threading.Thread(target=client.run_poll, daemon=True)
+                t.start()
+            receivers.append(t)
+        idle_start = time.time()
+        time.sleep(args.idle)
+        idle_requests = stats.counters["requests"]
+        start_at = time.time() + 0.1
+        senders = [threading.Thread(target=c.send_messages, args=(start_at,), daemon=True) for c in clients]
+        for t in senders:
+            t.start()
+        for t in senders:
+            t.join()
+        deadline = time.time() + args.reply_latency + args.poll_interval + 10
+        while any(c.pending for c in clients) and time.time() < deadline:
+            time.sleep(0.05)
+        elapsed = time.time() - idle_start
+        for client in clients:
+            client.close()
+    finally:
+        server.terminate()
+        server.wait()
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+    expected = args.clients * args.messages
+    return {
+        "mode": args.mode,
+        "clients_connected": stats.counters["connected"],
+        "idle_seconds": args.idle,
+        "idle_requests": idle_requests,
+        "total_requests": stats.counters["requests"],
+        "replies": len(stats.latencies),
+        "replies_expected": expected,
+        "deltas": stats.counters["deltas"],
+        "latency_p50": percentile(stats.latencies, 0.5),
+        "latency_p95": percentile(stats.latencies, 0.95),
+        "server_cpu_seconds": round(cpu, 3),
+        "wall_seconds": round(elapsed, 3),
+    }
+
+
+def main():
+    # 压测不写日志文件，只输出到控制台
+    from common import log
+
+    log.setup({"log_file": ""})
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=["poll", "sse", "both"], default="both")
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=2, help="每个客户端发送的消息数")
+    parser.add_argument("--interval", type=float, default=1.0, help="同一客户端两条消息的间隔(秒)")
+    parser.add_argument("--idle", type=float, default=10, help="发送消息前的空闲时间(秒)")
+    parser.add_argument("--poll-interval", type=float, default=2.0)
+    parser.add_argument("--reply-latency", type=float, default=0.03, help="桩bot的回复耗时(秒)")
+    parser.add_argument("--port", type=int, default=19899)
+    parser.add_argument("--output", help="结果写入的json文件")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    modes = ["poll", "sse"] if args.mode == "both" else [args.mode]
+    results = []
+    for mode in modes:
+        args.mode = mode
+        results.append(run_mode(args))
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
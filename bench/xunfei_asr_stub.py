@@ -0,0 +1,152 @@
+# encoding:utf-8
+"""
+讯飞流式语音识别的本地桩服务测试：并发识别多条语音，检查每条结果互不串扰，并统计耗时
+
+桩服务按讯飞iat接口的协议返回结果：每收到若干帧返回一段文字，其中一段带wpgs替换(rg)，
+收到最后一帧后返回status=2的最终结果。每条语音的第一个采样值不同，桩服务据此生成对应的文字。
+
+用法:
+    python bench/xunfei_asr_stub.py --concurrency 8 --duration 3
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiohttp import web
+
+from voice.xunfei import xunfei_asr
+
+FRAMES_PER_RESULT = 10
+received_frames = {}  # voice_id -> 桩服务实际收到的音频帧数
+
+
+def expected_text(voice_id, frames):
+    # 与stub_handler一致：每FRAMES_PER_RESULT帧返回一段中间结果，第3段中间结果修正第2段，最后一帧返回最终结果
+    middle = frames // FRAMES_PER_RESULT
+    results = {}
+    for sn in range(1, middle + 1):
+        results[sn] = "v{}-{};".format(voice_id, sn)
+    if middle >= 3:
+        results.pop(2)
+        results[3] = "v{}-fix;".format(voice_id)
+    results[middle + 1] = "v{}-{};".format(voice_id, middle + 1)
+    return "".join(results[sn] for sn in sorted(results))
+
+
+def result_message(sn, words, status, rg=None):
+    result = {"sn": sn, "ls": status == 2, "ws": [{"cw": [{"w": words}]}]}
+    if rg:
+        result["pgs"] = "rpl"
+        result["rg"] = rg
+    return json.dumps({"code": 0, "sid": "stub", "message": "success", "data": {"status": status, "result": result}})
+
+
+async def stub_handler(request):
+    ws = web.WebSocketResponse()
+    await ws.prepare(request)
+    voice_id = None
+    frames = 0
+    sn = 0
+    async for msg in ws:
+        data = json.loads(msg.data)
+        frame = data["data"]
+        if frame["status"] == 0:
+            audio = base64.b64decode(frame["audio"])
+            voice_id = struct.unpack("<h", audio[:2])[0]
+        if frame["status"] == 2:
+            received_frames[voice_id] = frames
+            sn += 1
+            await ws.send_str(result_message(sn, "v{}-{};".format(voice_id, sn), 2))
+            break
+        frames += 1
+        if frames % FRAMES_PER_RESULT == 0:
+            sn += 1
+            if sn == 3:
+                await ws.send_str(result_message(sn, "v{}-fix;".format(voice_id), 1, rg=[2, 2]))
+            else:
+                await ws.send_str(result_message(sn, "v{}-{};".format(voice_id, sn), 1))
+    await ws.close()
+    return ws
+
+
+def start_stub_server(port):
+    loop = asyncio.new_event_loop()
+    app = web.Application()
+    app.router.add_get("/v2/iat", stub_handler)
+    runner = web.AppRunner(app)
+    loop.run_until_complete(runner.setup())
+    loop.run_until_complete(web.TCPSite(runner, "127.0.0.1", port).start())
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+
+def make_voice(path, voice_id, duration_s):
+    # 第一个采样值为voice_id，其余为静音
+    n = 16000 * duration_s
+    with wave.open(path, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(16000)
+        wav.writeframes(struct.pack("<h", voice_id) + b"\x00\x00" * (n - 1))
+
+
+def main():
+    # 压测不写日志文件，只输出到控制台
+    from common import log
+
+    log.setup({"log_file": ""})
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=int, default=3, help="每条语音时长(秒)")
+    parser.add_argument("--port", type=int, default=18765)
+    args = parser.parse_args()
+
+    start_stub_server(args.port)
+    url = "ws://127.0.0.1:{}/v2/iat".format(args.port)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = []
+        for i in range(args.concurrency):
+            path = os.path.join(tmp, "voice-{}.wav".format(i + 1))
+            make_voice(path, i + 1, args.duration)
+            paths.append(path)
+
+        def recognize(i):
+            start = time.perf_counter()
+            text = xunfei_asr.xunfei_asr("appid", "secret", "key", {"domain": "iat"}, paths[i], url=url)
+            return text, time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            results = list(pool.map(recognize, range(args.concurrency)))
+        total = time.perf_counter() - start
+
+    errors = []
+    for i, (text, _) in enumerate(results):
+        expected = expected_text(i + 1, received_frames.get(i + 1, 0))
+        if text != expected:
+            errors.append({"voice": i + 1, "expected": expected, "actual": text})
+    summary = {
+        "concurrency": args.concurrency,
+        "audio_seconds": args.duration,
+        "wall_seconds": round(total, 3),
+        "max_request_seconds": round(max(t for _, t in results), 3),
+        "errors": errors,
+    }
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
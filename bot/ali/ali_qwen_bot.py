@@ -15,7 +15,7 @@ from bot.session_manager import SessionManager
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
 from common.log import logger
-from common import const
+from common import const, metrics
 from config import conf, load_config
 
 class AliQwenBot(Bot):
@@ -51,7 +51,7 @@ class AliQwenBot(Bot):
     def reply(self, query, context=None):
         # acquire reply content
         if context.type == ContextType.TEXT:
-            logger.info("[QWEN] query={}".format(query))
+            logger.info("[QWEN] query=%s", query)
 
             session_id = context["session_id"]
             reply = None
@@ -68,16 +68,15 @@ class AliQwenBot(Bot):
             if reply:
                 return reply
             session = self.sessions.session_query(query, session_id)
-            logger.debug("[QWEN] session query={}".format(session.messages))
+            logger.debug("[QWEN] session query=%s", session.messages)
 
             reply_content = self.reply_text(session)
             logger.debug(
-                "[QWEN] new_query={}, session_id={}, reply_cont={}, completion_tokens={}".format(
-                    session.messages,
-                    session_id,
-                    reply_content["content"],
-                    reply_content["completion_tokens"],
-                )
+                "[QWEN] new_query=%s, session_id=%s, reply_cont=%s, completion_tokens=%s",
+                session.messages,
+                session_id,
+                reply_content["content"],
+                reply_content["completion_tokens"]
             )
             if reply_content["completion_tokens"] == 0 and len(reply_content["content"]) > 0:
                 reply = Reply(ReplyType.ERROR, reply_content["content"])
@@ -86,7 +85,7 @@ class AliQwenBot(Bot):
                 reply = Reply(ReplyType.TEXT, reply_content["content"])
             else:
                 reply = Reply(ReplyType.ERROR, reply_content["content"])
-                logger.debug("[QWEN] reply {} used 0 tokens.".format(reply_content))
+                logger.debug("[QWEN] reply %s used 0 tokens.", reply_content)
             return reply
 
         else:
@@ -104,7 +103,8 @@ class AliQwenBot(Bot):
             prompt, history = self.convert_messages_format(session.messages)
             self.update_api_key_if_expired()
             # NOTE 阿里百炼的call()函数未提供temperature参数，考虑到temperature和top_p参数作用相同，取两者较小的值作为top_p参数传入，详情见文档 https://help.aliyun.com/document_detail/2587502.htm
-            response = broadscope_bailian.Completions().call(app_id=self.app_id(), prompt=prompt, history=history, top_p=min(self.temperature(), self.top_p()))
+            with metrics.llm_request("qwen", conf().get("model") or const.QWEN):
+                response = broadscope_bailian.Completions().call(app_id=self.app_id(), prompt=prompt, history=history, top_p=min(self.temperature(), self.top_p()))
             completion_content = self.get_completion_content(response, self.node_id())
             completion_tokens, total_tokens = self.calc_tokens(session.messages, completion_content)
             return {
@@ -176,8 +176,8 @@ class AliQwenBot(Bot):
             # NOTE 模拟系统消息，测试发现人格描述以"你需要扮演ChatGPT"开头能够起作用，而以"你是ChatGPT"开头模型会直接否认
             system_qa = ChatQaMessage(system_content, '好的，我会严格按照你的设定回答问题')
             history.insert(0, system_qa)
-        logger.debug("[QWEN] converted qa messages: {}".format([item.to_dict() for item in history]))
-        logger.debug("[QWEN] user content as prompt: {}".format(user_content))
+        logger.debug("[QWEN] converted qa messages: %s", [item.to_dict() for item in history])
+        logger.debug("[QWEN] user content as prompt: %s", user_content)
         return user_content, history
 
     def get_completion_content(self, response, node_id):
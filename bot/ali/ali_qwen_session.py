@@ -25,7 +25,7 @@ class AliQwenSession(Session):
             precise = False
             if cur_tokens is None:
                 raise e
-            logger.debug("Exception when counting tokens precisely for query: {}".format(e))
+            logger.debug("Exception when counting tokens precisely for query: %s", e)
         while cur_tokens > max_tokens:
             if len(self.messages) > 2:
                 self.messages.pop(1)
@@ -40,7 +40,7 @@ class AliQwenSession(Session):
                 logger.warn("user message exceed max_tokens. total_tokens={}".format(cur_tokens))
                 break
             else:
-                logger.debug("max_tokens={}, total_tokens={}, len(messages)={}".format(max_tokens, cur_tokens, len(self.messages)))
+                logger.debug("max_tokens=%s, total_tokens=%s, len(messages)=%s", max_tokens, cur_tokens, len(self.messages))
                 break
             if precise:
                 cur_tokens = self.calc_tokens()
@@ -2,7 +2,7 @@
 
 import requests
 import json
-from common import const
+from common import const, metrics
 from bot.bot import Bot
 from bot.session_manager import SessionManager
 from bridge.context import ContextType
@@ -38,7 +38,7 @@ class BaiduWenxinBot(Bot):
         # acquire reply content
         if context and context.type:
             if context.type == ContextType.TEXT:
-                logger.info("[BAIDU] query={}".format(query))
+                logger.info("[BAIDU] query=%s", query)
                 session_id = context["session_id"]
                 reply = None
                 if query == "#清除记忆":
@@ -56,7 +56,7 @@ class BaiduWenxinBot(Bot):
                         result["content"],
                     )
                     logger.debug(
-                        "[BAIDU] new_query={}, session_id={}, reply_cont={}, completion_tokens={}".format(session.messages, session_id, reply_content, completion_tokens)
+                        "[BAIDU] new_query=%s, session_id=%s, reply_cont=%s, completion_tokens=%s", session.messages, session_id, reply_content, completion_tokens
                     )
 
                     if total_tokens == 0:
@@ -76,7 +76,7 @@ class BaiduWenxinBot(Bot):
 
     def reply_text(self, session: BaiduWenxinSession, retry_count=0):
         try:
-            logger.info("[BAIDU] model={}".format(session.model))
+            logger.info("[BAIDU] model=%s", session.model)
             access_token = self.get_access_token()
             if access_token == 'None':
                 logger.warn("[BAIDU] access token 获取失败")
@@ -90,13 +90,15 @@ class BaiduWenxinBot(Bot):
                 'Content-Type': 'application/json'
             }
             payload = {'messages': session.messages, 'system': self.prompt} if self.prompt_enabled else {'messages': session.messages}
-            response = requests.request("POST", url, headers=headers, data=json.dumps(payload))
-            response_text = json.loads(response.text)
-            logger.info(f"[BAIDU] response text={response_text}")
+            with metrics.llm_request("baidu", session.model) as request:
+                response = requests.request("POST", url, headers=headers, data=json.dumps(payload))
+                response_text = json.loads(response.text)
+                request.ok = "result" in response_text
+            logger.info("[BAIDU] response text=%s", response_text)
             res_content = response_text["result"]
             total_tokens = response_text["usage"]["total_tokens"]
             completion_tokens = response_text["usage"]["completion_tokens"]
-            logger.info("[BAIDU] reply={}".format(res_content))
+            logger.info("[BAIDU] reply=%s", res_content)
             return {
                 "total_tokens": total_tokens,
                 "completion_tokens": completion_tokens,
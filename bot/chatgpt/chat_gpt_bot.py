@@ -1,18 +1,18 @@
 # encoding:utf-8
 
-import time
-
 import openai
 import openai.error
 import requests
-from common import const
+from common import const, metrics
 from bot.bot import Bot
 from bot.chatgpt.chat_gpt_session import ChatGPTSession
 from bot.openai.open_ai_image import OpenAIImage
 from bot.session_manager import SessionManager
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
+from common.key_pool import get_key_pool
 from common.log import logger
+from common.retry import get_retry_policy, then
 from common.token_bucket import TokenBucket
 from config import conf, load_config
 from bot.baidu.baidu_wenxin_session import BaiduWenxinSession
@@ -21,10 +21,7 @@ from bot.baidu.baidu_wenxin_session import BaiduWenxinSession
 class ChatGPTBot(Bot, OpenAIImage):
     def __init__(self):
         super().__init__()
-        # set the default api_key
-        openai.api_key = conf().get("open_ai_api_key")
-        if conf().get("open_ai_api_base"):
-            openai.api_base = conf().get("open_ai_api_base")
+        # 默认的api_key和api_base随每次请求传入，不修改openai模块的全局配置，避免和用户自定义的api_key互相覆盖
         proxy = conf().get("proxy")
         if proxy:
             openai.proxy = proxy
@@ -43,7 +40,10 @@ class ChatGPTBot(Bot, OpenAIImage):
             "presence_penalty": conf().get("presence_penalty", 0.0),  # [-2,2]之间，该值越大则更倾向于产生不同的内容
             "request_timeout": conf().get("request_timeout", None),  # 请求超时时间，openai接口默认设置为600，对于难问题一般需要较长时间
             "timeout": conf().get("request_timeout", None),  # 重试超时时间，在这个时间内，将会自动重试
+            "api_key": conf().get("open_ai_api_key"),
         }
+        if conf().get("open_ai_api_base"):
+            self.args["api_base"] = conf().get("open_ai_api_base")
         # o1相关模型固定了部分参数，暂时去掉
         if conf_model in [const.O1, const.O1_MINI]:
             self.sessions = SessionManager(BaiduWenxinSession, model=conf().get("model") or const.O1_MINI)
@@ -54,7 +54,7 @@ class ChatGPTBot(Bot, OpenAIImage):
     def reply(self, query, context=None):
         # acquire reply content
         if context.type == ContextType.TEXT:
-            logger.info("[CHATGPT] query={}".format(query))
+            logger.info("[CHATGPT] query=%s", query)
 
             session_id = context["session_id"]
             reply = None
@@ -71,7 +71,7 @@ class ChatGPTBot(Bot, OpenAIImage):
             if reply:
                 return reply
             session = self.sessions.session_query(query, session_id)
-            logger.debug("[CHATGPT] session query={}".format(session.messages))
+            logger.debug("[CHATGPT] session query=%s", session.messages)
 
             api_key = context.get("openai_api_key")
             model = context.get("gpt_model")
@@ -83,90 +83,104 @@ class ChatGPTBot(Bot, OpenAIImage):
             #     # reply in stream
             #     return self.reply_text_stream(query, new_query, session_id)
 
-            reply_content = self.reply_text(session, api_key, args=new_args)
-            logger.debug(
-                "[CHATGPT] new_query={}, session_id={}, reply_cont={}, completion_tokens={}".format(
-                    session.messages,
-                    session_id,
-                    reply_content["content"],
-                    reply_content["completion_tokens"],
-                )
-            )
-            if reply_content["completion_tokens"] == 0 and len(reply_content["content"]) > 0:
-                reply = Reply(ReplyType.ERROR, reply_content["content"])
-            elif reply_content["completion_tokens"] > 0:
-                self.sessions.session_reply(reply_content["content"], session_id, reply_content["total_tokens"])
-                reply = Reply(ReplyType.TEXT, reply_content["content"])
-            else:
-                reply = Reply(ReplyType.ERROR, reply_content["content"])
-                logger.debug("[CHATGPT] reply {} used 0 tokens.".format(reply_content))
-            return reply
+            # 延迟重试时，在重试完成后再构建回复
+            return then(lambda: self.reply_text(session, api_key, args=new_args),
+                        lambda reply_content: self._build_reply(session, reply_content))
 
         elif context.type == ContextType.IMAGE_CREATE:
-            ok, retstring = self.create_img(query, 0)
-            reply = None
-            if ok:
-                reply = Reply(ReplyType.IMAGE_URL, retstring)
-            else:
-                reply = Reply(ReplyType.ERROR, retstring)
-            return reply
+            return then(lambda: self.create_img(query, 0), self._build_img_reply)
         else:
             reply = Reply(ReplyType.ERROR, "Bot不支持处理{}类型的消息".format(context.type))
             return reply
 
-    def reply_text(self, session: ChatGPTSession, api_key=None, args=None, retry_count=0) -> dict:
+    def _build_reply(self, session: ChatGPTSession, reply_content) -> Reply:
+        session_id = session.session_id
+        logger.debug(
+            "[CHATGPT] new_query=%s, session_id=%s, reply_cont=%s, completion_tokens=%s",
+            session.messages,
+            session_id,
+            reply_content["content"],
+            reply_content["completion_tokens"]
+        )
+        if reply_content["completion_tokens"] == 0 and len(reply_content["content"]) > 0:
+            reply = Reply(ReplyType.ERROR, reply_content["content"])
+        elif reply_content["completion_tokens"] > 0:
+            self.sessions.session_reply(reply_content["content"], session_id, reply_content["total_tokens"])
+            reply = Reply(ReplyType.TEXT, reply_content["content"])
+        else:
+            reply = Reply(ReplyType.ERROR, reply_content["content"])
+            logger.debug("[CHATGPT] reply %s used 0 tokens.", reply_content)
+        return reply
+
+    def reply_text(self, session: ChatGPTSession, api_key=None, args=None, retry_count=0, retry=None) -> dict:
         """
         call openai's ChatCompletion to get the answer
         :param session: a conversation session
         :param session_id: session id
         :param retry_count: retry count
+        :param retry: retry state shared by all attempts of this request
         :return: {}
         """
+        retry = retry or get_retry_policy("openai").start()
+        key_pool = get_key_pool("open_ai_api_key")
+        pool_key = None
         try:
             if conf().get("rate_limit_chatgpt") and not self.tb4chatgpt.get_token():
                 raise openai.error.RateLimitError("RateLimitError: rate limit exceeded")
-            # if api_key == None, the default openai.api_key will be used
             if args is None:
                 args = self.args
-            response = openai.ChatCompletion.create(api_key=api_key, messages=session.messages, **args)
+            if api_key:
+                # 用户通过指令设置了自己的api_key
+                args = dict(args, api_key=api_key)
+            else:
+                # 从配置的多个key中选择剩余额度最多的key
+                pool_key = key_pool.acquire()
+                if pool_key:
+                    args = dict(args, api_key=pool_key.key)
+            with metrics.llm_request("openai", args.get("model")):
+                response = openai.ChatCompletion.create(messages=session.messages, **args)
+            key_pool.release(pool_key, tokens=response["usage"]["total_tokens"])
+            metrics.record_tokens("openai", args.get("model"), response["usage"].get("prompt_tokens"), response["usage"]["completion_tokens"])
             # logger.debug("[CHATGPT] response={}".format(response))
-            logger.info("[ChatGPT] reply={}, total_tokens={}".format(response.choices[0]['message']['content'], response["usage"]["total_tokens"]))
+            logger.info("[ChatGPT] reply=%s, total_tokens=%s", response.choices[0]['message']['content'], response["usage"]["total_tokens"])
             return {
                 "total_tokens": response["usage"]["total_tokens"],
                 "completion_tokens": response["usage"]["completion_tokens"],
                 "content": response.choices[0]["message"]["content"],
             }
         except Exception as e:
-            need_retry = retry_count < 2
+            rate_limited = isinstance(e, openai.error.RateLimitError)
+            key_pool.release(pool_key, headers=getattr(e, "headers", None), rate_limited=rate_limited, error=True)
+            need_retry = True
             result = {"completion_tokens": 0, "content": "我现在有点累了，等会再来吧"}
-            if isinstance(e, openai.error.RateLimitError):
+            if rate_limited:
                 logger.warn("[CHATGPT] RateLimitError: {}".format(e))
                 result["content"] = "提问太快啦，请休息一下再问我吧"
-                if need_retry:
-                    time.sleep(20)
+                # 还有未被限流的key时直接换key重试
+                delay = 0 if pool_key and key_pool.has_healthy() else 20
             elif isinstance(e, openai.error.Timeout):
                 logger.warn("[CHATGPT] Timeout: {}".format(e))
                 result["content"] = "我没有收到你的消息"
-                if need_retry:
-                    time.sleep(5)
+                delay = 5
             elif isinstance(e, openai.error.APIError):
                 logger.warn("[CHATGPT] Bad Gateway: {}".format(e))
                 result["content"] = "请再问我一次"
-                if need_retry:
-                    time.sleep(10)
+                delay = 10
             elif isinstance(e, openai.error.APIConnectionError):
                 logger.warn("[CHATGPT] APIConnectionError: {}".format(e))
                 result["content"] = "我连接不到你的网络"
-                if need_retry:
-                    time.sleep(5)
+                delay = 5
             else:
                 logger.exception("[CHATGPT] Exception: {}".format(e))
                 need_retry = False
                 self.sessions.clear_session(session.session_id)
 
+            if need_retry:
+                delay = retry.backoff(delay)
+                need_retry = delay is not None
             if need_retry:
                 logger.warn("[CHATGPT] 第{}次重试".format(retry_count + 1))
-                return self.reply_text(session, api_key, args, retry_count + 1)
+                return retry.retry(delay, self.reply_text, session, api_key, args, retry_count + 1, retry=retry)
             else:
                 return result
 
@@ -174,8 +188,8 @@ class ChatGPTBot(Bot, OpenAIImage):
 class AzureChatGPTBot(ChatGPTBot):
     def __init__(self):
         super().__init__()
-        openai.api_type = "azure"
-        openai.api_version = conf().get("azure_api_version", "2023-06-01-preview")
+        self.args["api_type"] = "azure"
+        self.args["api_version"] = conf().get("azure_api_version", "2023-06-01-preview")
         self.args["deployment_id"] = conf().get("azure_deployment_id")
 
     def create_img(self, query, retry_count=0, api_key=None):
@@ -144,7 +144,7 @@ class ClaudeAIBot(Bot, OpenAIImage):
             if session.messages[0].get("role") == "system":
                 if model == "wenxin" or model == "claude":
                     session.messages.pop(0)
-            logger.info(f"[CLAUDEAI] query={query}")
+            logger.info("[CLAUDEAI] query=%s", query)
 
             # do http request
             base_url = "https://claude.ai"
@@ -194,7 +194,7 @@ class ClaudeAIBot(Bot, OpenAIImage):
                 if "rate limi" in reply_content:
                     logger.error("rate limit error: The conversation has reached the system speed limit and is synchronized with Cladue. Please go to the official website to check the lifting time")
                     return Reply(ReplyType.ERROR, "对话达到系统速率限制，与cladue同步，请进入官网查看解除限制时间")
-                logger.info(f"[CLAUDE] reply={reply_content}, total_tokens=invisible")
+                logger.info("[CLAUDE] reply=%s, total_tokens=invisible", reply_content)
                 self.sessions.session_reply(reply_content, session_id, 100)
                 return Reply(ReplyType.TEXT, reply_content)
             else:
@@ -1,7 +1,5 @@
 # encoding:utf-8
 
-import time
-
 import openai
 import openai.error
 import anthropic
@@ -12,8 +10,11 @@ from bot.baidu.baidu_wenxin_session import BaiduWenxinSession
 from bot.session_manager import SessionManager
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
+from common.client_cache import get_client
+from common.key_pool import get_key_pool
 from common.log import logger
-from common import const
+from common.retry import get_retry_policy, then
+from common import const, metrics
 from config import conf
 
 user_session = dict()
@@ -23,20 +24,14 @@ user_session = dict()
 class ClaudeAPIBot(Bot, OpenAIImage):
     def __init__(self):
         super().__init__()
-        proxy = conf().get("proxy", None)
-        base_url = conf().get("open_ai_api_base", None)  # 复用"open_ai_api_base"参数作为base_url
-        self.claudeClient = anthropic.Anthropic(
-            api_key=conf().get("claude_api_key"),
-            proxies=proxy if proxy else None,
-            base_url=base_url if base_url else None
-        )
+        self.claudeClient = self._get_client(conf().get("claude_api_key"))
         self.sessions = SessionManager(BaiduWenxinSession, model=conf().get("model") or "text-davinci-003")
 
     def reply(self, query, context=None):
         # acquire reply content
         if context and context.type:
             if context.type == ContextType.TEXT:
-                logger.info("[CLAUDE_API] query={}".format(query))
+                logger.info("[CLAUDE_API] query=%s", query)
                 session_id = context["session_id"]
                 reply = None
                 if query == "#清除记忆":
@@ -47,64 +42,83 @@ class ClaudeAPIBot(Bot, OpenAIImage):
                     reply = Reply(ReplyType.INFO, "所有人记忆已清除")
                 else:
                     session = self.sessions.session_query(query, session_id)
-                    result = self.reply_text(session)
-                    logger.info(result)
-                    total_tokens, completion_tokens, reply_content = (
-                        result["total_tokens"],
-                        result["completion_tokens"],
-                        result["content"],
-                    )
-                    logger.debug(
-                        "[CLAUDE_API] new_query={}, session_id={}, reply_cont={}, completion_tokens={}".format(str(session), session_id, reply_content, completion_tokens)
-                    )
-
-                    if total_tokens == 0:
-                        reply = Reply(ReplyType.ERROR, reply_content)
-                    else:
-                        self.sessions.session_reply(reply_content, session_id, total_tokens)
-                        reply = Reply(ReplyType.TEXT, reply_content)
+                    return then(lambda: self.reply_text(session), lambda result: self._build_reply(session, result))
                 return reply
             elif context.type == ContextType.IMAGE_CREATE:
-                ok, retstring = self.create_img(query, 0)
-                reply = None
-                if ok:
-                    reply = Reply(ReplyType.IMAGE_URL, retstring)
-                else:
-                    reply = Reply(ReplyType.ERROR, retstring)
-                return reply
+                return then(lambda: self.create_img(query, 0), self._build_img_reply)
 
-    def reply_text(self, session: BaiduWenxinSession, retry_count=0):
+    def _build_reply(self, session: BaiduWenxinSession, result) -> Reply:
+        session_id = session.session_id
+        logger.info(result)
+        total_tokens, completion_tokens, reply_content = (
+            result["total_tokens"],
+            result["completion_tokens"],
+            result["content"],
+        )
+        logger.debug(
+            "[CLAUDE_API] new_query=%s, session_id=%s, reply_cont=%s, completion_tokens=%s", str(session), session_id, reply_content, completion_tokens
+        )
+
+        if total_tokens == 0:
+            return Reply(ReplyType.ERROR, reply_content)
+        self.sessions.session_reply(reply_content, session_id, total_tokens)
+        return Reply(ReplyType.TEXT, reply_content)
+
+    def _get_client(self, api_key):
+        proxy = conf().get("proxy", None)
+        base_url = conf().get("open_ai_api_base", None)  # 复用"open_ai_api_base"参数作为base_url
+        return get_client(
+            "claude",
+            lambda: anthropic.Anthropic(
+                api_key=api_key,
+                proxies=proxy if proxy else None,
+                base_url=base_url if base_url else None
+            ),
+            api_key,
+            base_url,
+        )
+
+    def reply_text(self, session: BaiduWenxinSession, retry_count=0, retry=None):
+        retry = retry or get_retry_policy("claude").start()
+        key_pool = get_key_pool("claude_api_key")
+        pool_key = key_pool.acquire()
         try:
             actual_model = self._model_mapping(conf().get("model"))
-            response = self.claudeClient.messages.create(
-                model=actual_model,
-                max_tokens=4096,
-                system=conf().get("character_desc", ""),
-                messages=session.messages
-            )
+            client = self._get_client(pool_key.key) if pool_key else self.claudeClient
+            with metrics.llm_request("claude", actual_model):
+                response = client.messages.create(
+                    model=actual_model,
+                    max_tokens=4096,
+                    system=conf().get("character_desc", ""),
+                    messages=session.messages
+                )
             # response = openai.Completion.create(prompt=str(session), **self.args)
             res_content = response.content[0].text.strip().replace("<|endoftext|>", "")
             total_tokens = response.usage.input_tokens+response.usage.output_tokens
             completion_tokens = response.usage.output_tokens
-            logger.info("[CLAUDE_API] reply={}".format(res_content))
+            key_pool.release(pool_key, tokens=total_tokens)
+            metrics.record_tokens("claude", actual_model, response.usage.input_tokens, completion_tokens)
+            logger.info("[CLAUDE_API] reply=%s", res_content)
             return {
                 "total_tokens": total_tokens,
                 "completion_tokens": completion_tokens,
                 "content": res_content,
             }
         except Exception as e:
-            need_retry = retry_count < 2
+            rate_limited = isinstance(e, (openai.error.RateLimitError, anthropic.RateLimitError))
+            response = getattr(e, "response", None)
+            key_pool.release(pool_key, headers=getattr(response, "headers", None), rate_limited=rate_limited, error=True)
+            need_retry = True
             result = {"total_tokens": 0, "completion_tokens": 0, "content": "我现在有点累了，等会再来吧"}
-            if isinstance(e, openai.error.RateLimitError):
+            if rate_limited:
                 logger.warn("[CLAUDE_API] RateLimitError: {}".format(e))
                 result["content"] = "提问太快啦，请休息一下再问我吧"
-                if need_retry:
-                    time.sleep(20)
+                # 还有未被限流的key时直接换key重试
+                delay = 0 if key_pool.has_healthy() else 20
             elif isinstance(e, openai.error.Timeout):
                 logger.warn("[CLAUDE_API] Timeout: {}".format(e))
                 result["content"] = "我没有收到你的消息"
-                if need_retry:
-                    time.sleep(5)
+                delay = 5
             elif isinstance(e, openai.error.APIConnectionError):
                 logger.warn("[CLAUDE_API] APIConnectionError: {}".format(e))
                 need_retry = False
@@ -114,9 +128,12 @@ class ClaudeAPIBot(Bot, OpenAIImage):
                 need_retry = False
                 self.sessions.clear_session(session.session_id)
 
+            if need_retry:
+                delay = retry.backoff(delay)
+                need_retry = delay is not None
             if need_retry:
                 logger.warn("[CLAUDE_API] 第{}次重试".format(retry_count + 1))
-                return self.reply_text(session, retry_count + 1)
+                return retry.retry(delay, self.reply_text, session, retry_count + 1, retry=retry)
             else:
                 return result
 
@@ -4,6 +4,7 @@ from bot.bot import Bot
 from bot.session_manager import SessionManager
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
+from common import metrics
 from common.log import logger
 from config import conf, load_config
 from .dashscope_session import DashscopeSession
@@ -32,7 +33,7 @@ class DashscopeBot(Bot):
     def reply(self, query, context=None):
         # acquire reply content
         if context.type == ContextType.TEXT:
-            logger.info("[DASHSCOPE] query={}".format(query))
+            logger.info("[DASHSCOPE] query=%s", query)
 
             session_id = context["session_id"]
             reply = None
@@ -49,16 +50,15 @@ class DashscopeBot(Bot):
             if reply:
                 return reply
             session = self.sessions.session_query(query, session_id)
-            logger.debug("[DASHSCOPE] session query={}".format(session.messages))
+            logger.debug("[DASHSCOPE] session query=%s", session.messages)
 
             reply_content = self.reply_text(session)
             logger.debug(
-                "[DASHSCOPE] new_query={}, session_id={}, reply_cont={}, completion_tokens={}".format(
-                    session.messages,
-                    session_id,
-                    reply_content["content"],
-                    reply_content["completion_tokens"],
-                )
+                "[DASHSCOPE] new_query=%s, session_id=%s, reply_cont=%s, completion_tokens=%s",
+                session.messages,
+                session_id,
+                reply_content["content"],
+                reply_content["completion_tokens"]
             )
             if reply_content["completion_tokens"] == 0 and len(reply_content["content"]) > 0:
                 reply = Reply(ReplyType.ERROR, reply_content["content"])
@@ -67,7 +67,7 @@ class DashscopeBot(Bot):
                 reply = Reply(ReplyType.TEXT, reply_content["content"])
             else:
                 reply = Reply(ReplyType.ERROR, reply_content["content"])
-                logger.debug("[DASHSCOPE] reply {} used 0 tokens.".format(reply_content))
+                logger.debug("[DASHSCOPE] reply %s used 0 tokens.", reply_content)
             return reply
         else:
             reply = Reply(ReplyType.ERROR, "Bot不支持处理{}类型的消息".format(context.type))
@@ -82,12 +82,15 @@ class DashscopeBot(Bot):
         :return: {}
         """
         try:
-            dashscope.api_key = self.api_key
-            response = self.client.call(
-                dashscope_models[self.model_name],
-                messages=session.messages,
-                result_format="message"
-            )
+            # 每次调用显式传入api_key，不修改dashscope模块的全局配置
+            with metrics.llm_request("dashscope", dashscope_models[self.model_name]) as request:
+                response = self.client.call(
+                    dashscope_models[self.model_name],
+                    api_key=self.api_key,
+                    messages=session.messages,
+                    result_format="message"
+                )
+                request.ok = response.status_code == HTTPStatus.OK
             if response.status_code == HTTPStatus.OK:
                 content = response.output.choices[0]["message"]["content"]
                 return {
@@ -11,11 +11,21 @@ import google.generativeai as genai
 from bot.session_manager import SessionManager
 from bridge.context import ContextType, Context
 from bridge.reply import Reply, ReplyType
+from common import metrics
 from common.log import logger
 from config import conf
 from bot.chatgpt.chat_gpt_session import ChatGPTSession
 from bot.baidu.baidu_wenxin_session import BaiduWenxinSession
 from google.generativeai.types import HarmCategory, HarmBlockThreshold
+from common.client_cache import get_client
+
+# 安全设置
+SAFETY_SETTINGS = {
+    HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
+    HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
+    HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
+    HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
+}
 
 
 # OpenAI对话模型API (可用)
@@ -29,35 +39,30 @@ class GoogleGeminiBot(Bot):
         self.model = conf().get("model") or "gemini-pro"
         if self.model == "gemini":
             self.model = "gemini-pro"
+        # genai.configure修改的是SDK的全局配置，只在初始化时调用一次，模型实例按(api_key, model)复用
+        genai.configure(api_key=self.api_key)
+
     def reply(self, query, context: Context = None) -> Reply:
         try:
             if context.type != ContextType.TEXT:
                 logger.warn(f"[Gemini] Unsupported message type, type={context.type}")
                 return Reply(ReplyType.TEXT, None)
-            logger.info(f"[Gemini] query={query}")
+            logger.info("[Gemini] query=%s", query)
             session_id = context["session_id"]
             session = self.sessions.session_query(query, session_id)
             gemini_messages = self._convert_to_gemini_messages(self.filter_messages(session.messages))
-            logger.debug(f"[Gemini] messages={gemini_messages}")
-            genai.configure(api_key=self.api_key)
-            model = genai.GenerativeModel(self.model)
-            
-            # 添加安全设置
-            safety_settings = {
-                HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
-                HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
-                HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
-                HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
-            }
-            
+            logger.debug("[Gemini] messages=%s", gemini_messages)
+            model = get_client("gemini", lambda: genai.GenerativeModel(self.model), self.api_key, model=self.model)
+
             # 生成回复，包含安全设置
-            response = model.generate_content(
-                gemini_messages,
-                safety_settings=safety_settings
-            )
+            with metrics.llm_request("gemini", self.model):
+                response = model.generate_content(
+                    gemini_messages,
+                    safety_settings=SAFETY_SETTINGS
+                )
             if response.candidates and response.candidates[0].content:
                 reply_text = response.candidates[0].content.parts[0].text
-                logger.info(f"[Gemini] reply={reply_text}")
+                logger.info("[Gemini] reply=%s", reply_text)
                 self.sessions.session_reply(reply_text, session_id)
                 return Reply(ReplyType.TEXT, reply_text)
             else:
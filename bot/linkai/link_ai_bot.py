@@ -10,10 +10,12 @@ from bot.chatgpt.chat_gpt_session import ChatGPTSession
 from bot.session_manager import SessionManager
 from bridge.context import Context, ContextType
 from bridge.reply import Reply, ReplyType
+from common.key_pool import get_key_pool
+from common.retry import get_retry_policy
 from common.log import logger
 from config import conf, pconf
 import threading
-from common import memory, utils
+from common import memory, metrics, utils
 import base64
 import os
 
@@ -44,32 +46,27 @@ class LinkAIBot(Bot):
             reply = Reply(ReplyType.ERROR, "Bot不支持处理{}类型的消息".format(context.type))
             return reply
 
-    def _chat(self, query, context, retry_count=0) -> Reply:
+    def _chat(self, query, context, retry_count=0, retry=None) -> Reply:
         """
         发起对话请求
         :param query: 请求提示词
         :param context: 对话上下文
         :param retry_count: 当前递归重试次数
+        :param retry: 本次请求各次重试共用的重试状态
         :return: 回复
         """
-        if retry_count > 2:
-            # exit from retry 2 times
-            logger.warn("[LINKAI] failed after maximum number of retry times")
-            return Reply(ReplyType.TEXT, "请再问我一次吧")
-
+        retry = retry or get_retry_policy("linkai").start()
         try:
             # load config
             if context.get("generate_breaked_by"):
-                logger.info(f"[LINKAI] won't set appcode because a plugin ({context['generate_breaked_by']}) affected the context")
+                logger.info("[LINKAI] won't set appcode because a plugin (%s) affected the context", context['generate_breaked_by'])
                 app_code = None
             else:
                 plugin_app_code = self._find_group_mapping_code(context)
                 app_code = context.kwargs.get("app_code") or plugin_app_code or conf().get("linkai_app_code")
-            linkai_api_key = conf().get("linkai_api_key")
-
             session_id = context["session_id"]
             session_message = self.sessions.session_msg_query(query, session_id)
-            logger.debug(f"[LinkAI] session={session_message}, session_id={session_id}")
+            logger.debug("[LinkAI] session=%s, session_id=%s", session_message, session_id)
 
             # image process
             img_cache = memory.USER_IMAGE_CACHE.get(session_id)
@@ -118,20 +115,18 @@ class LinkAIBot(Bot):
             file_id = context.kwargs.get("file_id")
             if file_id:
                 body["file_id"] = file_id
-            logger.info(f"[LINKAI] query={query}, app_code={app_code}, model={body.get('model')}, file_id={file_id}")
-            headers = {"Authorization": "Bearer " + linkai_api_key}
+            logger.info("[LINKAI] query=%s, app_code=%s, model=%s, file_id=%s", query, app_code, body.get('model'), file_id)
 
             # do http request
-            base_url = conf().get("linkai_api_base", "https://api.link-ai.tech")
-            res = requests.post(url=base_url + "/v1/chat/completions", json=body, headers=headers,
-                                timeout=conf().get("request_timeout", 180))
+            res = self._request_chat(body)
             if res.status_code == 200:
                 # execute success
                 response = res.json()
                 reply_content = response["choices"][0]["message"]["content"]
                 total_tokens = response["usage"]["total_tokens"]
+                metrics.record_tokens("linkai", body.get("model"), response["usage"].get("prompt_tokens"), response["usage"].get("completion_tokens"))
                 res_code = response.get('code')
-                logger.info(f"[LINKAI] reply={reply_content}, total_tokens={total_tokens}, res_code={res_code}")
+                logger.info("[LINKAI] reply=%s, total_tokens=%s, res_code=%s", reply_content, total_tokens, res_code)
                 if res_code == 429:
                     logger.warn(f"[LINKAI] 用户访问超出限流配置，sender_id={body.get('sender_id')}")
                 else:
@@ -160,9 +155,12 @@ class LinkAIBot(Bot):
 
                 if res.status_code >= 500:
                     # server error, need retry
-                    time.sleep(2)
-                    logger.warn(f"[LINKAI] do retry, times={retry_count}")
-                    return self._chat(query, context, retry_count + 1)
+                    return self._retry_chat(retry, 2, query, context, retry_count)
+
+                if res.status_code == 429 and retry_count < 2 and get_key_pool("linkai_api_key").has_healthy():
+                    # 当前key被限流，换其它key重试
+                    logger.warn(f"[LINKAI] rate limited, retry with another key, times={retry_count}")
+                    return self._retry_chat(retry, 0, query, context, retry_count)
 
                 error_reply = "提问太快啦，请休息一下再问我吧"
                 if res.status_code == 409:
@@ -172,16 +170,22 @@ class LinkAIBot(Bot):
         except Exception as e:
             logger.exception(e)
             # retry
-            time.sleep(2)
-            logger.warn(f"[LINKAI] do retry, times={retry_count}")
-            return self._chat(query, context, retry_count + 1)
+            return self._retry_chat(retry, 2, query, context, retry_count)
+
+    def _retry_chat(self, retry, delay, query, context, retry_count):
+        delay = retry.backoff(delay)
+        if delay is None:
+            logger.warn("[LINKAI] failed after maximum number of retry times")
+            return Reply(ReplyType.TEXT, "请再问我一次吧")
+        logger.warn(f"[LINKAI] do retry, times={retry_count}")
+        return retry.retry(delay, self._chat, query, context, retry_count + 1, retry=retry)
 
     def _process_image_msg(self, app_code: str, session_id: str, query:str, img_cache: dict):
         try:
             enable_image_input = False
             app_info = self._fetch_app_info(app_code)
             if not app_info:
-                logger.debug(f"[LinkAI] not found app, can't process images, app_code={app_code}")
+                logger.debug("[LinkAI] not found app, can't process images, app_code=%s", app_code)
                 return None
             plugins = app_info.get("data").get("plugins")
             for plugin in plugins:
@@ -192,7 +196,7 @@ class LinkAIBot(Bot):
             msg = img_cache.get("msg")
             path = img_cache.get("path")
             msg.prepare()
-            logger.info(f"[LinkAI] query with images, path={path}")
+            logger.info("[LinkAI] query with images, path=%s", path)
             messages = self._build_vision_msg(query, path)
             memory.USER_IMAGE_CACHE[session_id] = None
             return messages
@@ -236,16 +240,8 @@ class LinkAIBot(Bot):
         except Exception as e:
             logger.exception(e)
 
-    def reply_text(self, session: ChatGPTSession, app_code="", retry_count=0) -> dict:
-        if retry_count >= 2:
-            # exit from retry 2 times
-            logger.warn("[LINKAI] failed after maximum number of retry times")
-            return {
-                "total_tokens": 0,
-                "completion_tokens": 0,
-                "content": "请再问我一次吧"
-            }
-
+    def reply_text(self, session: ChatGPTSession, app_code="", retry_count=0, retry=None) -> dict:
+        retry = retry or get_retry_policy("linkai").start()
         try:
             body = {
                 "app_code": app_code,
@@ -258,18 +254,15 @@ class LinkAIBot(Bot):
             }
             if self.args.get("max_tokens"):
                 body["max_tokens"] = self.args.get("max_tokens")
-            headers = {"Authorization": "Bearer " + conf().get("linkai_api_key")}
-
             # do http request
-            base_url = conf().get("linkai_api_base", "https://api.link-ai.tech")
-            res = requests.post(url=base_url + "/v1/chat/completions", json=body, headers=headers,
-                                timeout=conf().get("request_timeout", 180))
+            res = self._request_chat(body)
             if res.status_code == 200:
                 # execute success
                 response = res.json()
                 reply_content = response["choices"][0]["message"]["content"]
                 total_tokens = response["usage"]["total_tokens"]
-                logger.info(f"[LINKAI] reply={reply_content}, total_tokens={total_tokens}")
+                metrics.record_tokens("linkai", body.get("model"), response["usage"].get("prompt_tokens"), response["usage"].get("completion_tokens"))
+                logger.info("[LINKAI] reply=%s, total_tokens=%s", reply_content, total_tokens)
                 return {
                     "total_tokens": total_tokens,
                     "completion_tokens": response["usage"]["completion_tokens"],
@@ -284,9 +277,12 @@ class LinkAIBot(Bot):
 
                 if res.status_code >= 500:
                     # server error, need retry
-                    time.sleep(2)
-                    logger.warn(f"[LINKAI] do retry, times={retry_count}")
-                    return self.reply_text(session, app_code, retry_count + 1)
+                    return self._retry_reply_text(retry, 2, session, app_code, retry_count)
+
+                if res.status_code == 429 and retry_count < 2 and get_key_pool("linkai_api_key").has_healthy():
+                    # 当前key被限流，换其它key重试
+                    logger.warn(f"[LINKAI] rate limited, retry with another key, times={retry_count}")
+                    return self._retry_reply_text(retry, 0, session, app_code, retry_count)
 
                 return {
                     "total_tokens": 0,
@@ -297,9 +293,40 @@ class LinkAIBot(Bot):
         except Exception as e:
             logger.exception(e)
             # retry
-            time.sleep(2)
-            logger.warn(f"[LINKAI] do retry, times={retry_count}")
-            return self.reply_text(session, app_code, retry_count + 1)
+            return self._retry_reply_text(retry, 2, session, app_code, retry_count)
+
+    def _retry_reply_text(self, retry, delay, session, app_code, retry_count):
+        delay = retry.backoff(delay)
+        if delay is None:
+            logger.warn("[LINKAI] failed after maximum number of retry times")
+            return {
+                "total_tokens": 0,
+                "completion_tokens": 0,
+                "content": "请再问我一次吧"
+            }
+        logger.warn(f"[LINKAI] do retry, times={retry_count}")
+        return retry.retry(delay, self.reply_text, session, app_code, retry_count + 1, retry=retry)
+
+    def _request_chat(self, body):
+        """
+        从linkai_api_key和linkai_api_keys中选择剩余额度最多的key发起对话请求，并根据响应更新key的状态
+        """
+        key_pool = get_key_pool("linkai_api_key")
+        pool_key = key_pool.acquire()
+        api_key = pool_key.key if pool_key else conf().get("linkai_api_key")
+        headers = {"Authorization": "Bearer " + api_key}
+        base_url = conf().get("linkai_api_base", "https://api.link-ai.tech")
+        try:
+            with metrics.llm_request("linkai", body.get("model")) as request:
+                res = requests.post(url=base_url + "/v1/chat/completions", json=body, headers=headers,
+                                    timeout=conf().get("request_timeout", 180))
+                request.ok = res.status_code == 200
+        except Exception:
+            key_pool.release(pool_key, error=True)
+            raise
+        key_pool.release(pool_key, headers=res.headers, rate_limited=res.status_code == 429,
+                         error=res.status_code != 200)
+        return res
 
     def _fetch_app_info(self, app_code: str):
         headers = {"Authorization": "Bearer " + conf().get("linkai_api_key")}
@@ -314,7 +341,7 @@ class LinkAIBot(Bot):
 
     def create_img(self, query, retry_count=0, api_key=None):
         try:
-            logger.info("[LinkImage] image_query={}".format(query))
+            logger.info("[LinkImage] image_query=%s", query)
             headers = {
                 "Content-Type": "application/json",
                 "Authorization": f"Bearer {conf().get('linkai_api_key')}"
@@ -330,7 +357,7 @@ class LinkAIBot(Bot):
             res = requests.post(url, headers=headers, json=data, timeout=(5, 90))
             t2 = time.time()
             image_url = res.json()["data"][0]["url"]
-            logger.info("[OPEN_AI] image_url={}".format(image_url))
+            logger.info("[OPEN_AI] image_url=%s", image_url)
             return True, image_url
 
         except Exception as e:
@@ -343,7 +370,7 @@ class LinkAIBot(Bot):
             if response.get("knowledge_base"):
                 search_hit = response.get("knowledge_base").get("search_hit")
                 first_similarity = response.get("knowledge_base").get("first_similarity")
-                logger.info(f"[LINKAI] knowledge base, search_hit={search_hit}, first_similarity={first_similarity}")
+                logger.info("[LINKAI] knowledge base, search_hit=%s, first_similarity=%s", search_hit, first_similarity)
                 plugin_config = pconf("linkai")
                 if plugin_config and plugin_config.get("knowledge_base") and plugin_config.get("knowledge_base").get("search_miss_text_enabled"):
                     search_miss_similarity = plugin_config.get("knowledge_base").get("search_miss_similarity")
@@ -359,7 +386,7 @@ class LinkAIBot(Bot):
     def _fetch_agent_suffix(self, response):
         try:
             plugin_list = []
-            logger.debug(f"[LinkAgent] res={response}")
+            logger.debug("[LinkAgent] res=%s", response)
             if response.get("agent") and response.get("agent").get("chain") and response.get("agent").get("need_show_plugin"):
                 chain = response.get("agent").get("chain")
                 suffix = "\n\n- - - - - - - - - - - -"
@@ -380,7 +407,7 @@ class LinkAIBot(Bot):
                     if i < len(chain) - 1:
                         suffix += "\n"
                     i += 1
-                logger.info(f"[LinkAgent] use plugins: {plugin_list}")
+                logger.info("[LinkAgent] use plugins: %s", plugin_list)
                 return suffix
         except Exception as e:
             logger.exception(e)
@@ -452,7 +479,7 @@ class LinkAISessionManager(SessionManager):
         try:
             max_tokens = conf().get("conversation_max_tokens", 2500)
             tokens_cnt = session.discard_exceeding(max_tokens, total_tokens)
-            logger.debug(f"[LinkAI] chat history, before tokens={total_tokens}, now tokens={tokens_cnt}")
+            logger.debug("[LinkAI] chat history, before tokens=%s, now tokens=%s", total_tokens, tokens_cnt)
         except Exception as e:
             logger.warning("Exception when counting tokens precisely for session: {}".format(str(e)))
         return session
@@ -13,7 +13,7 @@ from common.log import logger
 from config import conf, load_config
 from bot.chatgpt.chat_gpt_session import ChatGPTSession
 import requests
-from common import const
+from common import const, metrics
 
 
 # ZhipuAI对话模型API
@@ -45,7 +45,7 @@ class MinimaxBot(Bot):
 
     def reply(self, query, context: Context = None) -> Reply:
         # acquire reply content
-        logger.info("[Minimax_AI] query={}".format(query))
+        logger.info("[Minimax_AI] query=%s", query)
         if context.type == ContextType.TEXT:
             session_id = context["session_id"]
             reply = None
@@ -62,7 +62,7 @@ class MinimaxBot(Bot):
             if reply:
                 return reply
             session = self.sessions.session_query(query, session_id)
-            logger.debug("[Minimax_AI] session query={}".format(session))
+            logger.debug("[Minimax_AI] session query=%s", session)
 
             model = context.get("Minimax_model")
             new_args = self.args.copy()
@@ -74,12 +74,11 @@ class MinimaxBot(Bot):
 
             reply_content = self.reply_text(session, args=new_args)
             logger.debug(
-                "[Minimax_AI] new_query={}, session_id={}, reply_cont={}, completion_tokens={}".format(
-                    session.messages,
-                    session_id,
-                    reply_content["content"],
-                    reply_content["completion_tokens"],
-                )
+                "[Minimax_AI] new_query=%s, session_id=%s, reply_cont=%s, completion_tokens=%s",
+                session.messages,
+                session_id,
+                reply_content["content"],
+                reply_content["completion_tokens"]
             )
             if reply_content["completion_tokens"] == 0 and len(reply_content["content"]) > 0:
                 reply = Reply(ReplyType.ERROR, reply_content["content"])
@@ -88,7 +87,7 @@ class MinimaxBot(Bot):
                 reply = Reply(ReplyType.TEXT, reply_content["content"])
             else:
                 reply = Reply(ReplyType.ERROR, reply_content["content"])
-                logger.debug("[Minimax_AI] reply {} used 0 tokens.".format(reply_content))
+                logger.debug("[Minimax_AI] reply %s used 0 tokens.", reply_content)
             return reply
         else:
             reply = Reply(ReplyType.ERROR, "Bot不支持处理{}类型的消息".format(context.type))
@@ -105,9 +104,11 @@ class MinimaxBot(Bot):
         try:
             headers = {"Content-Type": "application/json", "Authorization": "Bearer " + self.api_key}
             self.request_body["messages"].extend(session.messages)
-            logger.info("[Minimax_AI] request_body={}".format(self.request_body))
+            logger.info("[Minimax_AI] request_body=%s", self.request_body)
             # logger.info("[Minimax_AI] reply={}, total_tokens={}".format(response.choices[0]['message']['content'], response["usage"]["total_tokens"]))
-            res = requests.post(self.base_url, headers=headers, json=self.request_body)
+            with metrics.llm_request("minimax", self.request_body.get("model")) as request:
+                res = requests.post(self.base_url, headers=headers, json=self.request_body)
+                request.ok = res.status_code == 200
 
             # self.request_body["messages"].extend(response.json()["choices"][0]["messages"])
             if res.status_code == 200:
@@ -8,6 +8,7 @@ from bot.bot import Bot
 from bot.session_manager import SessionManager
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
+from common import metrics
 from common.log import logger
 from config import conf, load_config
 from .modelscope_session import ModelScopeSession
@@ -37,7 +38,7 @@ class ModelScopeBot(Bot):
     def reply(self, query, context=None):
         # acquire reply content
         if context.type == ContextType.TEXT:
-            logger.info("[MODELSCOPE_AI] query={}".format(query))
+            logger.info("[MODELSCOPE_AI] query=%s", query)
 
             session_id = context["session_id"]
             reply = None
@@ -54,7 +55,7 @@ class ModelScopeBot(Bot):
             if reply:
                 return reply
             session = self.sessions.session_query(query, session_id)
-            logger.debug("[MODELSCOPE_AI] session query={}".format(session.messages))
+            logger.debug("[MODELSCOPE_AI] session query=%s", session.messages)
 
             model = context.get("modelscope_model")
             new_args = self.args.copy()
@@ -67,12 +68,11 @@ class ModelScopeBot(Bot):
                 reply_content = self.reply_text(session, args=new_args)
 
             logger.debug(
-                "[MODELSCOPE_AI] new_query={}, session_id={}, reply_cont={}, completion_tokens={}".format(
-                    session.messages,
-                    session_id,
-                    reply_content["content"],
-                    reply_content["completion_tokens"],
-                )
+                "[MODELSCOPE_AI] new_query=%s, session_id=%s, reply_cont=%s, completion_tokens=%s",
+                session.messages,
+                session_id,
+                reply_content["content"],
+                reply_content["completion_tokens"]
             )
             if reply_content["completion_tokens"] == 0 and len(reply_content["content"]) > 0:
                 # 只有当 content 为空且 completion_tokens 为 0 时才标记为错误
@@ -85,7 +85,7 @@ class ModelScopeBot(Bot):
                 reply = Reply(ReplyType.TEXT, reply_content["content"])
             else:
                 reply = Reply(ReplyType.ERROR, reply_content["content"])
-                logger.debug("[MODELSCOPE_AI] reply {} used 0 tokens.".format(reply_content))
+                logger.debug("[MODELSCOPE_AI] reply %s used 0 tokens.", reply_content)
             return reply
         elif context.type == ContextType.IMAGE_CREATE:
             ok, retstring = self.create_img(query, 0)
@@ -115,11 +115,13 @@ class ModelScopeBot(Bot):
             
             body = args
             body["messages"] = session.messages
-            res = requests.post(
-                self.base_url,
-                headers=headers,
-                data=json.dumps(body)
-            )
+            with metrics.llm_request("modelscope", body.get("model")) as request:
+                res = requests.post(
+                    self.base_url,
+                    headers=headers,
+                    data=json.dumps(body)
+                )
+                request.ok = res.status_code == 200
 
             if res.status_code == 200:
                 response = res.json()
@@ -249,7 +251,7 @@ class ModelScopeBot(Bot):
                 return result
     def create_img(self, query, retry_count=0):
         try:
-            logger.info("[ModelScopeImage] image_query={}".format(query))
+            logger.info("[ModelScopeImage] image_query=%s", query)
             headers = {
                 "Content-Type": "application/json; charset=utf-8",  # 明确指定编码
                 "Authorization": f"Bearer {self.api_key}"
@@ -269,7 +271,7 @@ class ModelScopeBot(Bot):
             
             response_data = res.json()
             image_url = response_data['images'][0]['url']
-            logger.info("[ModelScopeImage] image_url={}".format(image_url))
+            logger.info("[ModelScopeImage] image_url=%s", image_url)
             return True, image_url
 
         except Exception as e:
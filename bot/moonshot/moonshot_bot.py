@@ -8,6 +8,7 @@ from bot.bot import Bot
 from bot.session_manager import SessionManager
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
+from common import metrics
 from common.log import logger
 from config import conf, load_config
 from .moonshot_session import MoonshotSession
@@ -33,7 +34,7 @@ class MoonshotBot(Bot):
     def reply(self, query, context=None):
         # acquire reply content
         if context.type == ContextType.TEXT:
-            logger.info("[MOONSHOT_AI] query={}".format(query))
+            logger.info("[MOONSHOT_AI] query=%s", query)
 
             session_id = context["session_id"]
             reply = None
@@ -50,7 +51,7 @@ class MoonshotBot(Bot):
             if reply:
                 return reply
             session = self.sessions.session_query(query, session_id)
-            logger.debug("[MOONSHOT_AI] session query={}".format(session.messages))
+            logger.debug("[MOONSHOT_AI] session query=%s", session.messages)
 
             model = context.get("moonshot_model")
             new_args = self.args.copy()
@@ -62,12 +63,11 @@ class MoonshotBot(Bot):
 
             reply_content = self.reply_text(session, args=new_args)
             logger.debug(
-                "[MOONSHOT_AI] new_query={}, session_id={}, reply_cont={}, completion_tokens={}".format(
-                    session.messages,
-                    session_id,
-                    reply_content["content"],
-                    reply_content["completion_tokens"],
-                )
+                "[MOONSHOT_AI] new_query=%s, session_id=%s, reply_cont=%s, completion_tokens=%s",
+                session.messages,
+                session_id,
+                reply_content["content"],
+                reply_content["completion_tokens"]
             )
             if reply_content["completion_tokens"] == 0 and len(reply_content["content"]) > 0:
                 reply = Reply(ReplyType.ERROR, reply_content["content"])
@@ -76,7 +76,7 @@ class MoonshotBot(Bot):
                 reply = Reply(ReplyType.TEXT, reply_content["content"])
             else:
                 reply = Reply(ReplyType.ERROR, reply_content["content"])
-                logger.debug("[MOONSHOT_AI] reply {} used 0 tokens.".format(reply_content))
+                logger.debug("[MOONSHOT_AI] reply %s used 0 tokens.", reply_content)
             return reply
         else:
             reply = Reply(ReplyType.ERROR, "Bot不支持处理{}类型的消息".format(context.type))
@@ -99,11 +99,13 @@ class MoonshotBot(Bot):
             body["messages"] = session.messages
             # logger.debug("[MOONSHOT_AI] response={}".format(response))
             # logger.info("[MOONSHOT_AI] reply={}, total_tokens={}".format(response.choices[0]['message']['content'], response["usage"]["total_tokens"]))
-            res = requests.post(
-                self.base_url,
-                headers=headers,
-                json=body
-            )
+            with metrics.llm_request("moonshot", body.get("model")) as request:
+                res = requests.post(
+                    self.base_url,
+                    headers=headers,
+                    json=body
+                )
+                request.ok = res.status_code == 200
             if res.status_code == 200:
                 response = res.json()
                 return {
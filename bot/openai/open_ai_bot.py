@@ -1,7 +1,5 @@
 # encoding:utf-8
 
-import time
-
 import openai
 import openai.error
 
@@ -11,7 +9,10 @@ from bot.openai.open_ai_session import OpenAISession
 from bot.session_manager import SessionManager
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
+from common import metrics
+from common.key_pool import get_key_pool
 from common.log import logger
+from common.retry import get_retry_policy, then
 from config import conf
 
 user_session = dict()
@@ -21,9 +22,7 @@ user_session = dict()
 class OpenAIBot(Bot, OpenAIImage):
     def __init__(self):
         super().__init__()
-        openai.api_key = conf().get("open_ai_api_key")
-        if conf().get("open_ai_api_base"):
-            openai.api_base = conf().get("open_ai_api_base")
+        # 默认的api_key和api_base随每次请求传入，不修改openai模块的全局配置
         proxy = conf().get("proxy")
         if proxy:
             openai.proxy = proxy
@@ -38,13 +37,16 @@ class OpenAIBot(Bot, OpenAIImage):
             "presence_penalty": conf().get("presence_penalty", 0.0),  # [-2,2]之间，该值越大则更倾向于产生不同的内容
             "request_timeout": conf().get("request_timeout", None),  # 请求超时时间，openai接口默认设置为600，对于难问题一般需要较长时间
             "timeout": conf().get("request_timeout", None),  # 重试超时时间，在这个时间内，将会自动重试
+            "api_key": conf().get("open_ai_api_key"),
         }
+        if conf().get("open_ai_api_base"):
+            self.args["api_base"] = conf().get("open_ai_api_base")
 
     def reply(self, query, context=None):
         # acquire reply content
         if context and context.type:
             if context.type == ContextType.TEXT:
-                logger.info(f"[OPEN_AI] 请求: {query}")
+                logger.info("[OPEN_AI] 请求: %s", query)
                 session_id = context["session_id"]
                 reply = None
                 if query == "#清除记忆":
@@ -55,56 +57,60 @@ class OpenAIBot(Bot, OpenAIImage):
                     reply = Reply(ReplyType.INFO, "所有人记忆已清除")
                 else:
                     session = self.sessions.session_query(query, session_id)
-                    result = self.reply_text(session)
-                    total_tokens, completion_tokens, reply_content = (
-                        result["total_tokens"],
-                        result["completion_tokens"],
-                        result["content"],
-                    )
-                    logger.debug(
-                        f"[OPEN_AI] 新请求: {session.get_messages()}, 会话ID: {session_id}, 回复: {reply_content}, Tokens: {completion_tokens}"
-                    )
-
-                    if total_tokens == 0:
-                        reply = Reply(ReplyType.ERROR, reply_content)
-                    else:
-                        self.sessions.session_reply(reply_content, session_id, total_tokens)
-                        reply = Reply(ReplyType.TEXT, reply_content)
+                    return then(lambda: self.reply_text(session), lambda result: self._build_reply(session, result))
                 return reply
             elif context.type == ContextType.IMAGE_CREATE:
-                ok, retstring = self.create_img(query, 0)
-                reply = None
-                if ok:
-                    reply = Reply(ReplyType.IMAGE_URL, retstring)
-                else:
-                    reply = Reply(ReplyType.ERROR, retstring)
-                return reply
+                return then(lambda: self.create_img(query, 0), self._build_img_reply)
+
+    def _build_reply(self, session: OpenAISession, result) -> Reply:
+        session_id = session.session_id
+        total_tokens, completion_tokens, reply_content = (
+            result["total_tokens"],
+            result["completion_tokens"],
+            result["content"],
+        )
+        logger.debug(
+            "[OPEN_AI] 新请求: %s, 会话ID: %s, 回复: %s, Tokens: %s", session.get_messages(), session_id, reply_content, completion_tokens
+        )
 
-    def reply_text(self, session: OpenAISession, retry_count=0):
+        if total_tokens == 0:
+            return Reply(ReplyType.ERROR, reply_content)
+        self.sessions.session_reply(reply_content, session_id, total_tokens)
+        return Reply(ReplyType.TEXT, reply_content)
+
+    def reply_text(self, session: OpenAISession, retry_count=0, retry=None):
+        retry = retry or get_retry_policy("openai").start()
+        key_pool = get_key_pool("open_ai_api_key")
+        pool_key = key_pool.acquire()
         try:
-            response = openai.ChatCompletion.create(messages=session.get_messages(), **self.args)
+            args = dict(self.args, api_key=pool_key.key) if pool_key else self.args
+            with metrics.llm_request("openai", args.get("model")):
+                response = openai.ChatCompletion.create(messages=session.get_messages(), **args)
             res_content = response.choices[0]["message"]["content"].strip()
             total_tokens = response["usage"]["total_tokens"]
+            key_pool.release(pool_key, tokens=total_tokens)
             completion_tokens = response["usage"]["completion_tokens"]
-            logger.info(f"[OPEN_AI] 回复: {res_content}")
+            metrics.record_tokens("openai", args.get("model"), response["usage"].get("prompt_tokens"), completion_tokens)
+            logger.info("[OPEN_AI] 回复: %s", res_content)
             return {
                 "total_tokens": total_tokens,
                 "completion_tokens": completion_tokens,
                 "content": res_content,
             }
         except Exception as e:
-            need_retry = retry_count < 2
+            rate_limited = isinstance(e, openai.error.RateLimitError)
+            key_pool.release(pool_key, headers=getattr(e, "headers", None), rate_limited=rate_limited, error=True)
+            need_retry = True
             result = {"completion_tokens": 0, "content": "我现在有点累了，等会再来吧"}
-            if isinstance(e, openai.error.RateLimitError):
+            if rate_limited:
                 logger.warn(f"[OPEN_AI] 速率限制错误: {e}")
                 result["content"] = "提问太快啦，请休息一下再问我吧"
-                if need_retry:
-                    time.sleep(20)
+                # 还有未被限流的key时直接换key重试
+                delay = 0 if key_pool.has_healthy() else 20
             elif isinstance(e, openai.error.Timeout):
                 logger.warn(f"[OPEN_AI] 请求超时: {e}")
                 result["content"] = "我没有收到你的消息"
-                if need_retry:
-                    time.sleep(5)
+                delay = 5
             elif isinstance(e, openai.error.APIConnectionError):
                 logger.warn(f"[OPEN_AI] API连接错误: {e}")
                 need_retry = False
@@ -114,8 +120,11 @@ class OpenAIBot(Bot, OpenAIImage):
                 need_retry = False
                 self.sessions.clear_session(session.session_id)
 
+            if need_retry:
+                delay = retry.backoff(delay)
+                need_retry = delay is not None
             if need_retry:
                 logger.warn(f"[OPEN_AI] 第{retry_count + 1}次重试")
-                return self.reply_text(session, retry_count + 1)
+                return retry.retry(delay, self.reply_text, session, retry_count + 1, retry=retry)
             else:
                 return result
@@ -1,9 +1,9 @@
-import time
-
 import openai
 import openai.error
 
+from bridge.reply import Reply, ReplyType
 from common.log import logger
+from common.retry import get_retry_policy
 from common.token_bucket import TokenBucket
 from config import conf
 
@@ -11,33 +11,40 @@ from config import conf
 # OPENAI提供的画图接口
 class OpenAIImage(object):
     def __init__(self):
-        openai.api_key = conf().get("open_ai_api_key")
         if conf().get("rate_limit_dalle"):
             self.tb4dalle = TokenBucket(conf().get("rate_limit_dalle", 50))
 
-    def create_img(self, query, retry_count=0, api_key=None, api_base=None):
+    def create_img(self, query, retry_count=0, api_key=None, api_base=None, retry=None):
+        retry = retry or get_retry_policy("openai_image").start()
         try:
             if conf().get("rate_limit_dalle") and not self.tb4dalle.get_token():
                 return False, "请求太快了，请休息一下再问我吧"
-            logger.info("[OPEN_AI] image_query={}".format(query))
+            logger.info("[OPEN_AI] image_query=%s", query)
             response = openai.Image.create(
-                api_key=api_key,
+                api_key=api_key or conf().get("open_ai_api_key"),
+                api_base=api_base or conf().get("open_ai_api_base") or None,
                 prompt=query,  # 图片描述
                 n=1,  # 每次生成图片的数量
                 model=conf().get("text_to_image") or "dall-e-2",
                 # size=conf().get("image_create_size", "256x256"),  # 图片大小,可选有 256x256, 512x512, 1024x1024
             )
             image_url = response["data"][0]["url"]
-            logger.info("[OPEN_AI] image_url={}".format(image_url))
+            logger.info("[OPEN_AI] image_url=%s", image_url)
             return True, image_url
         except openai.error.RateLimitError as e:
             logger.warn(e)
-            if retry_count < 1:
-                time.sleep(5)
+            delay = retry.backoff(5, max_attempts=1)
+            if delay is not None:
                 logger.warn("[OPEN_AI] ImgCreate RateLimit exceed, 第{}次重试".format(retry_count + 1))
-                return self.create_img(query, retry_count + 1)
+                return retry.retry(delay, self.create_img, query, retry_count + 1, api_key, api_base, retry=retry)
             else:
                 return False, "画图出现问题，请休息一下再问我吧"
         except Exception as e:
             logger.exception(e)
             return False, "画图出现问题，请休息一下再问我吧"
+
+    def _build_img_reply(self, result) -> Reply:
+        ok, retstring = result
+        if ok:
+            return Reply(ReplyType.IMAGE_URL, retstring)
+        return Reply(ReplyType.ERROR, retstring)
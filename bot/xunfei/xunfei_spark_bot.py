@@ -1,6 +1,5 @@
 # encoding:utf-8
 
-import requests, json
 from bot.bot import Bot
 from bot.session_manager import SessionManager
 from bot.chatgpt.chat_gpt_session import ChatGPTSession
@@ -8,10 +7,8 @@ from bridge.context import ContextType, Context
 from bridge.reply import Reply, ReplyType
 from common.log import logger
 from config import conf
-from common import const
+from common import const, metrics
 import time
-import _thread as thread
-import datetime
 from datetime import datetime
 from wsgiref.handlers import format_date_time
 from urllib.parse import urlencode
@@ -23,107 +20,38 @@ import json
 from time import mktime
 from urllib.parse import urlparse
 import websocket
-import queue
 import threading
-import random
 
-# 消息队列 map
-queue_map = dict()
 
-# 响应队列 map
-reply_map = dict()
+class SparkError(Exception):
+    def __init__(self, code, message):
+        super().__init__("{}: {}".format(code, message))
+        self.code = code
 
 
-class XunFeiBot(Bot):
-    def __init__(self):
-        super().__init__()
-        self.app_id = conf().get("xunfei_app_id")
-        self.api_key = conf().get("xunfei_api_key")
-        self.api_secret = conf().get("xunfei_api_secret")
-        # 默认使用v2.0版本: "generalv2"
-        # Spark Lite请求地址(spark_url): wss://spark-api.xf-yun.com/v1.1/chat, 对应的domain参数为: "lite"
-        # Spark V2.0请求地址(spark_url): wss://spark-api.xf-yun.com/v2.1/chat, 对应的domain参数为: "generalv2"
-        # Spark Pro 请求地址(spark_url): wss://spark-api.xf-yun.com/v3.1/chat, 对应的domain参数为: "generalv3"
-        # Spark Pro-128K请求地址(spark_url):  wss://spark-api.xf-yun.com/chat/pro-128k, 对应的domain参数为: "pro-128k"
-        # Spark Max 请求地址(spark_url): wss://spark-api.xf-yun.com/v3.5/chat, 对应的domain参数为: "generalv3.5"
-        # Spark4.0 Ultra 请求地址(spark_url): wss://spark-api.xf-yun.com/v4.0/chat, 对应的domain参数为: "4.0Ultra"
-        # 后续模型更新，对应的参数可以参考官网文档获取：https://www.xfyun.cn/doc/spark/Web.html
-        self.domain = conf().get("xunfei_domain", "generalv3.5")
-        self.spark_url = conf().get("xunfei_spark_url", "wss://spark-api.xf-yun.com/v3.5/chat")
-        self.host = urlparse(self.spark_url).netloc
-        self.path = urlparse(self.spark_url).path
-        # 和wenxin使用相同的session机制
-        self.sessions = SessionManager(ChatGPTSession, model=const.XUNFEI)
-
-    def reply(self, query, context: Context = None) -> Reply:
-        if context.type == ContextType.TEXT:
-            logger.info("[XunFei] query={}".format(query))
-            session_id = context["session_id"]
-            request_id = self.gen_request_id(session_id)
-            reply_map[request_id] = ""
-            session = self.sessions.session_query(query, session_id)
-            threading.Thread(target=self.create_web_socket,
-                             args=(session.messages, request_id)).start()
-            depth = 0
-            time.sleep(0.1)
-            t1 = time.time()
-            usage = {}
-            while depth <= 300:
-                try:
-                    data_queue = queue_map.get(request_id)
-                    if not data_queue:
-                        depth += 1
-                        time.sleep(0.1)
-                        continue
-                    data_item = data_queue.get(block=True, timeout=0.1)
-                    if data_item.is_end:
-                        # 请求结束
-                        del queue_map[request_id]
-                        if data_item.reply:
-                            reply_map[request_id] += data_item.reply
-                        usage = data_item.usage
-                        break
-
-                    reply_map[request_id] += data_item.reply
-                    depth += 1
-                except Exception as e:
-                    depth += 1
-                    continue
-            t2 = time.time()
-            logger.info(
-                f"[XunFei-API] response={reply_map[request_id]}, time={t2 - t1}s, usage={usage}"
-            )
-            self.sessions.session_reply(reply_map[request_id], session_id,
-                                        usage.get("total_tokens"))
-            reply = Reply(ReplyType.TEXT, reply_map[request_id])
-            del reply_map[request_id]
-            return reply
-        else:
-            reply = Reply(ReplyType.ERROR,
-                          "Bot不支持处理{}类型的消息".format(context.type))
-            return reply
-
-    def create_web_socket(self, prompt, session_id, temperature=0.5):
-        logger.info(f"[XunFei] start connect, prompt={prompt}")
-        websocket.enableTrace(False)
-        wsUrl = self.create_url()
-        ws = websocket.WebSocketApp(wsUrl,
-                                    on_message=on_message,
-                                    on_error=on_error,
-                                    on_close=on_close,
-                                    on_open=on_open)
-        data_queue = queue.Queue(1000)
-        queue_map[session_id] = data_queue
-        ws.appid = self.app_id
-        ws.question = prompt
-        ws.domain = self.domain
-        ws.session_id = session_id
-        ws.temperature = temperature
-        ws.run_forever(sslopt={"cert_reqs": ssl.CERT_NONE})
+class SparkClient(object):
+    """
+    星火接口的WebSocket连接管理
+    星火服务端在一次问答结束后会关闭连接，无法复用同一个连接，这里：
+    1. 缓存鉴权URL的签名，签名中的date允许与服务端相差5分钟，有效期内不重复计算
+    2. 由一个常驻的后台线程预先建立少量已完成握手的空闲连接，请求时直接发送，把TLS和握手耗时移出请求路径
+    3. 在调用线程中同步读取响应，不再为每个请求创建线程和轮询队列
+    """
 
-    def gen_request_id(self, session_id: str):
-        return session_id + "_" + str(int(time.time())) + "" + str(
-            random.randint(0, 100))
+    def __init__(self, app_id, api_key, api_secret, spark_url, domain):
+        self.app_id = app_id
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.spark_url = spark_url
+        self.domain = domain
+        self.host = urlparse(spark_url).netloc
+        self.path = urlparse(spark_url).path
+        self.lock = threading.Lock()
+        self.signed_url = None
+        self.signed_at = 0
+        self.idle = []  # [(ws, 建立时间)]
+        self.wakeup = threading.Event()  # 通知后台线程补充空闲连接
+        self.warmer = None
 
     # 生成url
     def create_url(self):
@@ -157,89 +85,152 @@ class XunFeiBot(Bot):
         # 此处打印出建立连接时候的url,参考本demo的时候可取消上方打印的注释，比对相同参数时生成的url与自己代码生成的url是否一致
         return url
 
-    def gen_params(self, appid, domain, question):
-        """
-        通过appid和用户的提问来生成请参数
-        """
-        data = {
-            "header": {
-                "app_id": appid,
-                "uid": "1234"
-            },
-            "parameter": {
-                "chat": {
-                    "domain": domain,
-                    "random_threshold": 0.5,
-                    "max_tokens": 2048,
-                    "auditing": "default"
-                }
-            },
-            "payload": {
-                "message": {
-                    "text": question
-                }
-            }
-        }
-        return data
-
-
-class ReplyItem:
-    def __init__(self, reply, usage=None, is_end=False):
-        self.is_end = is_end
-        self.reply = reply
-        self.usage = usage
-
-
-# 收到websocket错误的处理
-def on_error(ws, error):
-    logger.error(f"[XunFei] error: {str(error)}")
+    def get_url(self):
+        with self.lock:
+            if not self.signed_url or time.time() - self.signed_at > conf().get("xunfei_url_sign_ttl", 60):
+                self.signed_url = self.create_url()
+                self.signed_at = time.time()
+            return self.signed_url
 
+    def _connect(self):
+        return websocket.create_connection(self.get_url(), sslopt={"cert_reqs": ssl.CERT_NONE},
+                                           timeout=conf().get("request_timeout", 180))
 
-# 收到websocket关闭的处理
-def on_close(ws, one, two):
-    data_queue = queue_map.get(ws.session_id)
-    data_queue.put("END")
+    def _warm_loop(self):
+        while True:
+            self.wakeup.wait()
+            self.wakeup.clear()
+            # 补充空闲连接，数量由xunfei_ws_pool_size控制
+            while True:
+                with self.lock:
+                    if len(self.idle) >= conf().get("xunfei_ws_pool_size", 1):
+                        break
+                try:
+                    ws = self._connect()
+                except Exception as e:
+                    logger.warning(f"[XunFei] pre-connect error: {e}")
+                    break
+                with self.lock:
+                    self.idle.append((ws, time.time()))
 
+    def _refill(self):
+        if self.warmer is None:
+            with self.lock:
+                if self.warmer is None:
+                    self.warmer = threading.Thread(target=self._warm_loop, name="spark-warmer", daemon=True)
+                    self.warmer.start()
+        self.wakeup.set()
 
-# 收到websocket连接建立的处理
-def on_open(ws):
-    logger.info(f"[XunFei] Start websocket, session_id={ws.session_id}")
-    thread.start_new_thread(run, (ws, ))
+    def _acquire(self):
+        max_idle = conf().get("xunfei_ws_max_idle", 20)
+        ws = None
+        with self.lock:
+            while self.idle:
+                conn, created = self.idle.pop()
+                if time.time() - created <= max_idle and conn.connected:
+                    ws = conn
+                    break
+                conn.close()
+        self._refill()
+        return ws, ws is not None
 
+    def stream(self, messages, temperature=0.5):
+        """
+        发送请求并按顺序返回增量内容
+        :return: 生成器，每次产出(content, usage)，usage只在最后一段不为None
+        """
+        data = json.dumps(gen_params(appid=self.app_id, domain=self.domain, question=messages, temperature=temperature))
+        ws, pooled = self._acquire()
+        try:
+            try:
+                if ws is None:
+                    ws = self._connect()
+                ws.send(data)
+                message = ws.recv()
+            except (websocket.WebSocketException, OSError) as e:
+                if not pooled:
+                    raise
+                # 预建立的连接可能已被服务端关闭，重新建立连接
+                logger.debug("[XunFei] pooled connection unavailable, reconnect: %s", e)
+                ws.close()
+                ws = self._connect()
+                ws.send(data)
+                message = ws.recv()
+            while True:
+                data = json.loads(message)
+                code = data['header']['code']
+                if code != 0:
+                    raise SparkError(code, data['header'].get('message'))
+                choices = data["payload"]["choices"]
+                content = choices["text"][0]["content"]
+                if choices["status"] == 2:
+                    usage = data["payload"].get("usage") or {}
+                    yield content, usage.get("text", usage)
+                    return
+                yield content, None
+                message = ws.recv()
+        finally:
+            if ws is not None:
+                ws.close()
 
-def run(ws, *args):
-    data = json.dumps(
-        gen_params(appid=ws.appid,
-                   domain=ws.domain,
-                   question=ws.question,
-                   temperature=ws.temperature))
-    ws.send(data)
 
+class XunFeiBot(Bot):
+    def __init__(self):
+        super().__init__()
+        self.app_id = conf().get("xunfei_app_id")
+        self.api_key = conf().get("xunfei_api_key")
+        self.api_secret = conf().get("xunfei_api_secret")
+        # 默认使用v2.0版本: "generalv2"
+        # Spark Lite请求地址(spark_url): wss://spark-api.xf-yun.com/v1.1/chat, 对应的domain参数为: "lite"
+        # Spark V2.0请求地址(spark_url): wss://spark-api.xf-yun.com/v2.1/chat, 对应的domain参数为: "generalv2"
+        # Spark Pro 请求地址(spark_url): wss://spark-api.xf-yun.com/v3.1/chat, 对应的domain参数为: "generalv3"
+        # Spark Pro-128K请求地址(spark_url):  wss://spark-api.xf-yun.com/chat/pro-128k, 对应的domain参数为: "pro-128k"
+        # Spark Max 请求地址(spark_url): wss://spark-api.xf-yun.com/v3.5/chat, 对应的domain参数为: "generalv3.5"
+        # Spark4.0 Ultra 请求地址(spark_url): wss://spark-api.xf-yun.com/v4.0/chat, 对应的domain参数为: "4.0Ultra"
+        # 后续模型更新，对应的参数可以参考官网文档获取：https://www.xfyun.cn/doc/spark/Web.html
+        self.domain = conf().get("xunfei_domain", "generalv3.5")
+        self.spark_url = conf().get("xunfei_spark_url", "wss://spark-api.xf-yun.com/v3.5/chat")
+        self.client = SparkClient(self.app_id, self.api_key, self.api_secret, self.spark_url, self.domain)
+        # 和wenxin使用相同的session机制
+        self.sessions = SessionManager(ChatGPTSession, model=const.XUNFEI)
 
-# Websocket 操作
-# 收到websocket消息的处理
-def on_message(ws, message):
-    data = json.loads(message)
-    code = data['header']['code']
-    if code != 0:
-        logger.error(f'请求错误: {code}, {data}')
-        ws.close()
-    else:
-        choices = data["payload"]["choices"]
-        status = choices["status"]
-        content = choices["text"][0]["content"]
-        data_queue = queue_map.get(ws.session_id)
-        if not data_queue:
-            logger.error(
-                f"[XunFei] can't find data queue, session_id={ws.session_id}")
-            return
-        reply_item = ReplyItem(content)
-        if status == 2:
-            usage = data["payload"].get("usage")
-            reply_item = ReplyItem(content, usage)
-            reply_item.is_end = True
-            ws.close()
-        data_queue.put(reply_item)
+    def reply(self, query, context: Context = None) -> Reply:
+        if context.type == ContextType.TEXT:
+            logger.info("[XunFei] query=%s", query)
+            session_id = context["session_id"]
+            session = self.sessions.session_query(query, session_id)
+            # 传入stream_callback时，每收到一段内容就回调一次
+            stream_callback = context.get("stream_callback")
+            t1 = time.time()
+            contents = []
+            usage = {}
+            try:
+                with metrics.llm_request("xunfei", self.domain):
+                    for content, end_usage in self.client.stream(session.messages):
+                        contents.append(content)
+                        if stream_callback and content:
+                            stream_callback(content)
+                        if end_usage is not None:
+                            usage = end_usage
+            except Exception as e:
+                logger.error(f"[XunFei] request error: {e}")
+                if not contents:
+                    return Reply(ReplyType.ERROR, "我现在有点累了，等会再来吧")
+                # 回复不完整，不作为正常回复返回，也不写入会话记录
+                logger.warning("[XunFei] stream interrupted after %s chunks", len(contents))
+                return Reply(ReplyType.ERROR, "回复中断了，请再问我一次吧")
+            reply_content = "".join(contents)
+            t2 = time.time()
+            logger.info(
+                "[XunFei-API] response=%s, time=%ss, usage=%s", reply_content, t2 - t1, usage
+            )
+            self.sessions.session_reply(reply_content, session_id,
+                                        usage.get("total_tokens"))
+            return Reply(ReplyType.TEXT, reply_content)
+        else:
+            reply = Reply(ReplyType.ERROR,
+                          "Bot不支持处理{}类型的消息".format(context.type))
+            return reply
 
 
 def gen_params(appid, domain, question, temperature=0.5):
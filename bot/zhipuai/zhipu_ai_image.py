@@ -1,3 +1,4 @@
+from common.client_cache import get_client
 from common.log import logger
 from config import conf
 
@@ -7,13 +8,14 @@ from config import conf
 class ZhipuAIImage(object):
     def __init__(self):
         from zhipuai import ZhipuAI
-        self.client = ZhipuAI(api_key=conf().get("zhipu_ai_api_key"))
+        api_key = conf().get("zhipu_ai_api_key")
+        self.client = get_client("zhipuai", lambda: ZhipuAI(api_key=api_key), api_key)
 
     def create_img(self, query, retry_count=0, api_key=None, api_base=None):
         try:
             if conf().get("rate_limit_dalle"):
                 return False, "请求太快了，请休息一下再问我吧"
-            logger.info("[ZHIPU_AI] image_query={}".format(query))
+            logger.info("[ZHIPU_AI] image_query=%s", query)
             response = self.client.images.generations(
                 prompt=query,
                 n=1,  # 每次生成图片的数量
@@ -22,7 +24,7 @@ class ZhipuAIImage(object):
                 quality="standard",
             )
             image_url = response.data[0].url
-            logger.info("[ZHIPU_AI] image_url={}".format(image_url))
+            logger.info("[ZHIPU_AI] image_url=%s", image_url)
             return True, image_url
         except Exception as e:
             logger.exception(e)
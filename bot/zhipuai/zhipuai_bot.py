@@ -10,6 +10,8 @@ from bot.zhipuai.zhipu_ai_image import ZhipuAIImage
 from bot.session_manager import SessionManager
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
+from common import metrics
+from common.client_cache import get_client
 from common.log import logger
 from config import conf, load_config
 from zhipuai import ZhipuAI
@@ -25,12 +27,13 @@ class ZHIPUAIBot(Bot, ZhipuAIImage):
             "temperature": conf().get("temperature", 0.9),  # 值在(0,1)之间(智谱AI 的温度不能取 0 或者 1)
             "top_p": conf().get("top_p", 0.7),  # 值在(0,1)之间(智谱AI 的 top_p 不能取 0 或者 1)
         }
-        self.client = ZhipuAI(api_key=conf().get("zhipu_ai_api_key"))
+        api_key = conf().get("zhipu_ai_api_key")
+        self.client = get_client("zhipuai", lambda: ZhipuAI(api_key=api_key), api_key)
 
     def reply(self, query, context=None):
         # acquire reply content
         if context.type == ContextType.TEXT:
-            logger.info("[ZHIPU_AI] query={}".format(query))
+            logger.info("[ZHIPU_AI] query=%s", query)
 
             session_id = context["session_id"]
             reply = None
@@ -47,9 +50,9 @@ class ZHIPUAIBot(Bot, ZhipuAIImage):
             if reply:
                 return reply
             session = self.sessions.session_query(query, session_id)
-            logger.debug("[ZHIPU_AI] session query={}".format(session.messages))
+            logger.debug("[ZHIPU_AI] session query=%s", session.messages)
 
-            api_key = context.get("openai_api_key") or openai.api_key
+            api_key = context.get("openai_api_key")
             model = context.get("gpt_model")
             new_args = None
             if model:
@@ -61,12 +64,11 @@ class ZHIPUAIBot(Bot, ZhipuAIImage):
 
             reply_content = self.reply_text(session, api_key, args=new_args)
             logger.debug(
-                "[ZHIPU_AI] new_query={}, session_id={}, reply_cont={}, completion_tokens={}".format(
-                    session.messages,
-                    session_id,
-                    reply_content["content"],
-                    reply_content["completion_tokens"],
-                )
+                "[ZHIPU_AI] new_query=%s, session_id=%s, reply_cont=%s, completion_tokens=%s",
+                session.messages,
+                session_id,
+                reply_content["content"],
+                reply_content["completion_tokens"]
             )
             if reply_content["completion_tokens"] == 0 and len(reply_content["content"]) > 0:
                 reply = Reply(ReplyType.ERROR, reply_content["content"])
@@ -75,7 +77,7 @@ class ZHIPUAIBot(Bot, ZhipuAIImage):
                 reply = Reply(ReplyType.TEXT, reply_content["content"])
             else:
                 reply = Reply(ReplyType.ERROR, reply_content["content"])
-                logger.debug("[ZHIPU_AI] reply {} used 0 tokens.".format(reply_content))
+                logger.debug("[ZHIPU_AI] reply %s used 0 tokens.", reply_content)
             return reply
         elif context.type == ContextType.IMAGE_CREATE:
             ok, retstring = self.create_img(query, 0)
@@ -105,7 +107,8 @@ class ZHIPUAIBot(Bot, ZhipuAIImage):
             if args is None:
                 args = self.args
             # response = openai.ChatCompletion.create(api_key=api_key, messages=session.messages, **args)
-            response = self.client.chat.completions.create(messages=session.messages, **args)
+            with metrics.llm_request("zhipu", args.get("model")):
+                response = self.client.chat.completions.create(messages=session.messages, **args)
             # logger.debug("[ZHIPU_AI] response={}".format(response))
             # logger.info("[ZHIPU_AI] reply={}, total_tokens={}".format(response.choices[0]['message']['content'], response["usage"]["total_tokens"]))
 
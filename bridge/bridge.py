@@ -1,4 +1,5 @@
 from bot.bot_factory import create_bot
+from bridge.chat_router import ChatRouter
 from bridge.context import Context
 from bridge.reply import Reply
 from common import const
@@ -7,6 +8,7 @@ from common.singleton import singleton
 from config import conf
 from translate.factory import create_translator
 from voice.factory import create_voice
+from voice.tts_cache import tts_cache
 
 
 @singleton
@@ -64,11 +66,12 @@ class Bridge(object):
 
         self.bots = {}
         self.chat_bots = {}
+        self.chat_router = ChatRouter(self.btype["chat"], self._get_chat_bot)
 
     # 模型对应的接口
     def get_bot(self, typename):
         if self.bots.get(typename) is None:
-            logger.info("create bot {} for {}".format(self.btype[typename], typename))
+            logger.info("create bot %s for %s", self.btype[typename], typename)
             if typename == "text_to_voice":
                 self.bots[typename] = create_voice(self.btype[typename])
             elif typename == "voice_to_text":
@@ -82,14 +85,20 @@ class Bridge(object):
     def get_bot_type(self, typename):
         return self.btype[typename]
 
+    def _get_chat_bot(self, bot_type):
+        # 主bot与插件通过get_bot("chat")拿到的是同一个实例
+        if bot_type == self.btype["chat"]:
+            return self.get_bot("chat")
+        return self.find_chat_bot(bot_type)
+
     def fetch_reply_content(self, query, context: Context) -> Reply:
-        return self.get_bot("chat").reply(query, context)
+        return self.chat_router.reply(query, context)
 
     def fetch_voice_to_text(self, voiceFile) -> Reply:
         return self.get_bot("voice_to_text").voiceToText(voiceFile)
 
     def fetch_text_to_voice(self, text) -> Reply:
-        return self.get_bot("text_to_voice").textToVoice(text)
+        return tts_cache().text_to_voice(self.btype["text_to_voice"], self.get_bot("text_to_voice"), text)
 
     def fetch_translate(self, text, from_lang="", to_lang="en") -> Reply:
         return self.get_bot("translate").translate(text, from_lang, to_lang)
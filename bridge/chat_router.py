@@ -0,0 +1,182 @@
+"""
+对话请求路由：按chat_fallback_bots配置的顺序在多个bot之间故障转移，
+每个bot有独立的熔断器，熔断中的bot直接跳过，不再等待它的重试耗尽；
+开启chat_hedge_enabled后，主bot超过其p95耗时仍未返回时，向下一个bot发送对冲请求，采用先成功返回的结果
+"""
+
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from bridge.context import Context, ContextType
+from bridge.reply import ReplyType
+from common import tracing
+from common.circuit_breaker import CircuitBreaker
+from common.log import logger
+from common.retry import RetryLater
+from config import conf
+
+# 用户通过指令设置的模型和api_key只对主bot有效，不传给备用bot和对冲bot
+PRIMARY_ONLY_KEYS = ("gpt_model", "openai_api_key")
+
+hedge_pool = None  # 对冲请求的线程池，首次使用时创建，重置bot时新的路由继续使用
+hedge_pool_lock = threading.Lock()
+
+
+def _get_hedge_pool():
+    global hedge_pool
+    with hedge_pool_lock:
+        if hedge_pool is None:
+            hedge_pool = ThreadPoolExecutor(max_workers=conf().get("chat_hedge_workers", 16), thread_name_prefix="chat-hedge")
+        return hedge_pool
+
+
+class ChatRouter(object):
+    def __init__(self, primary_type, get_bot):
+        """
+        :param primary_type: 主bot类型
+        :param get_bot: 根据bot类型返回bot实例的函数
+        """
+        fallback_types = conf().get("chat_fallback_bots") or []
+        self.chain = [primary_type] + [t for t in fallback_types if t != primary_type]
+        self.get_bot = get_bot
+        self.breakers = {}
+        self.lock = threading.Lock()
+
+    def breaker(self, bot_type) -> CircuitBreaker:
+        with self.lock:
+            breaker = self.breakers.get(bot_type)
+            if breaker is None:
+                breaker = CircuitBreaker(
+                    bot_type,
+                    window=conf().get("circuit_breaker_window", 60),
+                    min_requests=conf().get("circuit_breaker_min_requests", 5),
+                    error_rate=conf().get("circuit_breaker_error_rate", 0.5),
+                    max_p95=conf().get("circuit_breaker_max_p95", 0),
+                    open_seconds=conf().get("circuit_breaker_open_seconds", 30),
+                )
+                self.breakers[bot_type] = breaker
+            return breaker
+
+    def _context_for(self, bot_type, context):
+        """
+        :return: 发给bot_type的context，非主bot使用去掉PRIMARY_ONLY_KEYS的副本
+        """
+        if bot_type == self.chain[0]:
+            return context
+        kwargs = {key: value for key, value in context.kwargs.items() if key not in PRIMARY_ONLY_KEYS}
+        return Context(context.type, context.content, kwargs)
+
+    def _call(self, bot_type, query, context):
+        """
+        :return: (回复或异常, 是否成功)，bot抛出异常、没有回复或返回ERROR类型回复都视为失败
+        """
+        start = time.time()
+        try:
+            with tracing.span(context, "bot_call", bot=bot_type):
+                reply = self.get_bot(bot_type).reply(query, context)
+        except RetryLater as e:
+            # bot需要延迟重试，重试结束后再按最终结果记录，由调用方决定换bot还是等待重试
+            raise self._record_later(e, bot_type, start)
+        except Exception as e:
+            logger.exception("[ChatRouter] {} reply error: {}".format(bot_type, e))
+            reply = e
+        ok = self._record(bot_type, reply, start)
+        return reply, ok
+
+    def _record(self, bot_type, reply, start):
+        ok = reply is not None and not isinstance(reply, Exception) and reply.type != ReplyType.ERROR
+        self.breaker(bot_type).record(ok, time.time() - start)
+        return ok
+
+    def _record_later(self, retry, bot_type, start):
+        """
+        :return: 新的RetryLater，延迟重试完成(成功、返回ERROR回复或抛出异常)后在熔断器中记录最终结果
+        """
+        resume = retry.resume
+
+        def chained():
+            try:
+                reply = resume()
+            except RetryLater as e:
+                raise self._record_later(e, bot_type, start)
+            except Exception as e:
+                self._record(bot_type, e, start)
+                raise
+            self._record(bot_type, reply, start)
+            return reply
+
+        chained_retry = RetryLater(retry.delay, chained)
+        chained_retry.context = retry.context
+        return chained_retry
+
+    def _hedge_enabled(self, context):
+        # 流式回调会被两个bot同时调用，不对冲
+        return conf().get("chat_hedge_enabled", False) and not context.get("stream_callback")
+
+    def _hedged_call(self, bot_type, remaining, query, context):
+        pool = _get_hedge_pool()
+        futures = {pool.submit(self._call, bot_type, query, self._context_for(bot_type, context)): bot_type}
+        delay = self.breaker(bot_type).p95(min_samples=conf().get("chat_hedge_min_samples", 20))
+        if delay is None:
+            delay = conf().get("chat_hedge_delay", 10)
+        done, _ = wait(futures, timeout=delay)
+        if not done:
+            for hedge_type in list(remaining):
+                if self.breaker(hedge_type).allow():
+                    remaining.remove(hedge_type)
+                    logger.info("[ChatRouter] %s exceeds %.1fs, hedge to %s", bot_type, delay, hedge_type)
+                    futures[pool.submit(self._call, hedge_type, query, self._context_for(hedge_type, context))] = hedge_type
+                    break
+        result = None
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                result, ok = future.result()
+                if ok:
+                    # 已经开始执行的请求无法中断，只丢弃它的结果
+                    for other in pending:
+                        other.cancel()
+                    return result, True
+        return result, False
+
+    def reply(self, query, context: Context):
+        if context.type != ContextType.TEXT:
+            return self.get_bot(self.chain[0]).reply(query, context)
+        result = None
+        called = False
+        remaining = list(self.chain)
+        while remaining:
+            bot_type = remaining.pop(0)
+            if not self.breaker(bot_type).allow():
+                logger.warning("[ChatRouter] {} circuit open, skip".format(bot_type))
+                continue
+            called = True
+            call_start = time.time()
+            try:
+                if remaining and self._hedge_enabled(context):
+                    result, ok = self._hedged_call(bot_type, remaining, query, context)
+                else:
+                    result, ok = self._call(bot_type, query, self._context_for(bot_type, context))
+            except RetryLater:
+                if not remaining:
+                    raise
+                # 有备用bot时不等待重试，放弃的请求记为失败
+                self.breaker(bot_type).record(False, time.time() - call_start)
+                result, ok = None, False
+            if ok:
+                return result
+            if remaining:
+                logger.warning("[ChatRouter] {} failed, fallback to next bot".format(bot_type))
+        if not called:
+            # 全部熔断时仍然请求主bot，保证有回复
+            result, _ = self._call(self.chain[0], query, context)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def stats(self):
+        with self.lock:
+            breakers = dict(self.breakers)
+        return {bot_type: breaker.stats() for bot_type, breaker in breakers.items()}
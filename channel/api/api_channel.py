@@ -0,0 +1,416 @@
+# encoding:utf-8
+"""
+兼容OpenAI格式的HTTP接口，消息经过与其它channel相同的_compose_context/produce流程，
+插件、会话、敏感词等处理全部生效，便于内部服务调用和压测
+流式输出时，如果有插件处理ON_DECORATE_REPLY(如敏感词回复过滤)，不推送bot的增量输出，只返回装饰后的完整回复
+
+    POST /v1/chat/completions        支持stream流式输出
+    POST /v1/chat/completions/batch  一次提交多条消息，并行处理后一起返回
+    GET  /v1/models
+
+只取messages中最后一条user消息作为输入，上下文由bot的会话管理维护：
+请求中带user字段时作为session_id保持多轮对话，不带时每个请求使用独立会话，处理结束后清除
+"""
+
+import json
+import threading
+import time
+import uuid
+from queue import Empty, Queue
+
+import web
+
+from bridge.bridge import Bridge
+from bridge.context import *
+from bridge.reply import Reply, ReplyType
+from channel.chat_channel import DEFERRED, ChatChannel
+from channel.chat_message import ChatMessage
+from common import http_server
+from common.log import logger
+from common.singleton import singleton
+from config import conf
+
+
+class ApiMessage(ChatMessage):
+    def __init__(self, msg_id, content, session_id, ctype=ContextType.TEXT):
+        self.msg_id = msg_id
+        self.ctype = ctype
+        self.content = content
+        self.from_user_id = session_id
+        self.to_user_id = "Chatgpt"
+        self.other_user_id = session_id
+
+
+class ApiRequest(object):
+    def __init__(self, request_id, session_id, stateless, stream=False):
+        self.request_id = request_id
+        self.session_id = session_id
+        self.stateless = stateless  # 独立会话，处理结束后清除
+        self.stream = stream
+        self.events = Queue()  # ("delta", 文本) / ("reply", Reply) / ("done", finish_reason)
+        self.created_at = time.time()
+        self.started_at = None  # 处理线程开始处理的时间
+        self.finished_at = None
+        self.released = False  # 是否已释放并发名额
+
+    def timing(self):
+        """
+        :return: 排队、处理和总耗时(毫秒)
+        """
+        now = self.finished_at or time.time()
+        started = self.started_at or now
+        return {
+            "queue": round((started - self.created_at) * 1000, 1),
+            "process": round((now - started) * 1000, 1),
+            "total": round((now - self.created_at) * 1000, 1),
+        }
+
+    def server_timing(self):
+        return ", ".join("{};dur={}".format(name, value) for name, value in self.timing().items())
+
+
+def _error_body(message, error_type, code=None):
+    return json.dumps({"error": {"message": message, "type": error_type, "code": code}}, ensure_ascii=False)
+
+
+def _raise_error(status, message, error_type, code=None, headers=None):
+    headers = dict(headers or {})
+    headers["Content-Type"] = "application/json"
+    raise web.HTTPError(status, headers, _error_body(message, error_type, code))
+
+
+def _message_text(content):
+    # content可以是字符串或[{"type": "text", "text": ...}]格式的分段内容
+    if isinstance(content, list):
+        return "".join(part["text"] for part in content if isinstance(part, dict) and part.get("type") == "text" and isinstance(part.get("text"), str))
+    return content or ""
+
+
+def _check_body(body):
+    """
+    在占用并发名额前检查请求体格式，避免提交过程中出错
+    """
+    if not isinstance(body, dict):
+        _raise_error("400 Bad Request", "Request body must be a json object", "invalid_request_error")
+    if not isinstance(body.get("user"), (str, type(None))):
+        _raise_error("400 Bad Request", "user must be a string", "invalid_request_error")
+    messages = body.get("messages")
+    if messages is None:
+        return
+    if not isinstance(messages, list) or not all(isinstance(message, dict) for message in messages):
+        _raise_error("400 Bad Request", "messages must be a list of message objects", "invalid_request_error")
+    for message in messages:
+        if not isinstance(message.get("content"), (str, list, type(None))):
+            _raise_error("400 Bad Request", "message content must be a string or a list of parts", "invalid_request_error")
+
+
+def _reply_text(reply: Reply):
+    if reply.type in [ReplyType.IMAGE_URL, ReplyType.VIDEO_URL]:
+        return "![{}]({})".format(reply.type.name.lower(), reply.content)
+    if reply.type in [ReplyType.TEXT, ReplyType.INFO, ReplyType.ERROR]:
+        return reply.content
+    return None
+
+
+@singleton
+class ApiChannel(ChatChannel):
+    NOT_SUPPORT_REPLYTYPE = [ReplyType.VOICE, ReplyType.IMAGE, ReplyType.FILE, ReplyType.VIDEO]
+
+    def __init__(self):
+        super().__init__()
+        self.requests = {}  # request_id -> ApiRequest
+        self.inflight = 0
+        self.admission_lock = threading.Lock()
+        self.msg_id_counter = 0
+        # 接口调用无需前缀
+        conf()["single_chat_prefix"] = [""]
+
+    def startup(self):
+        port = conf().get("api_port", 9900)
+        urls = (
+            "/v1/chat/completions", "CompletionsHandler",
+            "/v1/chat/completions/batch", "BatchHandler",
+            "/v1/models", "ModelsHandler",
+        )
+        app = web.application(urls, globals(), autoreload=False)
+        logger.info("[API] OpenAI compatible api is running on http://0.0.0.0:%s/v1/chat/completions", port)
+        http_server.serve(app, port, threads=conf().get("api_server_threads", 100))
+
+    def _check_auth(self):
+        token = conf().get("api_token")
+        if token and web.ctx.env.get("HTTP_AUTHORIZATION", "") != "Bearer " + token:
+            _raise_error("401 Unauthorized", "Invalid api token", "invalid_request_error", "invalid_api_key")
+
+    def _admit(self, count):
+        """
+        占用count个并发名额，超过api_max_inflight时返回429
+        """
+        max_inflight = conf().get("api_max_inflight", 64)
+        with self.admission_lock:
+            if self.inflight + count > max_inflight:
+                inflight = self.inflight
+            else:
+                self.inflight += count
+                return
+        logger.warning("[API] too many requests, inflight={}, max={}".format(inflight, max_inflight))
+        _raise_error("429 Too Many Requests", "Too many inflight requests", "rate_limit_error", headers={"Retry-After": "1"})
+
+    def _unadmit(self, count):
+        # 归还没有提交成功的请求占用的名额
+        with self.admission_lock:
+            self.inflight -= count
+
+    def _release(self, request: ApiRequest):
+        # 请求处理结束、超时或客户端断开，以先发生的为准
+        with self.admission_lock:
+            if request.released:
+                return
+            request.released = True
+            self.inflight -= 1
+            self.requests.pop(request.request_id, None)
+
+    def _parse_body(self):
+        try:
+            return json.loads(web.data() or b"{}")
+        except ValueError:
+            _raise_error("400 Bad Request", "Invalid json body", "invalid_request_error")
+
+    def _submit(self, body, stream=False) -> ApiRequest:
+        """
+        按chat completion请求体构造context并放入消息队列，已占用并发名额
+        """
+        messages = body.get("messages") or []
+        prompt = ""
+        for message in reversed(messages):
+            if message.get("role") == "user":
+                prompt = _message_text(message.get("content"))
+                break
+        request_id = "chatcmpl-" + uuid.uuid4().hex
+        stateless = not body.get("user")
+        session_id = "api_" + (body.get("user") or request_id)
+        request = ApiRequest(request_id, session_id, stateless, stream)
+        with self.admission_lock:
+            self.requests[request_id] = request
+            self.msg_id_counter += 1
+            msg_id = str(self.msg_id_counter)
+        try:
+            if not prompt.strip():
+                request.events.put(("done", "content_filter"))
+                return request
+            context = self._compose_context(ContextType.TEXT, prompt, msg=ApiMessage(msg_id, prompt, session_id), isgroup=False)
+            if context is None or not context.content:
+                # 被插件或黑名单过滤
+                request.events.put(("done", "content_filter"))
+                return request
+            context["request_id"] = request_id
+            context["stateless"] = stateless
+            if stream and self._token_stream_enabled():
+                # 回复需要经过插件过滤时不推送bot的增量输出，只发送装饰后的完整回复
+                context["stream_callback"] = lambda delta: self._put(request_id, "delta", delta)
+            self.produce(context)
+            return request
+        except Exception:
+            # 由调用方归还并发名额
+            with self.admission_lock:
+                self.requests.pop(request_id, None)
+            raise
+
+    def _put(self, request_id, kind, value):
+        request = self.requests.get(request_id)
+        if request is None:
+            logger.debug("[API] request %s finished, %s dropped", request_id, kind)
+            return
+        request.events.put((kind, value))
+
+    def send(self, reply: Reply, context: Context):
+        self._put(context["request_id"], "reply", reply)
+
+    def _handle(self, context: Context):
+        request = self.requests.get(context.get("request_id"))
+        if request is not None and request.started_at is None:
+            request.started_at = time.time()
+        return super()._handle(context)
+
+    def _thread_pool_callback(self, session_id, **kwargs):
+        callback = super()._thread_pool_callback(session_id, **kwargs)
+        context = kwargs.get("context")
+
+        def func(worker):
+            callback(worker)
+            if not worker.cancelled() and worker.exception() is None and worker.result() is DEFERRED:
+                return
+            request = self.requests.get(context["request_id"])
+            if request is not None:
+                request.finished_at = time.time()
+                request.events.put(("done", "stop"))
+            # 请求超时或客户端断开后仍需清除独立会话
+            if context.get("stateless"):
+                self._clear_bot_session(context["session_id"])
+
+        return func
+
+    def _clear_bot_session(self, session_id):
+        bridge = Bridge()
+        for bot in list(bridge.bots.values()) + list(bridge.chat_bots.values()):
+            sessions = getattr(bot, "sessions", None)
+            if sessions is not None:
+                sessions.clear_session(session_id)
+
+    def _collect(self, request: ApiRequest, deadline):
+        """
+        等待请求处理结束
+        :return: (回复内容, finish_reason)，超时返回None
+        """
+        contents = []
+        try:
+            while True:
+                try:
+                    kind, value = request.events.get(timeout=max(0, deadline - time.time()))
+                except Empty:
+                    return None
+                if kind == "reply":
+                    text = _reply_text(value)
+                    if text is not None:
+                        contents.append(text)
+                elif kind == "done":
+                    return "\n\n".join(contents), value
+        finally:
+            request.finished_at = request.finished_at or time.time()
+            self._release(request)
+
+    def _completion(self, request: ApiRequest, content, finish_reason):
+        return {
+            "id": request.request_id,
+            "object": "chat.completion",
+            "created": int(request.created_at),
+            "model": conf().get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": finish_reason}],
+            "timing": request.timing(),
+        }
+
+    def _chunk(self, request: ApiRequest, delta, finish_reason=None):
+        chunk = {
+            "id": request.request_id,
+            "object": "chat.completion.chunk",
+            "created": int(request.created_at),
+            "model": conf().get("model"),
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        if finish_reason:
+            chunk["timing"] = request.timing()
+        return "data: {}\n\n".format(json.dumps(chunk, ensure_ascii=False))
+
+    def chat_completions(self):
+        self._check_auth()
+        body = self._parse_body()
+        _check_body(body)
+        stream = bool(body.get("stream"))
+        self._admit(1)
+        try:
+            request = self._submit(body, stream)
+        except Exception as e:
+            self._unadmit(1)
+            logger.exception("[API] submit request error: {}".format(e))
+            _raise_error("500 Internal Server Error", "Failed to process request", "server_error")
+        web.header("X-Request-Id", request.request_id)
+        timeout = conf().get("api_request_timeout", 120)
+        if stream:
+            web.header("Content-Type", "text/event-stream")
+            web.header("Cache-Control", "no-cache")
+            web.header("X-Accel-Buffering", "no")
+            return self._event_stream(request, time.time() + timeout)
+        result = self._collect(request, time.time() + timeout)
+        if result is None:
+            _raise_error("504 Gateway Timeout", "Request timed out after {}s".format(timeout), "timeout_error",
+                         headers={"X-Request-Id": request.request_id, "Server-Timing": request.server_timing()})
+        web.header("Content-Type", "application/json")
+        web.header("Server-Timing", request.server_timing())
+        return json.dumps(self._completion(request, *result), ensure_ascii=False)
+
+    def _event_stream(self, request: ApiRequest, deadline):
+        streamed = False
+        try:
+            yield self._chunk(request, {"role": "assistant", "content": ""})
+            while True:
+                try:
+                    kind, value = request.events.get(timeout=max(0, deadline - time.time()))
+                except Empty:
+                    yield self._chunk(request, {}, "timeout")
+                    break
+                if kind == "delta":
+                    streamed = True
+                    yield self._chunk(request, {"content": value})
+                elif kind == "reply":
+                    text = _reply_text(value)
+                    # 已经流式输出过的文本回复不再重复发送
+                    if text is not None and not (streamed and value.type == ReplyType.TEXT):
+                        yield self._chunk(request, {"content": text})
+                elif kind == "done":
+                    request.finished_at = request.finished_at or time.time()
+                    yield self._chunk(request, {}, value)
+                    break
+            yield "data: [DONE]\n\n"
+        finally:
+            self._release(request)
+
+    def batch_completions(self):
+        """
+        请求体: {"requests": [chat completion请求体或字符串, ...]}，字符串视为一条user消息
+        每条消息独立排队处理，返回结果与请求顺序一致
+        """
+        self._check_auth()
+        body = self._parse_body()
+        items = body.get("requests")
+        if not isinstance(items, list) or not items:
+            _raise_error("400 Bad Request", "requests must be a non-empty list", "invalid_request_error")
+        max_batch = conf().get("api_max_batch", 32)
+        if len(items) > max_batch:
+            _raise_error("400 Bad Request", "Batch size {} exceeds {}".format(len(items), max_batch), "invalid_request_error")
+        items = [{"messages": [{"role": "user", "content": item}]} if isinstance(item, str) else item for item in items]
+        for item in items:
+            _check_body(item)
+        self._admit(len(items))
+        start = time.time()
+        requests = []
+        try:
+            for item in items:
+                requests.append(self._submit(item))
+        except Exception as e:
+            # 已提交的请求不再等待结果，未提交的名额直接归还
+            for request in requests:
+                self._release(request)
+            self._unadmit(len(items) - len(requests))
+            logger.exception("[API] submit batch request error: {}".format(e))
+            _raise_error("500 Internal Server Error", "Failed to process request", "server_error")
+        deadline = start + conf().get("api_request_timeout", 120)
+        data = []
+        for request in requests:
+            result = self._collect(request, deadline)
+            if result is None:
+                data.append({"id": request.request_id, "error": {"message": "Request timed out", "type": "timeout_error"}})
+            else:
+                data.append(self._completion(request, *result))
+        web.header("Content-Type", "application/json")
+        web.header("Server-Timing", "total;dur={}".format(round((time.time() - start) * 1000, 1)))
+        return json.dumps({"object": "list", "data": data}, ensure_ascii=False)
+
+    def models(self):
+        self._check_auth()
+        web.header("Content-Type", "application/json")
+        model = conf().get("model")
+        return json.dumps({"object": "list", "data": [{"id": model, "object": "model", "owned_by": "chatgpt-on-wechat"}]})
+
+
+class CompletionsHandler:
+    def POST(self):
+        return ApiChannel().chat_completions()
+
+
+class BatchHandler:
+    def POST(self):
+        return ApiChannel().batch_completions()
+
+
+class ModelsHandler:
+    def GET(self):
+        return ApiChannel().models()
@@ -5,11 +5,14 @@ Message sending channel abstract class
 from bridge.bridge import Bridge
 from bridge.context import Context
 from bridge.reply import *
+from voice.parallel_asr import parallel_asr
+from voice.parallel_tts import parallel_tts
 
 
 class Channel(object):
     channel_type = ""
     NOT_SUPPORT_REPLYTYPE = [ReplyType.VOICE, ReplyType.IMAGE]
+    MULTI_REPLY = True  # 一条消息能否发送多条回复，如被动回复模式的公众号只能回复一条
 
     def startup(self):
         """
@@ -38,7 +41,7 @@ class Channel(object):
         return Bridge().fetch_reply_content(query, context)
 
     def build_voice_to_text(self, voice_file) -> Reply:
-        return Bridge().fetch_voice_to_text(voice_file)
+        return parallel_asr.voice_to_text(voice_file)
 
-    def build_text_to_voice(self, text) -> Reply:
-        return Bridge().fetch_text_to_voice(text)
+    def build_text_to_voice(self, text, on_chunk=None) -> Reply:
+        return parallel_tts.text_to_voice(text, on_chunk)
@@ -27,6 +27,9 @@ def create_channel(channel_type) -> Channel:
     elif channel_type == 'web':
         from channel.web.web_channel import WebChannel
         ch = WebChannel()
+    elif channel_type == "api":
+        from channel.api.api_channel import ApiChannel
+        ch = ApiChannel()
     elif channel_type == "wechatmp":
         from channel.wechatmp.wechatmp_channel import WechatMPChannel
         ch = WechatMPChannel(passive_reply=True)
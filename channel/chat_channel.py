@@ -9,7 +9,9 @@ from bridge.context import *
 from bridge.reply import *
 from channel.channel import Channel
 from common.dequeue import Dequeue
-from common import memory
+from common import memory, metrics, tracing
+from common.retry import RetryLater, deferrable, retry_scheduler
+from common.tmp_dir import tmp_manager
 from plugins import *
 
 try:
@@ -18,6 +20,21 @@ except Exception as e:
     pass
 
 handler_pool = ThreadPoolExecutor(max_workers=8)  # 处理消息的线程池
+prefetch_pool = None  # 预取语音/图片/文件的IO线程池，开启media_prefetch后首次使用时创建
+prefetch_slots = None  # 限制排队中的预取任务数
+prefetch_lock = threading.Lock()
+PREFETCH_CTYPES = [ContextType.VOICE, ContextType.IMAGE, ContextType.FILE, ContextType.VIDEO]
+DEFERRED = object()  # 处理线程返回该值表示回复在等待延迟重试
+
+
+def _get_prefetch_pool():
+    global prefetch_pool, prefetch_slots
+    with prefetch_lock:
+        if prefetch_pool is None:
+            workers = conf().get("media_prefetch_workers", 4)
+            prefetch_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+            prefetch_slots = threading.BoundedSemaphore(workers * 4)
+        return prefetch_pool, prefetch_slots
 
 
 # 抽象类, 它包含了与消息通道无关的通用处理逻辑
@@ -27,6 +44,7 @@ class ChatChannel(Channel):
     futures = {}  # 记录每个session_id提交到线程池的future对象, 用于重置会话时把没执行的future取消掉，正在执行的不会被取消
     sessions = {}  # 用于控制并发，每个session_id同时只能有一个context在处理
     lock = threading.Lock()  # 用于控制对sessions的访问
+    worker_pool = None  # 开启worker_processes后由channel.worker_pool设置，消息分发给worker进程处理
 
     def __init__(self):
         _thread = threading.Thread(target=self.consume)
@@ -37,6 +55,7 @@ class ChatChannel(Channel):
     def _compose_context(self, ctype: ContextType, content, **kwargs):
         context = Context(ctype, content)
         context.kwargs = kwargs
+        tracing.start_trace(context)
         # context首次传入时，origin_ctype是None,
         # 引入的起因是：当输入语音时，会嵌套生成两个context，第一步语音转文本，第二步通过文本生成文字回复。
         # origin_ctype用于第二步文本回复时，判断是否需要匹配前缀，如果是私聊的语音，就不需要匹配前缀
@@ -74,7 +93,7 @@ class ChatChannel(Channel):
                     ):
                         session_id = group_id
                 else:
-                    logger.debug(f"No need reply, groupName not in whitelist, group_name={group_name}")
+                    logger.debug("No need reply, groupName not in whitelist, group_name=%s", group_name)
                     return None
                 context["session_id"] = session_id
                 context["receiver"] = group_id
@@ -166,15 +185,27 @@ class ChatChannel(Channel):
     def _handle(self, context: Context):
         if context is None or not context.content:
             return
-        logger.debug("[chat_channel] ready to handle context: {}".format(context))
+        with metrics.handler_active.track(channel=self.channel_type):
+            return self._handle_context(context)
+
+    def _handle_context(self, context: Context):
+        logger.debug("[chat_channel] ready to handle context: %s", context)
+        trace = context.get("trace")
+        if trace is not None and trace.enqueued_at:
+            trace.add("queue", trace.enqueued_at)
         # reply的构建步骤
-        reply = self._generate_reply(context)
+        try:
+            with tracing.span(context, "generate"):
+                reply = self._generate_reply(context)
+        except RetryLater as e:
+            return self._defer_reply(context, e)
 
-        logger.debug("[chat_channel] ready to decorate reply: {}".format(reply))
+        logger.debug("[chat_channel] ready to decorate reply: %s", reply)
 
         # reply的包装步骤
         if reply and reply.content:
-            reply = self._decorate_reply(context, reply)
+            with tracing.span(context, "decorate"):
+                reply = self._decorate_reply(context, reply)
 
             # reply的发送步骤
             self._send_reply(context, reply)
@@ -188,30 +219,30 @@ class ChatChannel(Channel):
         )
         reply = e_context["reply"]
         if not e_context.is_pass():
-            logger.debug("[chat_channel] ready to handle context: type={}, content={}".format(context.type, context.content))
+            logger.debug("[chat_channel] ready to handle context: type=%s, content=%s", context.type, context.content)
             if context.type == ContextType.TEXT or context.type == ContextType.IMAGE_CREATE:  # 文字和图片消息
                 context["channel"] = e_context["channel"]
-                reply = super().build_reply_content(context.content, context)
+                try:
+                    # 需要等待的重试以RetryLater抛出，不在处理线程中sleep
+                    with deferrable(), tracing.span(context, "bot", type=str(context.type)):
+                        reply = super().build_reply_content(context.content, context)
+                except RetryLater as e:
+                    e.context = e.context or context
+                    raise
             elif context.type == ContextType.VOICE:  # 语音消息
                 cmsg = context["msg"]
                 cmsg.prepare()
-                file_path = context.content
-                wav_path = os.path.splitext(file_path)[0] + ".wav"
+                file_path = tmp_manager.acquire(context.content, context)
+                wav_path = tmp_manager.acquire(os.path.splitext(file_path)[0] + ".wav", context)
                 try:
-                    any_to_wav(file_path, wav_path)
+                    with tracing.span(context, "voice_convert"):
+                        any_to_wav(file_path, wav_path)
                 except Exception as e:  # 转换失败，直接使用mp3，对于某些api，mp3也可以识别
                     logger.warning("[chat_channel]any to wav error, use raw path. " + str(e))
                     wav_path = file_path
-                # 语音识别
-                reply = super().build_voice_to_text(wav_path)
-                # 删除临时文件
-                try:
-                    os.remove(file_path)
-                    if wav_path != file_path:
-                        os.remove(wav_path)
-                except Exception as e:
-                    pass
-                    # logger.warning("[chat_channel]delete temp file error: " + str(e))
+                # 语音识别，临时文件在context处理结束后删除
+                with tracing.span(context, "voice_to_text"):
+                    reply = super().build_voice_to_text(wav_path)
 
                 if reply.type == ReplyType.TEXT:
                     new_context = self._compose_context(ContextType.TEXT, reply.content, **context.kwargs)
@@ -252,7 +283,14 @@ class ChatChannel(Channel):
                 if reply.type == ReplyType.TEXT:
                     reply_text = reply.content
                     if desire_rtype == ReplyType.VOICE and ReplyType.VOICE not in self.NOT_SUPPORT_REPLYTYPE:
-                        reply = super().build_text_to_voice(reply.content)
+                        with tracing.span(context, "text_to_voice"):
+                            if conf().get("tts_stream_reply") and self.MULTI_REPLY:
+                                # 长回复分段合成，先合成好的段落先经过装饰后发送
+                                reply = super().build_text_to_voice(
+                                    reply.content, on_chunk=lambda chunk: self._send_reply(context, self._decorate_reply(context, chunk))
+                                )
+                            else:
+                                reply = super().build_text_to_voice(reply.content)
                         return self._decorate_reply(context, reply)
                     if context.get("isgroup", False):
                         if not context.get("no_need_at", False):
@@ -272,6 +310,10 @@ class ChatChannel(Channel):
                 logger.warning("[chat_channel] desire_rtype: {}, but reply type: {}".format(context.get("desire_rtype"), reply.type))
             return reply
 
+    def _token_stream_enabled(self):
+        # 有插件处理ON_DECORATE_REPLY(如banwords的回复过滤)时，bot的增量输出会绕过装饰，只发送装饰后的完整回复
+        return not PluginManager().has_listener(Event.ON_DECORATE_REPLY)
+
     def _send_reply(self, context: Context, reply: Reply):
         if reply and reply.type:
             e_context = PluginManager().emit_event(
@@ -282,13 +324,18 @@ class ChatChannel(Channel):
             )
             reply = e_context["reply"]
             if not e_context.is_pass() and reply and reply.type:
-                logger.debug("[chat_channel] ready to send reply: {}, context: {}".format(reply, context))
+                if reply.type in [ReplyType.VOICE, ReplyType.FILE, ReplyType.VIDEO]:
+                    tmp_manager.acquire(reply.content, context)  # 发送后随context一起删除
+                logger.debug("[chat_channel] ready to send reply: %s, context: %s", reply, context)
                 self._send(reply, context)
 
     def _send(self, reply: Reply, context: Context, retry_cnt=0):
         try:
-            self.send(reply, context)
+            with tracing.span(context, "send", type=str(reply.type), retry_cnt=retry_cnt):
+                self.send(reply, context)
+            metrics.messages_out.inc(channel=self.channel_type, type=reply.type.name)
         except Exception as e:
+            metrics.send_errors.inc(channel=self.channel_type)
             logger.error("[chat_channel] sendMsg error: {}".format(str(e)))
             if isinstance(e, NotImplementedError):
                 return
@@ -297,8 +344,45 @@ class ChatChannel(Channel):
                 time.sleep(3 + 3 * retry_cnt)
                 self._send(reply, context, retry_cnt + 1)
 
+    def _defer_reply(self, context: Context, retry: RetryLater):
+        """
+        到期后把重试提交回线程池，期间不占用处理线程；会话的并发名额和临时文件保留到重试任务结束
+        """
+        session_id = context["session_id"]
+        logger.info("[chat_channel] reply deferred for %.1fs, session_id=%s", retry.delay, session_id)
+        deferred_at = time.time_ns()
+
+        def resume():
+            trace = context.get("trace")
+            if trace is not None:
+                trace.add("retry_wait", deferred_at, delay=round(retry.delay, 3))
+            future: Future = handler_pool.submit(self._resume_reply, context, retry)
+            future.add_done_callback(self._thread_pool_callback(session_id, context=context))
+            with self.lock:
+                self.futures.setdefault(session_id, []).append(future)
+
+        retry_scheduler.call_later(retry.delay, resume)
+        return DEFERRED
+
+    def _resume_reply(self, context: Context, retry: RetryLater):
+        with metrics.handler_active.track(channel=self.channel_type):
+            return self._resume_reply_context(context, retry)
+
+    def _resume_reply_context(self, context: Context, retry: RetryLater):
+        try:
+            with deferrable(), tracing.span(context, "bot", resumed=True):
+                reply = retry.resume()
+        except RetryLater as e:
+            e.context = retry.context
+            return self._defer_reply(context, e)
+        reply_context = retry.context or context
+        if reply and reply.content:
+            with tracing.span(context, "decorate"):
+                reply = self._decorate_reply(reply_context, reply)
+            self._send_reply(reply_context, reply)
+
     def _success_callback(self, session_id, **kwargs):  # 线程正常结束时的回调函数
-        logger.debug("Worker return success, session_id = {}".format(session_id))
+        logger.debug("Worker return success, session_id = %s", session_id)
 
     def _fail_callback(self, session_id, exception, **kwargs):  # 线程异常结束时的回调函数
         logger.exception("Worker return exception: {}".format(exception))
@@ -308,20 +392,65 @@ class ChatChannel(Channel):
             try:
                 worker_exception = worker.exception()
                 if worker_exception:
+                    metrics.handler_errors.inc(channel=self.channel_type)
                     self._fail_callback(session_id, exception=worker_exception, **kwargs)
+                elif worker.result() is DEFERRED:
+                    # 等待延迟重试，由重试任务结束时释放
+                    return
                 else:
                     self._success_callback(session_id, **kwargs)
             except CancelledError as e:
-                logger.info("Worker cancelled, session_id = {}".format(session_id))
+                logger.info("Worker cancelled, session_id = %s", session_id)
+                self._cancel_prefetch(kwargs.get("context"))
             except Exception as e:
                 logger.exception("Worker raise exception: {}".format(e))
+            tracing.finish_trace(kwargs.get("context"))
+            tmp_manager.release_context(kwargs.get("context"))
             with self.lock:
                 self.sessions[session_id][1].release()
 
         return func
 
+    # 入队时就开始下载消息中的媒体文件，与排队等待重叠，处理线程调用prepare时直接使用下载好的文件
+    def _prefetch(self, context: Context):
+        if not conf().get("media_prefetch") or context.type not in PREFETCH_CTYPES:
+            return
+        cmsg = context.get("msg")
+        if cmsg is None or not getattr(cmsg, "_prepare_fn", None) or cmsg._prepared:
+            return
+        pool, slots = _get_prefetch_pool()
+        if not slots.acquire(blocking=False):
+            logger.debug("[chat_channel] prefetch pool is busy, skip prefetch: %s", context)
+            return
+
+        def prefetch():
+            try:
+                cmsg.prepare()
+            except Exception as e:
+                logger.warning("[chat_channel] prefetch error, will retry in handler: {}".format(e))
+
+        future = pool.submit(prefetch)
+        future.add_done_callback(lambda f: slots.release())
+        context["prefetch_future"] = future
+
+    def _cancel_prefetch(self, context: Context):
+        # 只能取消还没开始的预取，已经在下载的会继续完成
+        future = context.get("prefetch_future") if context else None
+        if future is not None:
+            future.cancel()
+
     def produce(self, context: Context):
         session_id = context["session_id"]
+        if self.worker_pool is not None:
+            # 由worker处理和统计
+            return self.worker_pool.dispatch(context)
+        metrics.messages_in.inc(channel=self.channel_type, type=context.type.name)
+        trace = tracing.start_trace(context)
+        if trace is not None:
+            trace.root.attrs["session_id"] = session_id
+            # 从构造context到入队
+            trace.add("compose", trace.root.start)
+            trace.enqueued_at = time.time_ns()
         with self.lock:
             if session_id not in self.sessions:
                 self.sessions[session_id] = [
@@ -332,6 +461,7 @@ class ChatChannel(Channel):
                 self.sessions[session_id][0].putleft(context)  # 优先处理管理命令
             else:
                 self.sessions[session_id][0].put(context)
+        self._prefetch(context)
 
     # 消费者函数，单独线程，用于从消息队列中取出消息并处理
     def consume(self):
@@ -344,7 +474,7 @@ class ChatChannel(Channel):
                 if semaphore.acquire(blocking=False):  # 等线程处理完毕才能删除
                     if not context_queue.empty():
                         context = context_queue.get()
-                        logger.debug("[chat_channel] consume context: {}".format(context))
+                        logger.debug("[chat_channel] consume context: %s", context)
                         future: Future = handler_pool.submit(self._handle, context)
                         future.add_done_callback(self._thread_pool_callback(session_id, context=context))
                         with self.lock:
@@ -368,7 +498,9 @@ class ChatChannel(Channel):
                     future.cancel()
                 cnt = self.sessions[session_id][0].qsize()
                 if cnt > 0:
-                    logger.info("Cancel {} messages in session {}".format(cnt, session_id))
+                    logger.info("Cancel %s messages in session %s", cnt, session_id)
+                for context in list(self.sessions[session_id][0].queue):
+                    self._cancel_prefetch(context)
                 self.sessions[session_id][0] = Dequeue()
 
     def cancel_all_session(self):
@@ -378,7 +510,9 @@ class ChatChannel(Channel):
                     future.cancel()
                 cnt = self.sessions[session_id][0].qsize()
                 if cnt > 0:
-                    logger.info("Cancel {} messages in session {}".format(cnt, session_id))
+                    logger.info("Cancel %s messages in session %s", cnt, session_id)
+                for context in list(self.sessions[session_id][0].queue):
+                    self._cancel_prefetch(context)
                 self.sessions[session_id][0] = Dequeue()
 
 
@@ -28,10 +28,16 @@ self_display_name: 自身的展示名，设置群昵称时，该字段表示群
 
 _prepare_fn: 准备函数，用于准备消息的内容，比如下载图片等,
 _prepared: 是否已经调用过准备函数
+_prepare_future: 准备函数执行中或执行完成的Future，预取下载与处理线程并发调用prepare时只执行一次
 _rawmsg: 原始消息对象
 
 """
 
+import threading
+from concurrent.futures import Future
+
+_prepare_lock = threading.Lock()
+
 
 class ChatMessage(object):
     msg_id = None
@@ -57,15 +63,36 @@ class ChatMessage(object):
 
     _prepare_fn = None
     _prepared = False
+    _prepare_future = None
     _rawmsg = None
 
     def __init__(self, _rawmsg):
         self._rawmsg = _rawmsg
 
     def prepare(self):
-        if self._prepare_fn and not self._prepared:
-            self._prepared = True
+        if not self._prepare_fn:
+            return
+        with _prepare_lock:
+            future = self._prepare_future
+            owner = future is None and not self._prepared
+            if owner:
+                self._prepared = True
+                future = self._prepare_future = Future()
+        if future is None:
+            return
+        if not owner:
+            # 其他线程(如预取)正在执行准备函数，等待其完成
+            return future.result()
+        try:
             self._prepare_fn()
+            future.set_result(None)
+        except BaseException as e:
+            # 失败后允许再次调用时重试
+            with _prepare_lock:
+                self._prepared = False
+                self._prepare_future = None
+            future.set_exception(e)
+            raise
 
     def __str__(self):
         return "ChatMessage: id={}, create_time={}, ctype={}, content={}, from_user_id={}, from_user_nickname={}, to_user_id={}, to_user_nickname={}, other_user_id={}, other_user_nickname={}, is_group={}, is_at={}, actual_user_id={}, actual_user_nickname={}, at_list={}".format(
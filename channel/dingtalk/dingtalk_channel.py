@@ -66,15 +66,15 @@ def _check(func):
     def wrapper(self, cmsg: DingTalkMessage):
         msgId = cmsg.msg_id
         if msgId in self.receivedMsgs:
-            logger.info("DingTalk message {} already received, ignore".format(msgId))
+            logger.info("DingTalk message %s already received, ignore", msgId)
             return
         self.receivedMsgs[msgId] = True
         create_time = cmsg.create_time  # 消息时间戳
         if conf().get("hot_reload") == True and int(create_time) < int(time.time()) - 60:  # 跳过1分钟前的历史消息
-            logger.debug("[DingTalk] History message {} skipped".format(msgId))
+            logger.debug("[DingTalk] History message %s skipped", msgId)
             return
         if cmsg.my_msg and not cmsg.is_group:
-            logger.debug("[DingTalk] My message {} skipped".format(msgId))
+            logger.debug("[DingTalk] My message %s skipped", msgId)
             return
         return func(self, cmsg)
 
@@ -101,8 +101,9 @@ class DingTalkChanel(ChatChannel, dingtalk_stream.ChatbotHandler):
         self.logger = self.setup_logger()
         # 历史消息id暂存，用于幂等控制
         self.receivedMsgs = ExpiredDict(conf().get("expires_in_seconds", 3600))
-        logger.info("[DingTalk] client_id={}, client_secret={} ".format(
-            self.dingtalk_client_id, self.dingtalk_client_secret))
+        logger.info("[DingTalk] client_id=%s, client_secret=%s ",
+                    self.dingtalk_client_id,
+                    self.dingtalk_client_secret)
         # 无需群校验和前缀
         conf()["group_name_white_list"] = ["ALL_GROUP"]
         # 单聊无需前缀
@@ -134,17 +135,17 @@ class DingTalkChanel(ChatChannel, dingtalk_stream.ChatbotHandler):
     def handle_single(self, cmsg: DingTalkMessage):
         # 处理单聊消息
         if cmsg.ctype == ContextType.VOICE:
-            logger.debug("[DingTalk]receive voice msg: {}".format(cmsg.content))
+            logger.debug("[DingTalk]receive voice msg: %s", cmsg.content)
         elif cmsg.ctype == ContextType.IMAGE:
-            logger.debug("[DingTalk]receive image msg: {}".format(cmsg.content))
+            logger.debug("[DingTalk]receive image msg: %s", cmsg.content)
         elif cmsg.ctype == ContextType.IMAGE_CREATE:
-            logger.debug("[DingTalk]receive image create msg: {}".format(cmsg.content))
+            logger.debug("[DingTalk]receive image create msg: %s", cmsg.content)
         elif cmsg.ctype == ContextType.PATPAT:
-            logger.debug("[DingTalk]receive patpat msg: {}".format(cmsg.content))
+            logger.debug("[DingTalk]receive patpat msg: %s", cmsg.content)
         elif cmsg.ctype == ContextType.TEXT:
-            logger.debug("[DingTalk]receive text msg: {}".format(cmsg.content))
+            logger.debug("[DingTalk]receive text msg: %s", cmsg.content)
         else:
-            logger.debug("[DingTalk]receive other msg: {}".format(cmsg.content))
+            logger.debug("[DingTalk]receive other msg: %s", cmsg.content)
         context = self._compose_context(cmsg.ctype, cmsg.content, isgroup=False, msg=cmsg)
         if context:
             self.produce(context)
@@ -155,17 +156,17 @@ class DingTalkChanel(ChatChannel, dingtalk_stream.ChatbotHandler):
     def handle_group(self, cmsg: DingTalkMessage):
         # 处理群聊消息
         if cmsg.ctype == ContextType.VOICE:
-            logger.debug("[DingTalk]receive voice msg: {}".format(cmsg.content))
+            logger.debug("[DingTalk]receive voice msg: %s", cmsg.content)
         elif cmsg.ctype == ContextType.IMAGE:
-            logger.debug("[DingTalk]receive image msg: {}".format(cmsg.content))
+            logger.debug("[DingTalk]receive image msg: %s", cmsg.content)
         elif cmsg.ctype == ContextType.IMAGE_CREATE:
-            logger.debug("[DingTalk]receive image create msg: {}".format(cmsg.content))
+            logger.debug("[DingTalk]receive image create msg: %s", cmsg.content)
         elif cmsg.ctype == ContextType.PATPAT:
-            logger.debug("[DingTalk]receive patpat msg: {}".format(cmsg.content))
+            logger.debug("[DingTalk]receive patpat msg: %s", cmsg.content)
         elif cmsg.ctype == ContextType.TEXT:
-            logger.debug("[DingTalk]receive text msg: {}".format(cmsg.content))
+            logger.debug("[DingTalk]receive text msg: %s", cmsg.content)
         else:
-            logger.debug("[DingTalk]receive other msg: {}".format(cmsg.content))
+            logger.debug("[DingTalk]receive other msg: %s", cmsg.content)
         context = self._compose_context(cmsg.ctype, cmsg.content, isgroup=True, msg=cmsg)
         context['no_need_at'] = True
         if context:
@@ -178,7 +179,7 @@ class DingTalkChanel(ChatChannel, dingtalk_stream.ChatbotHandler):
         incoming_message = context.kwargs['msg'].incoming_message
 
         if conf().get("dingtalk_card_enabled"):
-            logger.info("[Dingtalk] sendMsg={}, receiver={}".format(reply, receiver))
+            logger.info("[Dingtalk] sendMsg=%s, receiver=%s", reply, receiver)
             def reply_with_text():
                 self.reply_text(reply.content, incoming_message)
             def reply_with_at_text():
@@ -220,6 +221,6 @@ class DingTalkChanel(ChatChannel, dingtalk_stream.ChatbotHandler):
 {reply_text}
 
                                 """
-        logger.debug(f"[Dingtalk] generate_button_markdown_content, button_list={button_list} , markdown_content={markdown_content}")
+        logger.debug("[Dingtalk] generate_button_markdown_content, button_list=%s , markdown_content=%s", button_list, markdown_content)
 
         return button_list, markdown_content
@@ -44,7 +44,7 @@ class DingTalkMessage(ChatMessage):
                 download_url = image_download_handler.get_image_download_url(download_code)
                 self.content = download_image_file(download_url, TmpDir().path())
             else:
-                logger.debug(f"[Dingtalk] messageType :{self.message_type} , imageList isEmpty")
+                logger.debug("[Dingtalk] messageType :%s , imageList isEmpty", self.message_type)
 
         if self.is_group:
             self.from_user_id = event.conversation_id
@@ -80,5 +80,5 @@ def download_image_file(image_url, temp_dir):
             file.write(response.content)
         return file_path
     else:
-        logger.info(f"[Dingtalk] Failed to download image file, {response.content}")
+        logger.info("[Dingtalk] Failed to download image file, %s", response.content)
         return None
@@ -13,6 +13,7 @@ import web
 from channel.feishu.feishu_message import FeishuMessage
 from bridge.context import Context
 from bridge.reply import Reply, ReplyType
+from common import http_server
 from common.log import logger
 from common.singleton import singleton
 from config import conf
@@ -36,8 +37,10 @@ class FeiShuChanel(ChatChannel):
         super().__init__()
         # 历史消息id暂存，用于幂等控制
         self.receivedMsgs = ExpiredDict(60 * 60 * 7.1)
-        logger.info("[FeiShu] app_id={}, app_secret={} verification_token={}".format(
-            self.feishu_app_id, self.feishu_app_secret, self.feishu_token))
+        logger.info("[FeiShu] app_id=%s, app_secret=%s verification_token=%s",
+                    self.feishu_app_id,
+                    self.feishu_app_secret,
+                    self.feishu_token)
         # 无需群校验和前缀
         conf()["group_name_white_list"] = ["ALL_GROUP"]
         conf()["single_chat_prefix"] = [""]
@@ -48,7 +51,7 @@ class FeiShuChanel(ChatChannel):
         )
         app = web.application(urls, globals(), autoreload=False)
         port = conf().get("feishu_port", 9891)
-        web.httpserver.runsimple(app.wsgifunc(), ("0.0.0.0", port))
+        http_server.serve(app, port)
 
     def send(self, reply: Reply, context: Context):
         msg = context.get("msg")
@@ -62,7 +65,7 @@ class FeiShuChanel(ChatChannel):
             "Content-Type": "application/json",
         }
         msg_type = "text"
-        logger.info(f"[FeiShu] start send reply message, type={context.type}, content={reply.content}")
+        logger.info("[FeiShu] start send reply message, type=%s, content=%s", context.type, reply.content)
         reply_content = reply.content
         content_key = "text"
         if reply.type == ReplyType.IMAGE_URL:
@@ -120,7 +123,7 @@ class FeiShuChanel(ChatChannel):
 
 
     def _upload_image_url(self, img_url, access_token):
-        logger.debug(f"[WX] start download image, img_url={img_url}")
+        logger.debug("[WX] start download image, img_url=%s", img_url)
         response = requests.get(img_url)
         suffix = utils.get_path_suffix(img_url)
         temp_name = str(uuid.uuid4()) + "." + suffix
@@ -139,7 +142,7 @@ class FeiShuChanel(ChatChannel):
         }
         with open(temp_name, "rb") as file:
             upload_response = requests.post(upload_url, files={"image": file}, data=data, headers=headers)
-            logger.info(f"[FeiShu] upload file, res={upload_response.content}")
+            logger.info("[FeiShu] upload file, res=%s", upload_response.content)
             os.remove(temp_name)
             return upload_response.json().get("data").get("image_key")
 
@@ -159,7 +162,7 @@ class FeishuController:
             channel = FeiShuChanel()
 
             request = json.loads(web.data().decode("utf-8"))
-            logger.debug(f"[FeiShu] receive request: {request}")
+            logger.debug("[FeiShu] receive request: %s", request)
 
             # 1.事件订阅回调验证
             if request.get("type") == URL_VERIFICATION:
@@ -218,7 +221,7 @@ class FeishuController:
                 )
                 if context:
                     channel.produce(context)
-                logger.info(f"[FeiShu] query={feishu_msg.content}, type={feishu_msg.ctype}")
+                logger.info("[FeiShu] query=%s, type=%s", feishu_msg.content, feishu_msg.ctype)
             return self.SUCCESS_MSG
 
         except Exception as e:
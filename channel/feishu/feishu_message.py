@@ -44,7 +44,7 @@ class FeishuMessage(ChatMessage):
                     with open(self.content, "wb") as f:
                         f.write(response.content)
                 else:
-                    logger.info(f"[FeiShu] Failed to download file, key={file_key}, res={response.text}")
+                    logger.info("[FeiShu] Failed to download file, key=%s, res=%s", file_key, response.text)
             self._prepare_fn = _download_file
         else:
             raise NotImplementedError("Unsupported message type: Type:{} ".format(msg_type))
@@ -8,13 +8,12 @@ from bridge.context import *
 from bridge.reply import Reply, ReplyType
 from channel.chat_channel import ChatChannel, check_prefix
 from channel.chat_message import ChatMessage
+from common import http_server
 from common.log import logger
 from common.singleton import singleton
 from config import conf
 import os
-import mimetypes  # 添加这行来处理MIME类型
 import threading
-import logging
 
 class WebMessage(ChatMessage):
     def __init__(
@@ -49,6 +48,8 @@ class WebChannel(ChatChannel):
         self.msg_id_counter = 0  # 添加消息ID计数器
         self.session_queues = {}  # 存储session_id到队列的映射
         self.request_to_session = {}  # 存储request_id到session_id的映射
+        self.stream_counts = {}  # 存储session_id当前连接的SSE数量
+        self.stream_lock = threading.Lock()
         # web channel无需前缀
         conf()["single_chat_prefix"] = [""]
 
@@ -83,24 +84,38 @@ class WebChannel(ChatChannel):
             if not session_id:
                 logger.error(f"No session_id found for request {request_id}")
                 return
-            
-            # 检查是否有会话队列
-            if session_id in self.session_queues:
-                # 创建响应数据，包含请求ID以区分不同请求的响应
-                response_data = {
-                    "type": str(reply.type),
-                    "content": reply.content,
-                    "timestamp": time.time(),
-                    "request_id": request_id
-                }
-                self.session_queues[session_id].put(response_data)
-                logger.debug(f"Response sent to queue for session {session_id}, request {request_id}")
-            else:
-                logger.warning(f"No response queue found for session {session_id}, response dropped")
-            
+
+            # 创建响应数据，包含请求ID以区分不同请求的响应
+            self._push(session_id, {
+                "type": str(reply.type),
+                "content": reply.content,
+                "timestamp": time.time(),
+                "request_id": request_id
+            })
+
         except Exception as e:
             logger.error(f"Error in send method: {e}")
 
+    def _push(self, session_id, response_data):
+        """放入会话队列，轮询或SSE连接从队列中取出"""
+        queue = self.session_queues.get(session_id)
+        if queue is None:
+            logger.warning(f"No response queue found for session {session_id}, response dropped")
+            return
+        queue.put(response_data)
+        logger.debug("Response sent to queue for session %s, request %s", session_id, response_data['request_id'])
+
+    def _stream_callback(self, session_id, request_id):
+        """bot流式输出时，每段增量内容立即推送给SSE连接"""
+        def callback(delta):
+            self._push(session_id, {
+                "type": "DELTA",
+                "content": delta,
+                "timestamp": time.time(),
+                "request_id": request_id
+            })
+        return callback
+
     def post_message(self):
         """
         Handle incoming messages from users via POST request.
@@ -119,8 +134,9 @@ class WebChannel(ChatChannel):
             self.request_to_session[request_id] = session_id
             
             # 确保会话队列存在
-            if session_id not in self.session_queues:
-                self.session_queues[session_id] = Queue()
+            with self.stream_lock:
+                if session_id not in self.session_queues:
+                    self.session_queues[session_id] = Queue()
             
             # 创建消息对象
             msg = WebMessage(self._generate_msg_id(), prompt)
@@ -134,9 +150,12 @@ class WebChannel(ChatChannel):
             context["request_id"] = request_id
             context["isgroup"] = False  # 添加 isgroup 字段
             context["receiver"] = session_id  # 添加 receiver 字段
-            
-            # 异步处理消息 - 只传递上下文
-            threading.Thread(target=self.produce, args=(context,)).start()
+            if json_data.get('stream') and self._token_stream_enabled():
+                # SSE客户端接收bot的流式输出，回复需要经过插件过滤时只推送完整回复
+                context["stream_callback"] = self._stream_callback(session_id, request_id)
+
+            # produce只是放入会话队列，直接调用
+            self.produce(context)
             
             # 返回请求ID
             return json.dumps({"status": "success", "request_id": request_id})
@@ -182,11 +201,60 @@ class WebChannel(ChatChannel):
             logger.error(f"Error polling response: {e}")
             return json.dumps({"status": "error", "message": str(e)})
 
-    def chat_page(self):
-        """Serve the chat HTML page."""
-        file_path = os.path.join(os.path.dirname(__file__), 'chat.html')  # 使用绝对路径
-        with open(file_path, 'r', encoding='utf-8') as f:
-            return f.read()
+    def stream_response(self):
+        """
+        Push responses to the browser with Server-Sent Events.
+        """
+        web.ctx.log_request = False
+        session_id = web.input(session_id=None).session_id
+        if not session_id:
+            raise web.badrequest()
+        web.header("Content-Type", "text/event-stream")
+        web.header("Cache-Control", "no-cache")
+        web.header("X-Accel-Buffering", "no")  # 禁止nginx等反向代理缓冲
+        with self.stream_lock:
+            if session_id not in self.session_queues:
+                self.session_queues[session_id] = Queue()
+            queue = self.session_queues[session_id]
+            self.stream_counts[session_id] = self.stream_counts.get(session_id, 0) + 1
+        return self._event_stream(session_id, queue)
+
+    def _event_stream(self, session_id, queue):
+        heartbeat = conf().get("web_sse_heartbeat", 15)
+        try:
+            # 断线后浏览器3秒后自动重连
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    response = queue.get(timeout=heartbeat)
+                except Empty:
+                    # 注释行作为心跳，连接断开时写入失败，生成器随之关闭
+                    yield ": ping\n\n"
+                    continue
+                yield "data: {}\n\n".format(json.dumps(response, ensure_ascii=False))
+        finally:
+            self._close_stream(session_id)
+
+    def _close_stream(self, session_id):
+        with self.stream_lock:
+            count = self.stream_counts.get(session_id, 1) - 1
+            if count > 0:
+                self.stream_counts[session_id] = count
+                return
+            self.stream_counts.pop(session_id, None)
+        # 等待浏览器重连，期间到达的回复保留在队列中
+        timer = threading.Timer(conf().get("web_session_grace", 30), self._cleanup_session, args=(session_id,))
+        timer.daemon = True
+        timer.start()
+
+    def _cleanup_session(self, session_id):
+        with self.stream_lock:
+            if session_id in self.stream_counts:
+                return
+            self.session_queues.pop(session_id, None)
+            for request_id in [r for r, s in self.request_to_session.items() if s == session_id]:
+                self.request_to_session.pop(request_id, None)
+        logger.debug("[WebChannel] session %s disconnected, cleaned up", session_id)
 
     def startup(self):
         port = conf().get("web_port", 9899)
@@ -198,36 +266,31 @@ class WebChannel(ChatChannel):
         5. wechatcom_app: 企微自建应用
         6. dingtalk: 钉钉
         7. feishu: 飞书""")
-        logger.info(f"Web对话网页已运行, 请使用浏览器访问 http://localhost:{port}/chat（本地运行）或 http://ip:{port}/chat（服务器运行） ")
+        logger.info("Web对话网页已运行, 请使用浏览器访问 http://localhost:%s/chat（本地运行）或 http://ip:%s/chat（服务器运行） ", port, port)
         
         # 确保静态文件目录存在
         static_dir = os.path.join(os.path.dirname(__file__), 'static')
         if not os.path.exists(static_dir):
             os.makedirs(static_dir)
-            logger.info(f"Created static directory: {static_dir}")
+            logger.info("Created static directory: %s", static_dir)
         
         urls = (
             '/', 'RootHandler',  # 添加根路径处理器
             '/message', 'MessageHandler',
             '/poll', 'PollHandler',  # 添加轮询处理器
+            '/stream', 'StreamHandler',  # SSE推送
             '/chat', 'ChatHandler',
             '/assets/(.*)', 'AssetsHandler',  # 匹配 /assets/任何路径
         )
         app = web.application(urls, globals(), autoreload=False)
-        
-        # 禁用web.py的默认日志输出
-        import io
-        from contextlib import redirect_stdout
-        
-        # 配置web.py的日志级别为ERROR，只显示错误
-        logging.getLogger("web").setLevel(logging.ERROR)
-        
-        # 禁用web.httpserver的日志
-        logging.getLogger("web.httpserver").setLevel(logging.ERROR)
-        
-        # 临时重定向标准输出，捕获web.py的启动消息
-        with redirect_stdout(io.StringIO()):
-            web.httpserver.runsimple(app.wsgifunc(), ("0.0.0.0", port))
+
+        # 每个SSE连接占用一个服务线程，按web_server_threads创建线程池
+        http_server.serve(app, port, threads=conf().get("web_server_threads", 100))
+
+
+# 页面和静态资源缓存在内存中
+_pages = http_server.StaticFiles(os.path.dirname(os.path.abspath(__file__)))
+_assets = http_server.StaticFiles(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static'))
 
 
 class RootHandler:
@@ -246,49 +309,17 @@ class PollHandler:
         return WebChannel().poll_response()
 
 
+class StreamHandler:
+    def GET(self):
+        return WebChannel().stream_response()
+
+
 class ChatHandler:
     def GET(self):
-        # 正常返回聊天页面
-        file_path = os.path.join(os.path.dirname(__file__), 'chat.html')
-        with open(file_path, 'r', encoding='utf-8') as f:
-            return f.read()
+        # 页面随版本更新，每次请求用ETag校验
+        return _pages.serve('chat.html', max_age=0)
 
 
 class AssetsHandler:
-    def GET(self, file_path):  # 修改默认参数
-        try:
-            # 如果请求是/static/，需要处理
-            if file_path == '':
-                # 返回目录列表...
-                pass
-
-            # 获取当前文件的绝对路径
-            current_dir = os.path.dirname(os.path.abspath(__file__))
-            static_dir = os.path.join(current_dir, 'static')
-
-            full_path = os.path.normpath(os.path.join(static_dir, file_path))
-
-            # 安全检查：确保请求的文件在static目录内
-            if not os.path.abspath(full_path).startswith(os.path.abspath(static_dir)):
-                logger.error(f"Security check failed for path: {full_path}")
-                raise web.notfound()
-
-            if not os.path.exists(full_path) or not os.path.isfile(full_path):
-                logger.error(f"File not found: {full_path}")
-                raise web.notfound()
-
-            # 设置正确的Content-Type
-            content_type = mimetypes.guess_type(full_path)[0]
-            if content_type:
-                web.header('Content-Type', content_type)
-            else:
-                # 默认为二进制流
-                web.header('Content-Type', 'application/octet-stream')
-
-            # 读取并返回文件内容
-            with open(full_path, 'rb') as f:
-                return f.read()
-
-        except Exception as e:
-            logger.error(f"Error serving static file: {e}", exc_info=True)  # 添加更详细的错误信息
-            raise web.notfound()
+    def GET(self, file_path):
+        return _assets.serve(file_path)
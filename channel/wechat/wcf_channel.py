@@ -44,7 +44,7 @@ class WechatfChannel(ChatChannel):
             # wcferry会自动唤起微信并登录
             self.wxid = self.wcf.get_self_wxid()
             self.name = self.wcf.get_user_info().get("name")
-            logger.info(f"微信登录成功，当前用户ID: {self.wxid}, 用户名：{self.name}")
+            logger.info("微信登录成功，当前用户ID: %s, 用户名：%s", self.wxid, self.name)
             self.contact_cache = ContactCache(self.wcf)
             self.contact_cache.update()
             # 启动消息接收
@@ -87,7 +87,7 @@ class WechatfChannel(ChatChannel):
             # 清理过期消息ID
             self._clean_expired_msgs()
 
-            logger.debug(f"收到消息: {msg}")
+            logger.debug("收到消息: %s", msg)
             context = self._compose_context(cmsg.ctype, cmsg.content,
                                             isgroup=cmsg.is_group,
                                             msg=cmsg)
@@ -9,7 +9,6 @@ import json
 import os
 import threading
 import time
-import requests
 
 from bridge.context import *
 from bridge.reply import *
@@ -17,10 +16,12 @@ from channel.chat_channel import ChatChannel
 from channel import chat_channel
 from channel.wechat.wechat_message import *
 from common.expired_dict import ExpiredDict
-from common.log import logger
+from common.image_optimizer import optimize_image
+from common.log import lazy, logger
+from common.media_cache import media_cache
 from common.singleton import singleton
 from common.time_check import time_checker
-from common.utils import convert_webp_to_png, remove_markdown_symbol
+from common.utils import download_file, fsize, remove_markdown_symbol
 from config import conf, get_appdata_dir
 from lib import itchat
 from lib.itchat.content import *
@@ -31,7 +32,7 @@ def handler_single_msg(msg):
     try:
         cmsg = WechatMessage(msg, False)
     except NotImplementedError as e:
-        logger.debug("[WX]single message {} skipped: {}".format(msg["MsgId"], e))
+        logger.debug("[WX]single message %s skipped: %s", msg["MsgId"], e)
         return None
     WechatChannel().handle_single(cmsg)
     return None
@@ -42,7 +43,7 @@ def handler_group_msg(msg):
     try:
         cmsg = WechatMessage(msg, True)
     except NotImplementedError as e:
-        logger.debug("[WX]group message {} skipped: {}".format(msg["MsgId"], e))
+        logger.debug("[WX]group message %s skipped: %s", msg["MsgId"], e)
         return None
     WechatChannel().handle_group(cmsg)
     return None
@@ -52,15 +53,15 @@ def _check(func):
     def wrapper(self, cmsg: ChatMessage):
         msgId = cmsg.msg_id
         if msgId in self.receivedMsgs:
-            logger.info("Wechat message {} already received, ignore".format(msgId))
+            logger.info("Wechat message %s already received, ignore", msgId)
             return
         self.receivedMsgs[msgId] = True
         create_time = cmsg.create_time  # 消息时间戳
         if conf().get("hot_reload") == True and int(create_time) < int(time.time()) - 60:  # 跳过1分钟前的历史消息
-            logger.debug("[WX]history message {} skipped".format(msgId))
+            logger.debug("[WX]history message %s skipped", msgId)
             return
         if cmsg.my_msg and not cmsg.is_group:
-            logger.debug("[WX]my message {} skipped".format(msgId))
+            logger.debug("[WX]my message %s skipped", msgId)
             return
         return func(self, cmsg)
 
@@ -164,6 +165,8 @@ class WechatChannel(ChatChannel):
 
     def loginCallback(self):
         logger.debug("Login success")
+        # MediaId只在上传时的登录会话内有效，重新登录或切换账号后不能再复用
+        media_cache.clear("itchat")
         _send_login_success()
 
     # handle_* 系列函数处理收到的消息后构造Context，然后传入produce函数中处理Context和发送回复
@@ -186,15 +189,15 @@ class WechatChannel(ChatChannel):
         if cmsg.ctype == ContextType.VOICE:
             if conf().get("speech_recognition") != True:
                 return
-            logger.debug("[WX]receive voice msg: {}".format(cmsg.content))
+            logger.debug("[WX]receive voice msg: %s", cmsg.content)
         elif cmsg.ctype == ContextType.IMAGE:
-            logger.debug("[WX]receive image msg: {}".format(cmsg.content))
+            logger.debug("[WX]receive image msg: %s", cmsg.content)
         elif cmsg.ctype == ContextType.PATPAT:
-            logger.debug("[WX]receive patpat msg: {}".format(cmsg.content))
+            logger.debug("[WX]receive patpat msg: %s", cmsg.content)
         elif cmsg.ctype == ContextType.TEXT:
-            logger.debug("[WX]receive text msg: {}, cmsg={}".format(json.dumps(cmsg._rawmsg, ensure_ascii=False), cmsg))
+            logger.debug("[WX]receive text msg: %s, cmsg=%s", lazy(json.dumps, cmsg._rawmsg, ensure_ascii=False), cmsg)
         else:
-            logger.debug("[WX]receive msg: {}, cmsg={}".format(cmsg.content, cmsg))
+            logger.debug("[WX]receive msg: %s, cmsg=%s", cmsg.content, cmsg)
         context = self._compose_context(cmsg.ctype, cmsg.content, isgroup=False, msg=cmsg)
         if context:
             self.produce(context)
@@ -205,18 +208,18 @@ class WechatChannel(ChatChannel):
         if cmsg.ctype == ContextType.VOICE:
             if conf().get("group_speech_recognition") != True:
                 return
-            logger.debug("[WX]receive voice for group msg: {}".format(cmsg.content))
+            logger.debug("[WX]receive voice for group msg: %s", cmsg.content)
         elif cmsg.ctype == ContextType.IMAGE:
-            logger.debug("[WX]receive image for group msg: {}".format(cmsg.content))
+            logger.debug("[WX]receive image for group msg: %s", cmsg.content)
         elif cmsg.ctype in [ContextType.JOIN_GROUP, ContextType.PATPAT, ContextType.ACCEPT_FRIEND, ContextType.EXIT_GROUP]:
-            logger.debug("[WX]receive note msg: {}".format(cmsg.content))
+            logger.debug("[WX]receive note msg: %s", cmsg.content)
         elif cmsg.ctype == ContextType.TEXT:
             # logger.debug("[WX]receive group msg: {}, cmsg={}".format(json.dumps(cmsg._rawmsg, ensure_ascii=False), cmsg))
             pass
         elif cmsg.ctype == ContextType.FILE:
-            logger.debug(f"[WX]receive attachment msg, file_name={cmsg.content}")
+            logger.debug("[WX]receive attachment msg, file_name=%s", cmsg.content)
         else:
-            logger.debug("[WX]receive group msg: {}".format(cmsg.content))
+            logger.debug("[WX]receive group msg: %s", cmsg.content)
         context = self._compose_context(cmsg.ctype, cmsg.content, isgroup=True, msg=cmsg, no_need_at=conf().get("no_need_at", False))
         if context:
             self.produce(context)
@@ -227,59 +230,82 @@ class WechatChannel(ChatChannel):
         if reply.type == ReplyType.TEXT:
             reply.content = remove_markdown_symbol(reply.content)
             itchat.send(reply.content, toUserName=receiver)
-            logger.info("[WX] sendMsg={}, receiver={}".format(reply, receiver))
+            logger.info("[WX] sendMsg=%s, receiver=%s", reply, receiver)
         elif reply.type == ReplyType.ERROR or reply.type == ReplyType.INFO:
             reply.content = remove_markdown_symbol(reply.content)
             itchat.send(reply.content, toUserName=receiver)
-            logger.info("[WX] sendMsg={}, receiver={}".format(reply, receiver))
+            logger.info("[WX] sendMsg=%s, receiver=%s", reply, receiver)
         elif reply.type == ReplyType.VOICE:
-            itchat.send_file(reply.content, toUserName=receiver)
-            logger.info("[WX] sendFile={}, receiver={}".format(reply.content, receiver))
+            self._send_media(itchat.send_file, receiver, "file", reply.content)
+            logger.info("[WX] sendFile=%s, receiver=%s", reply.content, receiver)
         elif reply.type == ReplyType.IMAGE_URL:  # 从网络下载图片
             img_url = reply.content
-            logger.debug(f"[WX] start download image, img_url={img_url}")
-            pic_res = requests.get(img_url, stream=True)
-            image_storage = io.BytesIO()
-            size = 0
-            for block in pic_res.iter_content(1024):
-                size += len(block)
-                image_storage.write(block)
-            logger.info(f"[WX] download image success, size={size}, img_url={img_url}")
-            image_storage.seek(0)
+            logger.debug("[WX] start download image, img_url=%s", img_url)
+            image_storage = download_file(img_url)
+            logger.info("[WX] download image success, size=%s, img_url=%s", fsize(image_storage), img_url)
             if ".webp" in img_url:
                 try:
-                    image_storage = convert_webp_to_png(image_storage)
+                    image_storage = optimize_image(image_storage)
                 except Exception as e:
                     logger.error(f"Failed to convert image: {e}")
                     return
-            itchat.send_image(image_storage, toUserName=receiver)
-            logger.info("[WX] sendImage url={}, receiver={}".format(img_url, receiver))
+            self._send_media(itchat.send_image, receiver, "image", image_storage, "tmp.jpg", isPicture=True)
+            logger.info("[WX] sendImage url=%s, receiver=%s", img_url, receiver)
         elif reply.type == ReplyType.IMAGE:  # 从文件读取图片
             image_storage = reply.content
             image_storage.seek(0)
-            itchat.send_image(image_storage, toUserName=receiver)
-            logger.info("[WX] sendImage, receiver={}".format(receiver))
+            self._send_media(itchat.send_image, receiver, "image", image_storage, "tmp.jpg", isPicture=True)
+            logger.info("[WX] sendImage, receiver=%s", receiver)
         elif reply.type == ReplyType.FILE:  # 新增文件回复类型
             file_storage = reply.content
-            itchat.send_file(file_storage, toUserName=receiver)
-            logger.info("[WX] sendFile, receiver={}".format(receiver))
+            self._send_media(itchat.send_file, receiver, "file", file_storage)
+            logger.info("[WX] sendFile, receiver=%s", receiver)
         elif reply.type == ReplyType.VIDEO:  # 新增视频回复类型
             video_storage = reply.content
-            itchat.send_video(video_storage, toUserName=receiver)
-            logger.info("[WX] sendFile, receiver={}".format(receiver))
+            self._send_media(itchat.send_video, receiver, "video", video_storage, "tmp.mp4", isVideo=True)
+            logger.info("[WX] sendFile, receiver=%s", receiver)
         elif reply.type == ReplyType.VIDEO_URL:  # 新增视频URL回复类型
             video_url = reply.content
-            logger.debug(f"[WX] start download video, video_url={video_url}")
-            video_res = requests.get(video_url, stream=True)
-            video_storage = io.BytesIO()
-            size = 0
-            for block in video_res.iter_content(1024):
-                size += len(block)
-                video_storage.write(block)
-            logger.info(f"[WX] download video success, size={size}, video_url={video_url}")
-            video_storage.seek(0)
-            itchat.send_video(video_storage, toUserName=receiver)
-            logger.info("[WX] sendVideo url={}, receiver={}".format(video_url, receiver))
+            logger.debug("[WX] start download video, video_url=%s", video_url)
+            video_storage = download_file(video_url)
+            logger.info("[WX] download video success, size=%s, video_url=%s", fsize(video_storage), video_url)
+            self._send_media(itchat.send_video, receiver, "video", video_storage, "tmp.mp4", isVideo=True)
+            logger.info("[WX] sendVideo url=%s, receiver=%s", video_url, receiver)
+
+    def _send_media(self, send_func, receiver, media_type, media_file, file_dir=None, **kwargs):
+        """
+        使用缓存的MediaId发送，发送失败时(MediaId已失效)删除缓存重新上传后再发送一次
+        """
+        media_id = self._upload_media(media_type, media_file, file_dir, **kwargs)
+        r = send_func(media_file, toUserName=receiver, mediaId=media_id)
+        if not r and media_id:
+            logger.warning("[WX] send %s with media_id failed, upload again: %s", media_type, r)
+            media_cache.remove(self._media_platform(), media_type, media_file)
+            media_id = self._upload_media(media_type, media_file, file_dir, **kwargs)
+            r = send_func(media_file, toUserName=receiver, mediaId=media_id)
+        return r
+
+    def _media_platform(self):
+        # MediaId与登录的账号绑定
+        return "itchat:{}".format(self.user_id)
+
+    def _upload_media(self, media_type, media_file, file_dir=None, **kwargs):
+        """
+        上传媒体文件并按内容缓存MediaId，相同内容重复发送时跳过分片上传
+        :param media_file: 文件路径或file-like对象
+        :param file_dir: 上传时使用的文件名，media_file为file-like对象时需要指定
+        """
+
+        def upload():
+            file_ = None
+            if hasattr(media_file, "read"):
+                media_file.seek(0)
+                file_ = media_file
+            r = itchat.upload_file(file_dir or media_file, file_=file_, **kwargs)
+            return r["MediaId"] if r else None
+
+        return media_cache.get_or_upload(self._media_platform(), media_type, media_file, upload)
+
 
 def _send_login_success():
     try:
@@ -21,6 +21,7 @@ from channel.wechat.wechaty_message import WechatyMessage
 from common.log import logger
 from common.singleton import singleton
 from config import conf
+from voice.tts_cache import tts_cache
 
 try:
     from voice.audio_convert import any_to_sil
@@ -53,7 +54,7 @@ class WechatyChannel(ChatChannel):
     async def on_login(self, contact: Contact):
         self.user_id = contact.contact_id
         self.name = contact.name
-        logger.info("[WX] login user={}".format(contact))
+        logger.info("[WX] login user=%s", contact)
 
     # 统一的发送函数，每个Channel自行实现，根据reply的type字段发送不同类型的消息
     def send(self, reply: Reply, context: Context):
@@ -67,19 +68,19 @@ class WechatyChannel(ChatChannel):
         if reply.type == ReplyType.TEXT:
             msg = reply.content
             asyncio.run_coroutine_threadsafe(receiver.say(msg), loop).result()
-            logger.info("[WX] sendMsg={}, receiver={}".format(reply, receiver))
+            logger.info("[WX] sendMsg=%s, receiver=%s", reply, receiver)
         elif reply.type == ReplyType.ERROR or reply.type == ReplyType.INFO:
             msg = reply.content
             asyncio.run_coroutine_threadsafe(receiver.say(msg), loop).result()
-            logger.info("[WX] sendMsg={}, receiver={}".format(reply, receiver))
+            logger.info("[WX] sendMsg=%s, receiver=%s", reply, receiver)
         elif reply.type == ReplyType.VOICE:
             voiceLength = None
             file_path = reply.content
             sil_file = os.path.splitext(file_path)[0] + ".sil"
-            voiceLength = int(any_to_sil(file_path, sil_file))
+            voiceLength = int(tts_cache().convert(any_to_sil, file_path, sil_file))
             if voiceLength >= 60000:
                 voiceLength = 60000
-                logger.info("[WX] voice too long, length={}, set to 60s".format(voiceLength))
+                logger.info("[WX] voice too long, length=%s, set to 60s", voiceLength)
             # 发送语音
             t = int(time.time())
             msg = FileBox.from_file(sil_file, name=str(t) + ".sil")
@@ -92,20 +93,20 @@ class WechatyChannel(ChatChannel):
                     os.remove(sil_file)
             except Exception as e:
                 pass
-            logger.info("[WX] sendVoice={}, receiver={}".format(reply.content, receiver))
+            logger.info("[WX] sendVoice=%s, receiver=%s", reply.content, receiver)
         elif reply.type == ReplyType.IMAGE_URL:  # 从网络下载图片
             img_url = reply.content
             t = int(time.time())
             msg = FileBox.from_url(url=img_url, name=str(t) + ".png")
             asyncio.run_coroutine_threadsafe(receiver.say(msg), loop).result()
-            logger.info("[WX] sendImage url={}, receiver={}".format(img_url, receiver))
+            logger.info("[WX] sendImage url=%s, receiver=%s", img_url, receiver)
         elif reply.type == ReplyType.IMAGE:  # 从文件读取图片
             image_storage = reply.content
             image_storage.seek(0)
             t = int(time.time())
             msg = FileBox.from_base64(base64.b64encode(image_storage.read()), str(t) + ".png")
             asyncio.run_coroutine_threadsafe(receiver.say(msg), loop).result()
-            logger.info("[WX] sendImage, receiver={}".format(receiver))
+            logger.info("[WX] sendImage, receiver=%s", receiver)
 
     async def on_message(self, msg: Message):
         """
@@ -114,16 +115,16 @@ class WechatyChannel(ChatChannel):
         try:
             cmsg = await WechatyMessage(msg)
         except NotImplementedError as e:
-            logger.debug("[WX] {}".format(e))
+            logger.debug("[WX] %s", e)
             return
         except Exception as e:
             logger.exception("[WX] {}".format(e))
             return
-        logger.debug("[WX] message:{}".format(cmsg))
+        logger.debug("[WX] message:%s", cmsg)
         room = msg.room()  # 获取消息来自的群聊. 如果消息不是来自群聊, 则返回None
         isgroup = room is not None
         ctype = cmsg.ctype
         context = self._compose_context(ctype, cmsg.content, isgroup=isgroup, msg=cmsg)
         if context:
-            logger.info("[WX] receiveMsg={}, context={}".format(cmsg, context))
+            logger.info("[WX] receiveMsg=%s, context=%s", cmsg, context)
             self.produce(context)
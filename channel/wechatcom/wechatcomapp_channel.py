@@ -1,9 +1,7 @@
 # -*- coding=utf-8 -*-
-import io
 import os
 import time
 
-import requests
 import web
 from wechatpy.enterprise import create_reply, parse_message
 from wechatpy.enterprise.crypto import WeChatCrypto
@@ -15,11 +13,16 @@ from bridge.reply import Reply, ReplyType
 from channel.chat_channel import ChatChannel
 from channel.wechatcom.wechatcomapp_client import WechatComAppClient
 from channel.wechatcom.wechatcomapp_message import WechatComAppMessage
+from common.image_optimizer import optimize_image
+from common import http_server
 from common.log import logger
+from common.media_cache import media_cache
 from common.singleton import singleton
-from common.utils import compress_imgfile, fsize, split_string_by_utf8_length, convert_webp_to_png, remove_markdown_symbol
+from common.tmp_dir import tmp_manager
+from common.utils import compress_imgfile, download_file, fsize, split_string_by_utf8_length, remove_markdown_symbol
 from config import conf, subscribe_msg
 from voice.audio_convert import any_to_amr, split_audio
+from voice.tts_cache import tts_cache
 
 MAX_UTF8_LEN = 2048
 
@@ -37,7 +40,7 @@ class WechatComAppChannel(ChatChannel):
         self.aes_key = conf().get("wechatcomapp_aes_key")
         print(self.corp_id, self.secret, self.agent_id, self.token, self.aes_key)
         logger.info(
-            "[wechatcom] init: corp_id: {}, secret: {}, agent_id: {}, token: {}, aes_key: {}".format(self.corp_id, self.secret, self.agent_id, self.token, self.aes_key)
+            "[wechatcom] init: corp_id: %s, secret: %s, agent_id: %s, token: %s, aes_key: %s", self.corp_id, self.secret, self.agent_id, self.token, self.aes_key
         )
         self.crypto = WeChatCrypto(self.token, self.aes_key, self.corp_id)
         self.client = WechatComAppClient(self.corp_id, self.secret)
@@ -47,7 +50,7 @@ class WechatComAppChannel(ChatChannel):
         urls = ("/wxcomapp/?", "channel.wechatcom.wechatcomapp_channel.Query")
         app = web.application(urls, globals(), autoreload=False)
         port = conf().get("wechatcomapp_port", 9898)
-        web.httpserver.runsimple(app.wsgifunc(), ("0.0.0.0", port))
+        http_server.serve(app, port)
 
     def send(self, reply: Reply, context: Context):
         receiver = context["receiver"]
@@ -55,25 +58,24 @@ class WechatComAppChannel(ChatChannel):
             reply_text = remove_markdown_symbol(reply.content)
             texts = split_string_by_utf8_length(reply_text, MAX_UTF8_LEN)
             if len(texts) > 1:
-                logger.info("[wechatcom] text too long, split into {} parts".format(len(texts)))
+                logger.info("[wechatcom] text too long, split into %s parts", len(texts))
             for i, text in enumerate(texts):
                 self.client.message.send_text(self.agent_id, receiver, text)
                 if i != len(texts) - 1:
                     time.sleep(0.5)  # 休眠0.5秒，防止发送过快乱序
-            logger.info("[wechatcom] Do send text to {}: {}".format(receiver, reply_text))
+            logger.info("[wechatcom] Do send text to %s: %s", receiver, reply_text)
         elif reply.type == ReplyType.VOICE:
             try:
                 media_ids = []
                 file_path = reply.content
                 amr_file = os.path.splitext(file_path)[0] + ".amr"
-                any_to_amr(file_path, amr_file)
+                tts_cache().convert(any_to_amr, file_path, tmp_manager.acquire(amr_file, context))
                 duration, files = split_audio(amr_file, 60 * 1000)
                 if len(files) > 1:
-                    logger.info("[wechatcom] voice too long {}s > 60s , split into {} parts".format(duration / 1000.0, len(files)))
+                    logger.info("[wechatcom] voice too long %ss > 60s , split into %s parts", duration / 1000.0, len(files))
                 for path in files:
-                    response = self.client.media.upload("voice", open(path, "rb"))
-                    logger.debug("[wechatcom] upload voice response: {}".format(response))
-                    media_ids.append(response["media_id"])
+                    tmp_manager.acquire(path, context)  # 分段文件上传后随context一起删除
+                    media_ids.append(self._upload_media("voice", path, lambda: self._upload_voice(path)))
             except WeChatClientException as e:
                 logger.error("[wechatcom] upload voice failed: {}".format(e))
                 return
@@ -86,57 +88,62 @@ class WechatComAppChannel(ChatChannel):
             for media_id in media_ids:
                 self.client.message.send_voice(self.agent_id, receiver, media_id)
                 time.sleep(1)
-            logger.info("[wechatcom] sendVoice={}, receiver={}".format(reply.content, receiver))
+            logger.info("[wechatcom] sendVoice=%s, receiver=%s", reply.content, receiver)
         elif reply.type == ReplyType.IMAGE_URL:  # 从网络下载图片
             img_url = reply.content
-            pic_res = requests.get(img_url, stream=True)
-            image_storage = io.BytesIO()
-            for block in pic_res.iter_content(1024):
-                image_storage.write(block)
+            image_storage = download_file(img_url)
             sz = fsize(image_storage)
             if sz >= 10 * 1024 * 1024:
-                logger.info("[wechatcom] image too large, ready to compress, sz={}".format(sz))
-                image_storage = compress_imgfile(image_storage, 10 * 1024 * 1024 - 1)
-                logger.info("[wechatcom] image compressed, sz={}".format(fsize(image_storage)))
+                logger.info("[wechatcom] image too large, ready to compress, sz=%s", sz)
+            try:
+                # 压缩和webp转换在同一次解码中完成
+                image_storage = optimize_image(image_storage, 10 * 1024 * 1024 - 1, convert_webp=".webp" in img_url)
+            except Exception as e:
+                logger.error(f"Failed to convert image: {e}")
+                return
+            if sz >= 10 * 1024 * 1024:
+                logger.info("[wechatcom] image compressed, sz=%s", fsize(image_storage))
             image_storage.seek(0)
-            if ".webp" in img_url:
-                try:
-                    image_storage = convert_webp_to_png(image_storage)
-                except Exception as e:
-                    logger.error(f"Failed to convert image: {e}")
-                    return
             try:
-                response = self.client.media.upload("image", image_storage)
-                logger.debug("[wechatcom] upload image response: {}".format(response))
+                media_id = self._upload_media("image", image_storage, lambda: self.client.media.upload("image", image_storage)["media_id"])
             except WeChatClientException as e:
                 logger.error("[wechatcom] upload image failed: {}".format(e))
                 return
 
-            self.client.message.send_image(self.agent_id, receiver, response["media_id"])
-            logger.info("[wechatcom] sendImage url={}, receiver={}".format(img_url, receiver))
+            self.client.message.send_image(self.agent_id, receiver, media_id)
+            logger.info("[wechatcom] sendImage url=%s, receiver=%s", img_url, receiver)
         elif reply.type == ReplyType.IMAGE:  # 从文件读取图片
             image_storage = reply.content
             sz = fsize(image_storage)
             if sz >= 10 * 1024 * 1024:
-                logger.info("[wechatcom] image too large, ready to compress, sz={}".format(sz))
+                logger.info("[wechatcom] image too large, ready to compress, sz=%s", sz)
                 image_storage = compress_imgfile(image_storage, 10 * 1024 * 1024 - 1)
-                logger.info("[wechatcom] image compressed, sz={}".format(fsize(image_storage)))
+                logger.info("[wechatcom] image compressed, sz=%s", fsize(image_storage))
             image_storage.seek(0)
             try:
-                response = self.client.media.upload("image", image_storage)
-                logger.debug("[wechatcom] upload image response: {}".format(response))
+                media_id = self._upload_media("image", image_storage, lambda: self.client.media.upload("image", image_storage)["media_id"])
             except WeChatClientException as e:
                 logger.error("[wechatcom] upload image failed: {}".format(e))
                 return
-            self.client.message.send_image(self.agent_id, receiver, response["media_id"])
-            logger.info("[wechatcom] sendImage, receiver={}".format(receiver))
+            self.client.message.send_image(self.agent_id, receiver, media_id)
+            logger.info("[wechatcom] sendImage, receiver=%s", receiver)
+
+    def _upload_media(self, media_type, media_file, upload_func):
+        # 按内容缓存临时素材的media_id，相同的回复在有效期内不再重复上传
+        return media_cache.get_or_upload("wechatcom", media_type, media_file, upload_func)
+
+    def _upload_voice(self, path):
+        with open(path, "rb") as f:
+            response = self.client.media.upload("voice", f)
+        logger.debug("[wechatcom] upload voice response: %s", response)
+        return response["media_id"]
 
 
 class Query:
     def GET(self):
         channel = WechatComAppChannel()
         params = web.input()
-        logger.info("[wechatcom] receive params: {}".format(params))
+        logger.info("[wechatcom] receive params: %s", params)
         try:
             signature = params.msg_signature
             timestamp = params.timestamp
@@ -150,7 +157,7 @@ class Query:
     def POST(self):
         channel = WechatComAppChannel()
         params = web.input()
-        logger.info("[wechatcom] receive params: {}".format(params))
+        logger.info("[wechatcom] receive params: %s", params)
         try:
             signature = params.msg_signature
             timestamp = params.timestamp
@@ -159,7 +166,7 @@ class Query:
         except (InvalidSignatureException, InvalidCorpIdException):
             raise web.Forbidden()
         msg = parse_message(message)
-        logger.debug("[wechatcom] receive message: {}, msg= {}".format(message, msg))
+        logger.debug("[wechatcom] receive message: %s, msg= %s", message, msg)
         if msg.type == "event":
             if msg.event == "subscribe":
                 pass
@@ -172,7 +179,7 @@ class Query:
             try:
                 wechatcom_msg = WechatComAppMessage(msg, client=channel.client)
             except NotImplementedError as e:
-                logger.debug("[wechatcom] " + str(e))
+                logger.debug("[wechatcom] %s", e)
                 return "success"
             context = channel._compose_context(
                 wechatcom_msg.ctype,
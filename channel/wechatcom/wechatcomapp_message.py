@@ -27,7 +27,7 @@ class WechatComAppMessage(ChatMessage):
                     with open(self.content, "wb") as f:
                         f.write(response.content)
                 else:
-                    logger.info(f"[wechatcom] Failed to download voice file, {response.content}")
+                    logger.info("[wechatcom] Failed to download voice file, %s", response.content)
 
             self._prepare_fn = download_voice
         elif msg.type == "image":
@@ -41,7 +41,7 @@ class WechatComAppMessage(ChatMessage):
                     with open(self.content, "wb") as f:
                         f.write(response.content)
                 else:
-                    logger.info(f"[wechatcom] Failed to download image file, {response.content}")
+                    logger.info("[wechatcom] Failed to download image file, %s", response.content)
 
             self._prepare_fn = download_image
         else:
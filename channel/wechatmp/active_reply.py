@@ -27,13 +27,13 @@ class Query:
             message = web.data()
             encrypt_func = lambda x: x
             if args.get("encrypt_type") == "aes":
-                logger.debug("[wechatmp] Receive encrypted post data:\n" + message.decode("utf-8"))
+                logger.debug("[wechatmp] Receive encrypted post data:\n%s", message.decode("utf-8"))
                 if not channel.crypto:
                     raise Exception("Crypto not initialized, Please set wechatmp_aes_key in config.json")
                 message = channel.crypto.decrypt_message(message, args.msg_signature, args.timestamp, args.nonce)
                 encrypt_func = lambda x: channel.crypto.encrypt_message(x, args.nonce, args.timestamp)
             else:
-                logger.debug("[wechatmp] Receive post data:\n" + message.decode("utf-8"))
+                logger.debug("[wechatmp] Receive post data:\n%s", message.decode("utf-8"))
             msg = parse_message(message)
             if msg.type in ["text", "voice", "image"]:
                 wechatmp_msg = WeChatMPMessage(msg, client=channel.client)
@@ -42,13 +42,12 @@ class Query:
                 message_id = wechatmp_msg.msg_id
 
                 logger.info(
-                    "[wechatmp] {}:{} Receive post query {} {}: {}".format(
-                        web.ctx.env.get("REMOTE_ADDR"),
-                        web.ctx.env.get("REMOTE_PORT"),
-                        from_user,
-                        message_id,
-                        content,
-                    )
+                    "[wechatmp] %s:%s Receive post query %s %s: %s",
+                    web.ctx.env.get("REMOTE_ADDR"),
+                    web.ctx.env.get("REMOTE_PORT"),
+                    from_user,
+                    message_id,
+                    content
                 )
                 if msg.type == "voice" and wechatmp_msg.ctype == ContextType.TEXT and conf().get("voice_reply_voice", False):
                     context = channel._compose_context(wechatmp_msg.ctype, content, isgroup=False, desire_rtype=ReplyType.VOICE, msg=wechatmp_msg)
@@ -59,7 +58,7 @@ class Query:
                 # The reply will be sent by channel.send() in another thread
                 return "success"
             elif msg.type == "event":
-                logger.info("[wechatmp] Event {} from {}".format(msg.event, msg.source))
+                logger.info("[wechatmp] Event %s from %s", msg.event, msg.source)
                 if msg.event in ["subscribe", "subscribe_scan"]:
                     reply_text = subscribe_msg()
                     if reply_text:
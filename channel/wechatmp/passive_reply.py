@@ -1,4 +1,3 @@
-import asyncio
 import time
 
 import web
@@ -29,13 +28,13 @@ class Query:
             message = web.data()
             encrypt_func = lambda x: x
             if args.get("encrypt_type") == "aes":
-                logger.debug("[wechatmp] Receive encrypted post data:\n" + message.decode("utf-8"))
+                logger.debug("[wechatmp] Receive encrypted post data:\n%s", message.decode("utf-8"))
                 if not channel.crypto:
                     raise Exception("Crypto not initialized, Please set wechatmp_aes_key in config.json")
                 message = channel.crypto.decrypt_message(message, args.msg_signature, args.timestamp, args.nonce)
                 encrypt_func = lambda x: channel.crypto.encrypt_message(x, args.nonce, args.timestamp)
             else:
-                logger.debug("[wechatmp] Receive post data:\n" + message.decode("utf-8"))
+                logger.debug("[wechatmp] Receive post data:\n%s", message.decode("utf-8"))
             msg = parse_message(message)
             if msg.type in ["text", "voice", "image"]:
                 wechatmp_msg = WeChatMPMessage(msg, client=channel.client)
@@ -59,10 +58,10 @@ class Query:
                         context = channel._compose_context(wechatmp_msg.ctype, content, isgroup=False, desire_rtype=ReplyType.VOICE, msg=wechatmp_msg)
                     else:
                         context = channel._compose_context(wechatmp_msg.ctype, content, isgroup=False, msg=wechatmp_msg)
-                    logger.debug("[wechatmp] context: {} {} {}".format(context, wechatmp_msg, supported))
+                    logger.debug("[wechatmp] context: %s %s %s", context, wechatmp_msg, supported)
 
                     if supported and context:
-                        channel.running.add(from_user)
+                        channel.start_running(from_user)
                         channel.produce(context)
                     else:
                         trigger_prefix = conf().get("single_chat_prefix", [""])[0]
@@ -91,29 +90,27 @@ class Query:
                         return encrypt_func(replyPost.render())
 
                 # Wechat official server will request 3 times (5 seconds each), with the same message_id.
-                # Because the interval is 5 seconds, here assumed that do not have multithreading problems.
                 request_cnt = channel.request_cnt.get(message_id, 0) + 1
                 channel.request_cnt[message_id] = request_cnt
                 logger.info(
-                    "[wechatmp] Request {} from {} {} {}:{}\n{}".format(
-                        request_cnt, from_user, message_id, web.ctx.env.get("REMOTE_ADDR"), web.ctx.env.get("REMOTE_PORT"), content
-                    )
+                    "[wechatmp] Request %s from %s %s %s:%s\n%s",
+                    request_cnt,
+                    from_user,
+                    message_id,
+                    web.ctx.env.get("REMOTE_ADDR"),
+                    web.ctx.env.get("REMOTE_PORT"),
+                    content
                 )
 
-                task_running = True
-                waiting_until = request_time + 4
-                while time.time() < waiting_until:
-                    if from_user in channel.running:
-                        time.sleep(0.1)
-                    else:
-                        task_running = False
-                        break
+                # Wake up as soon as the reply is cached, wait at most 4 seconds after the request arrived
+                task_running = not channel.wait_reply(from_user, request_time + 4 - time.time())
 
                 reply_text = ""
                 if task_running:
                     if request_cnt < 3:
-                        # waiting for timeout (the POST request will be closed by Wechat official server)
-                        time.sleep(2)
+                        # Hold the request until Wechat official server closes it after 5 seconds,
+                        # any response before that stops the retry
+                        channel.hold_request(request_time + 5 - time.time())
                         # and do nothing, waiting for the next request
                         return "success"
                     else:  # request_cnt == 3:
@@ -135,6 +132,7 @@ class Query:
                     if not channel.cache_dict[from_user]:  # If popping the message makes the list empty, delete the user entry from cache
                         del channel.cache_dict[from_user]
                 except IndexError:
+                    channel.cache_dict.pop(from_user)
                     return "success"
 
                 if reply_type == "text":
@@ -151,28 +149,25 @@ class Query:
                         channel.cache_dict[from_user].append(("text", splits[1]))
 
                     logger.info(
-                        "[wechatmp] Request {} do send to {} {}: {}\n{}".format(
-                            request_cnt,
-                            from_user,
-                            message_id,
-                            content,
-                            reply_text,
-                        )
+                        "[wechatmp] Request %s do send to %s %s: %s\n%s",
+                        request_cnt,
+                        from_user,
+                        message_id,
+                        content,
+                        reply_text
                     )
                     replyPost = create_reply(reply_text, msg)
                     return encrypt_func(replyPost.render())
 
                 elif reply_type == "voice":
                     media_id = reply_content
-                    asyncio.run_coroutine_threadsafe(channel.delete_media(media_id), channel.delete_media_loop)
                     logger.info(
-                        "[wechatmp] Request {} do send to {} {}: {} voice media_id {}".format(
-                            request_cnt,
-                            from_user,
-                            message_id,
-                            content,
-                            media_id,
-                        )
+                        "[wechatmp] Request %s do send to %s %s: %s voice media_id %s",
+                        request_cnt,
+                        from_user,
+                        message_id,
+                        content,
+                        media_id
                     )
                     replyPost = VoiceReply(message=msg)
                     replyPost.media_id = media_id
@@ -180,22 +175,20 @@ class Query:
 
                 elif reply_type == "image":
                     media_id = reply_content
-                    asyncio.run_coroutine_threadsafe(channel.delete_media(media_id), channel.delete_media_loop)
                     logger.info(
-                        "[wechatmp] Request {} do send to {} {}: {} image media_id {}".format(
-                            request_cnt,
-                            from_user,
-                            message_id,
-                            content,
-                            media_id,
-                        )
+                        "[wechatmp] Request %s do send to %s %s: %s image media_id %s",
+                        request_cnt,
+                        from_user,
+                        message_id,
+                        content,
+                        media_id
                     )
                     replyPost = ImageReply(message=msg)
                     replyPost.media_id = media_id
                     return encrypt_func(replyPost.render())
 
             elif msg.type == "event":
-                logger.info("[wechatmp] Event {} from {}".format(msg.event, msg.source))
+                logger.info("[wechatmp] Event %s from %s", msg.event, msg.source)
                 if msg.event in ["subscribe", "subscribe_scan"]:
                     reply_text = subscribe_msg()
                     if reply_text:
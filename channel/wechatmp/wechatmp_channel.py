@@ -1,27 +1,28 @@
 # -*- coding: utf-8 -*-
-import asyncio
 import imghdr
-import io
 import os
 import threading
 import time
 
-import requests
 import web
 from wechatpy.crypto import WeChatCrypto
 from wechatpy.exceptions import WeChatClientException
-from collections import defaultdict
 
 from bridge.context import *
 from bridge.reply import *
 from channel.chat_channel import ChatChannel
 from channel.wechatmp.common import *
 from channel.wechatmp.wechatmp_client import WechatMPClient
+from common import http_server
+from common.expired_dict import BoundedExpiredDict
 from common.log import logger
+from common.media_cache import media_cache
 from common.singleton import singleton
-from common.utils import split_string_by_utf8_length, remove_markdown_symbol
+from common.tmp_dir import tmp_manager
+from common.utils import download_file, split_string_by_utf8_length, remove_markdown_symbol
 from config import conf
 from voice.audio_convert import any_to_mp3, split_audio
+from voice.tts_cache import tts_cache
 
 # If using SSL, uncomment the following lines, and modify the certificate path.
 # from cheroot.server import HTTPServer
@@ -37,6 +38,8 @@ class WechatMPChannel(ChatChannel):
         super().__init__()
         self.passive_reply = passive_reply
         self.NOT_SUPPORT_REPLYTYPE = []
+        # 被动回复时每次请求只能带回一条回复，语音不分段发送
+        self.MULTI_REPLY = not passive_reply
         appid = conf().get("wechatmp_app_id")
         secret = conf().get("wechatmp_app_secret")
         token = conf().get("wechatmp_token")
@@ -46,17 +49,15 @@ class WechatMPChannel(ChatChannel):
         if aes_key:
             self.crypto = WeChatCrypto(token, aes_key, appid)
         if self.passive_reply:
-            # Cache the reply to the user's first message
-            self.cache_dict = defaultdict(list)
-            # Record whether the current message is being processed
-            self.running = set()
-            # Count the request from wechat official server by message_id
-            self.request_cnt = dict()
-            # The permanent media need to be deleted to avoid media number limit
-            self.delete_media_loop = asyncio.new_event_loop()
-            t = threading.Thread(target=self.start_loop, args=(self.delete_media_loop,))
-            t.setDaemon(True)
-            t.start()
+            # Cache the reply to the user's first message, dropped if the user never asks for it
+            self.cache_dict = BoundedExpiredDict(conf().get("wechatmp_reply_cache_expires", 3600), default_factory=list)
+            # Record whether the current message is being processed, user -> Event set when the reply is cached
+            self.running = {}
+            self.running_lock = threading.Lock()
+            # Count the request from wechat official server by message_id, wechat retries within 15 seconds
+            self.request_cnt = BoundedExpiredDict(60, max_size=10000)
+            # Number of web server threads waiting for replies
+            self.waiting = 0
 
     def startup(self):
         if self.passive_reply:
@@ -65,65 +66,57 @@ class WechatMPChannel(ChatChannel):
             urls = ("/wx", "channel.wechatmp.active_reply.Query")
         app = web.application(urls, globals(), autoreload=False)
         port = conf().get("wechatmp_port", 8080)
-        web.httpserver.runsimple(app.wsgifunc(), ("0.0.0.0", port))
+        http_server.serve(app, port)
 
-    def start_loop(self, loop):
-        asyncio.set_event_loop(loop)
-        loop.run_forever()
+    def _upload_media(self, media_type, media_file, upload_func):
+        # 使用临时素材并按内容缓存media_id，相同的图片/语音/视频在有效期内不再重复上传
+        return media_cache.get_or_upload("wechatmp", media_type, media_file, upload_func)
 
-    async def delete_media(self, media_id):
-        logger.debug("[wechatmp] permanent media {} will be deleted in 10s".format(media_id))
-        await asyncio.sleep(10)
-        self.client.material.delete(media_id)
-        logger.info("[wechatmp] permanent media {} has been deleted".format(media_id))
+    def _upload_voice(self, path, file_type=None):
+        # support: <2M, <60s, mp3/wma/wav/amr
+        with open(path, "rb") as f:
+            media = (os.path.basename(path), f, file_type) if file_type else f
+            response = self.client.media.upload("voice", media)
+        logger.debug("[wechatmp] upload voice response: %s", response)
+        if self.passive_reply:
+            time.sleep(1.0 + 2 * os.path.getsize(path) / 1024 / 1024)
+        return response["media_id"]
 
     def send(self, reply: Reply, context: Context):
         receiver = context["receiver"]
         if self.passive_reply:
             if reply.type == ReplyType.TEXT or reply.type == ReplyType.INFO or reply.type == ReplyType.ERROR:
                 reply_text = remove_markdown_symbol(reply.content)
-                logger.info("[wechatmp] text cached, receiver {}\n{}".format(receiver, reply_text))
+                logger.info("[wechatmp] text cached, receiver %s\n%s", receiver, reply_text)
                 self.cache_dict[receiver].append(("text", reply_text))
             elif reply.type == ReplyType.VOICE:
                 voice_file_path = reply.content
                 duration, files = split_audio(voice_file_path, 60 * 1000)
                 if len(files) > 1:
-                    logger.info("[wechatmp] voice too long {}s > 60s , split into {} parts".format(duration / 1000.0, len(files)))
+                    logger.info("[wechatmp] voice too long %ss > 60s , split into %s parts", duration / 1000.0, len(files))
 
                 for path in files:
-                    # support: <2M, <60s, mp3/wma/wav/amr
+                    tmp_manager.acquire(path, context)  # 分段文件上传后随context一起删除
                     try:
-                        with open(path, "rb") as f:
-                            response = self.client.material.add("voice", f)
-                            logger.debug("[wechatmp] upload voice response: {}".format(response))
-                            f_size = os.fstat(f.fileno()).st_size
-                            time.sleep(1.0 + 2 * f_size / 1024 / 1024)
-                            # todo check media_id
+                        media_id = self._upload_media("voice", path, lambda: self._upload_voice(path))
                     except WeChatClientException as e:
                         logger.error("[wechatmp] upload voice failed: {}".format(e))
                         return
-                    media_id = response["media_id"]
-                    logger.info("[wechatmp] voice uploaded, receiver {}, media_id {}".format(receiver, media_id))
+                    logger.info("[wechatmp] voice uploaded, receiver %s, media_id %s", receiver, media_id)
                     self.cache_dict[receiver].append(("voice", media_id))
 
             elif reply.type == ReplyType.IMAGE_URL:  # 从网络下载图片
                 img_url = reply.content
-                pic_res = requests.get(img_url, stream=True)
-                image_storage = io.BytesIO()
-                for block in pic_res.iter_content(1024):
-                    image_storage.write(block)
-                image_storage.seek(0)
+                image_storage = download_file(img_url)
                 image_type = imghdr.what(image_storage)
                 filename = receiver + "-" + str(context["msg"].msg_id) + "." + image_type
                 content_type = "image/" + image_type
                 try:
-                    response = self.client.material.add("image", (filename, image_storage, content_type))
-                    logger.debug("[wechatmp] upload image response: {}".format(response))
+                    media_id = self._upload_media("image", image_storage, lambda: self.client.media.upload("image", (filename, image_storage, content_type))["media_id"])
                 except WeChatClientException as e:
                     logger.error("[wechatmp] upload image failed: {}".format(e))
                     return
-                media_id = response["media_id"]
-                logger.info("[wechatmp] image uploaded, receiver {}, media_id {}".format(receiver, media_id))
+                logger.info("[wechatmp] image uploaded, receiver %s, media_id %s", receiver, media_id)
                 self.cache_dict[receiver].append(("image", media_id))
             elif reply.type == ReplyType.IMAGE:  # 从文件读取图片
                 image_storage = reply.content
@@ -132,32 +125,24 @@ class WechatMPChannel(ChatChannel):
                 filename = receiver + "-" + str(context["msg"].msg_id) + "." + image_type
                 content_type = "image/" + image_type
                 try:
-                    response = self.client.material.add("image", (filename, image_storage, content_type))
-                    logger.debug("[wechatmp] upload image response: {}".format(response))
+                    media_id = self._upload_media("image", image_storage, lambda: self.client.media.upload("image", (filename, image_storage, content_type))["media_id"])
                 except WeChatClientException as e:
                     logger.error("[wechatmp] upload image failed: {}".format(e))
                     return
-                media_id = response["media_id"]
-                logger.info("[wechatmp] image uploaded, receiver {}, media_id {}".format(receiver, media_id))
+                logger.info("[wechatmp] image uploaded, receiver %s, media_id %s", receiver, media_id)
                 self.cache_dict[receiver].append(("image", media_id))
             elif reply.type == ReplyType.VIDEO_URL:  # 从网络下载视频
                 video_url = reply.content
-                video_res = requests.get(video_url, stream=True)
-                video_storage = io.BytesIO()
-                for block in video_res.iter_content(1024):
-                    video_storage.write(block)
-                video_storage.seek(0)
+                video_storage = download_file(video_url)
                 video_type = 'mp4'
                 filename = receiver + "-" + str(context["msg"].msg_id) + "." + video_type
                 content_type = "video/" + video_type
                 try:
-                    response = self.client.material.add("video", (filename, video_storage, content_type))
-                    logger.debug("[wechatmp] upload video response: {}".format(response))
+                    media_id = self._upload_media("video", video_storage, lambda: self.client.media.upload("video", (filename, video_storage, content_type))["media_id"])
                 except WeChatClientException as e:
                     logger.error("[wechatmp] upload video failed: {}".format(e))
                     return
-                media_id = response["media_id"]
-                logger.info("[wechatmp] video uploaded, receiver {}, media_id {}".format(receiver, media_id))
+                logger.info("[wechatmp] video uploaded, receiver %s, media_id %s", receiver, media_id)
                 self.cache_dict[receiver].append(("video", media_id))
 
             elif reply.type == ReplyType.VIDEO:  # 从文件读取视频
@@ -167,13 +152,11 @@ class WechatMPChannel(ChatChannel):
                 filename = receiver + "-" + str(context["msg"].msg_id) + "." + video_type
                 content_type = "video/" + video_type
                 try:
-                    response = self.client.material.add("video", (filename, video_storage, content_type))
-                    logger.debug("[wechatmp] upload video response: {}".format(response))
+                    media_id = self._upload_media("video", video_storage, lambda: self.client.media.upload("video", (filename, video_storage, content_type))["media_id"])
                 except WeChatClientException as e:
                     logger.error("[wechatmp] upload video failed: {}".format(e))
                     return
-                media_id = response["media_id"]
-                logger.info("[wechatmp] video uploaded, receiver {}, media_id {}".format(receiver, media_id))
+                logger.info("[wechatmp] video uploaded, receiver %s, media_id %s", receiver, media_id)
                 self.cache_dict[receiver].append(("video", media_id))
 
         else:
@@ -181,12 +164,12 @@ class WechatMPChannel(ChatChannel):
                 reply_text = reply.content
                 texts = split_string_by_utf8_length(reply_text, MAX_UTF8_LEN)
                 if len(texts) > 1:
-                    logger.info("[wechatmp] text too long, split into {} parts".format(len(texts)))
+                    logger.info("[wechatmp] text too long, split into %s parts", len(texts))
                 for i, text in enumerate(texts):
                     self.client.message.send_text(receiver, text)
                     if i != len(texts) - 1:
                         time.sleep(0.5)  # 休眠0.5秒，防止发送过快乱序
-                logger.info("[wechatmp] Do send text to {}: {}".format(receiver, reply_text))
+                logger.info("[wechatmp] Do send text to %s: %s", receiver, reply_text)
             elif reply.type == ReplyType.VOICE:
                 try:
                     file_path = reply.content
@@ -198,20 +181,19 @@ class WechatMPChannel(ChatChannel):
                         file_type = "audio/amr"
                     else:
                         mp3_file = os.path.splitext(file_path)[0] + ".mp3"
-                        any_to_mp3(file_path, mp3_file)
-                        file_path = mp3_file
+                        tts_cache().convert(any_to_mp3, file_path, mp3_file)
+                        file_path = tmp_manager.acquire(mp3_file, context)
                         file_name = os.path.basename(file_path)
                         file_type = "audio/mpeg"
-                    logger.info("[wechatmp] file_name: {}, file_type: {} ".format(file_name, file_type))
+                    logger.info("[wechatmp] file_name: %s, file_type: %s ", file_name, file_type)
                     media_ids = []
                     duration, files = split_audio(file_path, 60 * 1000)
                     if len(files) > 1:
-                        logger.info("[wechatmp] voice too long {}s > 60s , split into {} parts".format(duration / 1000.0, len(files)))
+                        logger.info("[wechatmp] voice too long %ss > 60s , split into %s parts", duration / 1000.0, len(files))
                     for path in files:
-                        # support: <2M, <60s, AMR\MP3
-                        response = self.client.media.upload("voice", (os.path.basename(path), open(path, "rb"), file_type))
-                        logger.debug("[wechatcom] upload voice response: {}".format(response))
-                        media_ids.append(response["media_id"])
+                        tmp_manager.acquire(path, context)  # 上传失败时也随context一起删除
+                        media_id = self._upload_media("voice", path, lambda: self._upload_voice(path, file_type))
+                        media_ids.append(media_id)
                         os.remove(path)
                 except WeChatClientException as e:
                     logger.error("[wechatmp] upload voice failed: {}".format(e))
@@ -225,25 +207,20 @@ class WechatMPChannel(ChatChannel):
                 for media_id in media_ids:
                     self.client.message.send_voice(receiver, media_id)
                     time.sleep(1)
-                logger.info("[wechatmp] Do send voice to {}".format(receiver))
+                logger.info("[wechatmp] Do send voice to %s", receiver)
             elif reply.type == ReplyType.IMAGE_URL:  # 从网络下载图片
                 img_url = reply.content
-                pic_res = requests.get(img_url, stream=True)
-                image_storage = io.BytesIO()
-                for block in pic_res.iter_content(1024):
-                    image_storage.write(block)
-                image_storage.seek(0)
+                image_storage = download_file(img_url)
                 image_type = imghdr.what(image_storage)
                 filename = receiver + "-" + str(context["msg"].msg_id) + "." + image_type
                 content_type = "image/" + image_type
                 try:
-                    response = self.client.media.upload("image", (filename, image_storage, content_type))
-                    logger.debug("[wechatmp] upload image response: {}".format(response))
+                    media_id = self._upload_media("image", image_storage, lambda: self.client.media.upload("image", (filename, image_storage, content_type))["media_id"])
                 except WeChatClientException as e:
                     logger.error("[wechatmp] upload image failed: {}".format(e))
                     return
-                self.client.message.send_image(receiver, response["media_id"])
-                logger.info("[wechatmp] Do send image to {}".format(receiver))
+                self.client.message.send_image(receiver, media_id)
+                logger.info("[wechatmp] Do send image to %s", receiver)
             elif reply.type == ReplyType.IMAGE:  # 从文件读取图片
                 image_storage = reply.content
                 image_storage.seek(0)
@@ -251,31 +228,25 @@ class WechatMPChannel(ChatChannel):
                 filename = receiver + "-" + str(context["msg"].msg_id) + "." + image_type
                 content_type = "image/" + image_type
                 try:
-                    response = self.client.media.upload("image", (filename, image_storage, content_type))
-                    logger.debug("[wechatmp] upload image response: {}".format(response))
+                    media_id = self._upload_media("image", image_storage, lambda: self.client.media.upload("image", (filename, image_storage, content_type))["media_id"])
                 except WeChatClientException as e:
                     logger.error("[wechatmp] upload image failed: {}".format(e))
                     return
-                self.client.message.send_image(receiver, response["media_id"])
-                logger.info("[wechatmp] Do send image to {}".format(receiver))
+                self.client.message.send_image(receiver, media_id)
+                logger.info("[wechatmp] Do send image to %s", receiver)
             elif reply.type == ReplyType.VIDEO_URL:  # 从网络下载视频
                 video_url = reply.content
-                video_res = requests.get(video_url, stream=True)
-                video_storage = io.BytesIO()
-                for block in video_res.iter_content(1024):
-                    video_storage.write(block)
-                video_storage.seek(0)
+                video_storage = download_file(video_url)
                 video_type = 'mp4'
                 filename = receiver + "-" + str(context["msg"].msg_id) + "." + video_type
                 content_type = "video/" + video_type
                 try:
-                    response = self.client.media.upload("video", (filename, video_storage, content_type))
-                    logger.debug("[wechatmp] upload video response: {}".format(response))
+                    media_id = self._upload_media("video", video_storage, lambda: self.client.media.upload("video", (filename, video_storage, content_type))["media_id"])
                 except WeChatClientException as e:
                     logger.error("[wechatmp] upload video failed: {}".format(e))
                     return
-                self.client.message.send_video(receiver, response["media_id"])
-                logger.info("[wechatmp] Do send video to {}".format(receiver))
+                self.client.message.send_video(receiver, media_id)
+                logger.info("[wechatmp] Do send video to %s", receiver)
             elif reply.type == ReplyType.VIDEO:  # 从文件读取视频
                 video_storage = reply.content
                 video_storage.seek(0)
@@ -283,22 +254,78 @@ class WechatMPChannel(ChatChannel):
                 filename = receiver + "-" + str(context["msg"].msg_id) + "." + video_type
                 content_type = "video/" + video_type
                 try:
-                    response = self.client.media.upload("video", (filename, video_storage, content_type))
-                    logger.debug("[wechatmp] upload video response: {}".format(response))
+                    media_id = self._upload_media("video", video_storage, lambda: self.client.media.upload("video", (filename, video_storage, content_type))["media_id"])
                 except WeChatClientException as e:
                     logger.error("[wechatmp] upload video failed: {}".format(e))
                     return
-                self.client.message.send_video(receiver, response["media_id"])
-                logger.info("[wechatmp] Do send video to {}".format(receiver))
+                self.client.message.send_video(receiver, media_id)
+                logger.info("[wechatmp] Do send video to %s", receiver)
         return
 
+    def start_running(self, user):
+        with self.running_lock:
+            self.running[user] = threading.Event()
+
+    def finish_running(self, user):
+        # 唤醒等待该用户回复的请求线程
+        with self.running_lock:
+            event = self.running.pop(user, None)
+        if event is not None:
+            event.set()
+
+    def wait_reply(self, user, timeout):
+        """
+        等待用户当前消息处理结束，回复已放入cache_dict或没有回复
+        :return: 是否已结束，超时返回False
+        """
+        with self.running_lock:
+            event = self.running.get(user)
+            if event is None:
+                return True
+            self.waiting += 1
+        try:
+            return event.wait(max(0, timeout))
+        finally:
+            with self.running_lock:
+                self.waiting -= 1
+
+    def hold_request(self, seconds):
+        # 不返回响应，让公众号服务器超时后重试
+        with self.running_lock:
+            self.waiting += 1
+        try:
+            time.sleep(max(0, seconds))
+        finally:
+            with self.running_lock:
+                self.waiting -= 1
+
+    def stats(self):
+        """
+        :return: 等待回复或等待超时的请求线程数、处理中的用户数、缓存的回复数和重试计数条目数
+        """
+        if not self.passive_reply:
+            return {}
+        with self.running_lock:
+            waiting, running = self.waiting, len(self.running)
+        return {"waiting": waiting, "running": running, "cached": len(self.cache_dict), "request_cnt": len(self.request_cnt)}
+
     def _success_callback(self, session_id, context, **kwargs):  # 线程异常结束时的回调函数
-        logger.debug("[wechatmp] Success to generate reply, msgId={}".format(context["msg"].msg_id))
+        logger.debug("[wechatmp] Success to generate reply, msgId=%s", context["msg"].msg_id)
         if self.passive_reply:
-            self.running.remove(session_id)
+            self.finish_running(session_id)
 
     def _fail_callback(self, session_id, exception, context, **kwargs):  # 线程异常结束时的回调函数
         logger.exception("[wechatmp] Fail to generate reply to user, msgId={}, exception={}".format(context["msg"].msg_id, exception))
         if self.passive_reply:
-            assert session_id not in self.cache_dict
-            self.running.remove(session_id)
+            self.finish_running(session_id)
+
+    def _thread_pool_callback(self, session_id, **kwargs):
+        callback = super()._thread_pool_callback(session_id, **kwargs)
+
+        def func(worker):
+            callback(worker)
+            # 被取消的消息不会调用成功或失败回调
+            if self.passive_reply and worker.cancelled():
+                self.finish_running(session_id)
+
+        return func
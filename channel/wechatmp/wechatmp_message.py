@@ -28,7 +28,7 @@ class WeChatMPMessage(ChatMessage):
                         with open(self.content, "wb") as f:
                             f.write(response.content)
                     else:
-                        logger.info(f"[wechatmp] Failed to download voice file, {response.content}")
+                        logger.info("[wechatmp] Failed to download voice file, %s", response.content)
 
                 self._prepare_fn = download_voice
             else:
@@ -45,7 +45,7 @@ class WeChatMPMessage(ChatMessage):
                     with open(self.content, "wb") as f:
                         f.write(response.content)
                 else:
-                    logger.info(f"[wechatmp] Failed to download image file, {response.content}")
+                    logger.info("[wechatmp] Failed to download image file, %s", response.content)
 
             self._prepare_fn = download_image
         else:
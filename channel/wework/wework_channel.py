@@ -1,4 +1,3 @@
-import io
 import os
 import random
 import tempfile
@@ -14,9 +13,10 @@ from channel.chat_channel import ChatChannel
 from channel.wework.wework_message import *
 from channel.wework.wework_message import WeworkMessage
 from common.singleton import singleton
-from common.log import logger
+from common.log import lazy, logger
 from common.time_check import time_checker
-from common.utils import compress_imgfile, fsize
+from common.tmp_dir import tmp_manager
+from common.utils import compress_imgfile, download_file, fsize
 from config import conf
 from channel.wework.run import wework
 from channel.wework import run
@@ -39,17 +39,14 @@ def download_and_compress_image(url, filename, quality=30):
         os.makedirs(directory)
 
     # 下载图片
-    pic_res = requests.get(url, stream=True)
-    image_storage = io.BytesIO()
-    for block in pic_res.iter_content(1024):
-        image_storage.write(block)
+    image_storage = download_file(url)
 
     # 检查图片大小并可能进行压缩
     sz = fsize(image_storage)
     if sz >= 10 * 1024 * 1024:  # 如果图片大于 10 MB
-        logger.info("[wework] image too large, ready to compress, sz={}".format(sz))
+        logger.info("[wework] image too large, ready to compress, sz=%s", sz)
         image_storage = compress_imgfile(image_storage, 10 * 1024 * 1024 - 1)
-        logger.info("[wework] image compressed, sz={}".format(fsize(image_storage)))
+        logger.info("[wework] image compressed, sz=%s", fsize(image_storage))
 
     # 将内存缓冲区的指针重置到起始位置
     image_storage.seek(0)
@@ -90,19 +87,19 @@ def download_video(url, filename):
 
 
 def create_message(wework_instance, message, is_group):
-    logger.debug(f"正在为{'群聊' if is_group else '单聊'}创建 WeworkMessage")
+    logger.debug("正在为%s创建 WeworkMessage", '群聊' if is_group else '单聊')
     cmsg = WeworkMessage(message, wework=wework_instance, is_group=is_group)
-    logger.debug(f"cmsg:{cmsg}")
+    logger.debug("cmsg:%s", cmsg)
     return cmsg
 
 
 def handle_message(cmsg, is_group):
-    logger.debug(f"准备用 WeworkChannel 处理{'群聊' if is_group else '单聊'}消息")
+    logger.debug("准备用 WeworkChannel 处理%s消息", '群聊' if is_group else '单聊')
     if is_group:
         WeworkChannel().handle_group(cmsg)
     else:
         WeworkChannel().handle_single(cmsg)
-    logger.debug(f"已用 WeworkChannel 处理完{'群聊' if is_group else '单聊'}消息")
+    logger.debug("已用 WeworkChannel 处理完%s消息", '群聊' if is_group else '单聊')
 
 
 def _check(func):
@@ -112,7 +109,7 @@ def _check(func):
         if create_time is None:
             return func(self, cmsg)
         if int(create_time) < int(time.time()) - 60:  # 跳过1分钟前的历史消息
-            logger.debug("[WX]history message {} skipped".format(msgId))
+            logger.debug("[WX]history message %s skipped", msgId)
             return
         return func(self, cmsg)
 
@@ -122,7 +119,7 @@ def _check(func):
 @wework.msg_register(
     [ntwork.MT_RECV_TEXT_MSG, ntwork.MT_RECV_IMAGE_MSG, 11072, ntwork.MT_RECV_LINK_CARD_MSG,ntwork.MT_RECV_FILE_MSG, ntwork.MT_RECV_VOICE_MSG])
 def all_msg_handler(wework_instance: ntwork.WeWork, message):
-    logger.debug(f"收到消息: {message}")
+    logger.debug("收到消息: %s", message)
     if 'data' in message:
         # 首先查找conversation_id，如果没有找到，则查找room_conversation_id
         conversation_id = message['data'].get('conversation_id', message['data'].get('room_conversation_id'))
@@ -144,7 +141,7 @@ def all_msg_handler(wework_instance: ntwork.WeWork, message):
 
 def accept_friend_with_retries(wework_instance, user_id, corp_id):
     result = wework_instance.accept_friend(user_id, corp_id)
-    logger.debug(f'result:{result}')
+    logger.debug("result:%s", result)
 
 
 # @wework.msg_register(ntwork.MT_RECV_FRIEND_MSG)
@@ -187,7 +184,7 @@ class WeworkChannel(ChatChannel):
         login_info = wework.get_login_info()
         self.user_id = login_info['user_id']
         self.name = login_info['nickname']
-        logger.info(f"登录信息:>>>user_id:{self.user_id}>>>>>>>>name:{self.name}")
+        logger.info("登录信息:>>>user_id:%s>>>>>>>>name:%s", self.user_id, self.name)
         logger.info("静默延迟60s，等待客户端刷新数据，请勿进行任何操作······")
         time.sleep(60)
         contacts = get_with_retry(wework.get_external_contacts)
@@ -233,15 +230,15 @@ class WeworkChannel(ChatChannel):
         if cmsg.ctype == ContextType.VOICE:
             if not conf().get("speech_recognition"):
                 return
-            logger.debug("[WX]receive voice msg: {}".format(cmsg.content))
+            logger.debug("[WX]receive voice msg: %s", cmsg.content)
         elif cmsg.ctype == ContextType.IMAGE:
-            logger.debug("[WX]receive image msg: {}".format(cmsg.content))
+            logger.debug("[WX]receive image msg: %s", cmsg.content)
         elif cmsg.ctype == ContextType.PATPAT:
-            logger.debug("[WX]receive patpat msg: {}".format(cmsg.content))
+            logger.debug("[WX]receive patpat msg: %s", cmsg.content)
         elif cmsg.ctype == ContextType.TEXT:
-            logger.debug("[WX]receive text msg: {}, cmsg={}".format(json.dumps(cmsg._rawmsg, ensure_ascii=False), cmsg))
+            logger.debug("[WX]receive text msg: %s, cmsg=%s", lazy(json.dumps, cmsg._rawmsg, ensure_ascii=False), cmsg)
         else:
-            logger.debug("[WX]receive msg: {}, cmsg={}".format(cmsg.content, cmsg))
+            logger.debug("[WX]receive msg: %s, cmsg=%s", cmsg.content, cmsg)
         context = self._compose_context(cmsg.ctype, cmsg.content, isgroup=False, msg=cmsg)
         if context:
             self.produce(context)
@@ -252,38 +249,38 @@ class WeworkChannel(ChatChannel):
         if cmsg.ctype == ContextType.VOICE:
             if not conf().get("speech_recognition"):
                 return
-            logger.debug("[WX]receive voice for group msg: {}".format(cmsg.content))
+            logger.debug("[WX]receive voice for group msg: %s", cmsg.content)
         elif cmsg.ctype == ContextType.IMAGE:
-            logger.debug("[WX]receive image for group msg: {}".format(cmsg.content))
+            logger.debug("[WX]receive image for group msg: %s", cmsg.content)
         elif cmsg.ctype in [ContextType.JOIN_GROUP, ContextType.PATPAT]:
-            logger.debug("[WX]receive note msg: {}".format(cmsg.content))
+            logger.debug("[WX]receive note msg: %s", cmsg.content)
         elif cmsg.ctype == ContextType.TEXT:
             pass
         else:
-            logger.debug("[WX]receive group msg: {}".format(cmsg.content))
+            logger.debug("[WX]receive group msg: %s", cmsg.content)
         context = self._compose_context(cmsg.ctype, cmsg.content, isgroup=True, msg=cmsg)
         if context:
             self.produce(context)
 
     # 统一的发送函数，每个Channel自行实现，根据reply的type字段发送不同类型的消息
     def send(self, reply: Reply, context: Context):
-        logger.debug(f"context: {context}")
+        logger.debug("context: %s", context)
         receiver = context["receiver"]
         actual_user_id = context["msg"].actual_user_id
         if reply.type == ReplyType.TEXT or reply.type == ReplyType.TEXT_:
             match = re.search(r"^@(.*?)\n", reply.content)
-            logger.debug(f"match: {match}")
+            logger.debug("match: %s", match)
             if match:
                 new_content = re.sub(r"^@(.*?)\n", "\n", reply.content)
                 at_list = [actual_user_id]
-                logger.debug(f"new_content: {new_content}")
+                logger.debug("new_content: %s", new_content)
                 wework.send_room_at_msg(receiver, new_content, at_list)
             else:
                 wework.send_text(receiver, reply.content)
-            logger.info("[WX] sendMsg={}, receiver={}".format(reply, receiver))
+            logger.info("[WX] sendMsg=%s, receiver=%s", reply, receiver)
         elif reply.type == ReplyType.ERROR or reply.type == ReplyType.INFO:
             wework.send_text(receiver, reply.content)
-            logger.info("[WX] sendMsg={}, receiver={}".format(reply, receiver))
+            logger.info("[WX] sendMsg=%s, receiver=%s", reply, receiver)
         elif reply.type == ReplyType.IMAGE:  # 从文件读取图片
             image_storage = reply.content
             image_storage.seek(0)
@@ -295,7 +292,7 @@ class WeworkChannel(ChatChannel):
                 temp.write(data)
             # Send the image
             wework.send_image(receiver, temp_path)
-            logger.info("[WX] sendImage, receiver={}".format(receiver))
+            logger.info("[WX] sendImage, receiver=%s", receiver)
             # Remove the temporary file
             os.remove(temp_path)
         elif reply.type == ReplyType.IMAGE_URL:  # 从网络下载图片
@@ -303,24 +300,24 @@ class WeworkChannel(ChatChannel):
             filename = str(uuid.uuid4())
 
             # 调用你的函数，下载图片并保存为本地文件
-            image_path = download_and_compress_image(img_url, filename)
+            image_path = tmp_manager.acquire(download_and_compress_image(img_url, filename), context)
 
             wework.send_image(receiver, file_path=image_path)
-            logger.info("[WX] sendImage url={}, receiver={}".format(img_url, receiver))
+            logger.info("[WX] sendImage url=%s, receiver=%s", img_url, receiver)
         elif reply.type == ReplyType.VIDEO_URL:
             video_url = reply.content
             filename = str(uuid.uuid4())
-            video_path = download_video(video_url, filename)
+            video_path = tmp_manager.acquire(download_video(video_url, filename), context)
 
             if video_path is None:
                 # 如果视频太大，下载可能会被跳过，此时 video_path 将为 None
                 wework.send_text(receiver, "抱歉，视频太大了！！！")
             else:
                 wework.send_video(receiver, video_path)
-            logger.info("[WX] sendVideo, receiver={}".format(receiver))
+            logger.info("[WX] sendVideo, receiver=%s", receiver)
         elif reply.type == ReplyType.VOICE:
             current_dir = os.getcwd()
             voice_file = reply.content.split("/")[-1]
             reply.content = os.path.join(current_dir, "tmp", voice_file)
             wework.send_file(receiver, reply.content)
-            logger.info("[WX] sendFile={}, receiver={}".format(reply.content, receiver))
+            logger.info("[WX] sendFile=%s, receiver=%s", reply.content, receiver)
@@ -25,13 +25,13 @@ def get_with_retry(get_func, max_retries=5, delay=5):
 
 
 def get_room_info(wework, conversation_id):
-    logger.debug(f"传入的 conversation_id: {conversation_id}")
+    logger.debug("传入的 conversation_id: %s", conversation_id)
     rooms = wework.get_rooms()
     if not rooms or 'room_list' not in rooms:
         logger.error(f"获取群聊信息失败: {rooms}")
         return None
     time.sleep(1)
-    logger.debug(f"获取到的群聊信息: {rooms}")
+    logger.debug("获取到的群聊信息: %s", rooms)
     for room in rooms['room_list']:
         if room['conversation_id'] == conversation_id:
             return room
@@ -75,7 +75,7 @@ def cdn_download(wework, message, file_name):
         return
 
     # 输出下载结果
-    logger.debug(f"result: {result}")
+    logger.debug("result: %s", result)
 
 
 def c2c_download_and_convert(wework, message, file_name):
@@ -173,7 +173,7 @@ class WeworkMessage(ChatMessage):
 
             data = wework_msg['data']
             login_info = self.wework.get_login_info()
-            logger.debug(f"login_info: {login_info}")
+            logger.debug("login_info: %s", login_info)
             nickname = f"{login_info['username']}({login_info['nickname']})" if login_info['nickname'] else login_info['username']
             user_id = login_info['user_id']
 
@@ -200,8 +200,8 @@ class WeworkMessage(ChatMessage):
                     for at in at_list:
                         tmp_list.append(at['nickname'])
                     at_list = tmp_list
-                    logger.debug(f"at_list: {at_list}")
-                    logger.debug(f"nickname: {nickname}")
+                    logger.debug("at_list: %s", at_list)
+                    logger.debug("nickname: %s", nickname)
                     self.is_at = False
                     if nickname in at_list or login_info['nickname'] in at_list or login_info['username'] in at_list:
                         self.is_at = True
@@ -212,7 +212,7 @@ class WeworkMessage(ChatMessage):
                     name = nickname
                     pattern = f"@{re.escape(name)}(\u2005|\u0020)"
                     if re.search(pattern, content):
-                        logger.debug(f"Wechaty message {self.msg_id} includes at")
+                        logger.debug("Wechaty message %s includes at", self.msg_id)
                         self.is_at = True
 
                     if not self.actual_user_id:
@@ -221,7 +221,7 @@ class WeworkMessage(ChatMessage):
                 else:
                     logger.error("群聊消息中没有找到 conversation_id 或 room_conversation_id")
 
-            logger.debug(f"WeworkMessage has been successfully instantiated with message id: {self.msg_id}")
+            logger.debug("WeworkMessage has been successfully instantiated with message id: %s", self.msg_id)
         except Exception as e:
             logger.error(f"在 WeworkMessage 的初始化过程中出现错误：{e}")
             raise e
@@ -0,0 +1,437 @@
+"""
+多进程处理模式：前端进程持有channel连接(登录、收发消息)，构造好的context按session_id一致性哈希
+分发给worker进程，由worker执行插件、bot调用、装饰等处理流程，需要发送的回复再交回前端进程发送。
+同一会话总在同一个worker中处理，会话记录、插件状态等保留在该进程内；worker异常退出时在原位置
+重新启动，已发给它但还没有发出回复的消息按原顺序重新分发，同一会话内的顺序不变。
+
+前端与worker之间通过multiprocessing的Pipe通信，消息为：
+    前端 -> worker: ("handle", 请求id, context, (name, user_id))、("ack", 发送id, 错误信息)、("stop",)
+    worker -> 前端: ("send", 请求id, 发送id, reply)、("done", 请求id, 错误信息, spans)
+handle消息带上前端channel当前的登录身份，itchat等channel在worker启动之后才登录，重新登录后身份也会变化。
+链路追踪由前端开始trace，worker沿用trace_id记录处理过程的span，在done消息中交回前端合并后导出；
+指标由各worker在自己的端口(metrics_port+1+worker编号)上输出，前端端口只有前端进程自身的指标。
+"""
+
+import bisect
+import copy
+import hashlib
+import itertools
+import multiprocessing
+import os
+import pickle
+import queue
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from bridge.context import Context
+from channel.chat_channel import DEFERRED, ChatChannel, _get_prefetch_pool
+from common import http_server, log, metrics, tracing
+from common.log import logger
+from common.tmp_dir import tmp_manager
+from config import conf
+
+# 只在前端进程中有意义，不发给worker的context字段
+LOCAL_KEYS = ("channel", "prefetch_future", "trace", "stream_callback")
+
+
+class HashRing(object):
+    """
+    一致性哈希环，每个worker对应vnodes个虚拟节点
+    """
+
+    def __init__(self, size, vnodes=64):
+        self.ring = sorted((self._hash("worker-{}-{}".format(index, v)), index) for index in range(size) for v in range(vnodes))
+        self.hashes = [h for h, _ in self.ring]
+
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(hashlib.md5(str(key).encode("utf-8")).digest()[:8], "big")
+
+    def get(self, key):
+        i = bisect.bisect(self.hashes, self._hash(key)) % len(self.ring)
+        return self.ring[i][1]
+
+
+def _portable(value):
+    try:
+        pickle.dumps(value)
+        return value
+    except Exception:
+        return None
+
+
+def portable_context(context):
+    """
+    复制一份可以发给worker的context：去掉只在前端有效的字段，消息对象不再携带下载函数等无法序列化的属性，
+    trace只传递id，由worker记录span
+    """
+    kwargs = {}
+    for key, value in context.kwargs.items():
+        if key in LOCAL_KEYS:
+            continue
+        if key == "msg" and value is not None:
+            msg = copy.copy(value)
+            msg._prepare_fn = None
+            msg._prepare_future = None
+            msg._prepared = True
+            for attr, attr_value in list(vars(msg).items()):
+                setattr(msg, attr, _portable(attr_value))
+            value = msg
+        else:
+            value = _portable(value)
+        kwargs[key] = value
+    trace = context.get("trace")
+    if trace is not None:
+        kwargs["trace_parent"] = (trace.trace_id, trace.root.span_id, trace.root.start)
+    return Context(context.type, context.content, kwargs)
+
+
+class _Request(object):
+    def __init__(self, request_id, slot, context, prepare_future):
+        self.request_id = request_id
+        self.slot = slot
+        self.context = context
+        self.prepare_future = prepare_future
+        self.dispatched = False  # 已经发给worker
+        self.replied = False  # worker已经发出过回复，重新分发会重复回复
+        self.sends = []  # 提交给send_pool的回复发送任务
+
+
+class _Slot(object):
+    def __init__(self, index):
+        self.index = index
+        self.queue = queue.PriorityQueue()  # 等待发给worker的请求id，id按到达顺序递增，放回时仍按原顺序发送
+        self.lock = threading.Lock()  # 保护process/conn，并保证同一时间只有一个线程写conn
+        self.process = None
+        self.conn = None
+        self.started_at = 0
+        self.restarts = 0
+
+
+class WorkerPool(object):
+    def __init__(self, channel, size):
+        self.channel = channel
+        self.size = size
+        self.ring = HashRing(size, conf().get("worker_virtual_nodes", 64))
+        self.slots = [_Slot(i) for i in range(size)]
+        self.requests = {}
+        self.lock = threading.Lock()  # 保护requests
+        self.ids = itertools.count(1)
+        self.send_pool = ThreadPoolExecutor(max_workers=conf().get("worker_send_threads", 4), thread_name_prefix="worker-send")
+        self.mp = multiprocessing.get_context("spawn")
+        self.stopping = False
+
+    def start(self):
+        for slot in self.slots:
+            with slot.lock:
+                self._spawn(slot)
+            threading.Thread(target=self._dispatch_loop, args=(slot,), name="worker-dispatch-{}".format(slot.index), daemon=True).start()
+        logger.info("[WorkerPool] started %s worker processes", self.size)
+
+    def _spawn(self, slot):
+        # 调用方持有slot.lock
+        conn, child_conn = self.mp.Pipe()
+        channel = self.channel
+        process = self.mp.Process(
+            target=worker_main,
+            args=(child_conn, slot.index, channel.channel_type, list(channel.NOT_SUPPORT_REPLYTYPE), channel.MULTI_REPLY),
+            name="chat-worker-{}".format(slot.index),
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        slot.process, slot.conn, slot.started_at = process, conn, time.time()
+        threading.Thread(target=self._read_loop, args=(slot, conn), name="worker-reader-{}".format(slot.index), daemon=True).start()
+
+    def _prepare(self, context):
+        # 语音、图片等需要通过channel连接下载的内容在前端下载，worker直接使用下载好的文件
+        cmsg = context.get("msg")
+        if cmsg is None or not getattr(cmsg, "_prepare_fn", None) or cmsg._prepared:
+            return None
+        pool, _ = _get_prefetch_pool()
+        return pool.submit(cmsg.prepare)
+
+    def dispatch(self, context):
+        slot = self.slots[self.ring.get(context["session_id"])]
+        trace = tracing.start_trace(context)
+        if trace is not None:
+            trace.root.attrs["session_id"] = context["session_id"]
+        request = _Request(next(self.ids), slot, context, self._prepare(context))
+        with self.lock:
+            self.requests[request.request_id] = request
+        slot.queue.put(request.request_id)
+
+    def _dispatch_loop(self, slot):
+        while True:
+            request_id = slot.queue.get()
+            with self.lock:
+                request = self.requests.get(request_id)
+            if request is None:
+                continue
+            if request.prepare_future is not None:
+                try:
+                    request.prepare_future.result()
+                except Exception as e:
+                    logger.warning("[WorkerPool] prepare message error: %s", e)
+            data = ("handle", request_id, portable_context(request.context), (self.channel.name, self.channel.user_id))
+            with slot.lock:
+                with slot.queue.mutex:
+                    # 等待期间worker重启，放回了更早的消息，需要先发送
+                    earlier = slot.queue.queue and slot.queue.queue[0] < request_id
+                if not earlier:
+                    try:
+                        slot.conn.send(data)
+                        request.dispatched = True
+                        continue
+                    except (OSError, EOFError, ValueError) as e:
+                        logger.warning("[WorkerPool] worker %s unavailable: %s", slot.index, e)
+            slot.queue.put(request_id)
+            if not earlier:
+                # worker正在重启
+                time.sleep(conf().get("worker_restart_delay", 1))
+
+    def _read_loop(self, slot, conn):
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                break
+            except Exception as e:
+                logger.exception("[WorkerPool] invalid message from worker %s: %s", slot.index, e)
+                continue
+            if message[0] == "send":
+                _, request_id, send_id, reply = message
+                with self.lock:
+                    request = self.requests.get(request_id)
+                if request is None:
+                    self._write(slot, conn, ("ack", send_id, "request {} not found".format(request_id)))
+                    continue
+                # 在提交发送前标记，worker此时退出也不会重新分发这条消息
+                request.replied = True
+                request.sends.append(self.send_pool.submit(self._send, slot, conn, request, send_id, reply))
+            elif message[0] == "done":
+                self._finish(message[1], message[2], message[3])
+        # 等待已提交的回复发完，之后再结束或重新分发这些消息
+        with self.lock:
+            sends = [future for r in self.requests.values() if r.slot is slot for future in r.sends]
+        wait(sends)
+        self._on_exit(slot, conn)
+
+    def _write(self, slot, conn, data):
+        with slot.lock:
+            if slot.conn is not conn:
+                return
+            try:
+                conn.send(data)
+            except (OSError, EOFError, ValueError):
+                pass
+
+    def _send(self, slot, conn, request, send_id, reply):
+        error = None
+        try:
+            self.channel.send(reply, request.context)
+        except NotImplementedError as e:
+            error = "NotImplementedError: {}".format(e)
+        except Exception as e:
+            error = "{}: {}".format(type(e).__name__, e)
+        self._write(slot, conn, ("ack", send_id, error))
+
+    def _finish(self, request_id, error, spans=None):
+        with self.lock:
+            request = self.requests.pop(request_id, None)
+        if request is None:
+            return
+        context = request.context
+        trace = context.get("trace")
+        if trace is not None and spans:
+            trace.merge(spans)
+        if error:
+            self.channel._fail_callback(context["session_id"], exception=RuntimeError(error), context=context)
+        else:
+            self.channel._success_callback(context["session_id"], context=context)
+        tracing.finish_trace(context)
+        tmp_manager.release_context(context)
+
+    def _on_exit(self, slot, conn):
+        with slot.lock:
+            if slot.conn is not conn or self.stopping:
+                return
+            slot.process.join(5)
+            logger.error("[WorkerPool] worker %s (pid=%s) exited, exitcode=%s, restarting", slot.index, slot.process.pid, slot.process.exitcode)
+            # 刚启动就退出时等待一段时间，避免反复重启
+            if time.time() - slot.started_at < conf().get("worker_restart_delay", 1) * 5:
+                time.sleep(conf().get("worker_restart_delay", 1))
+            with self.lock:
+                lost = sorted((r for r in self.requests.values() if r.slot is slot and r.dispatched), key=lambda r: r.request_id)
+            resend = []
+            for request in lost:
+                if request.replied:
+                    # 已经发出部分回复，重新处理会重复回复
+                    self._finish(request.request_id, "worker {} exited".format(slot.index))
+                else:
+                    request.dispatched = False
+                    resend.append(request.request_id)
+            # 放回队列后按id顺序先于排队中的消息发给新worker，保持会话内的顺序
+            for request_id in resend:
+                slot.queue.put(request_id)
+            slot.restarts += 1
+            self._spawn(slot)
+        if resend:
+            logger.info("[WorkerPool] redispatch %s messages to worker %s", len(resend), slot.index)
+
+    def stop(self):
+        self.stopping = True
+        for slot in self.slots:
+            with slot.lock:
+                try:
+                    slot.conn.send(("stop",))
+                except (OSError, EOFError, ValueError, AttributeError):
+                    pass
+        for slot in self.slots:
+            if slot.process is not None:
+                slot.process.join(conf().get("http_shutdown_timeout", 10))
+
+    def stats(self):
+        with self.lock:
+            pending = len(self.requests)
+        return {
+            "workers": self.size,
+            "pending": pending,
+            "queued": sum(slot.queue.qsize() for slot in self.slots),
+            "restarts": sum(slot.restarts for slot in self.slots),
+        }
+
+
+def start(channel):
+    """
+    worker_processes大于1时启动worker进程，之后channel收到的消息都分发给worker处理；
+    HTTP类channel的回复与请求连接绑定，不使用worker进程，其中api channel可以用http_workers多进程监听
+    :return: WorkerPool，未开启时返回None
+    """
+    size = conf().get("worker_processes", 0)
+    if size <= 1:
+        return None
+    if not isinstance(channel, ChatChannel):
+        return None
+    if channel.channel_type in http_server.MULTI_PROCESS_CHANNELS:
+        logger.warning("[WorkerPool] worker_processes is not supported by channel %s, use http_workers instead", channel.channel_type)
+        return None
+    if channel.channel_type in http_server.HTTP_CHANNELS:
+        logger.warning("[WorkerPool] worker_processes is not supported by channel %s, run in a single process", channel.channel_type)
+        return None
+    pool = WorkerPool(channel, size)
+    pool.start()
+    channel.worker_pool = pool
+    import atexit
+
+    atexit.register(pool.stop)
+    return pool
+
+
+# ---------------- worker进程 ----------------
+
+class WorkerChannel(ChatChannel):
+    """
+    worker进程中的channel：从前端接收context，按原有的会话队列处理，发送回复时交给前端发送并等待结果
+    """
+
+    def __init__(self, conn, index, channel_type, not_support_reply_types, multi_reply):
+        super().__init__()
+        self.conn = conn
+        self.index = index
+        self.channel_type = channel_type
+        self.NOT_SUPPORT_REPLYTYPE = not_support_reply_types
+        self.MULTI_REPLY = multi_reply
+        self.write_lock = threading.Lock()
+        self.send_ids = itertools.count(1)
+        self.acks = {}  # 发送id -> [Event, 错误信息]
+        self.acks_lock = threading.Lock()
+
+    def _write(self, data):
+        with self.write_lock:
+            self.conn.send(data)
+
+    def send(self, reply, context):
+        send_id = next(self.send_ids)
+        ack = [threading.Event(), None]
+        with self.acks_lock:
+            self.acks[send_id] = ack
+        try:
+            self._write(("send", context["worker_request_id"], send_id, reply))
+            if not ack[0].wait(conf().get("worker_send_timeout", 60)):
+                raise TimeoutError("send reply timeout")
+        finally:
+            with self.acks_lock:
+                self.acks.pop(send_id, None)
+        if ack[1]:
+            if ack[1].startswith("NotImplementedError"):
+                raise NotImplementedError(ack[1])
+            raise Exception(ack[1])
+
+    def _done(self, context, error=None):
+        request_id = context.get("worker_request_id") if context else None
+        if request_id is not None:
+            trace = context.get("trace")
+            spans = trace.export_spans() if trace is not None else None
+            self._write(("done", request_id, error, spans))
+
+    def _thread_pool_callback(self, session_id, **kwargs):
+        callback = super()._thread_pool_callback(session_id, **kwargs)
+        context = kwargs.get("context")
+
+        def func(worker):
+            callback(worker)
+            if worker.cancelled():
+                return self._done(context, "cancelled")
+            exception = worker.exception()
+            if exception is None and worker.result() is DEFERRED:
+                return
+            self._done(context, "{}: {}".format(type(exception).__name__, exception) if exception else None)
+
+        return func
+
+    def _cancel_prefetch(self, context):
+        # 会话被重置时排队中的消息不会再处理，通知前端结束
+        super()._cancel_prefetch(context)
+        self._done(context, "cancelled")
+
+    def serve(self):
+        while True:
+            try:
+                message = self.conn.recv()
+            except (EOFError, OSError):
+                # 前端进程已退出
+                break
+            if message[0] == "handle":
+                _, request_id, context, identity = message
+                self.name, self.user_id = identity
+                context["worker_request_id"] = request_id
+                parent = context.kwargs.pop("trace_parent", None)
+                context["trace"] = tracing.RemoteTrace(*parent) if parent else None
+                self.produce(context)
+            elif message[0] == "ack":
+                with self.acks_lock:
+                    ack = self.acks.get(message[1])
+                if ack is not None:
+                    ack[1] = message[2]
+                    ack[0].set()
+            elif message[0] == "stop":
+                break
+        logger.info("[WorkerPool] worker %s exit", self.index)
+
+
+def worker_main(conn, index, channel_type, not_support_reply_types, multi_reply):
+    # 由前端进程负责退出，Ctrl+C时worker等待前端通知
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from config import load_config
+    from plugins import PluginManager
+
+    log.use_process_file("worker-{}".format(index))
+    load_config()
+    logger.info("[WorkerPool] worker %s started, pid=%s", index, os.getpid())
+    # 前端进程使用metrics_port，worker依次使用后面的端口
+    metrics.start_server(index + 1)
+    PluginManager().load_plugins()
+    WorkerChannel(conn, index, channel_type, not_support_reply_types, multi_reply).serve()
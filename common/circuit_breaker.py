@@ -0,0 +1,102 @@
+import threading
+import time
+from collections import deque
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    按最近一段时间的错误率和p95耗时熔断:
+    closed: 正常放行，统计窗口内请求数足够且错误率或p95耗时超过阈值时进入open
+    open: 拒绝请求，open_seconds后进入half_open
+    half_open: 只放行一个探测请求，成功则恢复closed，失败则重新open
+    """
+
+    def __init__(self, name, window=60, min_requests=5, error_rate=0.5, max_p95=0, open_seconds=30):
+        self.name = name
+        self.window = window  # 统计窗口(秒)
+        self.min_requests = min_requests  # 窗口内请求数达到该值才判断是否熔断
+        self.error_rate = error_rate  # 错误率阈值
+        self.max_p95 = max_p95  # p95耗时阈值(秒)，0表示不按耗时熔断
+        self.open_seconds = open_seconds  # 熔断持续时间(秒)
+        self.lock = threading.Lock()
+        self.records = deque()  # [(完成时间, 是否成功, 耗时)]
+        self.state = CLOSED
+        self.opened_at = 0
+        self.probing = False
+
+    def _trim(self, now):
+        while self.records and now - self.records[0][0] > self.window:
+            self.records.popleft()
+
+    def allow(self):
+        """
+        :return: 当前是否可以发起请求，half_open状态下返回True即占用探测名额
+        """
+        now = time.time()
+        with self.lock:
+            if self.state == OPEN:
+                if now - self.opened_at < self.open_seconds:
+                    return False
+                self.state = HALF_OPEN
+                self.probing = False
+            if self.state == HALF_OPEN:
+                if self.probing:
+                    return False
+                self.probing = True
+            return True
+
+    def record(self, success, latency):
+        now = time.time()
+        with self.lock:
+            self.records.append((now, success, latency))
+            self._trim(now)
+            if self.state == HALF_OPEN:
+                self.probing = False
+                if success:
+                    self.state = CLOSED
+                    self.records.clear()
+                else:
+                    self._open(now)
+                return
+            if self.state == CLOSED and len(self.records) >= self.min_requests:
+                errors = sum(1 for _, ok, _ in self.records if not ok)
+                if errors / len(self.records) >= self.error_rate:
+                    self._open(now)
+                elif self.max_p95 and self._p95() > self.max_p95:
+                    self._open(now)
+
+    def _open(self, now):
+        self.state = OPEN
+        self.opened_at = now
+
+    def _p95(self):
+        latencies = sorted(latency for _, ok, latency in self.records if ok)
+        if not latencies:
+            return 0
+        return latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+
+    def p95(self, min_samples=1):
+        """
+        :return: 窗口内成功请求的p95耗时，样本不足时返回None
+        """
+        with self.lock:
+            self._trim(time.time())
+            if sum(1 for _, ok, _ in self.records if ok) < min_samples:
+                return None
+            return self._p95()
+
+    def stats(self):
+        with self.lock:
+            self._trim(time.time())
+            total = len(self.records)
+            errors = sum(1 for _, ok, _ in self.records if not ok)
+            return {
+                "state": self.state,
+                "requests": total,
+                "error_rate": round(errors / total, 3) if total else 0,
+                "p95": round(self._p95(), 3),
+            }
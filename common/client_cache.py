@@ -0,0 +1,36 @@
+"""
+SDK客户端缓存：按(provider, api_key, base_url, model)复用长期存在的客户端实例，
+避免每条消息重新创建客户端、重新建立连接，也避免通过修改SDK的全局配置切换api_key
+"""
+
+import threading
+from collections import OrderedDict
+
+from common import metrics
+
+MAX_CLIENTS = 64  # 用户自定义api_key较多时，按最近使用淘汰
+
+_clients = OrderedDict()
+_lock = threading.Lock()
+
+
+def get_client(provider, factory, api_key=None, base_url=None, model=None):
+    """
+    :param factory: 缓存未命中时创建客户端的无参函数，返回的客户端需要是线程安全的
+    """
+    key = (provider, api_key, base_url, model)
+    with _lock:
+        client = _clients.get(key)
+        if client is not None:
+            _clients.move_to_end(key)
+    metrics.cache_hit("client", client is not None)
+    if client is not None:
+        return client
+    client = factory()
+    with _lock:
+        # 并发创建时保留先放入的实例
+        client = _clients.setdefault(key, client)
+        _clients.move_to_end(key)
+        while len(_clients) > MAX_CLIENTS:
+            _clients.popitem(last=False)
+    return client
@@ -1,3 +1,6 @@
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
 
 
@@ -40,3 +43,72 @@ class ExpiredDict(dict):
 
     def __iter__(self):
         return self.keys().__iter__()
+
+
+class BoundedExpiredDict(object):
+    """
+    有过期时间和容量上限的字典，按写入顺序淘汰：写入时清理已过期的条目，超过max_size时删除最早写入的条目，
+    不会像ExpiredDict一样在没有读取时无限增长；线程安全
+    :param default_factory: 读取不存在的key时用它创建默认值，与defaultdict相同
+    """
+
+    def __init__(self, expires_in_seconds, max_size=None, default_factory=None):
+        self.expires_in_seconds = expires_in_seconds
+        self.max_size = max_size
+        self.default_factory = default_factory
+        self.data = OrderedDict()  # key -> (value, 过期时间)
+        self.lock = threading.RLock()
+
+    def _purge(self, now):
+        while self.data:
+            key, (_, expiry_time) = next(iter(self.data.items()))
+            if expiry_time > now and (self.max_size is None or len(self.data) <= self.max_size):
+                break
+            del self.data[key]
+
+    def __setitem__(self, key, value):
+        now = time.monotonic()
+        with self.lock:
+            self.data[key] = (value, now + self.expires_in_seconds)
+            self.data.move_to_end(key)
+            self._purge(now)
+
+    def __getitem__(self, key):
+        with self.lock:
+            item = self.data.get(key)
+            if item is not None and item[1] > time.monotonic():
+                return item[0]
+            if item is not None:
+                del self.data[key]
+            if self.default_factory is None:
+                raise KeyError(key)
+            value = self.default_factory()
+            self[key] = value
+            return value
+
+    def __delitem__(self, key):
+        with self.lock:
+            del self.data[key]
+
+    def __contains__(self, key):
+        with self.lock:
+            item = self.data.get(key)
+            return item is not None and item[1] > time.monotonic()
+
+    def __len__(self):
+        with self.lock:
+            self._purge(time.monotonic())
+            return len(self.data)
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key in self:
+                return self.data[key][0]
+            return default
+
+    def pop(self, key, default=None):
+        with self.lock:
+            item = self.data.pop(key, None)
+            if item is None or item[1] <= time.monotonic():
+                return default
+            return item[0]
@@ -0,0 +1,168 @@
+"""
+HTTP类channel(web、api、公众号、企微应用、飞书)的服务层，替代web.py自带的开发服务器runsimple：
+服务线程数、监听队列、keep-alive超时、请求体大小均可配置，支持SO_REUSEPORT多进程监听，
+退出时停止接收新连接并等待进行中的请求处理完成；静态文件在内存中缓存，支持ETag和gzip
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import signal
+import sys
+import threading
+
+from common import const, log
+from common.log import logger
+from config import conf
+
+HTTP_CHANNELS = ["web", "api", "wechatmp", "wechatmp_service", "wechatcom_app", const.FEISHU]
+# 可以多进程监听的channel：请求之间不依赖进程内的状态。公众号被动回复的缓存和重试判断、web的轮询队列、
+# 回调的消息去重等都保存在进程内，同一用户的请求落到不同进程时会重复处理或丢失回复
+MULTI_PROCESS_CHANNELS = ["api"]
+GZIP_MIN_SIZE = 1024
+GZIP_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+
+_worker_pids = []
+
+
+def fork_workers(channel_type):
+    """
+    http_workers大于1时fork出多个进程，各自监听同一端口(SO_REUSEPORT)，由内核分配连接；
+    需要在创建channel之前调用，保证每个进程的处理线程、线程池等都在fork之后创建
+    :return: 当前进程的编号，主进程为0
+    """
+    workers = conf().get("http_workers", 1)
+    if channel_type not in HTTP_CHANNELS or workers <= 1 or not hasattr(os, "fork"):
+        return 0
+    if channel_type not in MULTI_PROCESS_CHANNELS:
+        logger.warning("[HTTP] http_workers is not supported by channel %s, which keeps per-process state, run in a single process",
+                       channel_type)
+        return 0
+    for index in range(1, workers):
+        pid = os.fork()
+        if pid == 0:
+            _worker_pids.clear()
+            log.use_process_file("http-{}".format(index))
+            return index
+        _worker_pids.append(pid)
+    logger.info("[HTTP] started %s worker processes: %s", workers, [os.getpid()] + _worker_pids)
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        _forward_signal(signum)
+    return 0
+
+
+def _forward_signal(signum):
+    # 主进程收到退出信号时先通知子进程，再执行原有的处理函数
+    old_handler = signal.getsignal(signum)
+
+    def handler(_signo, _stack_frame):
+        for pid in _worker_pids:
+            try:
+                os.kill(pid, _signo)
+            except OSError:
+                pass
+        if callable(old_handler):
+            return old_handler(_signo, _stack_frame)
+        sys.exit(0)
+
+    signal.signal(signum, handler)
+
+
+def create_server(wsgi_app, port, host="0.0.0.0", threads=None):
+    from cheroot import wsgi
+
+    threads = threads or conf().get("http_server_threads", 32)
+    server = wsgi.Server(
+        (host, port),
+        wsgi_app,
+        numthreads=threads,
+        # cheroot默认的监听队列只有5，同时建立大量连接时会被重置
+        request_queue_size=conf().get("http_backlog", 128),
+        timeout=conf().get("http_keepalive_timeout", 15),
+        shutdown_timeout=conf().get("http_shutdown_timeout", 10),
+        reuse_port=conf().get("http_workers", 1) > 1,
+    )
+    server.keep_alive_conn_limit = conf().get("http_keepalive_conn_limit", 100)
+    server.max_request_body_size = conf().get("http_max_body_size", 10 * 1024 * 1024)
+    server.nodelay = True
+    return server
+
+
+def serve(app, port, host="0.0.0.0", threads=None):
+    """
+    启动服务并阻塞，收到SystemExit或KeyboardInterrupt时停止接收新连接，
+    最多等待http_shutdown_timeout秒让进行中的请求完成
+    :param app: web.application
+    :param threads: 服务线程数，默认http_server_threads
+    """
+    server = create_server(app.wsgifunc(), port, host, threads)
+    logger.info("[HTTP] listening on %s:%s, pid=%s, threads=%s", host, port, os.getpid(), server.requests.min)
+    try:
+        server.start()
+    except (KeyboardInterrupt, SystemExit):
+        logger.info("[HTTP] shutting down, waiting for inflight requests")
+        server.stop()
+        raise
+
+
+class StaticFiles(object):
+    """
+    按需读取目录下的文件并缓存在内存中，同时缓存gzip压缩结果，通过ETag支持304
+    """
+
+    def __init__(self, directory, max_age=3600):
+        self.directory = os.path.abspath(directory)
+        self.max_age = max_age
+        self.files = {}  # 相对路径 -> (内容, gzip内容, ETag, Content-Type)
+        self.lock = threading.Lock()
+
+    def _load(self, path):
+        full_path = os.path.normpath(os.path.join(self.directory, path))
+        # 确保请求的文件在目录内
+        if not full_path.startswith(self.directory + os.sep) or not os.path.isfile(full_path):
+            return None
+        with open(full_path, "rb") as f:
+            body = f.read()
+        content_type = mimetypes.guess_type(full_path)[0] or "application/octet-stream"
+        gzipped = None
+        if len(body) >= GZIP_MIN_SIZE and content_type.startswith(GZIP_TYPES):
+            gzipped = gzip.compress(body, mtime=0)
+            if len(gzipped) >= len(body):
+                gzipped = None
+        etag = '"{}"'.format(hashlib.sha1(body).hexdigest()[:16])
+        return body, gzipped, etag, content_type
+
+    def get(self, path):
+        entry = self.files.get(path)
+        if entry is None:
+            with self.lock:
+                entry = self.files.get(path)
+                if entry is None:
+                    entry = self._load(path)
+                    if entry is None:
+                        return None
+                    self.files[path] = entry
+        return entry
+
+    def serve(self, path, max_age=None):
+        """
+        在web.py handler中返回文件内容，不存在时抛出404
+        """
+        import web
+
+        entry = self.get(path)
+        if entry is None:
+            raise web.notfound()
+        body, gzipped, etag, content_type = entry
+        web.header("Content-Type", content_type)
+        web.header("ETag", etag)
+        web.header("Cache-Control", "max-age={}".format(self.max_age if max_age is None else max_age))
+        if gzipped is not None:
+            web.header("Vary", "Accept-Encoding")
+        if web.ctx.env.get("HTTP_IF_NONE_MATCH") == etag:
+            raise web.notmodified()
+        if gzipped is not None and "gzip" in web.ctx.env.get("HTTP_ACCEPT_ENCODING", ""):
+            web.header("Content-Encoding", "gzip")
+            return gzipped
+        return body
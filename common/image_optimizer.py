@@ -0,0 +1,121 @@
+import io
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from PIL import Image
+
+from common.log import logger
+from config import conf
+
+MIN_QUALITY = 20
+MAX_QUALITY = 95
+MAX_RESIZE_TIMES = 5
+
+_pool = None
+_pool_slots = None
+_pool_lock = threading.Lock()
+
+
+def _encode(img, fmt, **kwargs):
+    buf = io.BytesIO()
+    img.save(buf, fmt, **kwargs)
+    return buf.getvalue()
+
+
+def _search_quality(img, max_size):
+    """
+    二分查找不超过max_size的最高JPEG质量
+    :return: (满足大小限制的编码结果或None, 最低质量下的编码大小)
+    """
+    lo, hi = MIN_QUALITY, MAX_QUALITY
+    best = None
+    min_size = None
+    while lo <= hi:
+        quality = (lo + hi) // 2
+        data = _encode(img, "JPEG", quality=quality)
+        if len(data) <= max_size:
+            best = data
+            lo = quality + 1
+        else:
+            min_size = len(data)
+            hi = quality - 1
+    return best, min_size
+
+
+def optimize_image_bytes(data, max_size=None, convert_webp=True):
+    """
+    在一次解码中完成webp转换、JPEG质量二分查找和必要的缩放
+    :param data: 原始图片数据
+    :param max_size: 输出大小上限(字节)，None表示不限制
+    :param convert_webp: 是否将webp转为png(超过大小限制时转为jpeg)
+    :return: (图片数据, 格式)，无需处理时图片数据为None
+    """
+    img = Image.open(io.BytesIO(data))
+    fmt = (img.format or "").lower()
+    out = None
+    if fmt == "webp" and convert_webp:
+        out = _encode(img.convert("RGBA"), "PNG")
+        fmt = "png"
+    if not max_size or len(out or data) <= max_size:
+        return out, fmt
+
+    rgb_image = img.convert("RGB")
+    for _ in range(MAX_RESIZE_TIMES):
+        out, min_size = _search_quality(rgb_image, max_size)
+        if out:
+            return out, "jpeg"
+        # 最低质量仍然超限，按面积比例缩小后重新查找
+        scale = max(0.1, (max_size / min_size) ** 0.5 * 0.95)
+        size = (max(1, int(rgb_image.width * scale)), max(1, int(rgb_image.height * scale)))
+        rgb_image = rgb_image.resize(size, Image.LANCZOS)
+    raise ValueError("image can not be compressed to {} bytes".format(max_size))
+
+
+def _get_pool():
+    global _pool, _pool_slots
+    with _pool_lock:
+        if _pool is None:
+            workers = conf().get("image_optimize_workers", 2)
+            _pool = ProcessPoolExecutor(max_workers=workers)
+            # 限制提交中的任务数，避免大图片数据在进程池队列中堆积
+            _pool_slots = threading.BoundedSemaphore(workers * 2)
+        return _pool, _pool_slots
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+            _pool = None
+
+
+def optimize_image(file, max_size=None, convert_webp=True):
+    """
+    压缩/转换图片，CPU密集的编码在独立进程中执行，不占用消息处理线程的GIL
+    :param file: 图片file-like对象
+    :return: 无需处理时返回原对象，否则返回新的BytesIO
+    """
+    from common.utils import fsize
+
+    if not convert_webp and (not max_size or fsize(file) <= max_size):
+        return file
+    file.seek(0)
+    data = file.read()
+    if conf().get("image_optimize_workers", 2) > 0:
+        pool, slots = _get_pool()
+        with slots:
+            try:
+                out, fmt = pool.submit(optimize_image_bytes, data, max_size, convert_webp).result()
+            except BrokenProcessPool as e:
+                logger.warning("[image_optimizer] process pool broken, optimize in current process: {}".format(e))
+                _reset_pool()
+                out, fmt = optimize_image_bytes(data, max_size, convert_webp)
+    else:
+        out, fmt = optimize_image_bytes(data, max_size, convert_webp)
+    if out is None:
+        file.seek(0)
+        return file
+    logger.debug("[image_optimizer] image optimized, size %s -> %s, format=%s", len(data), len(out), fmt)
+    return io.BytesIO(out)
@@ -0,0 +1,212 @@
+"""
+多api_key负载均衡：同一服务商配置多个key时，按剩余额度和进行中的请求数选择key，
+被限流(429)或额度用尽的key进入冷却期，冷却结束后重新参与分配
+
+配置方式: 在原有单个key的配置项名后加s，填写额外的key列表，如
+    "open_ai_api_key": "sk-xxx",
+    "open_ai_api_keys": ["sk-yyy", "sk-zzz"]
+"""
+
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from common.log import logger
+from config import conf
+
+DURATION_PATTERN = re.compile(r"([\d.]+)(ms|s|m|h)")
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+# 各服务商的剩余额度响应头：openai及兼容接口为x-ratelimit-*，claude为anthropic-ratelimit-*
+REMAINING_REQUESTS_HEADERS = ("x-ratelimit-remaining-requests", "anthropic-ratelimit-requests-remaining")
+REMAINING_TOKENS_HEADERS = ("x-ratelimit-remaining-tokens", "anthropic-ratelimit-tokens-remaining")
+
+
+def parse_duration(value):
+    """
+    解析限流头中的重置时间，如 "1s", "6m0s", "120ms", "20"
+    :return: 秒数，无法解析时返回None
+    """
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    matches = DURATION_PATTERN.findall(value)
+    if not matches:
+        return None
+    return sum(float(num) * DURATION_UNITS[unit] for num, unit in matches)
+
+
+def _first_header(headers, names):
+    for name in names:
+        value = headers.get(name)
+        if value is not None:
+            return value
+    return None
+
+
+def mask_key(key):
+    if not key or len(key) <= 10:
+        return "***"
+    return key[:6] + "..." + key[-4:]
+
+
+class ApiKey(object):
+    def __init__(self, key):
+        self.key = key
+        self.inflight = 0
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.tokens = 0
+        self.remaining_requests = None
+        self.remaining_tokens = None
+        self.cooldown_until = 0
+
+    def healthy(self, now):
+        return self.cooldown_until <= now
+
+    def stats(self, now):
+        return {
+            "key": mask_key(self.key),
+            "inflight": self.inflight,
+            "requests": self.requests,
+            "errors": self.errors,
+            "rate_limited": self.rate_limited,
+            "tokens": self.tokens,
+            "remaining_requests": self.remaining_requests,
+            "remaining_tokens": self.remaining_tokens,
+            "cooldown": max(0, round(self.cooldown_until - now, 1)),
+        }
+
+
+class KeyPool(object):
+    def __init__(self, name, keys):
+        self.name = name
+        self.lock = threading.Lock()
+        self.keys = [ApiKey(key) for key in dict.fromkeys(k for k in keys if k)]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def acquire(self):
+        """
+        选择冷却期外、进行中请求最少、剩余额度最多的key；全部在冷却时选择最早结束冷却的key
+        """
+        if not self.keys:
+            return None
+        now = time.time()
+        with self.lock:
+            healthy = [k for k in self.keys if k.healthy(now)]
+            if healthy:
+                key = min(
+                    healthy,
+                    key=lambda k: (
+                        k.inflight,
+                        -(k.remaining_requests if k.remaining_requests is not None else float("inf")),
+                        -(k.remaining_tokens if k.remaining_tokens is not None else float("inf")),
+                        k.requests,
+                    ),
+                )
+            else:
+                key = min(self.keys, key=lambda k: k.cooldown_until)
+            key.inflight += 1
+            key.requests += 1
+            return key
+
+    def release(self, key, tokens=0, headers=None, rate_limited=False, error=False):
+        """
+        请求结束后更新key的状态
+        :param headers: 响应头，用于读取x-ratelimit-*和retry-after
+        :param rate_limited: 是否被限流(429)
+        """
+        if key is None:
+            return
+        now = time.time()
+        cooldown = None
+        with self.lock:
+            key.inflight = max(0, key.inflight - 1)
+            key.tokens += tokens or 0
+            if error:
+                key.errors += 1
+            if headers:
+                remaining_requests = _first_header(headers, REMAINING_REQUESTS_HEADERS)
+                remaining_tokens = _first_header(headers, REMAINING_TOKENS_HEADERS)
+                if remaining_requests is not None:
+                    key.remaining_requests = int(float(remaining_requests))
+                if remaining_tokens is not None:
+                    key.remaining_tokens = int(float(remaining_tokens))
+                if key.remaining_requests == 0:
+                    cooldown = parse_duration(headers.get("x-ratelimit-reset-requests"))
+                elif key.remaining_tokens == 0:
+                    cooldown = parse_duration(headers.get("x-ratelimit-reset-tokens"))
+            if rate_limited:
+                key.rate_limited += 1
+                retry_after = parse_duration(headers.get("retry-after")) if headers else None
+                cooldown = retry_after or cooldown or conf().get("api_key_cooldown", 20)
+            if cooldown:
+                key.cooldown_until = max(key.cooldown_until, now + cooldown)
+        if cooldown:
+            logger.warning("[KeyPool] {} key {} cool down for {}s".format(self.name, mask_key(key.key), cooldown))
+
+    def has_healthy(self):
+        now = time.time()
+        with self.lock:
+            return any(k.healthy(now) for k in self.keys)
+
+    def cooldown_remaining(self):
+        """
+        :return: 最早可用的key还需要等待的秒数
+        """
+        now = time.time()
+        with self.lock:
+            if not self.keys:
+                return 0
+            return max(0, min(k.cooldown_until for k in self.keys) - now)
+
+    @contextmanager
+    def use(self):
+        """
+        with pool.use() as key: ...
+        只统计请求数和进行中的请求，需要上报限流或额度信息时直接调用acquire/release
+        """
+        key = self.acquire()
+        try:
+            yield key
+        finally:
+            self.release(key)
+
+    def stats(self):
+        now = time.time()
+        with self.lock:
+            return [k.stats(now) for k in self.keys]
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_key_pool(conf_key):
+    """
+    :param conf_key: 单个key的配置项名，如 open_ai_api_key、linkai_api_key、claude_api_key
+    """
+    keys = [conf().get(conf_key)] + list(conf().get(conf_key + "s") or [])
+    with _pools_lock:
+        pool = _pools.get(conf_key)
+        # 配置重新加载后key列表变化时重建
+        if pool is None or [k.key for k in pool.keys] != list(dict.fromkeys(k for k in keys if k)):
+            pool = KeyPool(conf_key, keys)
+            _pools[conf_key] = pool
+        return pool
+
+
+def key_pool_stats():
+    """
+    :return: 各服务商每个key的使用情况
+    """
+    with _pools_lock:
+        pools = dict(_pools)
+    return {name: pool.stats() for name, pool in pools.items()}
@@ -19,7 +19,7 @@ class ChatClient(LinkAIClient):
     def on_message(self, push_msg: PushMsg):
         session_id = push_msg.session_id
         msg_content = push_msg.msg_content
-        logger.info(f"receive msg push, session_id={session_id}, msg_content={msg_content}")
+        logger.info("receive msg push, session_id=%s, msg_content=%s", session_id, msg_content)
         context = Context()
         context.type = ContextType.TEXT
         context["receiver"] = session_id
@@ -29,7 +29,7 @@ class ChatClient(LinkAIClient):
     def on_config(self, config: dict):
         if not self.client_id:
             return
-        logger.info(f"[LinkAI] 从客户端管理加载远程配置: {config}")
+        logger.info("[LinkAI] 从客户端管理加载远程配置: %s", config)
         if config.get("enabled") != "Y":
             return
 
@@ -1,38 +1,223 @@
+"""
+日志：业务线程只把日志记录放入队列，由后台线程写入控制台和文件，写盘不阻塞消息处理
+日志文件按大小和时间轮转，可选JSON格式，支持按模块设置日志级别(log_levels)
+多进程时(http_workers、worker_processes)子进程写入各自的日志文件，如run.http-1.log，各进程只轮转自己的文件
+
+调用时使用 logger.debug("xxx %s", value) 的形式传参，日志级别未开启时不会格式化参数
+"""
+
+import atexit
+import json
 import logging
+import logging.handlers
+import os
+import queue
 import sys
+import time
+
+LOG_FORMAT = "[%(levelname)s][%(asctime)s][%(filename)s:%(lineno)d] - %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROTATE_INTERVALS = {"hour": 3600, "midnight": 86400}
+
+_listener = None
+_queue_handler = None
+_handler_args = {}  # 最近一次创建日志输出的参数，子进程切换日志文件时按同样的参数重建
+_process_name = ""  # 子进程名，非空时日志文件名带上该后缀
+
+
+class lazy(object):
+    """
+    参数需要额外计算时使用，只在日志实际输出时调用func，如 logger.debug("%s", lazy(json.dumps, data))
+    """
+
+    def __init__(self, func, *args, **kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+    def __str__(self):
+        return str(self.func(*self.args, **self.kwargs))
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    每条日志输出为一行json
+    """
+
+    def format(self, record):
+        data = {
+            "time": self.formatTime(record, DATE_FORMAT),
+            "level": record.levelname,
+            "file": record.filename,
+            "line": record.lineno,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+
+class RotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    文件超过max_bytes或到达轮转时间时轮转，备份为run.log.1 ~ run.log.N
+    """
+
+    def __init__(self, filename, max_bytes=0, backup_count=5, when=""):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=max(1, backup_count), encoding="utf-8")
+        self.interval = ROTATE_INTERVALS.get(when, 0)
+        self.rollover_at = self._next_rollover(time.time())
+
+    def _next_rollover(self, now):
+        if not self.interval:
+            return None
+        # 按本地时间对齐到整点或零点
+        offset = time.localtime(now).tm_gmtoff
+        return now - (now + offset) % self.interval + self.interval
+
+    def shouldRollover(self, record):
+        if self.rollover_at is not None and time.time() >= self.rollover_at:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self.rollover_at = self._next_rollover(time.time())
+
+
+class ModuleLevelFilter(logging.Filter):
+    """
+    按日志所在模块过滤，levels如 {"channel.wechat": "DEBUG", "plugins": "WARNING"}，按最长的模块前缀匹配
+    """
 
+    def __init__(self, default_level, levels):
+        super().__init__()
+        self.default_level = default_level
+        self.levels = sorted(((name, logging._checkLevel(level.upper())) for name, level in levels.items()), key=lambda x: -len(x[0]))
+        self.cache = {}  # pathname -> level
 
-def _reset_logger(log):
+    def _level(self, pathname):
+        level = self.cache.get(pathname)
+        if level is None:
+            module = os.path.splitext(os.path.relpath(pathname, ROOT_DIR))[0].replace(os.sep, ".")
+            level = self.default_level
+            for name, module_level in self.levels:
+                if module == name or module.startswith(name + "."):
+                    level = module_level
+                    break
+            self.cache[pathname] = level
+        return level
+
+    def filter(self, record):
+        return record.levelno >= self._level(record.pathname)
+
+
+def _process_file(log_file):
+    if not _process_name:
+        return log_file
+    root, ext = os.path.splitext(log_file)
+    return "{}.{}{}".format(root, _process_name, ext)
+
+
+def _build_handlers(log_file="run.log", max_bytes=0, backup_count=5, when="", json_format=False):
+    _handler_args.clear()
+    _handler_args.update(log_file=log_file, max_bytes=max_bytes, backup_count=backup_count, when=when, json_format=json_format)
+    text_formatter = logging.Formatter(LOG_FORMAT, datefmt=DATE_FORMAT)
+    console_handle = logging.StreamHandler(sys.stdout)
+    console_handle.setFormatter(text_formatter)
+    handlers = [console_handle]
+    if log_file:
+        log_file = _process_file(log_file)
+        if max_bytes or when:
+            file_handle = RotatingFileHandler(log_file, max_bytes, backup_count, when)
+        else:
+            # 第一条日志写入时才创建文件，只导入模块不会生成空的日志文件
+            file_handle = logging.FileHandler(log_file, encoding="utf-8", delay=True)
+        file_handle.setFormatter(JsonFormatter() if json_format else text_formatter)
+        handlers.insert(0, file_handle)
+    return handlers
+
+
+def _start(log, handlers):
+    global _listener, _queue_handler
+    _stop()
     for handler in log.handlers:
         handler.close()
-        log.removeHandler(handler)
-        del handler
     log.handlers.clear()
     log.propagate = False
-    console_handle = logging.StreamHandler(sys.stdout)
-    console_handle.setFormatter(
-        logging.Formatter(
-            "[%(levelname)s][%(asctime)s][%(filename)s:%(lineno)d] - %(message)s",
-            datefmt="%Y-%m-%d %H:%M:%S",
-        )
-    )
-    file_handle = logging.FileHandler("run.log", encoding="utf-8")
-    file_handle.setFormatter(
-        logging.Formatter(
-            "[%(levelname)s][%(asctime)s][%(filename)s:%(lineno)d] - %(message)s",
-            datefmt="%Y-%m-%d %H:%M:%S",
-        )
+    _queue_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+    _listener = logging.handlers.QueueListener(_queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    log.addHandler(_queue_handler)
+
+
+def _stop():
+    # 退出前写完队列中的日志
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+def _restart_in_child():
+    # fork出的子进程没有日志线程，重新创建队列和日志线程
+    global _listener
+    if _listener is None:
+        return
+    handlers = _listener.handlers
+    _queue_handler.queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(_queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def use_process_file(name):
+    """
+    子进程启动时调用，之后的日志写入带name后缀的文件，避免多个进程同时轮转同一个文件
+    """
+    global _process_name
+    if name == _process_name:
+        return
+    _process_name = name
+    level_filters = list(_queue_handler.filters)
+    _start(logger, _build_handlers(**_handler_args))
+    for level_filter in level_filters:
+        _queue_handler.addFilter(level_filter)
+
+
+def setup(config):
+    """
+    加载配置后按配置重建日志输出
+    """
+    level = logging.DEBUG if config.get("debug", False) else logging.INFO
+    handlers = _build_handlers(
+        log_file=config.get("log_file", "run.log"),
+        max_bytes=config.get("log_max_bytes", 52428800),
+        backup_count=config.get("log_backup_count", 5),
+        when=config.get("log_rotate_when", ""),
+        json_format=config.get("log_json", False),
     )
-    log.addHandler(file_handle)
-    log.addHandler(console_handle)
+    _start(logger, handlers)
+    levels = config.get("log_levels") or {}
+    if levels:
+        module_filter = ModuleLevelFilter(level, levels)
+        _queue_handler.addFilter(module_filter)
+        # logger级别取最低的级别，由过滤器按模块判断
+        level = min([level] + [module_level for _, module_level in module_filter.levels])
+    logger.setLevel(level)
 
 
 def _get_logger():
     log = logging.getLogger("log")
-    _reset_logger(log)
+    _start(log, _build_handlers())
     log.setLevel(logging.INFO)
     return log
 
 
 # 日志句柄
 logger = _get_logger()
+atexit.register(_stop)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_in_child)
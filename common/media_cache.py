@@ -0,0 +1,103 @@
+import hashlib
+import io
+import threading
+import time
+from collections import OrderedDict
+
+from common import metrics
+from common.log import logger
+from config import conf
+
+# 临时素材在微信公众号/企业微信平台的有效期为3天，预留1小时余量避免临界时刻失效
+TEMP_MEDIA_EXPIRES = 3 * 24 * 3600 - 3600
+
+
+def file_md5(file, chunk_size=64 * 1024):
+    """
+    增量计算文件内容的md5，支持文件路径和file-like对象，计算后恢复对象的读写位置
+    """
+    md5 = hashlib.md5()
+    if isinstance(file, str):
+        with open(file, "rb") as f:
+            for block in iter(lambda: f.read(chunk_size), b""):
+                md5.update(block)
+        return md5.hexdigest()
+    if isinstance(file, io.BytesIO):
+        md5.update(file.getbuffer())
+        return md5.hexdigest()
+    pos = file.tell()
+    file.seek(0)
+    for block in iter(lambda: file.read(chunk_size), b""):
+        md5.update(block)
+    file.seek(pos)
+    return md5.hexdigest()
+
+
+class MediaCache(object):
+    """
+    平台media_id缓存，key为(平台, 媒体类型, 内容md5)，命中且未过期时直接复用media_id，避免重复上传
+    """
+
+    def __init__(self, expires_in_seconds=TEMP_MEDIA_EXPIRES, max_size=1000):
+        self.expires_in_seconds = expires_in_seconds
+        self.max_size = max_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.cache.get(key)
+            if item is None:
+                return None
+            media_id, expiry_time = item
+            if time.time() > expiry_time:
+                del self.cache[key]
+                return None
+            self.cache.move_to_end(key)
+            return media_id
+
+    def set(self, key, media_id, expires_in_seconds=None):
+        expires_in_seconds = expires_in_seconds or self.expires_in_seconds
+        with self.lock:
+            self.cache[key] = (media_id, time.time() + expires_in_seconds)
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)
+
+    def get_or_upload(self, platform, media_type, file, upload_func):
+        """
+        :param platform: 平台名称，如 wechatmp、wechatcom、itchat
+        :param media_type: 媒体类型，如 image、voice、video、file
+        :param file: 文件路径或file-like对象，用于计算内容md5
+        :param upload_func: 无参函数，执行实际上传并返回media_id
+        :return: media_id
+        """
+        if not conf().get("media_cache_enabled", True):
+            return upload_func()
+        key = (platform, media_type, file_md5(file))
+        media_id = self.get(key)
+        metrics.cache_hit("media", bool(media_id))
+        if media_id:
+            logger.debug("[media_cache] hit, platform=%s, type=%s, media_id=%s", platform, media_type, media_id)
+            return media_id
+        media_id = upload_func()
+        if media_id:
+            self.set(key, media_id)
+        return media_id
+
+    def remove(self, platform, media_type, file):
+        key = (platform, media_type, file_md5(file))
+        with self.lock:
+            self.cache.pop(key, None)
+
+    def clear(self, platform):
+        """
+        删除某个平台的全部缓存，如itchat重新登录后之前上传的MediaId都已失效，
+        platform为"itchat"时同时删除各登录账号的"itchat:<user_id>"
+        """
+        with self.lock:
+            for key in [key for key in self.cache if key[0] == platform or key[0].startswith(platform + ":")]:
+                del self.cache[key]
+
+
+media_cache = MediaCache()
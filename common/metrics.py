@@ -0,0 +1,369 @@
+"""
+运行指标：计数器和直方图在业务线程中累加，收集指标时再汇总；队列长度、线程池、临时目录等
+状态在收集时通过collector读取。开启metrics_enabled后在独立端口以Prometheus文本格式提供 /metrics，
+与channel类型无关
+
+累加时每个线程写自己的分片，不加锁，也不会与其它线程竞争；只有线程第一次写入某个指标时加锁登记分片
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+from common.log import logger
+from config import conf
+
+# 秒，覆盖从几十毫秒的插件到上百秒的bot请求
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+
+class _Metric(object):
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.shards = []  # 各线程的 {标签值: 数值}
+        self.shards_lock = threading.Lock()
+        self.local = threading.local()
+
+    def _shard(self):
+        shard = getattr(self.local, "shard", None)
+        if shard is None:
+            shard = {}
+            self.local.shard = shard
+            with self.shards_lock:
+                self.shards.append(shard)
+        return shard
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _snapshots(self):
+        with self.shards_lock:
+            shards = list(self.shards)
+        # dict()复制在持有GIL时完成，不会遇到其它线程写入到一半的状态
+        return [dict(shard) for shard in shards]
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        shard = self._shard()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def values(self):
+        total = {}
+        for shard in self._snapshots():
+            for key, value in shard.items():
+                total[key] = total.get(key, 0) + value
+        return total
+
+    def samples(self):
+        return [(self.name, list(zip(self.labelnames, key)), value) for key, value in sorted(self.values().items())]
+
+
+class Gauge(Counter):
+    """
+    可增减的数值，如进行中的请求数；各线程分片的和即为当前值，inc和dec可以在不同线程中调用
+    """
+
+    type = "gauge"
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track(self, **labels):
+        self.inc(1, **labels)
+        try:
+            yield
+        finally:
+            self.dec(1, **labels)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        shard = self._shard()
+        key = self._key(labels)
+        item = shard.get(key)
+        if item is None:
+            # 各区间计数(含+Inf)、总和、总数
+            item = shard[key] = [0] * (len(self.buckets) + 3)
+        item[bisect.bisect_left(self.buckets, value)] += 1
+        item[-2] += value
+        item[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(time.time() - start, **labels)
+
+    def samples(self):
+        total = {}
+        for shard in self._snapshots():
+            for key, item in shard.items():
+                item = list(item)
+                merged = total.get(key)
+                total[key] = item if merged is None else [a + b for a, b in zip(merged, item)]
+        samples = []
+        for key, item in sorted(total.items()):
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), item):
+                cumulative += count
+                samples.append((self.name + "_bucket", labels + [("le", _format_value(bound))], cumulative))
+            samples.append((self.name + "_sum", labels, item[-2]))
+            samples.append((self.name + "_count", labels, item[-1]))
+        return samples
+
+
+class Registry(object):
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+        self.lock = threading.Lock()
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self._register(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def _register(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+        return metric
+
+    def register_collector(self, func):
+        """
+        :param func: 收集指标时调用，返回 [(指标名, 类型, 说明, [(标签dict, 数值), ...]), ...]
+        """
+        with self.lock:
+            self.collectors.append(func)
+        return func
+
+    def render(self):
+        """
+        :return: Prometheus文本格式
+        """
+        with self.lock:
+            metrics = list(self.metrics)
+            collectors = list(self.collectors)
+        lines = []
+        for metric in metrics:
+            lines.append("# HELP {} {}".format(metric.name, metric.help))
+            lines.append("# TYPE {} {}".format(metric.name, metric.type))
+            for name, labels, value in metric.samples():
+                lines.append(_format_sample(name, labels, value))
+        for collector in collectors:
+            try:
+                families = collector()
+            except Exception as e:
+                logger.warning("[Metrics] collector %s error: %s", getattr(collector, "__name__", collector), e)
+                continue
+            for name, type, help, samples in families:
+                lines.append("# HELP {} {}".format(name, help))
+                lines.append("# TYPE {} {}".format(name, type))
+                for labels, value in samples:
+                    lines.append(_format_sample(name, list(labels.items()), value))
+        return "\n".join(lines) + "\n"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_sample(name, labels, value):
+    if labels:
+        return '{}{{{}}} {}'.format(name, ",".join('{}="{}"'.format(k, _escape(v)) for k, v in labels), _format_value(value))
+    return "{} {}".format(name, _format_value(value))
+
+
+registry = Registry()
+
+messages_in = registry.counter("chat_messages_received_total", "进入处理队列的消息数", ("channel", "type"))
+messages_out = registry.counter("chat_messages_sent_total", "发送成功的回复数", ("channel", "type"))
+send_errors = registry.counter("chat_send_errors_total", "发送失败次数(含重试)", ("channel",))
+handler_errors = registry.counter("chat_handler_errors_total", "消息处理线程抛出异常的次数", ("channel",))
+handler_active = registry.gauge("chat_handler_active", "正在处理消息的线程数", ("channel",))
+llm_latency = registry.histogram("llm_request_seconds", "模型请求耗时，由各bot按实际请求的模型记录", ("provider", "model", "status"))
+llm_tokens = registry.counter("llm_tokens_total", "bot请求消耗的token数，kind为prompt或completion", ("provider", "model", "kind"))
+cache_requests = registry.counter("cache_requests_total", "缓存查询次数", ("cache", "result"))
+
+
+def record_tokens(provider, model, prompt_tokens, completion_tokens):
+    llm_tokens.inc(prompt_tokens or 0, provider=provider, model=model, kind="prompt")
+    llm_tokens.inc(completion_tokens or 0, provider=provider, model=model, kind="completion")
+
+
+class _LLMRequest(object):
+    __slots__ = ("ok",)
+
+    def __init__(self):
+        self.ok = True
+
+
+@contextmanager
+def llm_request(provider, model):
+    """
+    with metrics.llm_request("openai", model) as request: ... 记录一次模型请求的耗时，
+    抛出异常或设置request.ok = False(如返回错误状态码)时status为error
+    """
+    request = _LLMRequest()
+    start = time.time()
+    try:
+        yield request
+    except BaseException:
+        request.ok = False
+        raise
+    finally:
+        llm_latency.observe(time.time() - start, provider=provider, model=model or "", status="ok" if request.ok else "error")
+
+
+def cache_hit(cache, hit):
+    cache_requests.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def _collect_pipeline():
+    from channel.chat_channel import ChatChannel, handler_pool
+
+    with ChatChannel.lock:
+        sessions = list(ChatChannel.sessions.items())
+    depths = sorted(((session_id, item[0].qsize()) for session_id, item in sessions), key=lambda x: -x[1])
+    top = conf().get("metrics_session_top", 10)
+    return [
+        ("chat_sessions", "gauge", "有消息在排队或处理中的会话数", [({}, len(depths))]),
+        ("chat_queue_depth", "gauge", "所有会话排队中的消息总数", [({}, sum(depth for _, depth in depths))]),
+        # 会话数可能很多，只输出排队最多的几个会话
+        ("chat_session_queue_depth", "gauge", "排队最多的会话的排队消息数",
+         [({"session": session_id}, depth) for session_id, depth in depths[:top] if depth]),
+        ("chat_handler_pool_queued", "gauge", "已提交到处理线程池、等待线程的任务数", [({}, handler_pool._work_queue.qsize())]),
+        ("chat_handler_pool_threads", "gauge", "处理线程池已创建的线程数", [({}, len(handler_pool._threads))]),
+    ]
+
+
+def _collect_providers():
+    from common.key_pool import key_pool_stats
+    from common.retry import retry_stats
+
+    families = []
+    retry_samples = []
+    for provider, counters in retry_stats().items():
+        for kind, value in counters.items():
+            retry_samples.append(({"provider": provider, "kind": kind}, value))
+    families.append(("llm_retry_total", "counter", "bot请求的重试统计，kind为requests/retries/deferred/exhausted/budget_exhausted", retry_samples))
+    key_samples = {"inflight": [], "requests": [], "errors": [], "rate_limited": [], "tokens": []}
+    for pool, keys in key_pool_stats().items():
+        for name, samples in key_samples.items():
+            samples.append(({"pool": pool}, sum(k[name] for k in keys)))
+    for name, samples in key_samples.items():
+        type = "gauge" if name == "inflight" else "counter"
+        families.append(("llm_key_pool_" + name, type, "api key池的{}合计".format(name), samples))
+    try:
+        from bridge.bridge import Bridge
+
+        router = Bridge().chat_router
+    except Exception:
+        router = None
+    if router is not None:
+        states = []
+        error_rates = []
+        for bot_type, stats in router.stats().items():
+            states.append(({"bot": bot_type}, 0 if stats["state"] == "closed" else 1))
+            error_rates.append(({"bot": bot_type}, stats["error_rate"]))
+        families.append(("llm_circuit_open", "gauge", "bot熔断器是否打开(含半开)", states))
+        families.append(("llm_error_rate", "gauge", "熔断窗口内的失败率", error_rates))
+    return families
+
+
+def _collect_resources():
+    from common.tmp_dir import tmp_manager
+
+    tmp = tmp_manager.stats()
+    families = [
+        ("tmp_dir_bytes", "gauge", "临时目录占用的字节数", [({}, tmp.get("bytes", 0))]),
+        ("tmp_dir_files", "gauge", "临时目录中的文件数", [({}, tmp.get("files", 0))]),
+        ("tmp_dir_reaped_bytes_total", "counter", "临时目录累计清理的字节数", [({}, tmp.get("reaped_bytes", 0))]),
+    ]
+    try:
+        from voice.audio_convert import transcoder
+    except Exception:
+        return families
+    convert_count, convert_errors = [], []
+    for format, stats in transcoder.stats().items():
+        convert_count.append(({"format": format}, stats["count"]))
+        convert_errors.append(({"format": format}, stats["errors"]))
+    families.append(("audio_convert_total", "counter", "音频转换次数", convert_count))
+    families.append(("audio_convert_errors_total", "counter", "音频转换失败次数", convert_errors))
+    return families
+
+
+registry.register_collector(_collect_pipeline)
+registry.register_collector(_collect_providers)
+registry.register_collector(_collect_resources)
+
+
+def register_channel(channel):
+    """
+    channel提供stats()时，把返回的数值作为gauge输出，如公众号被动回复的等待线程数
+    """
+    if not hasattr(channel, "stats"):
+        return
+
+    def collect():
+        samples = [({"channel": channel.channel_type, "name": name}, value) for name, value in channel.stats().items()
+                   if isinstance(value, (int, float))]
+        return [("channel_stats", "gauge", "channel自身的状态统计", samples)]
+
+    registry.register_collector(collect)
+
+
+def wsgi_app(environ, start_response):
+    if environ.get("PATH_INFO") != "/metrics":
+        start_response("404 Not Found", [("Content-Type", "text/plain")])
+        return [b"not found"]
+    body = registry.render().encode("utf-8")
+    start_response("200 OK", [("Content-Type", "text/plain; version=0.0.4; charset=utf-8"), ("Content-Length", str(len(body)))])
+    return [body]
+
+
+def start_server(worker_index=0):
+    """
+    开启metrics_enabled时在后台线程启动指标服务；多进程监听时每个进程使用metrics_port+进程编号
+    """
+    if not conf().get("metrics_enabled", False):
+        return None
+    from common import http_server
+
+    port = conf().get("metrics_port", 9464) + worker_index
+    server = http_server.create_server(wsgi_app, port, conf().get("metrics_host", "127.0.0.1"), threads=2)
+    # 指标端口不参与多进程共享监听
+    server.reuse_port = False
+    threading.Thread(target=server.safe_start, name="metrics-server", daemon=True).start()
+    logger.info("[Metrics] serving on %s:%s/metrics", conf().get("metrics_host", "127.0.0.1"), port)
+    return server
@@ -0,0 +1,219 @@
+"""
+bot接口调用的统一重试策略：指数退避+随机抖动，限制重试次数、总耗时和重试预算
+
+在channel的消息处理线程中(deferrable范围内)，需要等待的重试不再sleep占用线程，
+而是抛出RetryLater，由channel交给调度线程在到期后重新提交到线程池继续执行；
+其它调用方(插件、对冲请求等)仍在当前线程等待后重试
+"""
+
+import heapq
+import itertools
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from common.log import logger
+from config import conf
+
+_local = threading.local()
+
+
+class RetryLater(Exception):
+    """
+    bot请求需要在delay秒后重试，resume执行重试并返回最终结果
+    """
+
+    def __init__(self, delay, resume):
+        super().__init__("retry after {:.1f}s".format(delay))
+        self.delay = delay
+        self.resume = resume
+        self.context = None  # 由channel记录需要继续处理的context
+
+    def then(self, callback):
+        """
+        :return: 新的RetryLater，重试得到结果后再交给callback处理
+        """
+        resume = self.resume
+
+        def chained():
+            return then(resume, callback)
+
+        retry = RetryLater(self.delay, chained)
+        retry.context = self.context
+        return retry
+
+
+def then(func, callback):
+    """
+    调用func并把结果交给callback；func需要延迟重试时，callback在重试完成后执行
+    """
+    try:
+        result = func()
+    except RetryLater as e:
+        raise e.then(callback)
+    return callback(result)
+
+
+@contextmanager
+def deferrable():
+    """
+    在该范围内发生的重试以RetryLater抛出，调用方负责延迟后执行resume
+    """
+    previous = getattr(_local, "deferrable", False)
+    _local.deferrable = True
+    try:
+        yield
+    finally:
+        _local.deferrable = previous
+
+
+def is_deferrable():
+    return getattr(_local, "deferrable", False)
+
+
+class RetryBudget(object):
+    """
+    重试预算：每次请求存入ratio个令牌，每次重试消耗1个，最多积累min_retries个，
+    服务故障时重试量不超过请求量的ratio倍，避免重试放大流量
+    """
+
+    def __init__(self, ratio, min_retries):
+        self.ratio = ratio
+        self.capacity = min_retries
+        self.balance = min_retries
+        self.lock = threading.Lock()
+
+    def deposit(self):
+        with self.lock:
+            self.balance = min(self.capacity, self.balance + self.ratio)
+
+    def withdraw(self):
+        with self.lock:
+            if self.balance < 1:
+                return False
+            self.balance -= 1
+            return True
+
+
+class RetryPolicy(object):
+    def __init__(self, provider):
+        self.provider = provider
+        self.budget = RetryBudget(conf().get("retry_budget_ratio", 0.2), conf().get("retry_budget_min", 10))
+        self.lock = threading.Lock()
+        self.counters = {"requests": 0, "retries": 0, "deferred": 0, "exhausted": 0, "budget_exhausted": 0}
+
+    def incr(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def start(self):
+        """
+        开始一次请求，返回记录本次请求重试状态的RetryCall，同一请求的多次重试共用
+        """
+        self.incr("requests")
+        self.budget.deposit()
+        return RetryCall(self)
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters)
+
+
+class RetryCall(object):
+    def __init__(self, policy: RetryPolicy):
+        self.policy = policy
+        self.attempt = 0
+        self.started_at = time.time()
+
+    def backoff(self, hint=None, max_attempts=None):
+        """
+        计算下一次重试前的等待时间
+        :param hint: 该类错误的退避基数(秒)，如限流时较长、超时时较短，默认retry_base_delay
+        :param max_attempts: 最多重试次数，默认retry_max_attempts
+        :return: 等待秒数，None表示不再重试(次数、截止时间或重试预算用尽)
+        """
+        policy = self.policy
+        if max_attempts is None:
+            max_attempts = conf().get("retry_max_attempts", 2)
+        if self.attempt >= max_attempts:
+            policy.incr("exhausted")
+            return None
+        base = conf().get("retry_base_delay", 2) if hint is None else hint
+        delay = min(conf().get("retry_max_delay", 60), base * (2 ** self.attempt))
+        # 抖动：在[delay/2, delay]之间随机，避免大量请求同时重试
+        delay = delay / 2 + random.uniform(0, delay / 2)
+        deadline = conf().get("retry_deadline", 120)
+        if deadline and time.time() + delay - self.started_at > deadline:
+            policy.incr("exhausted")
+            return None
+        if not policy.budget.withdraw():
+            logger.warning("[Retry] {} retry budget exhausted".format(policy.provider))
+            policy.incr("budget_exhausted")
+            return None
+        self.attempt += 1
+        policy.incr("retries")
+        return delay
+
+    def retry(self, delay, func, *args, **kwargs):
+        """
+        delay秒后调用func重试：在deferrable范围内抛出RetryLater，否则在当前线程等待
+        """
+        if is_deferrable():
+            self.policy.incr("deferred")
+            raise RetryLater(delay, lambda: func(*args, **kwargs))
+        time.sleep(delay)
+        return func(*args, **kwargs)
+
+
+class RetryScheduler(object):
+    """
+    单个后台线程按到期时间执行延迟任务
+    """
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.tasks = []
+        self.counter = itertools.count()
+        self.thread = None
+
+    def call_later(self, delay, func):
+        with self.cond:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="retry-scheduler", daemon=True)
+                self.thread.start()
+            heapq.heappush(self.tasks, (time.time() + delay, next(self.counter), func))
+            self.cond.notify()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.tasks or self.tasks[0][0] > time.time():
+                    self.cond.wait(self.tasks[0][0] - time.time() if self.tasks else None)
+                _, _, func = heapq.heappop(self.tasks)
+            try:
+                func()
+            except Exception as e:
+                logger.exception("[Retry] scheduled task error: {}".format(e))
+
+
+retry_scheduler = RetryScheduler()
+
+_policies = {}
+_policies_lock = threading.Lock()
+
+
+def get_retry_policy(provider) -> RetryPolicy:
+    with _policies_lock:
+        if provider not in _policies:
+            _policies[provider] = RetryPolicy(provider)
+        return _policies[provider]
+
+
+def retry_stats():
+    """
+    :return: 各服务商的请求数、重试次数、延迟重试次数、放弃重试次数
+    """
+    with _policies_lock:
+        policies = dict(_policies)
+    return {provider: policy.stats() for provider, policy in policies.items()}
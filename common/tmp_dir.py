@@ -1,6 +1,9 @@
 import os
 import pathlib
+import threading
+import time
 
+from common.log import logger
 from config import conf
 
 
@@ -13,6 +16,159 @@ class TmpDir(object):
         pathExists = os.path.exists(self.tmpFilePath)
         if not pathExists:
             os.makedirs(self.tmpFilePath)
+        tmp_manager.start()
 
     def path(self):
         return str(self.tmpFilePath) + "/"
+
+
+class TmpFileManager(object):
+    """
+    临时文件管理：
+    1. 引用计数的临时文件句柄，随context的生命周期释放，引用数归零后删除
+    2. 后台清理线程删除超过tmp_file_max_age且没有被引用的孤儿文件
+    3. 临时目录超过tmp_dir_quota时，按修改时间从旧到新删除没有被引用的文件
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.refs = {}  # 绝对路径 -> 引用数
+        self.usage = {"bytes": 0, "files": 0, "reaped_files": 0, "reaped_bytes": 0}
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread is not None:
+            return
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._reap_loop, name="tmp-reaper", daemon=True)
+                self.thread.start()
+
+    @staticmethod
+    def _abspath(path):
+        return os.path.abspath(path)
+
+    @staticmethod
+    def is_tmp_path(path):
+        if not isinstance(path, str):
+            return False
+        root = os.path.abspath(TmpDir.tmpFilePath)
+        return os.path.abspath(path).startswith(root + os.sep)
+
+    def acquire(self, path, context=None):
+        """
+        登记临时文件并增加引用，传入context时在context处理结束后自动释放
+        :return: path
+        """
+        if not self.is_tmp_path(path):
+            return path
+        abspath = self._abspath(path)
+        with self.lock:
+            self.refs[abspath] = self.refs.get(abspath, 0) + 1
+        if context is not None:
+            files = context.get("tmp_files")
+            if files is None:
+                files = []
+                context["tmp_files"] = files
+            files.append(abspath)
+        if self.usage["bytes"] > conf().get("tmp_dir_quota", 1024 * 1024 * 1024):
+            self.wakeup.set()
+        return path
+
+    def release(self, path):
+        """
+        减少引用，引用数归零时删除文件
+        """
+        if not self.is_tmp_path(path):
+            return
+        abspath = self._abspath(path)
+        with self.lock:
+            cnt = self.refs.get(abspath, 0) - 1
+            if cnt > 0:
+                self.refs[abspath] = cnt
+                return
+            self.refs.pop(abspath, None)
+        try:
+            os.remove(abspath)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning("[TmpFileManager] remove {} error: {}".format(abspath, e))
+
+    def release_context(self, context):
+        if context is None:
+            return
+        files = context.get("tmp_files")
+        if not files:
+            return
+        while files:
+            self.release(files.pop())
+
+    def _scan(self):
+        items = []
+        for root, _, names in os.walk(TmpDir.tmpFilePath):
+            for name in names:
+                path = os.path.abspath(os.path.join(root, name))
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                items.append((st.st_mtime, st.st_size, path))
+        items.sort()
+        return items
+
+    def reap(self):
+        """
+        清理超期和超出配额的未引用文件，并刷新磁盘占用统计
+        """
+        max_age = conf().get("tmp_file_max_age", 3600)
+        quota = conf().get("tmp_dir_quota", 1024 * 1024 * 1024)
+        items = self._scan()
+        total = sum(size for _, size, _ in items)
+        now = time.time()
+        reaped_files, reaped_bytes = 0, 0
+        for mtime, size, path in items:
+            if now - mtime <= max_age and total <= quota:
+                break
+            if now - mtime < 60:  # 刚写入的文件可能正在下载或处理中，超出配额也不删除
+                break
+            with self.lock:
+                if path in self.refs:
+                    continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.warning("[TmpFileManager] remove {} error: {}".format(path, e))
+                continue
+            total -= size
+            reaped_files += 1
+            reaped_bytes += size
+        with self.lock:
+            self.usage["bytes"] = total
+            self.usage["files"] = len(items) - reaped_files
+            self.usage["reaped_files"] += reaped_files
+            self.usage["reaped_bytes"] += reaped_bytes
+        if reaped_files:
+            logger.info("[TmpFileManager] reaped %s files, %s bytes, usage=%s bytes", reaped_files, reaped_bytes, total)
+
+    def _reap_loop(self):
+        while True:
+            try:
+                self.reap()
+            except Exception as e:
+                logger.exception("[TmpFileManager] reap error: {}".format(e))
+            self.wakeup.wait(conf().get("tmp_reap_interval", 600))
+            self.wakeup.clear()
+
+    def stats(self):
+        """
+        :return: 临时目录占用字节数、文件数、被引用的文件数和累计清理量
+        """
+        with self.lock:
+            return dict(self.usage, tracked_files=len(self.refs))
+
+
+tmp_manager = TmpFileManager()
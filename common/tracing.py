@@ -0,0 +1,287 @@
+"""
+消息处理链路追踪：produce时为每条消息分配trace_id，记录各阶段的耗时(span)：
+compose、排队、每个插件的处理函数、bot调用(含重试)、装饰、语音转换和发送，
+处理结束后由后台线程批量导出到按大小轮转的jsonl文件，或以OTLP/HTTP json格式发送到本地collector
+
+记录span只是读取时间和追加到列表，导出不在消息处理线程中进行；
+trace_sample_rate控制采样比例，trace_min_duration只导出总耗时超过该值的消息
+"""
+
+import json
+import os
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+from common.log import logger
+from config import conf
+
+
+class Span(object):
+    __slots__ = ("name", "span_id", "parent_id", "start", "end", "attrs")
+
+    def __init__(self, name, span_id, parent_id, start, end=None, attrs=None):
+        self.name = name
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.start = start  # 纳秒
+        self.end = end
+        self.attrs = attrs
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": self.start,
+            "duration_ms": round((self.end - self.start) / 1e6, 3),
+            "attrs": self.attrs or {},
+        }
+
+
+class Trace(object):
+    def __init__(self, attrs=None):
+        self.trace_id = "%032x" % random.getrandbits(128)
+        self.root = Span("message", self._new_id(), None, time.time_ns(), attrs=attrs or {})
+        self.spans = []
+        self.lock = threading.Lock()
+        self.finished = False
+        self.enqueued_at = None  # 入队时间，用于计算排队耗时
+        self._local = threading.local()  # 各线程当前所在的span，作为新span的父span
+
+    @staticmethod
+    def _new_id():
+        return "%016x" % random.getrandbits(64)
+
+    def add(self, name, start, end=None, parent_id=None, **attrs):
+        """
+        记录一个已经结束的阶段
+        :param start: 开始时间(time.time_ns())
+        """
+        parent_id = parent_id or getattr(self._local, "current", None) or self.root.span_id
+        span = Span(name, self._new_id(), parent_id, start, end or time.time_ns(), attrs)
+        with self.lock:
+            self.spans.append(span)
+        return span
+
+    @contextmanager
+    def span(self, name, parent_id=None, **attrs):
+        """
+        with trace.span("send"): ... 记录代码块的耗时，抛出异常时记录error
+        """
+        previous = getattr(self._local, "current", None)
+        span = Span(name, self._new_id(), parent_id or previous or self.root.span_id, time.time_ns(), attrs=attrs)
+        self._local.current = span.span_id
+        try:
+            yield span
+        except BaseException as e:
+            span.attrs["error"] = type(e).__name__
+            raise
+        finally:
+            span.end = time.time_ns()
+            self._local.current = previous
+            with self.lock:
+                self.spans.append(span)
+
+    def finish(self):
+        with self.lock:
+            if self.finished:
+                return
+            self.finished = True
+            self.root.end = time.time_ns()
+        _exporter_submit(self)
+
+    def export_spans(self):
+        with self.lock:
+            return list(self.spans)
+
+    def merge(self, spans):
+        # 合并其他进程记录的span
+        with self.lock:
+            self.spans.extend(spans)
+
+    def __repr__(self):
+        return "Trace({})".format(self.trace_id)
+
+    def to_dict(self):
+        with self.lock:
+            spans = [self.root] + list(self.spans)
+        return {"trace_id": self.trace_id, "spans": [span.to_dict() for span in spans]}
+
+
+class RemoteTrace(Trace):
+    """
+    worker进程中的trace：沿用前端trace的id和根span，结束时不导出，由前端合并span后导出
+    """
+
+    def __init__(self, trace_id, root_id, start):
+        super().__init__()
+        self.trace_id = trace_id
+        self.root = Span("message", root_id, None, start, attrs={})
+
+    def finish(self):
+        with self.lock:
+            self.finished = True
+
+
+class _NoopSpan(object):
+    attrs = {}
+
+
+_NOOP = nullcontext(_NoopSpan())
+
+
+def span(context, name, **attrs):
+    """
+    with tracing.span(context, "send"): ... 在context的trace中记录代码块耗时，
+    没有trace(未开启或未采样)时返回空的上下文管理器
+    """
+    trace = context.get("trace") if context is not None else None
+    if trace is None:
+        return _NOOP
+    return trace.span(name, **attrs)
+
+
+def start_trace(context):
+    """
+    为消息分配trace，已有trace(如语音转文字后生成的context)时沿用，未开启或未被采样时返回None
+    """
+    if "trace" in context:
+        return context["trace"]
+    if not conf().get("trace_enabled", False):
+        return None
+    if random.random() >= conf().get("trace_sample_rate", 1.0):
+        context["trace"] = None
+        return None
+    trace = Trace({"type": str(context.type)})
+    context["trace"] = trace
+    return trace
+
+
+def finish_trace(context):
+    trace = context.get("trace") if context is not None else None
+    if trace is not None:
+        trace.finish()
+
+
+class FileExporter(object):
+    """
+    每个trace一行json，文件超过trace_file_max_bytes时轮转
+    """
+
+    def __init__(self):
+        from common.log import RotatingFileHandler
+
+        self.handler = RotatingFileHandler(
+            conf().get("trace_file", "trace.jsonl"),
+            max_bytes=conf().get("trace_file_max_bytes", 52428800),
+            backup_count=conf().get("trace_file_backup_count", 3),
+        )
+
+    def export(self, traces):
+        import logging
+
+        for trace in traces:
+            record = logging.makeLogRecord({"msg": json.dumps(trace.to_dict(), ensure_ascii=False)})
+            self.handler.handle(record)
+
+
+class OTLPExporter(object):
+    """
+    以OTLP/HTTP json格式发送到collector，如 http://127.0.0.1:4318/v1/traces
+    """
+
+    def __init__(self):
+        self.endpoint = conf().get("trace_otlp_endpoint", "http://127.0.0.1:4318/v1/traces")
+        self.service_name = conf().get("trace_service_name", "chatgpt-on-wechat")
+
+    @staticmethod
+    def _attributes(attrs):
+        return [{"key": key, "value": {"stringValue": str(value)}} for key, value in (attrs or {}).items()]
+
+    def _span(self, trace, span):
+        data = {
+            "traceId": trace.trace_id,
+            "spanId": span.span_id,
+            "name": span.name,
+            "kind": 1,
+            "startTimeUnixNano": str(span.start),
+            "endTimeUnixNano": str(span.end),
+            "attributes": self._attributes(span.attrs),
+        }
+        if span.parent_id:
+            data["parentSpanId"] = span.parent_id
+        if span.attrs and "error" in span.attrs:
+            data["status"] = {"code": 2}
+        return data
+
+    def export(self, traces):
+        import requests
+
+        spans = []
+        for trace in traces:
+            with trace.lock:
+                trace_spans = [trace.root] + list(trace.spans)
+            spans.extend(self._span(trace, span) for span in trace_spans)
+        body = {
+            "resourceSpans": [{
+                "resource": {"attributes": self._attributes({"service.name": self.service_name})},
+                "scopeSpans": [{"scope": {"name": "chatgpt-on-wechat"}, "spans": spans}],
+            }]
+        }
+        requests.post(self.endpoint, json=body, timeout=5)
+
+
+class _ExportWorker(object):
+    """
+    后台线程批量导出，队列满时丢弃，不阻塞消息处理
+    """
+
+    def __init__(self, exporter):
+        self.exporter = exporter
+        self.queue = queue.Queue(maxsize=conf().get("trace_queue_size", 10000))
+        self.dropped = 0
+        self.thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+        self.thread.start()
+
+    def submit(self, trace):
+        try:
+            self.queue.put_nowait(trace)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            # 最多等待1秒凑一批
+            deadline = time.time() + 1
+            while len(batch) < 100:
+                try:
+                    batch.append(self.queue.get(timeout=max(0, deadline - time.time())))
+                except queue.Empty:
+                    break
+            try:
+                self.exporter.export(batch)
+            except Exception as e:
+                logger.warning("[Tracing] export %s traces failed: %s", len(batch), e)
+
+
+_worker = None
+_worker_lock = threading.Lock()
+_worker_pid = None
+
+
+def _exporter_submit(trace):
+    global _worker, _worker_pid
+    min_duration = conf().get("trace_min_duration", 0)
+    if min_duration and (trace.root.end - trace.root.start) / 1e9 < min_duration:
+        return
+    with _worker_lock:
+        # fork出的子进程需要重新创建导出线程
+        if _worker is None or _worker_pid != os.getpid():
+            exporter = OTLPExporter() if conf().get("trace_exporter", "file") == "otlp" else FileExporter()
+            _worker = _ExportWorker(exporter)
+            _worker_pid = os.getpid()
+    _worker.submit(trace)
@@ -1,9 +1,10 @@
 import io
 import os
 import re
+import tempfile
 from urllib.parse import urlparse
-from PIL import Image
-from common.log import logger
+
+import requests
 
 def fsize(file):
     if isinstance(file, io.BytesIO):
@@ -20,19 +21,27 @@ def fsize(file):
         raise TypeError("Unsupported type")
 
 
+def download_file(url, chunk_size=64 * 1024):
+    """
+    流式下载文件，内容先写入内存，超过media_buffer_size后自动落盘到临时文件，
+    避免大图片/视频回复整体驻留内存
+    :return: 已回到开头的file-like对象
+    """
+    from config import conf
+
+    storage = tempfile.SpooledTemporaryFile(max_size=conf().get("media_buffer_size", 4 * 1024 * 1024))
+    # 连接超时5秒，两次读取之间最多等待60秒
+    with requests.get(url, stream=True, timeout=(5, 60)) as res:
+        for block in res.iter_content(chunk_size):
+            storage.write(block)
+    storage.seek(0)
+    return storage
+
+
 def compress_imgfile(file, max_size):
-    if fsize(file) <= max_size:
-        return file
-    file.seek(0)
-    img = Image.open(file)
-    rgb_image = img.convert("RGB")
-    quality = 95
-    while True:
-        out_buf = io.BytesIO()
-        rgb_image.save(out_buf, "JPEG", quality=quality)
-        if fsize(out_buf) <= max_size:
-            return out_buf
-        quality -= 5
+    from common.image_optimizer import optimize_image
+
+    return optimize_image(file, max_size, convert_webp=False)
 
 
 def split_string_by_utf8_length(string, max_length, max_split=0):
@@ -58,17 +67,12 @@ def get_path_suffix(path):
 
 
 def convert_webp_to_png(webp_image):
-    from PIL import Image
-    try:
-        webp_image.seek(0)
-        img = Image.open(webp_image).convert("RGBA")
-        png_image = io.BytesIO()
-        img.save(png_image, format="PNG")
-        png_image.seek(0)
-        return png_image
-    except Exception as e:
-        logger.error(f"Failed to convert WEBP to PNG: {e}")
-        raise
+    """
+    webp图片转为png，保留给已有的调用方，新代码直接使用common.image_optimizer.optimize_image
+    """
+    from common.image_optimizer import optimize_image
+
+    return optimize_image(webp_image)
 
 
 def remove_markdown_symbol(text: str):
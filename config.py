@@ -1,11 +1,11 @@
 # encoding:utf-8
 
 import json
-import logging
 import os
 import pickle
 import copy
 
+from common import log
 from common.log import logger
 
 # 将所有可用的配置项写在字典里, 请使用小写字母
@@ -13,6 +13,24 @@ from common.log import logger
 available_setting = {
     # openai api配置
     "open_ai_api_key": "",  # openai api key
+    "open_ai_api_keys": [],  # 额外的openai api key列表，与open_ai_api_key一起按剩余额度负载均衡，claude_api_keys、linkai_api_keys同理
+    "api_key_cooldown": 20,  # key被限流且响应中没有重置时间时的冷却秒数
+    "chat_fallback_bots": [],  # 主模型失败或熔断时依次尝试的bot_type列表，如 ["linkai", "claudeAPI"]
+    "circuit_breaker_window": 60,  # 熔断统计窗口(秒)
+    "circuit_breaker_min_requests": 5,  # 窗口内请求数达到该值才判断是否熔断
+    "circuit_breaker_error_rate": 0.5,  # 错误率达到该值时熔断
+    "circuit_breaker_max_p95": 0,  # p95耗时超过该秒数时熔断，0表示不按耗时熔断
+    "circuit_breaker_open_seconds": 30,  # 熔断持续时间(秒)，之后放行一个探测请求
+    "chat_hedge_enabled": False,  # 主模型超过p95耗时未返回时，向下一个备用模型发送对冲请求
+    "chat_hedge_delay": 10,  # 主模型耗时样本不足时，发送对冲请求前等待的秒数
+    "chat_hedge_min_samples": 20,  # 使用p95作为对冲等待时间所需的最少样本数
+    "chat_hedge_workers": 16,  # 对冲请求线程池大小
+    "retry_max_attempts": 2,  # 模型接口调用失败后的最多重试次数
+    "retry_base_delay": 2,  # 重试退避基数(秒)，每次重试翻倍并加入随机抖动，限流、超时等错误使用各自的基数
+    "retry_max_delay": 60,  # 单次重试的最长等待(秒)
+    "retry_deadline": 120,  # 一次请求包括重试在内的最长耗时(秒)，0表示不限制
+    "retry_budget_ratio": 0.2,  # 重试预算：重试次数不超过请求数的该比例
+    "retry_budget_min": 10,  # 重试预算的最少可用次数
     # openai apibase，当use_azure_chatgpt为true时，需要设置对应的api base
     "open_ai_api_base": "https://api.openai.com/v1",
     "proxy": "",  # openai使用的代理
@@ -77,11 +95,15 @@ available_setting = {
     "xunfei_api_secret": "",  # 讯飞 API secret
     "xunfei_domain": "",  # 讯飞模型对应的domain参数，Spark4.0 Ultra为 4.0Ultra，其他模型详见: https://www.xfyun.cn/doc/spark/Web.html
     "xunfei_spark_url": "",  # 讯飞模型对应的请求地址，Spark4.0 Ultra为 wss://spark-api.xf-yun.com/v4.0/chat，其他模型参考详见: https://www.xfyun.cn/doc/spark/Web.html
+    "xunfei_ws_pool_size": 1,  # 预先建立的讯飞星火空闲连接数，0表示不预建连接
+    "xunfei_ws_max_idle": 20,  # 预建连接的最长空闲时间(秒)，超过后丢弃
+    "xunfei_url_sign_ttl": 60,  # 讯飞鉴权URL签名的缓存时间(秒)，服务端允许的时间偏差为5分钟
     # claude 配置
     "claude_api_cookie": "",
     "claude_uuid": "",
     # claude api key
     "claude_api_key": "",
+    "claude_api_keys": [],
     # 通义千问API, 获取方式查看文档 https://help.aliyun.com/document_detail/2587494.html
     "qwen_access_key_id": "",
     "qwen_access_key_secret": "",
@@ -134,6 +156,7 @@ available_setting = {
     "wechatmp_app_id": "",  # 微信公众平台的appID
     "wechatmp_app_secret": "",  # 微信公众平台的appsecret
     "wechatmp_aes_key": "",  # 微信公众平台的EncodingAESKey，加密模式需要
+    "wechatmp_reply_cache_expires": 3600,  # 被动回复模式下未被取走的回复保留时间(秒)
     # wechatcom的通用配置
     "wechatcom_corp_id": "",  # 企业微信公司的corpID
     # wechatcomapp的配置
@@ -156,9 +179,31 @@ available_setting = {
     # chatgpt指令自定义触发词
     "clear_memory_commands": ["#清除记忆"],  # 重置会话指令，必须以#开头
     # channel配置
-    "channel_type": "",  # 通道类型，支持：{wx,wxy,terminal,wechatmp,wechatmp_service,wechatcom_app,dingtalk}
+    "channel_type": "",  # 通道类型，支持：{wx,wxy,terminal,wechatmp,wechatmp_service,wechatcom_app,dingtalk,web,api}
     "subscribe_msg": "",  # 订阅消息, 支持: wechatmp, wechatmp_service, wechatcom_app
     "debug": False,  # 是否开启debug模式，开启后会打印更多日志
+    "log_file": "run.log",  # 日志文件，为空时只输出到控制台；多进程时子进程写入带后缀的文件，如run.worker-1.log
+    "log_max_bytes": 52428800,  # 日志文件超过该大小(字节)时轮转，0表示不按大小轮转
+    "log_rotate_when": "",  # 按时间轮转，可选：hour, midnight，为空表示不按时间轮转
+    "log_backup_count": 5,  # 保留的轮转日志文件数
+    "log_json": False,  # 日志文件是否按json lines格式输出
+    "log_levels": {},  # 按模块设置日志级别，如 {"channel.wechat": "DEBUG", "plugins": "WARNING"}
+    # 消息处理链路追踪
+    "trace_enabled": False,  # 是否记录每条消息在各处理阶段的耗时
+    "trace_sample_rate": 1.0,  # 采样比例，0~1
+    "trace_min_duration": 0,  # 只导出总耗时超过该秒数的消息，0表示全部导出
+    "trace_exporter": "file",  # 导出方式，file：写入jsonl文件，otlp：以OTLP/HTTP json格式发送到collector
+    "trace_file": "trace.jsonl",  # file方式的文件路径
+    "trace_file_max_bytes": 52428800,  # 文件超过该大小时轮转
+    "trace_file_backup_count": 3,  # 保留的轮转文件数
+    "trace_otlp_endpoint": "http://127.0.0.1:4318/v1/traces",  # otlp方式的collector地址
+    "trace_service_name": "chatgpt-on-wechat",  # otlp方式上报的service.name
+    "trace_queue_size": 10000,  # 等待导出的消息数上限，超过时丢弃
+    # 运行指标
+    "metrics_enabled": False,  # 是否在独立端口以Prometheus文本格式提供 /metrics
+    "metrics_host": "127.0.0.1",  # 指标服务监听地址
+    "metrics_port": 9464,  # 指标服务端口，http_workers大于1时每个进程使用metrics_port+进程编号，worker_processes大于1时worker使用metrics_port+1+worker编号
+    "metrics_session_top": 10,  # 输出排队消息数最多的前几个会话
     "appdata_dir": "",  # 数据目录
     # 插件配置
     "plugin_trigger_prefix": "$",  # 规范插件提供聊天相关指令的前缀，建议不要和管理员指令前缀"#"冲突
@@ -166,6 +211,26 @@ available_setting = {
     "use_global_plugin_config": False,
     "max_media_send_count": 3,  # 单次最大发送媒体资源的个数
     "media_send_interval": 1,  # 发送图片的事件间隔，单位秒
+    "media_buffer_size": 4 * 1024 * 1024,  # 下载媒体文件时的内存缓冲上限(字节)，超出部分写入临时文件
+    "audio_convert_workers": 2,  # 音频转码使用的进程数，0表示在当前线程中处理
+    "image_optimize_workers": 2,  # 图片压缩/格式转换使用的进程数，0表示在当前线程中处理
+    "media_cache_enabled": True,  # 是否按内容缓存已上传媒体的media_id，有效期内重复发送相同图片/语音/视频时不再重新上传
+    "tts_cache_enabled": True,  # 是否按(语音引擎, 音色, 文本)缓存语音合成结果及渠道转码后的音频
+    "tts_cache_max_size": 200 * 1024 * 1024,  # 语音缓存占用磁盘上限(字节)，超出后按最近使用时间淘汰
+    "tts_parallel_enabled": True,  # 长文本语音合成时是否按句子切分并发合成
+    "tts_chunk_length": 200,  # 并发语音合成时每段的最大字符数
+    "tts_max_concurrency": 3,  # 每个语音合成引擎的最大并发请求数
+    "tts_pool_size": 8,  # 并发语音合成的线程数
+    "tts_stream_reply": False,  # 是否每段语音合成后立即按顺序发送，关闭时拼接成一条语音发送，被动回复的公众号等只能回复一条消息的channel不生效
+    "asr_parallel_enabled": True,  # 长语音识别时是否在静音处切分并发识别
+    "asr_chunk_length": 30 * 1000,  # 并发语音识别时每段的最大时长(毫秒)，同时不超过语音引擎的单次识别上限
+    "asr_max_concurrency": 3,  # 每个语音识别引擎的最大并发请求数
+    "asr_pool_size": 8,  # 并发语音识别的线程数
+    "tmp_dir_quota": 1024 * 1024 * 1024,  # 临时目录占用上限(字节)，超出后按修改时间删除未被引用的文件
+    "tmp_file_max_age": 3600,  # 临时目录中未被引用的文件保留时长(秒)
+    "tmp_reap_interval": 600,  # 临时文件清理间隔(秒)
+    "media_prefetch": False,  # 是否在消息入队时就开始下载语音/图片/文件，与排队等待时间重叠
+    "media_prefetch_workers": 4,  # 预取下载的线程数
     # 智谱AI 平台配置
     "zhipu_ai_api_key": "",
     "zhipu_ai_api_base": "https://open.bigmodel.cn/api/paas/v4",
@@ -177,12 +242,36 @@ available_setting = {
     # LinkAI平台配置
     "use_linkai": False,
     "linkai_api_key": "",
+    "linkai_api_keys": [],
     "linkai_app_code": "",
     "linkai_api_base": "https://api.link-ai.tech",  # linkAI服务地址
     "Minimax_api_key": "",
     "Minimax_group_id": "",
     "Minimax_base_url": "",
     "web_port": 9899,
+    "web_server_threads": 100,  # web channel服务线程数，每个SSE连接占用一个线程
+    "web_sse_heartbeat": 15,  # SSE心跳间隔(秒)，用于保持连接和及时发现断开的连接
+    "web_session_grace": 30,  # SSE断开后保留会话队列的秒数，浏览器在此期间重连不会丢失回复
+    # HTTP类channel(web, api, wechatmp, wechatmp_service, wechatcom_app, feishu)的服务配置
+    "http_server_threads": 32,  # 服务线程数，web和api channel分别使用web_server_threads和api_server_threads
+    "http_backlog": 128,  # 监听队列长度
+    "http_keepalive_timeout": 15,  # keep-alive连接的空闲超时(秒)
+    "http_keepalive_conn_limit": 100,  # 最多保持的空闲keep-alive连接数
+    "http_max_body_size": 10485760,  # 请求体大小上限(字节)，超过时返回413
+    "http_shutdown_timeout": 10,  # 退出时等待进行中请求完成的最长时间(秒)
+    "http_workers": 1,  # 监听同一端口的进程数(SO_REUSEPORT)，各进程的会话上下文不共享，只对api channel生效
+    "worker_processes": 0,  # 大于1时启动多个worker进程处理消息，前端进程只负责收发，同一会话固定由一个worker处理(不适用于http类channel)
+    "worker_virtual_nodes": 64,  # 一致性哈希中每个worker的虚拟节点数
+    "worker_send_threads": 4,  # 前端进程发送worker回复的线程数
+    "worker_send_timeout": 60,  # worker等待前端发送回复结果的最长时间(秒)
+    "worker_restart_delay": 1,  # worker启动后很快退出时，等待该时间(秒)再重启
+    # 兼容OpenAI格式的接口channel配置(channel_type为api)
+    "api_port": 9900,
+    "api_token": "",  # 调用接口时Authorization: Bearer携带的token，为空时不校验
+    "api_server_threads": 100,  # 服务线程数，每个进行中的请求占用一个线程
+    "api_max_inflight": 64,  # 同时处理的最大消息数，批量请求按消息条数计算，超过时返回429
+    "api_max_batch": 32,  # 批量接口单次最多提交的消息数
+    "api_request_timeout": 120,  # 等待回复的超时时间(秒)，超时返回504
 }
 
 
@@ -228,7 +317,7 @@ class Config(dict):
         except FileNotFoundError as e:
             logger.info("[Config] User datas file not found, ignore.")
         except Exception as e:
-            logger.info("[Config] User datas error: {}".format(e))
+            logger.info("[Config] User datas error: %s", e)
             self.user_datas = {}
 
     def save_user_datas(self):
@@ -237,7 +326,7 @@ class Config(dict):
                 pickle.dump(self.user_datas, f)
                 logger.info("[Config] User datas saved.")
         except Exception as e:
-            logger.info("[Config] User datas error: {}".format(e))
+            logger.info("[Config] User datas error: %s", e)
 
 
 config = Config()
@@ -275,7 +364,7 @@ def load_config():
         config_path = "./config-template.json"
 
     config_str = read_file(config_path)
-    logger.debug("[INIT] config str: {}".format(drag_sensitive(config_str)))
+    logger.debug("[INIT] config str: %s", drag_sensitive(config_str))
 
     # 将json字符串反序列化为dict类型
     config = Config(json.loads(config_str))
@@ -285,7 +374,7 @@ def load_config():
     for name, value in os.environ.items():
         name = name.lower()
         if name in available_setting:
-            logger.info("[INIT] override config by environ args: {}={}".format(name, value))
+            logger.info("[INIT] override config by environ args: %s=%s", name, value)
             try:
                 config[name] = eval(value)
             except:
@@ -296,11 +385,11 @@ def load_config():
                 else:
                     config[name] = value
 
+    log.setup(config)
     if config.get("debug", False):
-        logger.setLevel(logging.DEBUG)
         logger.debug("[INIT] set log level to DEBUG")
 
-    logger.info("[INIT] load config: {}".format(drag_sensitive(config)))
+    logger.info("[INIT] load config: %s", drag_sensitive(config))
 
     config.load_user_datas()
 
@@ -321,7 +410,7 @@ def conf():
 def get_appdata_dir():
     data_path = os.path.join(get_root(), conf().get("appdata_dir", ""))
     if not os.path.exists(data_path):
-        logger.info("[INIT] data path not exists, create it: {}".format(data_path))
+        logger.info("[INIT] data path not exists, create it: %s", data_path)
         os.makedirs(data_path)
     return data_path
 
@@ -30,18 +30,18 @@ def get_download_fn(core, url, msgId):
             'skey': core.loginInfo['skey'],}
         headers = { 'User-Agent' : config.USER_AGENT }
         r = core.s.get(url, params=params, stream=True, headers = headers)
-        tempStorage = io.BytesIO()
-        for block in r.iter_content(1024):
-            tempStorage.write(block)
         if downloadDir is None:
-            return tempStorage.getvalue()
+            return r.content
+        header = b''
         with open(downloadDir, 'wb') as f:
-            f.write(tempStorage.getvalue())
-        tempStorage.seek(0)
+            for block in r.iter_content(65536):
+                if len(header) < 20:
+                    header += block[:20 - len(header)]
+                f.write(block)
         return ReturnValue({'BaseResponse': {
             'ErrMsg': 'Successfully downloaded',
             'Ret': 0, },
-            'PostFix': utils.get_image_postfix(tempStorage.read(20)), })
+            'PostFix': utils.get_image_postfix(header), })
     return download_fn
 
 def produce_msg(core, msgList):
@@ -126,13 +126,11 @@ def produce_msg(core, msgList):
                     'skey': core.loginInfo['skey'],}
                 headers = {'Range': 'bytes=0-', 'User-Agent' : config.USER_AGENT }
                 r = core.s.get(url, params=params, headers=headers, stream=True)
-                tempStorage = io.BytesIO()
-                for block in r.iter_content(1024):
-                    tempStorage.write(block)
                 if videoDir is None:
-                    return tempStorage.getvalue()
+                    return r.content
                 with open(videoDir, 'wb') as f:
-                    f.write(tempStorage.getvalue())
+                    for block in r.iter_content(65536):
+                        f.write(block)
                 return ReturnValue({'BaseResponse': {
                     'ErrMsg': 'Successfully downloaded',
                     'Ret': 0, }})
@@ -159,13 +157,11 @@ def produce_msg(core, msgList):
                         'webwx_data_ticket': cookiesList['webwx_data_ticket'],}
                     headers = { 'User-Agent' : config.USER_AGENT }
                     r = core.s.get(url, params=params, stream=True, headers=headers)
-                    tempStorage = io.BytesIO()
-                    for block in r.iter_content(1024):
-                        tempStorage.write(block)
                     if attaDir is None:
-                        return tempStorage.getvalue()
+                        return r.content
                     with open(attaDir, 'wb') as f:
-                        f.write(tempStorage.getvalue())
+                        for block in r.iter_content(65536):
+                            f.write(block)
                     return ReturnValue({'BaseResponse': {
                         'ErrMsg': 'Successfully downloaded',
                         'Ret': 0, }})
@@ -286,22 +282,32 @@ def send_msg(self, msg='Test Message', toUserName=None):
 def _prepare_file(fileDir, file_=None):
     fileDict = {}
     if file_:
-        if hasattr(file_, 'read'):
-            file_ = file_.read()
-        else:
+        if not hasattr(file_, 'read'):
             return ReturnValue({'BaseResponse': {
                 'ErrMsg': 'file_ param should be opened file',
                 'Ret': -1005, }})
+        f = file_
     else:
         if not utils.check_file(fileDir):
             return ReturnValue({'BaseResponse': {
                 'ErrMsg': 'No file found in specific dir',
                 'Ret': -1002, }})
-        with open(fileDir, 'rb') as f:
-            file_ = f.read()
-    fileDict['fileSize'] = len(file_)
-    fileDict['fileMd5'] = hashlib.md5(file_).hexdigest()
-    fileDict['file_'] = io.BytesIO(file_)
+        f = open(fileDir, 'rb')
+    # hash the file chunk by chunk instead of reading it into memory,
+    # upload_file will read the same chunks again from file_ or fileDir
+    try:
+        startPos = f.tell()
+        fileMd5 = hashlib.md5()
+        for block in iter(lambda: f.read(524288), b''):
+            fileMd5.update(block)
+        fileDict['fileSize'] = f.tell() - startPos
+        fileDict['fileMd5'] = fileMd5.hexdigest()
+        if file_:
+            f.seek(startPos)
+    finally:
+        if not file_:
+            f.close()
+    fileDict['file_'] = file_
     return fileDict
 
 def upload_file(self, fileDir, isPicture=False, isVideo=False,
@@ -330,10 +336,17 @@ def upload_file(self, fileDir, isPicture=False, isVideo=False,
         ('FileMd5', fileMd5)]
         ), separators = (',', ':'))
     r = {'BaseResponse': {'Ret': -1005, 'ErrMsg': 'Empty file detected'}}
-    for chunk in range(chunks):
-        r = upload_chunk_file(self, fileDir, fileSymbol, fileSize,
-            file_, chunk, chunks, uploadMediaRequest)
-    file_.close()
+    # only close the file opened here, the caller owns file_
+    openedFile = file_ is None
+    if openedFile:
+        file_ = open(fileDir, 'rb')
+    try:
+        for chunk in range(chunks):
+            r = upload_chunk_file(self, fileDir, fileSymbol, fileSize,
+                file_, chunk, chunks, uploadMediaRequest)
+    finally:
+        if openedFile:
+            file_.close()
     if isinstance(r, dict):
         return ReturnValue(r)
     return ReturnValue(rawResponse=r)
@@ -80,7 +80,7 @@ class AgentPlugin(Plugin):
         if team_name not in teams_config:
             logger.error(f"Team '{team_name}' not found in configuration.")
             available_teams = list(teams_config.keys())
-            logger.info(f"Available teams: {', '.join(available_teams)}")
+            logger.info("Available teams: %s", ', '.join(available_teams))
             return None
 
         # Get team configuration
@@ -231,7 +231,7 @@ class AgentPlugin(Plugin):
         
         # Run the task
         try:
-            logger.info(f"[agent] Running task '{task}' with team '{team_name}', team_model={team.model.model}")
+            logger.info("[agent] Running task '%s' with team '%s', team_model=%s", task, team_name, team.model.model)
             result = team.run_async(task=task)
             for agent_result in result:
                 res_text = f"🤖 {agent_result.get('agent_name')}\n\n{agent_result.get('final_answer')}"
@@ -26,18 +26,18 @@ class Keyword(Plugin):
             config_path = os.path.join(curdir, "config.json")
             conf = None
             if not os.path.exists(config_path):
-                logger.debug(f"[keyword]不存在配置文件{config_path}")
+                logger.debug("[keyword]不存在配置文件%s", config_path)
                 conf = {"keyword": {}}
                 with open(config_path, "w", encoding="utf-8") as f:
                     json.dump(conf, f, indent=4)
             else:
-                logger.debug(f"[keyword]加载配置文件{config_path}")
+                logger.debug("[keyword]加载配置文件%s", config_path)
                 with open(config_path, "r", encoding="utf-8") as f:
                     conf = json.load(f)
             # 加载关键词
             self.keyword = conf["keyword"]
 
-            logger.info("[keyword] {}".format(self.keyword))
+            logger.info("[keyword] %s", self.keyword)
             self.handlers[Event.ON_HANDLE_CONTEXT] = self.on_handle_context
             logger.info("[keyword] inited.")
         except Exception as e:
@@ -51,7 +51,7 @@ class Keyword(Plugin):
         content = e_context["context"].content.strip()
         logger.debug("[keyword] on_handle_context. content: %s" % content)
         if content in self.keyword:
-            logger.info(f"[keyword] 匹配到关键字【{content}】")
+            logger.info("[keyword] 匹配到关键字【%s】", content)
             reply_text = self.keyword[content]
 
             # 判断匹配内容的类型
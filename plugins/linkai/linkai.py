@@ -7,6 +7,7 @@ from .summary import LinkSummary
 from bridge import bridge
 from common.expired_dict import ExpiredDict
 from common import const
+from common.tmp_dir import tmp_manager
 import os
 from .utils import Util
 from config import plugin_config, conf
@@ -32,7 +33,7 @@ class LinkAI(Plugin):
         self.sum_config = {}
         if self.config:
             self.sum_config = self.config.get("summary")
-        logger.info(f"[LinkAI] inited, config={self.config}")
+        logger.info("[LinkAI] inited, config=%s", self.config)
 
     def on_handle_context(self, e_context: EventContext):
         """
@@ -52,6 +53,9 @@ class LinkAI(Plugin):
             # 文件处理
             context.get("msg").prepare()
             file_path = context.content
+            if context.type == ContextType.FILE:
+                # 没有生成摘要时也随context一起删除；图片没有摘要时还会缓存给后续提问使用，由临时目录按时间清理
+                tmp_manager.acquire(file_path, context)
             if not LinkSummary().check_file(file_path, self.sum_config):
                 return
             if context.type != ContextType.IMAGE:
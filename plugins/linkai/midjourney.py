@@ -194,7 +194,7 @@ class MJBot:
         :param e_context: 对话上下文
         :return: 任务ID
         """
-        logger.info(f"[MJ] image generate, prompt={prompt}")
+        logger.info("[MJ] image generate, prompt=%s", prompt)
         mode = self._fetch_mode(prompt)
         body = {"prompt": prompt, "mode": mode, "auto_translate": self.config.get("auto_translate")}
         if not self.config.get("img_proxy"):
@@ -202,7 +202,7 @@ class MJBot:
         res = requests.post(url=self.base_url + "/generate", json=body, headers=self.headers, timeout=(5, 40))
         if res.status_code == 200:
             res = res.json()
-            logger.debug(f"[MJ] image generate, res={res}")
+            logger.debug("[MJ] image generate, res=%s", res)
             if res.get("code") == 200:
                 task_id = res.get("data").get("task_id")
                 real_prompt = res.get("data").get("real_prompt")
@@ -234,7 +234,7 @@ class MJBot:
 
     def do_operate(self, task_type: TaskType, user_id: str, img_id: str, e_context: EventContext,
                    index: int = None) -> Reply:
-        logger.info(f"[MJ] image operate, task_type={task_type}, img_id={img_id}, index={index}")
+        logger.info("[MJ] image operate, task_type=%s, img_id=%s, index=%s", task_type, img_id, index)
         body = {"type": task_type.name, "img_id": img_id}
         if index:
             body["index"] = index
@@ -246,7 +246,7 @@ class MJBot:
             res = res.json()
             if res.get("code") == 200:
                 task_id = res.get("data").get("task_id")
-                logger.info(f"[MJ] image operate processing, task_id={task_id}")
+                logger.info("[MJ] image operate processing, task_id=%s", task_id)
                 icon_map = {TaskType.UPSCALE: "🔎", TaskType.VARIATION: "🪄", TaskType.RESET: "🔄"}
                 content = f"{icon_map.get(task_type)}图片正在{task_name_mapping.get(task_type.name)}中，请耐心等待"
                 reply = Reply(ReplyType.INFO, content)
@@ -268,7 +268,7 @@ class MJBot:
             return reply
 
     def check_task_sync(self, task: MJTask, e_context: EventContext):
-        logger.debug(f"[MJ] start check task status, {task}")
+        logger.debug("[MJ] start check task status, %s", task)
         max_retry_times = 90
         while max_retry_times > 0:
             time.sleep(10)
@@ -277,8 +277,11 @@ class MJBot:
                 res = requests.get(url, headers=self.headers, timeout=8)
                 if res.status_code == 200:
                     res_json = res.json()
-                    logger.debug(f"[MJ] task check res sync, task_id={task.id}, status={res.status_code}, "
-                                 f"data={res_json.get('data')}, thread={threading.current_thread().name}")
+                    logger.debug("[MJ] task check res sync, task_id=%s, status=%s, data=%s, thread=%s",
+                                 task.id,
+                                 res.status_code,
+                                 res_json.get('data'),
+                                 threading.current_thread().name)
                     if res_json.get("data") and res_json.get("data").get("status") == Status.FINISHED.name:
                         # process success res
                         if self.tasks.get(task.id):
@@ -311,7 +314,7 @@ class MJBot:
         task.status = Status.FINISHED
         task.img_id = res.get("img_id")
         task.img_url = res.get("img_url")
-        logger.info(f"[MJ] task success, task_id={task.id}, img_id={task.img_id}, img_url={task.img_url}")
+        logger.info("[MJ] task success, task_id=%s, img_id=%s, img_url=%s", task.id, task.img_id, task.img_url)
 
         # send img
         reply = Reply(ReplyType.IMAGE_URL, task.img_url)
@@ -376,7 +379,7 @@ class MJBot:
 
     def _print_tasks(self):
         for id in self.tasks:
-            logger.debug(f"[MJ] current task: {self.tasks[id]}")
+            logger.debug("[MJ] current task: %s", self.tasks[id])
 
     def _set_reply_text(self, content: str, e_context: EventContext, level: ReplyType = ReplyType.ERROR):
         """
@@ -406,7 +409,7 @@ class MJBot:
             for task in self.tasks.values():
                 if task.status == Status.PENDING and now > task.expiry_time:
                     task.status = Status.EXPIRED
-                    logger.info(f"[MJ] {task} expired")
+                    logger.info("[MJ] %s expired", task)
                 if task.user_id == user_id:
                     result.append(task)
         return result
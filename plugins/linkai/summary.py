@@ -18,7 +18,7 @@ class LinkSummary:
             "app_code": app_code
         }
         url = self.base_url() + "/v1/summary/file"
-        logger.info(f"[LinkSum] file summary, app_code={app_code}")
+        logger.info("[LinkSum] file summary, app_code=%s", app_code)
         res = requests.post(url, headers=self.headers(), files=file_body, data=body, timeout=(5, 300))
         return self._parse_summary_res(res)
 
@@ -28,7 +28,7 @@ class LinkSummary:
             "url": url,
             "app_code": app_code
         }
-        logger.info(f"[LinkSum] url summary, app_code={app_code}")
+        logger.info("[LinkSum] url summary, app_code=%s", app_code)
         res = requests.post(url=self.base_url() + "/v1/summary/url", headers=self.headers(), json=body, timeout=(5, 180))
         return self._parse_summary_res(res)
 
@@ -39,7 +39,7 @@ class LinkSummary:
         res = requests.post(url=self.base_url() + "/v1/summary/chat", headers=self.headers(), json=body, timeout=(5, 180))
         if res.status_code == 200:
             res = res.json()
-            logger.debug(f"[LinkSum] chat open, res={res}")
+            logger.debug("[LinkSum] chat open, res=%s", res)
             if res.get("code") == 200:
                 data = res.get("data")
                 return {
@@ -54,7 +54,7 @@ class LinkSummary:
     def _parse_summary_res(self, res):
         if res.status_code == 200:
             res = res.json()
-            logger.debug(f"[LinkSum] summary result, res={res}")
+            logger.debug("[LinkSum] summary result, res=%s", res)
             if res.get("code") == 200:
                 data = res.get("data")
                 return {
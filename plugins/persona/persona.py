@@ -70,7 +70,7 @@ class Persona(Plugin):
             if self.evolution_enabled:
                 self._start_evolution_scheduler()
 
-            logger.info(f"[人格插件] 已初始化。版本 0.4.1。当前情绪: {self.current_emotion}")
+            logger.info("[人格插件] 已初始化。版本 0.4.1。当前情绪: %s", self.current_emotion)
 
         except Exception as e:
             logger.error(f"[人格插件] 初始化失败: {e}")
@@ -87,7 +87,7 @@ class Persona(Plugin):
         emotion_behavior = self.emotions.get(self.current_emotion, {})
         reply_probability = emotion_behavior.get("reply_probability", 1.0)
         if random.random() > reply_probability:
-            logger.info(f"[人格插件] 基于情绪 '{self.current_emotion}' 决定忽略消息 (概率: {reply_probability})")
+            logger.info("[人格插件] 基于情绪 '%s' 决定忽略消息 (概率: %s)", self.current_emotion, reply_probability)
             e_context.action = EventAction.BREAK_PASS
             return
 
@@ -136,7 +136,7 @@ class Persona(Plugin):
             if new_emotion := data.get("new_emotion"):
                 if new_emotion in self.emotions:
                     self.current_emotion = new_emotion
-                    logger.info(f"[人格插件] 情绪已更新为: {self.current_emotion}")
+                    logger.info("[人格插件] 情绪已更新为: %s", self.current_emotion)
             if facts := data.get("facts_to_remember"):
                 if isinstance(facts, list) and len(facts) > 0:
                     self._save_memory(self._get_session_id(context), facts)
@@ -161,7 +161,7 @@ class Persona(Plugin):
             session_id = session_file.replace(".json", "")
             memory_file_path = self._get_memory_path(session_id)
             if (now - os.path.getmtime(memory_file_path)) > self.proactive_min_silence:
-                logger.info(f"[人格插件] 正在为 {session_id} 考虑主动发送消息")
+                logger.info("[人格插件] 正在为 %s 考虑主动发送消息", session_id)
                 memory = self._load_memory(session_id)
                 if not memory: continue
                 prompt = self.proactive_prompt.format(personality_prompt=self.personality_prompt, memory_list="\n".join(memory))
@@ -170,7 +170,7 @@ class Persona(Plugin):
                     self._send_proactive_message(session_id, reply.content)
 
     def _send_proactive_message(self, session_id: str, content: str):
-        logger.info(f"[人格插件] 发送主动消息给 {session_id}")
+        logger.info("[人格插件] 发送主动消息给 %s", session_id)
         bridge = Bridge()
         mock_msg = ChatMessage()
         mock_msg.from_user_id = session_id
@@ -213,7 +213,7 @@ class Persona(Plugin):
                 if new_prompt != self.personality_prompt:
                     self.personality_prompt = new_prompt
                     self._update_config_file()
-                    logger.info(f"[人格插件] 人格已为 {session_id} 进化！")
+                    logger.info("[人格插件] 人格已为 %s 进化！", session_id)
         except Exception as e:
             logger.error(f"[人格插件] 处理反思回复失败: {e}")
 
@@ -251,7 +251,7 @@ class Persona(Plugin):
         try:
             with open(memory_file, "w", encoding="utf-8") as f:
                 json.dump(memory, f, ensure_ascii=False, indent=4)
-            logger.info(f"[人格插件] 已为 {session_id} 保存 {len(new_facts)} 条新记忆")
+            logger.info("[人格插件] 已为 %s 保存 %s 条新记忆", session_id, len(new_facts))
         except Exception as e:
             logger.error(f"[人格插件] 为 {session_id} 保存记忆失败: {e}")
 
@@ -18,14 +18,14 @@ class Plugin:
         if not plugin_conf:
             # 全局配置不存在，则获取插件目录下的配置
             plugin_config_path = os.path.join(self.path, "config.json")
-            logger.debug(f"loading plugin config, plugin_config_path={plugin_config_path}, exist={os.path.exists(plugin_config_path)}")
+            logger.debug("loading plugin config, plugin_config_path=%s, exist=%s", plugin_config_path, os.path.exists(plugin_config_path))
             if os.path.exists(plugin_config_path):
                 with open(plugin_config_path, "r", encoding="utf-8") as f:
                     plugin_conf = json.load(f)
 
                 # 写入全局配置内存
                 write_plugin_config({self.name: plugin_conf})
-        logger.debug(f"loading plugin config, plugin_name={self.name}, conf={plugin_conf}")
+        logger.debug("loading plugin config, plugin_name=%s, conf=%s", self.name, plugin_conf)
         return plugin_conf
 
     def save_config(self, config: dict):
@@ -6,6 +6,7 @@ import json
 import os
 import sys
 
+from common import tracing
 from common.log import logger
 from common.singleton import singleton
 from common.sorted_dict import SortedDict
@@ -77,7 +78,7 @@ class PluginManager:
                 # read from all plugins config
                 with open(all_config_path, "r", encoding="utf-8") as f:
                     all_conf = json.load(f)
-                    logger.info(f"load all config from plugins/config.json: {all_conf}")
+                    logger.info("load all config from plugins/config.json: %s", all_conf)
 
                 # write to global config
                 write_plugin_config(all_conf)
@@ -181,7 +182,7 @@ class PluginManager:
         # 加载全量插件配置
         self._load_all_config()
         pconf = self.pconf
-        logger.debug("plugins.json config={}".format(pconf))
+        logger.debug("plugins.json config=%s", pconf)
         for name, plugin in pconf["plugins"].items():
             if name.upper() not in self.plugins:
                 logger.error("Plugin %s not found, but found in plugins.json" % name)
@@ -191,14 +192,21 @@ class PluginManager:
         if e_context.event in self.listening_plugins:
             for name in self.listening_plugins[e_context.event]:
                 if self.plugins[name].enabled and e_context.action == EventAction.CONTINUE:
-                    logger.debug("Plugin %s triggered by event %s" % (name, e_context.event))
+                    logger.debug("Plugin %s triggered by event %s", name, e_context.event)
                     instance = self.instances[name]
-                    instance.handlers[e_context.event](e_context, *args, **kwargs)
+                    with tracing.span(e_context.econtext.get("context"), "plugin", plugin=name, event=e_context.event.name):
+                        instance.handlers[e_context.event](e_context, *args, **kwargs)
                     if e_context.is_break():
                         e_context["breaked_by"] = name
-                        logger.debug("Plugin %s breaked event %s" % (name, e_context.event))
+                        logger.debug("Plugin %s breaked event %s", name, e_context.event)
         return e_context
 
+    def has_listener(self, event: Event):
+        """
+        是否有已开启的插件处理该事件
+        """
+        return any(self.plugins[name].enabled for name in self.listening_plugins.get(event, []))
+
     def set_plugin_priority(self, name: str, priority: int):
         name = name.upper()
         if name not in self.plugins:
@@ -256,7 +264,7 @@ class PluginManager:
 
         from dulwich import porcelain
 
-        logger.info("clone git repo: {}".format(repo))
+        logger.info("clone git repo: %s", repo)
 
         match = re.match(r"^(https?:\/\/|git@)([^\/:]+)[\/:]([^\/:]+)\/(.+).git$", repo)
 
@@ -59,7 +59,7 @@ class Role(Plugin):
                         self.tags[tag][1].append(role)
                 for tag in list(self.tags.keys()):
                     if len(self.tags[tag][1]) == 0:
-                        logger.debug(f"[Role] no role found for tag {tag} ")
+                        logger.debug("[Role] no role found for tag %s ", tag)
                         del self.tags[tag]
 
             if len(self.roles) == 0:
@@ -100,7 +100,7 @@ class Role(Plugin):
             return
         btype = Bridge().get_bot_type("chat")
         if btype not in [const.OPEN_AI, const.CHATGPT, const.CHATGPTONAZURE, const.QWEN_DASHSCOPE, const.XUNFEI, const.BAIDU, const.ZHIPU_AI, const.MOONSHOT, const.MiniMax, const.LINKAI,const.MODELSCOPE]:
-            logger.debug(f'不支持的bot: {btype}')
+            logger.debug("不支持的bot: %s", btype)
             return
         bot = Bridge().get_bot("chat")
         content = e_context["context"].content[:]
@@ -54,10 +54,10 @@ def text_to_speech_aliyun(url, text, appkey, token):
 
         with open(output_file, 'wb') as file:
             file.write(response.content)
-        logger.debug(f"音频文件保存成功，文件名：{output_file}")
+        logger.debug("音频文件保存成功，文件名：%s", output_file)
     else:
-        logger.debug("响应状态码: {}".format(response.status_code))
-        logger.debug("响应内容: {}".format(response.text))
+        logger.debug("响应状态码: %s", response.status_code)
+        logger.debug("响应内容: %s", response.text)
         output_file = None
 
     return output_file
@@ -115,7 +115,7 @@ def speech_to_text_aliyun(url, audioContent, appkey, token):
         if status == 20000000 :
             result = body['result']
             if result :
-                logger.info(f"阿里云语音识别到了：{result}")
+                logger.info("阿里云语音识别到了：%s", result)
             conn.close()
             return result
         else :
@@ -22,6 +22,8 @@ from config import conf
 
 
 class AliVoice(Voice):
+    ASR_MAX_DURATION = 60 * 1000
+
     def __init__(self):
         """
         初始化AliVoice类，从配置文件加载必要的配置。
@@ -42,6 +44,9 @@ class AliVoice(Voice):
         except Exception as e:
             logger.warn("AliVoice init failed: %s, ignore " % e)
 
+    def ttsCacheKey(self):
+        return {"app_key": self.app_key, "api_url": self.api_url_text_to_voice}
+
     def textToVoice(self, text):
         """
         将文本转换为语音文件。
@@ -56,7 +61,7 @@ class AliVoice(Voice):
         token_id = self.get_valid_token()
         fileName = text_to_speech_aliyun(self.api_url_text_to_voice, text, self.app_key, token_id)
         if fileName:
-            logger.info("[Ali] textToVoice text={} voice file name={}".format(text, fileName))
+            logger.info("[Ali] textToVoice text=%s voice file name=%s", text, fileName)
             reply = Reply(ReplyType.VOICE, fileName)
         else:
             reply = Reply(ReplyType.ERROR, "抱歉，语音合成失败")
@@ -71,11 +76,11 @@ class AliVoice(Voice):
         """
         # 提取有效的token
         token_id = self.get_valid_token()
-        logger.debug("[Ali] voice file name={}".format(voice_file))
+        logger.debug("[Ali] voice file name=%s", voice_file)
         pcm = get_pcm_from_wav(voice_file)
         text = speech_to_text_aliyun(self.api_url_voice_to_text, pcm, self.app_key, token_id)
         if text:
-            logger.info("[Ali] VoicetoText = {}".format(text))
+            logger.info("[Ali] VoicetoText = %s", text)
             reply = Reply(ReplyType.TEXT, text)
         else:
             reply = Reply(ReplyType.ERROR, "抱歉，语音识别失败")
@@ -95,7 +100,7 @@ class AliVoice(Voice):
             self.token = token_data["Token"]["Id"]
             # 将过期时间减少一小段时间（例如5分钟），以避免在边界条件下的过期
             self.token_expire_time = token_data["Token"]["ExpireTime"] - 300
-            logger.debug(f"新获取的阿里云token：{self.token}")
+            logger.debug("新获取的阿里云token：%s", self.token)
         else:
             logger.debug("使用缓存的token")
         return self.token
@@ -1,5 +1,11 @@
+import os
 import shutil
+import subprocess
+import threading
+import time
 import wave
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 from common.log import logger
 
@@ -8,10 +14,14 @@ try:
 except ImportError:
     logger.debug("import pysilk failed, wechaty voice message will not be supported.")
 
-from pydub import AudioSegment
+from pydub import AudioSegment, silence
 
 sil_supports = [8000, 12000, 16000, 24000, 32000, 44100, 48000]  # slk转wav时，支持的采样率
 
+# 百度、阿里、讯飞、腾讯的语音识别均按16000采样率、pcm_s16le、单通道处理
+ASR_SAMPLE_RATE = 16000
+SILK_SAMPLE_RATE = 24000
+
 
 def find_closest_sil_supports(sample_rate):
     """
@@ -40,43 +50,58 @@ def get_pcm_from_wav(wav_path):
     return wav.readframes(wav.getnframes())
 
 
-def any_to_mp3(any_path, mp3_path):
+def _is_silk(path):
+    return path.endswith(".sil") or path.endswith(".silk") or path.endswith(".slk")
+
+
+def _load_audio(path):
     """
-    把任意格式转成mp3文件
+    解码为内存中的PCM，silk文件直接解码，不生成中间wav文件
     """
+    if _is_silk(path):
+        pcm = pysilk.decode_file(path, to_wav=False, sample_rate=SILK_SAMPLE_RATE)
+        return AudioSegment(data=pcm, sample_width=2, frame_rate=SILK_SAMPLE_RATE, channels=1)
+    return AudioSegment.from_file(path)
+
+
+def _export(audio, path, format):
+    """
+    通过管道把PCM直接送入ffmpeg编码并写入目标文件，避免pydub导出时的临时文件
+    """
+    if format == "wav":
+        audio.export(path, format="wav")
+        return
+    audio = audio.set_sample_width(2)
+    cmd = [AudioSegment.converter, "-y", "-f", "s16le", "-ar", str(audio.frame_rate), "-ac", str(audio.channels), "-i", "pipe:0", "-f", format, path]
+    p = subprocess.run(cmd, input=audio.raw_data, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if p.returncode != 0:
+        raise RuntimeError("ffmpeg encode {} failed: {}".format(format, p.stderr.decode("utf-8", errors="ignore")[-500:]))
+
+
+def _any_to_mp3(any_path, mp3_path):
     if any_path.endswith(".mp3"):
         shutil.copy2(any_path, mp3_path)
         return
-    if any_path.endswith(".sil") or any_path.endswith(".silk") or any_path.endswith(".slk"):
-        sil_to_wav(any_path, any_path)
-        any_path = mp3_path
-    audio = AudioSegment.from_file(any_path)
-    audio.export(mp3_path, format="mp3")
+    _export(_load_audio(any_path), mp3_path, "mp3")
 
 
-def any_to_wav(any_path, wav_path):
-    """
-    把任意格式转成wav文件
-    """
+def _any_to_wav(any_path, wav_path, sample_rate):
     if any_path.endswith(".wav"):
-        shutil.copy2(any_path, wav_path)
-        return
-    if any_path.endswith(".sil") or any_path.endswith(".silk") or any_path.endswith(".slk"):
-        return sil_to_wav(any_path, wav_path)
-    audio = AudioSegment.from_file(any_path)
-    audio.set_frame_rate(8000)    # 百度语音转写支持8000采样率, pcm_s16le, 单通道语音识别
-    audio.set_channels(1)
-    audio.export(wav_path, format="wav", codec='pcm_s16le')
+        with wave.open(any_path, "rb") as wav:
+            params = wav.getparams()
+        if params.framerate == sample_rate and params.nchannels == 1 and params.sampwidth == 2:
+            shutil.copy2(any_path, wav_path)
+            return
+    audio = _load_audio(any_path)
+    audio = audio.set_frame_rate(sample_rate).set_channels(1).set_sample_width(2)
+    _export(audio, wav_path, "wav")
 
 
-def any_to_sil(any_path, sil_path):
-    """
-    把任意格式转成sil文件
-    """
-    if any_path.endswith(".sil") or any_path.endswith(".silk") or any_path.endswith(".slk"):
+def _any_to_sil(any_path, sil_path):
+    if _is_silk(any_path):
         shutil.copy2(any_path, sil_path)
         return 10000
-    audio = AudioSegment.from_file(any_path)
+    audio = _load_audio(any_path)
     rate = find_closest_sil_supports(audio.frame_rate)
     # Convert to PCM_s16
     pcm_s16 = audio.set_sample_width(2)
@@ -88,21 +113,183 @@ def any_to_sil(any_path, sil_path):
     return audio.duration_seconds * 1000
 
 
-def any_to_amr(any_path, amr_path):
-    """
-    把任意格式转成amr文件
-    """
+def _any_to_amr(any_path, amr_path):
     if any_path.endswith(".amr"):
         shutil.copy2(any_path, amr_path)
         return
-    if any_path.endswith(".sil") or any_path.endswith(".silk") or any_path.endswith(".slk"):
-        raise NotImplementedError("Not support file type: {}".format(any_path))
-    audio = AudioSegment.from_file(any_path)
-    audio = audio.set_frame_rate(8000)  # only support 8000
-    audio.export(amr_path, format="amr")
+    audio = _load_audio(any_path)
+    audio = audio.set_frame_rate(8000).set_channels(1)  # only support 8000
+    _export(audio, amr_path, "amr")
     return audio.duration_seconds * 1000
 
 
+def _split_audio(file_path, max_segment_length_ms):
+    audio = _load_audio(file_path)
+    audio_length_ms = len(audio)
+    if audio_length_ms <= max_segment_length_ms:
+        return audio_length_ms, [file_path]
+    file_prefix = file_path[: file_path.rindex(".")]
+    format = file_path[file_path.rindex(".") + 1 :]
+    files = []
+    for i, start_ms in enumerate(range(0, audio_length_ms, max_segment_length_ms)):
+        end_ms = min(audio_length_ms, start_ms + max_segment_length_ms)
+        path = f"{file_prefix}_{i+1}" + f".{format}"
+        _export(audio[start_ms:end_ms], path, format)
+        files.append(path)
+    return audio_length_ms, files
+
+
+def _split_on_silence(file_path, max_segment_length_ms, min_silence_len=300):
+    audio = _load_audio(file_path)
+    audio_length_ms = len(audio)
+    if audio_length_ms <= max_segment_length_ms:
+        return audio_length_ms, [file_path]
+    # 以静音段的中点作为候选切分点
+    silences = silence.detect_silence(audio, min_silence_len=min_silence_len, silence_thresh=audio.dBFS - 16, seek_step=10)
+    cut_points = [(start + end) // 2 for start, end in silences]
+    file_prefix = file_path[: file_path.rindex(".")]
+    format = file_path[file_path.rindex(".") + 1 :]
+    files = []
+    start_ms = 0
+    while start_ms < audio_length_ms:
+        end_ms = min(audio_length_ms, start_ms + max_segment_length_ms)
+        if end_ms < audio_length_ms:
+            # 在不超过最大长度的范围内找最后一个静音点，找不到时按最大长度硬切
+            candidates = [p for p in cut_points if start_ms < p <= end_ms]
+            if candidates:
+                end_ms = candidates[-1]
+        path = f"{file_prefix}_{len(files)+1}" + f".{format}"
+        _export(audio[start_ms:end_ms], path, format)
+        files.append(path)
+        start_ms = end_ms
+    return audio_length_ms, files
+
+
+def _concat_audio(paths, out_path):
+    audio = _load_audio(paths[0])
+    for path in paths[1:]:
+        audio += _load_audio(path)  # pydub会把采样率、声道统一到较高的一方
+    _export(audio, out_path, os.path.splitext(out_path)[1][1:])
+    return len(audio)
+
+
+class AudioTranscoder(object):
+    """
+    音频转码服务，转码在进程池中执行，并按目标格式统计转换耗时
+    """
+
+    def __init__(self):
+        self.pool = None
+        self.lock = threading.Lock()
+        self.latency = {}  # format -> {"count", "errors", "total_ms", "max_ms"}
+
+    def _get_pool(self):
+        from config import conf
+
+        with self.lock:
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor(max_workers=conf().get("audio_convert_workers", 2))
+            return self.pool
+
+    def _reset_pool(self):
+        with self.lock:
+            if self.pool is not None:
+                self.pool.shutdown(wait=False)
+                self.pool = None
+
+    def _record(self, format, elapsed_ms, success):
+        with self.lock:
+            item = self.latency.setdefault(format, {"count": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0})
+            item["count"] += 1
+            item["total_ms"] += elapsed_ms
+            item["max_ms"] = max(item["max_ms"], elapsed_ms)
+            if not success:
+                item["errors"] += 1
+
+    def run(self, format, func, *args):
+        from config import conf
+
+        start = time.time()
+        success = False
+        try:
+            if conf().get("audio_convert_workers", 2) > 0:
+                try:
+                    result = self._get_pool().submit(func, *args).result()
+                except BrokenProcessPool as e:
+                    logger.warning("[audio_convert] process pool broken, convert in current process: {}".format(e))
+                    self._reset_pool()
+                    result = func(*args)
+            else:
+                result = func(*args)
+            success = True
+            return result
+        finally:
+            elapsed_ms = (time.time() - start) * 1000
+            self._record(format, elapsed_ms, success)
+            logger.debug("[audio_convert] convert to %s cost %.1fms, args=%s", format, elapsed_ms, args)
+
+    def stats(self):
+        """
+        :return: 各格式的转换次数、失败次数、平均和最大耗时(毫秒)
+        """
+        with self.lock:
+            return {
+                format: {
+                    "count": item["count"],
+                    "errors": item["errors"],
+                    "avg_ms": round(item["total_ms"] / item["count"], 1),
+                    "max_ms": round(item["max_ms"], 1),
+                }
+                for format, item in self.latency.items()
+            }
+
+
+transcoder = AudioTranscoder()
+
+
+def any_to_mp3(any_path, mp3_path):
+    """
+    把任意格式转成mp3文件
+    """
+    return transcoder.run("mp3", _any_to_mp3, any_path, mp3_path)
+
+
+def any_to_wav(any_path, wav_path, sample_rate=ASR_SAMPLE_RATE):
+    """
+    把任意格式转成语音识别使用的wav文件(pcm_s16le, 单通道)
+    """
+    return transcoder.run("wav", _any_to_wav, any_path, wav_path, sample_rate)
+
+
+def any_to_sil(any_path, sil_path):
+    """
+    把任意格式转成sil文件
+    """
+    return transcoder.run("sil", _any_to_sil, any_path, sil_path)
+
+
+def any_to_amr(any_path, amr_path):
+    """
+    把任意格式转成amr文件
+    """
+    return transcoder.run("amr", _any_to_amr, any_path, amr_path)
+
+
+def split_on_silence(file_path, max_segment_length_ms=60000):
+    """
+    在静音处分割音频文件，每段不超过max_segment_length_ms
+    """
+    return transcoder.run("split", _split_on_silence, file_path, max_segment_length_ms)
+
+
+def concat_audio(paths, out_path):
+    """
+    按顺序拼接多个音频文件，解码后的PCM在内存中拼接，只编码一次
+    :return: 拼接后的时长(毫秒)
+    """
+    return transcoder.run("concat", _concat_audio, paths, out_path)
+
+
 def sil_to_wav(silk_path, wav_path, rate: int = 24000):
     """
     silk 文件转 wav
@@ -116,20 +303,4 @@ def split_audio(file_path, max_segment_length_ms=60000):
     """
     分割音频文件
     """
-    audio = AudioSegment.from_file(file_path)
-    audio_length_ms = len(audio)
-    if audio_length_ms <= max_segment_length_ms:
-        return audio_length_ms, [file_path]
-    segments = []
-    for start_ms in range(0, audio_length_ms, max_segment_length_ms):
-        end_ms = min(audio_length_ms, start_ms + max_segment_length_ms)
-        segment = audio[start_ms:end_ms]
-        segments.append(segment)
-    file_prefix = file_path[: file_path.rindex(".")]
-    format = file_path[file_path.rindex(".") + 1 :]
-    files = []
-    for i, segment in enumerate(segments):
-        path = f"{file_prefix}_{i+1}" + f".{format}"
-        segment.export(path, format=format)
-        files.append(path)
-    return audio_length_ms, files
+    return transcoder.run("split", _split_audio, file_path, max_segment_length_ms)
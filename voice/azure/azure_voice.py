@@ -24,6 +24,8 @@ Azure voice
 
 
 class AzureVoice(Voice):
+    ASR_MAX_DURATION = 15 * 1000  # recognize_once只识别一句，最长15秒
+
     def __init__(self):
         try:
             curdir = os.path.dirname(__file__)
@@ -61,7 +63,7 @@ class AzureVoice(Voice):
         speech_recognizer = speechsdk.SpeechRecognizer(speech_config=self.speech_config, audio_config=audio_config)
         result = speech_recognizer.recognize_once()
         if result.reason == speechsdk.ResultReason.RecognizedSpeech:
-            logger.info("[Azure] voiceToText voice file name={} text={}".format(voice_file, result.text))
+            logger.info("[Azure] voiceToText voice file name=%s text=%s", voice_file, result.text)
             reply = Reply(ReplyType.TEXT, result.text)
         else:
             cancel_details = result.cancellation_details
@@ -69,12 +71,15 @@ class AzureVoice(Voice):
             reply = Reply(ReplyType.ERROR, "抱歉，语音识别失败")
         return reply
 
+    def ttsCacheKey(self):
+        return self.config
+
     def textToVoice(self, text):
         if self.config.get("auto_detect"):
             lang = classify(text)[0]
             key = "speech_synthesis_" + lang
             if key in self.config:
-                logger.info("[Azure] textToVoice auto detect language={}, voice={}".format(lang, self.config[key]))
+                logger.info("[Azure] textToVoice auto detect language=%s, voice=%s", lang, self.config[key])
                 self.speech_config.speech_synthesis_voice_name = self.config[key]
             else:
                 self.speech_config.speech_synthesis_voice_name = self.config["speech_synthesis_voice_name"]
@@ -86,7 +91,7 @@ class AzureVoice(Voice):
         speech_synthesizer = speechsdk.SpeechSynthesizer(speech_config=self.speech_config, audio_config=audio_config)
         result = speech_synthesizer.speak_text(text)
         if result.reason == speechsdk.ResultReason.SynthesizingAudioCompleted:
-            logger.info("[Azure] textToVoice text={} voice file name={}".format(text, fileName))
+            logger.info("[Azure] textToVoice text=%s voice file name=%s", text, fileName)
             reply = Reply(ReplyType.VOICE, fileName)
         else:
             cancel_details = result.cancellation_details
@@ -41,10 +41,13 @@ class EdgeVoice(Voice):
         communicate = edge_tts.Communicate(text, self.voice)
         await communicate.save(fileName)
 
+    def ttsCacheKey(self):
+        return {"voice": self.voice}
+
     def textToVoice(self, text):
         fileName = TmpDir().path() + "reply-" + str(int(time.time())) + "-" + str(hash(text) & 0x7FFFFFFF) + ".mp3"
 
         asyncio.run(self.gen_voice(text, fileName))
 
-        logger.info("[EdgeTTS] textToVoice text={} voice file name={}".format(text, fileName))
+        logger.info("[EdgeTTS] textToVoice text=%s voice file name=%s", text, fileName)
         return Reply(ReplyType.VOICE, fileName)
@@ -20,6 +20,9 @@ class ElevenLabsVoice(Voice):
     def voiceToText(self, voice_file):
         pass
 
+    def ttsCacheKey(self):
+        return {"voice": name, "model": "eleven_multilingual_v2"}
+
     def textToVoice(self, text):
         audio = client.generate(
             text=text,
@@ -28,5 +31,5 @@ class ElevenLabsVoice(Voice):
         )
         fileName = TmpDir().path() + "reply-" + str(int(time.time())) + "-" + str(hash(text) & 0x7FFFFFFF) + ".mp3"
         save(audio, fileName)
-        logger.info("[ElevenLabs] textToVoice text={} voice file name={}".format(text, fileName))
+        logger.info("[ElevenLabs] textToVoice text=%s voice file name=%s", text, fileName)
         return Reply(ReplyType.VOICE, fileName)
\ No newline at end of file
@@ -14,6 +14,8 @@ from voice.voice import Voice
 
 
 class GoogleVoice(Voice):
+    ASR_MAX_DURATION = 60 * 1000
+
     recognizer = speech_recognition.Recognizer()
 
     def __init__(self):
@@ -24,7 +26,7 @@ class GoogleVoice(Voice):
             audio = self.recognizer.record(source)
         try:
             text = self.recognizer.recognize_google(audio, language="zh-CN")
-            logger.info("[Google] voiceToText text={} voice file name={}".format(text, voice_file))
+            logger.info("[Google] voiceToText text=%s voice file name=%s", text, voice_file)
             reply = Reply(ReplyType.TEXT, text)
         except speech_recognition.UnknownValueError:
             reply = Reply(ReplyType.ERROR, "抱歉，我听不懂")
@@ -39,7 +41,7 @@ class GoogleVoice(Voice):
             mp3File = TmpDir().path() + "reply-" + str(int(time.time())) + "-" + str(hash(text) & 0x7FFFFFFF) + ".mp3"
             tts = gTTS(text=text, lang="zh")
             tts.save(mp3File)
-            logger.info("[Google] textToVoice text={} voice file name={}".format(text, mp3File))
+            logger.info("[Google] textToVoice text=%s voice file name=%s", text, mp3File)
             reply = Reply(ReplyType.VOICE, mp3File)
         except Exception as e:
             reply = Reply(ReplyType.ERROR, str(e))
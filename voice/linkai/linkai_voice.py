@@ -17,7 +17,7 @@ class LinkAIVoice(Voice):
         pass
 
     def voiceToText(self, voice_file):
-        logger.debug("[LinkVoice] voice file name={}".format(voice_file))
+        logger.debug("[LinkVoice] voice file name=%s", voice_file)
         try:
             url = conf().get("linkai_api_base", "https://api.link-ai.tech") + "/v1/audio/transcriptions"
             headers = {"Authorization": "Bearer " + conf().get("linkai_api_key")}
@@ -46,7 +46,7 @@ class LinkAIVoice(Voice):
                 logger.error(f"[LinkVoice] voiceToText error, status_code={res.status_code}, msg={res_json.get('message')}")
                 return None
             reply = Reply(ReplyType.TEXT, text)
-            logger.info(f"[LinkVoice] voiceToText success, text={text}, file name={voice_file}")
+            logger.info("[LinkVoice] voiceToText success, text=%s, file name=%s", text, voice_file)
         except Exception as e:
             logger.error(e)
             return None
@@ -71,7 +71,7 @@ class LinkAIVoice(Voice):
                 with open(tmp_file_name, 'wb') as f:
                     f.write(res.content)
                 reply = Reply(ReplyType.VOICE, tmp_file_name)
-                logger.info(f"[LinkVoice] textToVoice success, input={text}, model={model}, voice_id={data.get('voice')}")
+                logger.info("[LinkVoice] textToVoice success, input=%s, model=%s, voice_id=%s", text, model, data.get('voice'))
                 return reply
             else:
                 res_json = res.json()
@@ -3,8 +3,6 @@ google voice service
 """
 import json
 
-import openai
-
 from bridge.reply import Reply, ReplyType
 from common.log import logger
 from config import conf
@@ -15,10 +13,10 @@ import datetime, random
 
 class OpenaiVoice(Voice):
     def __init__(self):
-        openai.api_key = conf().get("open_ai_api_key")
+        pass
 
     def voiceToText(self, voice_file):
-        logger.debug("[Openai] voice file name={}".format(voice_file))
+        logger.debug("[Openai] voice file name=%s", voice_file)
         try:
             file = open(voice_file, "rb")
             api_base = conf().get("open_ai_api_base") or "https://api.openai.com/v1"
@@ -37,7 +35,7 @@ class OpenaiVoice(Voice):
             response_data = response.json()
             text = response_data['text']
             reply = Reply(ReplyType.TEXT, text)
-            logger.info("[Openai] voiceToText text={} voice file name={}".format(text, voice_file))
+            logger.info("[Openai] voiceToText text=%s voice file name=%s", text, voice_file)
         except Exception as e:
             reply = Reply(ReplyType.ERROR, "我暂时还无法听清您的语音，请稍后再试吧~")
         finally:
@@ -59,7 +57,7 @@ class OpenaiVoice(Voice):
             }
             response = requests.post(url, headers=headers, json=data)
             file_name = "tmp/" + datetime.datetime.now().strftime('%Y%m%d%H%M%S') + str(random.randint(0, 1000)) + ".mp3"
-            logger.debug(f"[OPENAI] text_to_Voice file_name={file_name}, input={text}")
+            logger.debug("[OPENAI] text_to_Voice file_name=%s, input=%s", file_name, text)
             with open(file_name, 'wb') as f:
                 f.write(response.content)
             logger.info(f"[OPENAI] text_to_Voice success")
@@ -0,0 +1,109 @@
+"""
+长语音识别：在静音处切分音频，各段并发识别后按顺序拼接文本
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from bridge.bridge import Bridge
+from bridge.reply import Reply, ReplyType
+from common.log import logger
+from config import conf
+from voice.audio_convert import split_on_silence
+
+
+def join_texts(texts):
+    """
+    拼接各段识别结果，中文之间不加空格，其他情况用空格分隔
+    """
+    result = ""
+    for text in texts:
+        text = text.strip()
+        if not text:
+            continue
+        if result and (result[-1].isascii() or text[0].isascii()):
+            result += " "
+        result += text
+    return result
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except Exception:
+        pass
+
+
+class ParallelASR(object):
+    def __init__(self):
+        self.pool = None
+        self.semaphores = {}  # voice_type -> BoundedSemaphore，限制每个语音引擎的并发请求数
+        self.lock = threading.Lock()
+
+    def _get_pool(self):
+        with self.lock:
+            if self.pool is None:
+                self.pool = ThreadPoolExecutor(max_workers=conf().get("asr_pool_size", 8), thread_name_prefix="asr")
+            return self.pool
+
+    def _get_semaphore(self, voice_type, voice):
+        with self.lock:
+            if voice_type not in self.semaphores:
+                self.semaphores[voice_type] = threading.BoundedSemaphore(voice.ASR_MAX_CONCURRENCY or conf().get("asr_max_concurrency", 3))
+            return self.semaphores[voice_type]
+
+    def _recognize(self, semaphore, voice, path):
+        # 每段识别完成后删除自己的文件，提前返回时已经在识别的分段仍在读取文件
+        try:
+            with semaphore:
+                return voice.voiceToText(path)
+        finally:
+            _remove(path)
+
+    def voice_to_text(self, voice_file):
+        """
+        :param voice_file: 语音文件路径，一般是16k单声道wav
+        :return: 识别结果，任一分段失败时返回该分段的失败回复
+        """
+        bridge = Bridge()
+        if not conf().get("asr_parallel_enabled", True):
+            return bridge.fetch_voice_to_text(voice_file)
+        voice_type = bridge.btype["voice_to_text"]
+        voice = bridge.get_bot("voice_to_text")
+        max_length = conf().get("asr_chunk_length", 30 * 1000)
+        if voice.ASR_MAX_DURATION:
+            max_length = min(max_length, voice.ASR_MAX_DURATION)
+        try:
+            duration, files = split_on_silence(voice_file, max_length)
+        except Exception as e:
+            logger.warning("[ParallelASR] split audio error, recognize the whole file instead: {}".format(e))
+            return bridge.fetch_voice_to_text(voice_file)
+        if len(files) <= 1:
+            return bridge.fetch_voice_to_text(voice_file)
+        logger.info("[ParallelASR] voice duration=%ss, split into %s segments, voice_type=%s", duration / 1000.0, len(files), voice_type)
+        semaphore = self._get_semaphore(voice_type, voice)
+        futures = [self._get_pool().submit(self._recognize, semaphore, voice, path) for path in files]
+        texts = []
+        reply = None
+        try:
+            for i, future in enumerate(futures):
+                try:
+                    reply = future.result()
+                except Exception as e:
+                    logger.exception("[ParallelASR] recognize segment {} error: {}".format(i, e))
+                    reply = Reply(ReplyType.ERROR, "抱歉，语音识别失败")
+                if not reply or reply.type != ReplyType.TEXT:
+                    for f in futures[i + 1 :]:
+                        f.cancel()
+                    return reply
+                texts.append(reply.content or "")
+        finally:
+            # 已取消的分段不会执行，由这里删除文件
+            for path, future in zip(files, futures):
+                if future.cancelled():
+                    _remove(path)
+        return Reply(ReplyType.TEXT, join_texts(texts))
+
+
+parallel_asr = ParallelASR()
@@ -0,0 +1,134 @@
+"""
+长文本语音合成：按句子切分后并发合成，再按顺序拼接成一个语音文件，或者每段合成好就按顺序发送
+"""
+
+import os
+import re
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from bridge.bridge import Bridge
+from bridge.reply import Reply, ReplyType
+from common.log import logger
+from common.tmp_dir import TmpDir
+from config import conf
+from voice.audio_convert import concat_audio
+
+SENTENCE_SPLIT = re.compile(r"(?<=[。！？!?；;…\n])|(?<=\.)\s+")
+
+
+def split_sentences(text, max_length):
+    """
+    在句子边界切分文本，相邻的短句合并到max_length以内，超长的单句按长度截断
+    """
+    chunks = []
+    current = ""
+    for sentence in SENTENCE_SPLIT.split(text):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        while len(sentence) > max_length:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(sentence[:max_length])
+            sentence = sentence[max_length:]
+        sep = " " if current and current[-1].isascii() else ""
+        if current and len(current) + len(sep) + len(sentence) > max_length:
+            chunks.append(current)
+            current = sentence
+        else:
+            current = current + sep + sentence
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _discard(future):
+    # 放弃的分段如果已经在合成，完成后删除生成的文件
+    def func(f):
+        try:
+            reply = f.result()
+            if reply and reply.type == ReplyType.VOICE:
+                os.remove(reply.content)
+        except Exception:
+            pass
+
+    if not future.cancel():
+        future.add_done_callback(func)
+
+
+class ParallelTTS(object):
+    def __init__(self):
+        self.pool = None
+        self.semaphores = {}  # voice_type -> BoundedSemaphore，限制每个语音引擎的并发请求数
+        self.lock = threading.Lock()
+
+    def _get_pool(self):
+        with self.lock:
+            if self.pool is None:
+                self.pool = ThreadPoolExecutor(max_workers=conf().get("tts_pool_size", 8), thread_name_prefix="tts")
+            return self.pool
+
+    def _get_semaphore(self, voice_type):
+        with self.lock:
+            if voice_type not in self.semaphores:
+                self.semaphores[voice_type] = threading.BoundedSemaphore(conf().get("tts_max_concurrency", 3))
+            return self.semaphores[voice_type]
+
+    def _synthesize(self, voice_type, text):
+        with self._get_semaphore(voice_type):
+            return Bridge().fetch_text_to_voice(text)
+
+    def text_to_voice(self, text, on_chunk=None):
+        """
+        :param on_chunk: 逐段发送的回调，传入时除最后一段外，每段合成后按顺序立即回调，最后一段作为返回值
+        :return: 语音回复，失败时返回合成失败的回复
+        """
+        chunks = split_sentences(text, conf().get("tts_chunk_length", 200))
+        if not conf().get("tts_parallel_enabled", True) or len(chunks) <= 1:
+            return Bridge().fetch_text_to_voice(text)
+        voice_type = Bridge().btype["text_to_voice"]
+        logger.info("[ParallelTTS] text length=%s, split into %s chunks, voice_type=%s", len(text), len(chunks), voice_type)
+        futures = [self._get_pool().submit(self._synthesize, voice_type, chunk) for chunk in chunks]
+        replies = []
+        for i, future in enumerate(futures):
+            try:
+                reply = future.result()
+            except Exception as e:
+                logger.exception("[ParallelTTS] synthesize chunk {} error: {}".format(i, e))
+                reply = Reply(ReplyType.ERROR, "抱歉，语音合成失败")
+            if not reply or reply.type != ReplyType.VOICE:
+                for f in futures[i + 1 :]:
+                    _discard(f)
+                for r in replies:
+                    try:
+                        os.remove(r.content)
+                    except Exception:
+                        pass
+                return reply
+            if on_chunk and i < len(futures) - 1:
+                on_chunk(reply)
+            else:
+                replies.append(reply)
+        if on_chunk:
+            return replies[0]
+
+        paths = [r.content for r in replies]
+        file_name = TmpDir().path() + "reply-" + uuid.uuid4().hex + os.path.splitext(paths[0])[1]
+        try:
+            concat_audio(paths, file_name)
+        except Exception as e:
+            logger.warning("[ParallelTTS] concat audio error, synthesize the whole text instead: {}".format(e))
+            return Bridge().fetch_text_to_voice(text)
+        finally:
+            for path in paths:
+                try:
+                    os.remove(path)
+                except Exception:
+                    pass
+        return Reply(ReplyType.VOICE, file_name)
+
+
+parallel_tts = ParallelTTS()
@@ -37,7 +37,7 @@ class PyttsVoice(Voice):
             # Avoid the same filename under multithreading
             wavFileName = "reply-" + str(int(time.time())) + "-" + str(hash(text) & 0x7FFFFFFF) + ".wav"
             wavFile = TmpDir().path() + wavFileName
-            logger.info("[Pytts] textToVoice text={} voice file name={}".format(text, wavFile))
+            logger.info("[Pytts] textToVoice text=%s voice file name=%s", text, wavFile)
 
             self.engine.save_to_file(text, wavFile)
 
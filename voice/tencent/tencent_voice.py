@@ -11,6 +11,8 @@ from bridge.reply import Reply, ReplyType
 from common.tmp_dir import TmpDir
 
 class TencentVoice(Voice):
+    ASR_MAX_DURATION = 60 * 1000
+
     def __init__(self):
         super().__init__()
         self.secret_id = None
@@ -73,7 +75,7 @@ class TencentVoice(Voice):
             
             # 解析结果
             if resp.Result:
-                logger.info("[Tencent] Voice to text success: {}".format(resp.Result))
+                logger.info("[Tencent] Voice to text success: %s", resp.Result)
                 return Reply(ReplyType.TEXT, resp.Result)
             else:
                 logger.warning("[Tencent] Voice to text failed")
@@ -83,6 +85,9 @@ class TencentVoice(Voice):
             logger.error("[Tencent] Voice to text error: {}".format(e))
             return Reply(ReplyType.ERROR, "腾讯语音识别出错：{}".format(str(e)))
 
+    def ttsCacheKey(self):
+        return {"voice_type": self.voice_type}
+
     def textToVoice(self, text):
         """
         将文本转换为语音
@@ -108,7 +113,7 @@ class TencentVoice(Voice):
                 fileName = TmpDir().path() + "reply-" + str(int(time.time())) + "-" + str(hash(text) & 0x7FFFFFFF) + ".mp3"
                 with open(fileName, "wb") as f:
                     f.write(base64.b64decode(response.Audio))
-                logger.info("[Tencent] textToVoice text={} voice file name={}".format(text, fileName))
+                logger.info("[Tencent] textToVoice text=%s voice file name=%s", text, fileName)
                 return Reply(ReplyType.VOICE, fileName)
             else:
                 logger.error("[Tencent] textToVoice failed")
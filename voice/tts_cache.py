@@ -0,0 +1,167 @@
+"""
+TTS cache: 按 (语音引擎, 音色/模型参数, 归一化文本) 缓存合成的音频，
+同时按音频内容缓存渠道需要的转码结果(amr/sil/mp3)，重复的语音回复不再调用接口和ffmpeg
+"""
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+
+from bridge.reply import Reply, ReplyType
+from common import metrics
+from common.log import logger
+from common.media_cache import file_md5
+from common.tmp_dir import TmpDir
+from config import conf, get_appdata_dir
+
+
+def normalize_text(text):
+    return re.sub(r"\s+", " ", text.strip())
+
+
+class TTSCache(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cache_dir = os.path.join(get_appdata_dir(), "tts_cache")
+        self.index_path = os.path.join(self.cache_dir, "index.json")
+        self.index = {}  # key -> {"file", "size", "atime", "result"}
+        self.total_size = 0
+        self._load_index()
+
+    def _load_index(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            index = {}
+        except Exception as e:
+            logger.warning("[TTSCache] load index error, rebuild cache: {}".format(e))
+            index = {}
+        for key, item in index.items():
+            if os.path.exists(os.path.join(self.cache_dir, item["file"])):
+                self.index[key] = item
+                self.total_size += item["size"]
+
+    def _save_index(self):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, self.index_path)
+
+    def _evict(self):
+        max_size = conf().get("tts_cache_max_size", 200 * 1024 * 1024)
+        if self.total_size <= max_size:
+            return
+        for key, item in sorted(self.index.items(), key=lambda kv: kv[1]["atime"]):
+            if self.total_size <= max_size:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, item["file"]))
+            except FileNotFoundError:
+                pass
+            self.total_size -= item["size"]
+            del self.index[key]
+
+    def get(self, key, dst_path):
+        """
+        命中时把缓存文件复制到dst_path，调用方可以像处理新文件一样发送后删除
+        :return: (是否命中, 写入缓存时附带的结果)
+        """
+        with self.lock:
+            item = self.index.get(key)
+            if item is None:
+                return False, None
+            item["atime"] = time.time()
+            path = os.path.join(self.cache_dir, item["file"])
+        try:
+            shutil.copyfile(path, dst_path)
+        except FileNotFoundError:
+            with self.lock:
+                if self.index.pop(key, None):
+                    self.total_size -= item["size"]
+            return False, None
+        return True, item.get("result")
+
+    def put(self, key, src_path, result=None):
+        file_name = key + os.path.splitext(src_path)[1]
+        path = os.path.join(self.cache_dir, file_name)
+        shutil.copyfile(src_path, path)
+        size = os.path.getsize(path)
+        with self.lock:
+            old = self.index.get(key)
+            if old:
+                self.total_size -= old["size"]
+            self.index[key] = {"file": file_name, "size": size, "atime": time.time(), "result": result}
+            self.total_size += size
+            self._evict()
+            self._save_index()
+
+    def text_to_voice(self, voice_type, voice, text):
+        """
+        带缓存的语音合成
+        :param voice_type: 语音引擎类型
+        :param voice: Voice实例
+        """
+        if not conf().get("tts_cache_enabled", True):
+            return voice.textToVoice(text)
+        params = json.dumps([voice_type, voice.ttsCacheKey(), normalize_text(text)], ensure_ascii=False, sort_keys=True, default=str)
+        key = "tts-" + hashlib.sha1(params.encode("utf-8")).hexdigest()
+        with self.lock:
+            item = self.index.get(key)
+        hit = False
+        if item:
+            file_name = TmpDir().path() + "reply-" + uuid.uuid4().hex + os.path.splitext(item["file"])[1]
+            hit, _ = self.get(key, file_name)
+        metrics.cache_hit("tts", hit)
+        if hit:
+            logger.info("[TTSCache] hit, voice_type=%s, text=%s, file=%s", voice_type, text, file_name)
+            return Reply(ReplyType.VOICE, file_name)
+        reply = voice.textToVoice(text)
+        if reply and reply.type == ReplyType.VOICE and reply.content and os.path.exists(reply.content):
+            try:
+                self.put(key, reply.content)
+            except Exception as e:
+                logger.warning("[TTSCache] put error: {}".format(e))
+        return reply
+
+    def convert(self, convert_func, src_path, dst_path):
+        """
+        带缓存的音频转码，按源文件内容和目标格式缓存转码结果
+        :param convert_func: audio_convert中的转换函数，如 any_to_amr、any_to_sil
+        :return: convert_func的返回值
+        """
+        if not conf().get("tts_cache_enabled", True) or os.path.abspath(src_path) == os.path.abspath(dst_path):
+            return convert_func(src_path, dst_path)
+        target = os.path.splitext(dst_path)[1]
+        key = "convert-" + hashlib.sha1("{}{}".format(file_md5(src_path), target).encode("utf-8")).hexdigest()
+        hit, result = self.get(key, dst_path)
+        metrics.cache_hit("audio_convert", hit)
+        if hit:
+            logger.debug("[TTSCache] convert hit, src=%s, dst=%s", src_path, dst_path)
+            return result
+        result = convert_func(src_path, dst_path)
+        if os.path.exists(dst_path):
+            try:
+                self.put(key, dst_path, result)
+            except Exception as e:
+                logger.warning("[TTSCache] put error: {}".format(e))
+        return result
+
+
+_instance = None
+_instance_lock = threading.Lock()
+
+
+def tts_cache():
+    global _instance
+    if _instance is None:
+        with _instance_lock:
+            if _instance is None:
+                _instance = TTSCache()
+    return _instance
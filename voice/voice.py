@@ -2,8 +2,13 @@
 Voice service abstract class
 """
 
+from config import conf
+
 
 class Voice(object):
+    ASR_MAX_DURATION = None  # 单次语音识别支持的最长音频(毫秒)，None表示不限制
+    ASR_MAX_CONCURRENCY = None  # 语音识别的最大并发数，None表示使用asr_max_concurrency配置
+
     def voiceToText(self, voice_file):
         """
         Send voice to voice service and get text
@@ -15,3 +20,9 @@ class Voice(object):
         Send text to voice service and get voice
         """
         raise NotImplementedError
+
+    def ttsCacheKey(self):
+        """
+        Return the voice/model settings which affect textToVoice output, used as part of the TTS cache key
+        """
+        return {"voice": conf().get("tts_voice_id"), "model": conf().get("text_to_voice_model")}
@@ -1,7 +1,7 @@
 # -*- coding:utf-8 -*-
 #
-#  Author: njnuko 
-#  Email: njnuko@163.com 
+#  Author: njnuko
+#  Email: njnuko@163.com
 #
 #  这个文档是基于官方的demo来改的，固体官方demo文档请参考官网
 #
@@ -13,45 +13,46 @@
 #  语音听写流式WebAPI 服务，方言试用方法：登陆开放平台https://www.xfyun.cn/后，找到控制台--我的应用---语音听写（流式）---服务管理--识别语种列表
 #  可添加语种或方言，添加后会显示该方言的参数值
 #  错误码链接：https://www.xfyun.cn/document/error-code （code返回错误码时必看）
+#
+#  所有识别请求共用一个后台事件循环，每个请求的识别结果保存在各自的ASRSession中，
+#  多条语音可以并发识别；音频按接口建议的实时速率(每40ms发送1280字节)分帧发送，发送等待不占用处理线程
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
-import websocket
-import datetime
-import hashlib
+import asyncio
 import base64
+import hashlib
 import hmac
 import json
-from urllib.parse import urlencode
-import time
-import ssl
-from wsgiref.handlers import format_date_time
+import threading
+import wave
 from datetime import datetime
 from time import mktime
-import _thread as thread
-import os
-import wave
+from urllib.parse import urlencode, urlparse
+from wsgiref.handlers import format_date_time
+
+import aiohttp
 
+from common.log import logger
 
 STATUS_FIRST_FRAME = 0  # 第一帧的标识
 STATUS_CONTINUE_FRAME = 1  # 中间帧标识
 STATUS_LAST_FRAME = 2  # 最后一帧的标识
 
-#############
-#whole_dict 是用来存储返回值的，由于带语音修正，所以用dict来存储，有更新的化pop之前的值，最后再合并
-global whole_dict
-#这个文档是官方文档改的，这个参数是用来做函数调用时用的
-global wsParam
-##############
+ASR_URL = "wss://ws-api.xfyun.cn/v2/iat"
+FRAME_SIZE = 1280  # 每一帧的音频大小(字节)，16k采样率16bit单声道下为40ms
+FRAME_INTERVAL = 0.04  # 发送音频间隔(单位:s)
+AUDIO_FORMAT = "audio/L16;rate=16000"
 
 
 class Ws_Param(object):
     # 初始化
-    def __init__(self, APPID, APIKey, APISecret,BusinessArgs, AudioFile):
+    def __init__(self, APPID, APIKey, APISecret, BusinessArgs, AudioFile, url=ASR_URL):
         self.APPID = APPID
         self.APIKey = APIKey
         self.APISecret = APISecret
         self.AudioFile = AudioFile
         self.BusinessArgs = BusinessArgs
+        self.url = url
         # 公共参数(common)
         self.CommonArgs = {"app_id": self.APPID}
         # 业务参数(business)，更多个性化参数可在官网查看
@@ -59,15 +60,16 @@ class Ws_Param(object):
 
     # 生成url
     def create_url(self):
-        url = 'wss://ws-api.xfyun.cn/v2/iat'
+        host = urlparse(self.url).netloc
+        path = urlparse(self.url).path
         # 生成RFC1123格式的时间戳
         now = datetime.now()
         date = format_date_time(mktime(now.timetuple()))
 
         # 拼接字符串
-        signature_origin = "host: " + "ws-api.xfyun.cn" + "\n"
+        signature_origin = "host: " + host + "\n"
         signature_origin += "date: " + date + "\n"
-        signature_origin += "GET " + "/v2/iat " + "HTTP/1.1"
+        signature_origin += "GET " + path + " HTTP/1.1"
         # 进行hmac-sha256进行加密
         signature_sha = hmac.new(self.APISecret.encode('utf-8'), signature_origin.encode('utf-8'),
                                  digestmod=hashlib.sha256).digest()
@@ -80,130 +82,121 @@ class Ws_Param(object):
         v = {
             "authorization": authorization,
             "date": date,
-            "host": "ws-api.xfyun.cn"
+            "host": host
         }
         # 拼接鉴权参数，生成url
-        url = url + '?' + urlencode(v)
-        #print("date: ",date)
-        #print("v: ",v)
-        # 此处打印出建立连接时候的url,参考本demo的时候可取消上方打印的注释，比对相同参数时生成的url与自己代码生成的url是否一致
-        #print('websocket url :', url)
-        return url
-
-
-# 收到websocket消息的处理
-def on_message(ws, message):
-    global whole_dict
-    try:
-        code = json.loads(message)["code"]
-        sid = json.loads(message)["sid"]
+        return self.url + '?' + urlencode(v)
+
+
+class ASRSession(object):
+    """
+    单个识别请求的状态
+    whole_dict 是用来存储返回值的，由于带语音修正(wpgs)，所以用dict来存储，有更新的话pop之前的值，最后再合并
+    """
+
+    def __init__(self, param: Ws_Param):
+        self.param = param
+        self.whole_dict = {}
+        self.error = None
+
+    def on_message(self, message):
+        data = json.loads(message)
+        code = data["code"]
         if code != 0:
-            errMsg = json.loads(message)["message"]
-            print("sid:%s call error:%s code is:%s" % (sid, errMsg, code))
-        else:
-            temp1 = json.loads(message)["data"]["result"]
-            data = json.loads(message)["data"]["result"]["ws"]
-            sn = temp1["sn"]
-            if "rg" in temp1.keys():
-                rep = temp1["rg"]
-                rep_start = rep[0]
-                rep_end = rep[1]
-                for sn in range(rep_start,rep_end+1):
-                    #print("before pop",whole_dict)
-                    #print("sn",sn)
-                    whole_dict.pop(sn,None)
-                    #print("after pop",whole_dict)
-                results = ""
-                for i in data:
-                    for w in i["cw"]:
-                        results += w["w"]
-                whole_dict[sn]=results
-                #print("after add",whole_dict)
-            else:
-                results = ""
-                for i in data:
-                    for w in i["cw"]:
-                        results += w["w"]
-                whole_dict[sn]=results
-            #print("sid:%s call success!,data is:%s" % (sid, json.dumps(data, ensure_ascii=False)))
-    except Exception as e:
-        print("receive msg,but parse exception:", e)
-
-
-
-# 收到websocket错误的处理
-def on_error(ws, error):
-    print("### error:", error)
-
-
-# 收到websocket关闭的处理
-def on_close(ws,a,b):
-    print("### closed ###")
-
-
-# 收到websocket连接建立的处理
-def on_open(ws):
-    global wsParam
-    def run(*args):
-        frameSize = 8000  # 每一帧的音频大小
-        intervel = 0.04  # 发送音频间隔(单位:s)
-        status = STATUS_FIRST_FRAME  # 音频的状态信息，标识音频是第一帧，还是中间帧、最后一帧
-
-        with wave.open(wsParam.AudioFile, "rb") as fp:
-            while True:
-                buf = fp.readframes(frameSize)
-                # 文件结束
-                if not buf:
-                    status = STATUS_LAST_FRAME
-                # 第一帧处理
+            self.error = "sid:%s call error:%s code is:%s" % (data.get("sid"), data.get("message"), code)
+            return True
+        result = data["data"]["result"]
+        sn = result["sn"]
+        if "rg" in result:
+            rep_start, rep_end = result["rg"][0], result["rg"][1]
+            for i in range(rep_start, rep_end + 1):
+                self.whole_dict.pop(i, None)
+        words = ""
+        for i in result["ws"]:
+            for w in i["cw"]:
+                words += w["w"]
+        self.whole_dict[sn] = words
+        return data["data"]["status"] == STATUS_LAST_FRAME
+
+    def text(self):
+        #把字典的值合并起来做最后识别的输出
+        return "".join(self.whole_dict[i] for i in sorted(self.whole_dict.keys()))
+
+    def frames(self, pcm):
+        for offset in range(0, len(pcm), FRAME_SIZE):
+            buf = pcm[offset : offset + FRAME_SIZE]
+            if offset == 0:
                 # 发送第一帧音频，带business 参数
                 # appid 必须带上，只需第一帧发送
-                if status == STATUS_FIRST_FRAME:
-                    d = {"common": wsParam.CommonArgs,
-                         "business": wsParam.BusinessArgs,
-                         "data": {"status": 0, "format": "audio/L16;rate=16000","audio": str(base64.b64encode(buf), 'utf-8'), "encoding": "raw"}} 
-                    d = json.dumps(d)
-                    ws.send(d)
-                    status = STATUS_CONTINUE_FRAME
-                # 中间帧处理
-                elif status == STATUS_CONTINUE_FRAME:
-                    d = {"data": {"status": 1, "format": "audio/L16;rate=16000",
-                                  "audio": str(base64.b64encode(buf), 'utf-8'),
-                                  "encoding": "raw"}}
-                    ws.send(json.dumps(d))
-                # 最后一帧处理
-                elif status == STATUS_LAST_FRAME:
-                    d = {"data": {"status": 2, "format": "audio/L16;rate=16000",
-                                  "audio": str(base64.b64encode(buf), 'utf-8'),
-                                  "encoding": "raw"}}
-                    ws.send(json.dumps(d))
-                    time.sleep(1)
-                    break
-                # 模拟音频采样间隔
-                time.sleep(intervel)
-        ws.close()
-
-    thread.start_new_thread(run, ())
+                yield {"common": self.param.CommonArgs,
+                       "business": self.param.BusinessArgs,
+                       "data": {"status": STATUS_FIRST_FRAME, "format": AUDIO_FORMAT, "audio": str(base64.b64encode(buf), 'utf-8'), "encoding": "raw"}}
+            else:
+                yield {"data": {"status": STATUS_CONTINUE_FRAME, "format": AUDIO_FORMAT, "audio": str(base64.b64encode(buf), 'utf-8'), "encoding": "raw"}}
+        yield {"data": {"status": STATUS_LAST_FRAME, "format": AUDIO_FORMAT, "audio": "", "encoding": "raw"}}
+
+
+class XunfeiASRClient(object):
+    """
+    在后台线程的事件循环中执行所有识别请求，调用线程只等待最终结果
+    """
+
+    def __init__(self):
+        self.loop = None
+        self.lock = threading.Lock()
+
+    def _get_loop(self):
+        with self.lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                threading.Thread(target=self.loop.run_forever, name="xunfei-asr", daemon=True).start()
+            return self.loop
+
+    async def _send_frames(self, ws, session: ASRSession, pcm):
+        # 按绝对时间安排每帧的发送时刻，避免sleep误差累积
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        for i, frame in enumerate(session.frames(pcm)):
+            delay = start + i * FRAME_INTERVAL - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await ws.send_str(json.dumps(frame))
+
+    async def _recognize(self, session: ASRSession):
+        with wave.open(session.param.AudioFile, "rb") as fp:
+            pcm = fp.readframes(fp.getnframes())
+        async with aiohttp.ClientSession() as http_session, http_session.ws_connect(session.param.create_url(), ssl=False) as ws:
+            sender = asyncio.ensure_future(self._send_frames(ws, session, pcm))
+            try:
+                async for msg in ws:
+                    if msg.type == aiohttp.WSMsgType.TEXT:
+                        if session.on_message(msg.data):
+                            break
+                    elif msg.type in (aiohttp.WSMsgType.ERROR, aiohttp.WSMsgType.CLOSED):
+                        break
+            finally:
+                sender.cancel()
+        if session.error:
+            raise RuntimeError(session.error)
+        return session.text()
+
+    def recognize(self, param: Ws_Param, timeout=None):
+        future = asyncio.run_coroutine_threadsafe(self._recognize(ASRSession(param)), self._get_loop())
+        try:
+            return future.result(timeout)
+        except Exception:
+            future.cancel()
+            raise
+
+
+client = XunfeiASRClient()
+
 
 #提供给xunfei_voice调用的函数
-def xunfei_asr(APPID,APISecret,APIKey,BusinessArgsASR,AudioFile):
-    global whole_dict
-    global wsParam
-    whole_dict = {}
-    wsParam1 = Ws_Param(APPID=APPID, APISecret=APISecret,
-                       APIKey=APIKey,BusinessArgs=BusinessArgsASR,
-                       AudioFile=AudioFile)
-    #wsParam是global变量，给上面on_open函数调用使用的
-    wsParam = wsParam1
-    websocket.enableTrace(False)
-    wsUrl = wsParam.create_url()
-    ws = websocket.WebSocketApp(wsUrl, on_message=on_message, on_error=on_error, on_close=on_close)
-    ws.on_open = on_open
-    ws.run_forever(sslopt={"cert_reqs": ssl.CERT_NONE})
-    #把字典的值合并起来做最后识别的输出
-    whole_words = ""
-    for i in sorted(whole_dict.keys()):
-        whole_words += whole_dict[i]
-    return whole_words
-
-     
+def xunfei_asr(APPID, APISecret, APIKey, BusinessArgsASR, AudioFile, url=ASR_URL, timeout=120):
+    wsParam = Ws_Param(APPID=APPID, APISecret=APISecret,
+                       APIKey=APIKey, BusinessArgs=BusinessArgsASR,
+                       AudioFile=AudioFile, url=url)
+    text = client.recognize(wsParam, timeout)
+    logger.debug("[Xunfei] asr result: %s", text)
+    return text
@@ -34,6 +34,8 @@ from pydub import AudioSegment
 
 
 class XunfeiVoice(Voice):
+    ASR_MAX_DURATION = 60 * 1000
+
     def __init__(self):
         try:
             curdir = os.path.dirname(__file__)
@@ -54,7 +56,7 @@ class XunfeiVoice(Voice):
     def voiceToText(self, voice_file):
         # 识别本地文件
         try:
-            logger.debug("[Xunfei] voice file name={}".format(voice_file))
+            logger.debug("[Xunfei] voice file name=%s", voice_file)
             #print("voice_file===========",voice_file)
             #print("voice_file_type===========",type(voice_file))
             #mp3_name, file_extension = os.path.splitext(voice_file)
@@ -66,19 +68,22 @@ class XunfeiVoice(Voice):
             #shutil.copy2(mp3_file, 'tmp/test1.mp3')
             #print("voice and mp3 file",voice_file,mp3_file)
             text = xunfei_asr(self.APPID,self.APISecret,self.APIKey,self.BusinessArgsASR,voice_file)
-            logger.info("讯飞语音识别到了: {}".format(text))
+            logger.info("讯飞语音识别到了: %s", text)
             reply = Reply(ReplyType.TEXT, text)
         except Exception as e:
             logger.warn("XunfeiVoice init failed: %s, ignore " % e)
             reply = Reply(ReplyType.ERROR, "讯飞语音识别出错了；{0}")
         return reply
 
+    def ttsCacheKey(self):
+        return self.BusinessArgsTTS
+
     def textToVoice(self, text):
         try:
             # Avoid the same filename under multithreading
             fileName = TmpDir().path() + "reply-" + str(int(time.time())) + "-" + str(hash(text) & 0x7FFFFFFF) + ".mp3"
             return_file = xunfei_tts(self.APPID,self.APIKey,self.APISecret,self.BusinessArgsTTS,text,fileName)
-            logger.info("[Xunfei] textToVoice text={} voice file name={}".format(text, fileName))
+            logger.info("[Xunfei] textToVoice text=%s voice file name=%s", text, fileName)
             reply = Reply(ReplyType.VOICE, fileName)
         except Exception as e:
             logger.error("[Xunfei] textToVoice error={}".format(fileName))